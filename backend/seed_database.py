@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 """
 Seed script to populate the Car Zone database with sample data
-This script creates 5-10 records for each model to demonstrate the admin interface
+This script creates 5-10 records for each model to demonstrate the admin interface.
+For load testing, generate large datasets with `python manage.py generate_data`.
 """
 from analytics.models import Analytics, SearchLog
 from moderation.models import Report
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
-from .models import User, BuyerProfile, SellerProfile
+from moderation import counters
+from .models import User, BuyerProfile, SavedSearchNotification, SellerProfile, SellerReview
 
 
 @admin.register(User)
@@ -10,7 +11,7 @@ class UserAdmin(BaseUserAdmin):
 
     list_display = (
         'username', 'email', 'role', 'is_active',
-        'profile_picture_preview', 'date_joined'
+        'profile_picture_preview', 'open_reports', 'date_joined'
     )
     list_filter = ('role', 'is_active', 'is_staff', 'date_joined')
     search_fields = ('username', 'email', 'first_name', 'last_name')
@@ -33,7 +34,12 @@ class UserAdmin(BaseUserAdmin):
         ('Important dates', {
             'fields': ('last_login', 'date_joined')
         }),
+        ('Moderation', {
+            'fields': ('report_breakdown',),
+            'classes': ('collapse',)
+        }),
     )
+    readonly_fields = ('report_breakdown',)
 
     # Define add_fieldsets properly
     add_fieldsets = (
@@ -58,6 +64,22 @@ class UserAdmin(BaseUserAdmin):
     # Set the short description for the admin column
     profile_picture_preview.short_description = "Profile Picture"  # type: ignore
 
+    def get_queryset(self, request):
+        """Annotate open reports from the report counters, not per row"""
+        queryset = super().get_queryset(request)
+        return queryset.annotate(open_report_count=counters.open_reports('user'))
+
+    def open_reports(self, obj):
+        """Display number of pending or reviewed reports about this user or their listings"""
+        return getattr(obj, 'open_report_count', 0)
+    open_reports.short_description = 'Open reports'  # type: ignore
+    open_reports.admin_order_field = 'open_report_count'  # type: ignore
+
+    def report_breakdown(self, obj):
+        """Display reports about this user or their listings by status and reason"""
+        return counters.describe(counters.breakdown(user_id=obj.pk, listing__isnull=True))
+    report_breakdown.short_description = 'Reports'  # type: ignore
+
 
 @admin.register(BuyerProfile)
 class BuyerProfileAdmin(admin.ModelAdmin):
@@ -82,22 +104,39 @@ class BuyerProfileAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(SavedSearchNotification)
+class SavedSearchNotificationAdmin(admin.ModelAdmin):
+    """Admin for saved-search notifications"""
+
+    list_display = ('buyer', 'search', 'listing', 'reason', 'price',
+                    'created_at', 'sent_at')
+    list_filter = ('reason', 'created_at', 'sent_at')
+    search_fields = ('buyer__user__username', 'buyer__user__email')
+    raw_id_fields = ('buyer', 'listing')
+    readonly_fields = ('created_at',)
+
+    def get_queryset(self, request):
+        """Optimize queryset with select_related"""
+        queryset = super().get_queryset(request)
+        return queryset.select_related('buyer__user', 'listing__car')
+
+
 @admin.register(SellerProfile)
 class SellerProfileAdmin(admin.ModelAdmin):
     """Admin for Seller Profile"""
 
-    list_display = ('user', 'company_name', 'rating',
+    list_display = ('user', 'company_name', 'rating', 'rating_count',
                     'created_at', 'updated_at')
-    list_filter = ('rating', 'created_at', 'updated_at')
+    list_filter = ('created_at', 'updated_at')
     search_fields = ('user__username', 'user__email', 'company_name')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('rating', 'rating_count', 'average_rating', 'created_at', 'updated_at')
 
     fieldsets = (
         ('User Information', {
             'fields': ('user',)
         }),
         ('Business Information', {
-            'fields': ('company_name', 'rating')
+            'fields': ('company_name', 'rating', 'rating_count', 'average_rating')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -109,3 +148,20 @@ class SellerProfileAdmin(admin.ModelAdmin):
         """Optimize queryset with select_related"""
         queryset = super().get_queryset(request)
         return queryset.select_related('user')
+
+
+@admin.register(SellerReview)
+class SellerReviewAdmin(admin.ModelAdmin):
+    """Admin for Seller Review; saving or deleting one moves the seller's rating"""
+
+    list_display = ('seller', 'reviewer', 'rating', 'listing', 'created_at')
+    list_filter = ('rating', 'created_at')
+    search_fields = ('seller__username', 'reviewer__username', 'comment')
+    raw_id_fields = ('seller', 'reviewer', 'listing')
+    readonly_fields = ('created_at', 'updated_at')
+    ordering = ('-created_at',)
+
+    def get_queryset(self, request):
+        """Optimize queryset with select_related"""
+        queryset = super().get_queryset(request)
+        return queryset.select_related('seller', 'reviewer', 'listing__car')
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from carzone.instrumentation import registry
+
+        from . import signals  # noqa: F401
+        from .saved_searches import notifier
+        registry.register_provider('carzone_saved_search_notifier', notifier.metrics)
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.saved_searches import SavedSearchNotifier, listing_attributes
+from cars.models import CarListing
+
+
+class Command(BaseCommand):
+    help = (
+        "Match recently created available listings against every saved "
+        "search and write the notifications, e.g. to catch up after downtime"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24,
+                            help="Match listings created in the last N hours")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        listings = (
+            CarListing.objects.filter(status='available', created_at__gte=since)
+            .select_related('car').order_by('pk')
+        )
+        notifier = SavedSearchNotifier(batch_size=options['batch_size'])
+        batch = []
+        for listing in listings.iterator(chunk_size=options['batch_size']):
+            batch.append((listing_attributes(listing), listing.pk, 'new'))
+            if len(batch) >= options['batch_size']:
+                notifier.process(batch)
+                batch = []
+        notifier.process(batch)
+
+        metrics = notifier.metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f"Matched {metrics['listings']} listing(s) against "
+            f"{metrics['indexed_searches']} saved search(es): "
+            f"{metrics['notifications']} notification(s), slowest match "
+            f"{metrics['max_match_ms']} ms."))
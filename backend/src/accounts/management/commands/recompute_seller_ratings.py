@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from accounts import ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every seller's review sum, count and smoothed rating from "
+        "the reviews, in batches of sellers, and copy the ratings onto the "
+        "listing summaries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report differences, do not fix them")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Sellers aggregated per query")
+
+    def handle(self, *args, **options):
+        checked, stale, stale_summaries = ratings.recompute(
+            batch_size=options['batch_size'], check_only=options['check'])
+        message = (f"Checked {checked} seller(s): {stale} stale rating(s), "
+                   f"{stale_summaries} stale listing summary row(s)")
+        if options['check']:
+            style = self.style.SUCCESS if not (stale or stale_summaries) else self.style.WARNING
+            self.stdout.write(style(message + "."))
+        else:
+            self.stdout.write(self.style.SUCCESS(message + " fixed."))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('cars', '0004_listing_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedSearchNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search', models.PositiveSmallIntegerField(help_text="Position of the search in the buyer's saved searches")),
+                ('reason', models.CharField(choices=[('new', 'New listing'), ('repriced', 'Price changed')], max_length=20)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='accounts.buyerprofile')),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cars.carlisting')),
+            ],
+            options={
+                'verbose_name': 'Saved Search Notification',
+                'verbose_name_plural': 'Saved Search Notifications',
+                'db_table': 'saved_search_notification',
+                'indexes': [models.Index(fields=['sent_at', 'id'], name='saved_searc_sent_at_3db4a3_idx'), models.Index(fields=['buyer', '-created_at'], name='saved_searc_buyer_i_f628b4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:18
+
+import accounts.ratings
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def recompute_ratings(apps, schema_editor):
+    from accounts import ratings
+
+    ratings.recompute(profile_model=apps.get_model('accounts', 'SellerProfile'),
+                      review_model=apps.get_model('accounts', 'SellerReview'),
+                      summary_model=apps.get_model('cars', 'ListingSummary'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_saved_search_notification'),
+        ('cars', '0008_listingsummary_seller_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.PositiveSmallIntegerField(help_text='1 to 5 stars', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)])),
+                ('comment', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Seller Review',
+                'verbose_name_plural': 'Seller Reviews',
+                'db_table': 'seller_review',
+            },
+        ),
+        migrations.AddField(
+            model_name='sellerprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of reviews'),
+        ),
+        migrations.AddField(
+            model_name='sellerprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Stars of all reviews'),
+        ),
+        migrations.AlterField(
+            model_name='sellerprofile',
+            name='rating',
+            field=models.FloatField(default=accounts.ratings.prior_rating, editable=False, help_text='Average rating from buyers, smoothed towards the site prior'),
+        ),
+        migrations.AddIndex(
+            model_name='sellerprofile',
+            index=models.Index(fields=['-rating'], name='seller_prof_rating_e73fe1_idx'),
+        ),
+        migrations.AddField(
+            model_name='sellerreview',
+            name='listing',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviews', to='cars.carlisting'),
+        ),
+        migrations.AddField(
+            model_name='sellerreview',
+            name='reviewer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews_written', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='sellerreview',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews_received', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='sellerreview',
+            index=models.Index(fields=['seller', '-created_at'], name='seller_revi_seller__ba2580_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerreview',
+            constraint=models.UniqueConstraint(fields=('seller', 'reviewer'), name='seller_review_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerreview',
+            constraint=models.CheckConstraint(condition=models.Q(('rating__gte', 1), ('rating__lte', 5)), name='seller_review_rating_range'),
+        ),
+        migrations.RunPython(recompute_ratings, migrations.RunPython.noop),
+    ]
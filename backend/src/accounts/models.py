@@ -1,6 +1,10 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.core.validators import RegexValidator
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
+from django.utils import timezone
+
+from . import ratings
 
 
 class User(AbstractUser):
@@ -57,13 +61,51 @@ class BuyerProfile(models.Model):
         return f"Buyer: {self.user.username}"
 
 
+class SavedSearchNotification(models.Model):
+    """A listing that matched one of a buyer's saved searches"""
+
+    REASON_CHOICES = [
+        ('new', 'New listing'),
+        ('repriced', 'Price changed'),
+    ]
+
+    buyer = models.ForeignKey(
+        BuyerProfile, on_delete=models.CASCADE, related_name='notifications')
+    search = models.PositiveSmallIntegerField(
+        help_text="Position of the search in the buyer's saved searches")
+    listing = models.ForeignKey(
+        'cars.CarListing', on_delete=models.CASCADE, related_name='+')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'saved_search_notification'
+        verbose_name = 'Saved Search Notification'
+        verbose_name_plural = 'Saved Search Notifications'
+        indexes = [
+            models.Index(fields=['sent_at', 'id']),
+            models.Index(fields=['buyer', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"Listing #{self.listing_id} for {self.buyer_id} ({self.reason})"
+
+
 class SellerProfile(models.Model):
 
     user = models.OneToOneField(
         User, on_delete=models.CASCADE, related_name='seller_profile')
     company_name = models.CharField(max_length=255, blank=True, null=True)
+    # Maintained from the seller's reviews (see accounts.ratings)
     rating = models.FloatField(
-        default=0.0, help_text="Average rating from buyers")
+        default=ratings.prior_rating, editable=False,
+        help_text="Average rating from buyers, smoothed towards the site prior")
+    rating_sum = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Stars of all reviews")
+    rating_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Number of reviews")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -71,6 +113,79 @@ class SellerProfile(models.Model):
         db_table = 'seller_profile'
         verbose_name = 'Seller Profile'
         verbose_name_plural = 'Seller Profiles'
+        indexes = [
+            models.Index(fields=['-rating']),
+        ]
+
+    @property
+    def average_rating(self):
+        """Unsmoothed mean of the reviews, or None without reviews"""
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
 
     def __str__(self):
         return f"Seller: {self.user.username}" + (f" ({self.company_name})" if self.company_name else "")
+
+
+class SellerReview(models.Model):
+    """A buyer's rating of a seller, optionally for one of their listings"""
+
+    seller = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='reviews_received')
+    reviewer = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='reviews_written')
+    listing = models.ForeignKey(
+        'cars.CarListing',
+        on_delete=models.SET_NULL,
+        related_name='reviews',
+        null=True,
+        blank=True
+    )
+    rating = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(5)],
+        help_text="1 to 5 stars")
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'seller_review'
+        verbose_name = 'Seller Review'
+        verbose_name_plural = 'Seller Reviews'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['seller', 'reviewer'], name='seller_review_unique'),
+            models.CheckConstraint(
+                condition=models.Q(rating__gte=1, rating__lte=5),
+                name='seller_review_rating_range'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', '-created_at']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as stored, so a changed review moves the seller's rating
+        instance._saved_seller_id = instance.__dict__.get('seller_id')
+        instance._saved_rating = instance.__dict__.get('rating')
+        return instance
+
+    def clean(self):
+        if self.seller_id is not None and self.seller_id == self.reviewer_id:
+            raise ValidationError("Sellers cannot review themselves.")
+        if self.listing_id is not None and self.listing.seller_id != self.seller_id:
+            raise ValidationError("The listing must belong to the reviewed seller.")
+
+    def save(self, *args, **kwargs):
+        self.clean()
+        with transaction.atomic():
+            created = self._state.adding
+            super().save(*args, **kwargs)
+            ratings.review_saved(self, created)
+        self._saved_seller_id = self.seller_id
+        self._saved_rating = self.rating
+
+    def __str__(self):
+        return f"{self.rating}/5 for {self.seller.username} by {self.reviewer.username}"
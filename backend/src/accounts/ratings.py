@@ -0,0 +1,169 @@
+"""
+Smoothed seller ratings.
+
+Buyers rate sellers from 1 to 5 stars with a ``SellerReview``. Each
+``SellerProfile`` keeps the running ``rating_sum`` and ``rating_count`` of
+the reviews of its seller and the smoothed rating
+
+    rating = (PRIOR_WEIGHT * PRIOR_MEAN + rating_sum) / (PRIOR_WEIGHT + rating_count)
+
+that is the mean of the reviews plus ``SELLER_RATING_PRIOR_WEIGHT``
+imaginary reviews of ``SELLER_RATING_PRIOR_MEAN`` stars. A seller with a
+single five-star review does not outrank one with two hundred reviews
+averaging 4.8, and a seller without reviews sits at the prior.
+
+``SellerReview.save()`` and deleting a review move the sum and count of
+the seller's profile by the review's rating (the profile row is locked,
+so concurrent reviews do not lose updates) and derive the rating from
+them: constant work whatever the number of reviews. The rating is copied
+to the seller's ``ListingSummary`` rows (``seller_rating``), which search
+sorts on. ``recompute`` (the ``recompute_seller_ratings`` command)
+re-aggregates the reviews one batch of sellers at a time, e.g. after the
+prior settings changed or reviews were bulk-loaded.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+
+
+def _prior():
+    return (getattr(settings, 'SELLER_RATING_PRIOR_MEAN', 4.0),
+            getattr(settings, 'SELLER_RATING_PRIOR_WEIGHT', 5))
+
+
+def smoothed(rating_sum, rating_count):
+    """Smoothed rating of ``rating_count`` reviews totalling ``rating_sum`` stars"""
+    mean, weight = _prior()
+    if weight + rating_count <= 0:
+        return 0.0
+    return round((weight * mean + rating_sum) / (weight + rating_count), 4)
+
+
+def prior_rating():
+    """Rating of a seller without reviews"""
+    return smoothed(0, 0)
+
+
+def rating_of(user):
+    """Smoothed rating of ``user`` as a seller"""
+    try:
+        return user.seller_profile.rating
+    except ObjectDoesNotExist:
+        return prior_rating()
+
+
+def _models(profile_model=None, review_model=None, summary_model=None):
+    from cars.models import ListingSummary
+
+    from .models import SellerProfile, SellerReview
+
+    return (profile_model or SellerProfile, review_model or SellerReview,
+            summary_model or ListingSummary)
+
+
+def apply(deltas):
+    """Add ``deltas`` (seller id -> ``(stars, reviews)``) to the sellers' ratings"""
+    SellerProfile, _, ListingSummary = _models()
+    with transaction.atomic():
+        for seller_id in sorted(deltas):
+            stars, reviews = deltas[seller_id]
+            if not stars and not reviews:
+                continue
+            profile = SellerProfile.objects.select_for_update().filter(user_id=seller_id).first()
+            if profile is None:
+                if reviews <= 0:
+                    # The seller is being deleted along with their reviews
+                    continue
+                SellerProfile.objects.get_or_create(user_id=seller_id)
+                profile = SellerProfile.objects.select_for_update().get(user_id=seller_id)
+            profile.rating_sum += stars
+            profile.rating_count += reviews
+            profile.rating = smoothed(profile.rating_sum, profile.rating_count)
+            profile.save(update_fields=['rating_sum', 'rating_count', 'rating', 'updated_at'])
+            ListingSummary.objects.filter(seller_id=seller_id).update(seller_rating=profile.rating)
+
+
+def review_saved(review, created):
+    """Move a just-saved ``review`` from its previous seller and rating"""
+    old = None if created else (review._saved_seller_id, review._saved_rating)
+    new = (review.seller_id, review.rating)
+    if old == new:
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    if old:
+        deltas[old[0]][0] -= old[1]
+        deltas[old[0]][1] -= 1
+    deltas[new[0]][0] += new[1]
+    deltas[new[0]][1] += 1
+    apply(deltas)
+
+
+def review_deleted(review):
+    """Take a deleted ``review`` off its seller's rating"""
+    apply({review.seller_id: (-review.rating, -1)})
+
+
+def recompute(batch_size=1000, check_only=False, profile_model=None,
+              review_model=None, summary_model=None):
+    """
+    Re-aggregate every seller's reviews, ``batch_size`` sellers per grouped
+    query, fixing profiles and listing summaries that differ unless
+    ``check_only``. Sellers with reviews but no profile get one.
+
+    Returns ``(sellers checked, profiles stale, summaries stale)``.
+    """
+    SellerProfile, SellerReview, ListingSummary = _models(
+        profile_model, review_model, summary_model)
+    reviewed = set(SellerReview.objects.order_by().values_list('seller_id', flat=True).distinct())
+    missing = reviewed - set(SellerProfile.objects.values_list('user_id', flat=True))
+    if not check_only:
+        SellerProfile.objects.bulk_create(
+            [SellerProfile(user_id=pk, rating=prior_rating()) for pk in sorted(missing)],
+            batch_size=batch_size)
+
+    checked, stale, stale_summaries = 0, len(missing) if check_only else 0, 0
+    last_pk = 0
+    while True:
+        profiles = list(SellerProfile.objects.filter(pk__gt=last_pk).order_by('pk')
+                        .only('user_id', 'rating_sum', 'rating_count', 'rating')[:batch_size])
+        if not profiles:
+            break
+        last_pk = profiles[-1].pk
+        user_ids = [profile.user_id for profile in profiles]
+        totals = {
+            row['seller_id']: (row['stars'], row['n']) for row in
+            SellerReview.objects.filter(seller_id__in=user_ids).order_by()
+            .values('seller_id').annotate(stars=Sum('rating'), n=Count('pk'))
+        }
+        changed = []
+        for profile in profiles:
+            stars, count = totals.get(profile.user_id, (0, 0))
+            rating = smoothed(stars, count)
+            if (profile.rating_sum, profile.rating_count, profile.rating) != (stars, count, rating):
+                profile.rating_sum, profile.rating_count, profile.rating = stars, count, rating
+                changed.append(profile)
+        checked += len(profiles)
+        stale += len(changed)
+
+        rating = SellerProfile.objects.filter(user_id=OuterRef('seller_id')).values('rating')[:1]
+        summaries = ListingSummary.objects.filter(seller_id__in=user_ids)
+        if check_only:
+            expected = {profile.user_id: profile.rating for profile in profiles}
+            stale_summaries += sum(
+                1 for seller_id, value in summaries.values_list('seller_id', 'seller_rating')
+                if value != expected[seller_id])
+            continue
+        with transaction.atomic():
+            SellerProfile.objects.bulk_update(
+                changed, ['rating_sum', 'rating_count', 'rating'], batch_size=batch_size)
+            stale_summaries += summaries.exclude(seller_rating=Subquery(rating)).update(
+                seller_rating=Subquery(rating))
+
+    # Listings of users without a profile (who have never been reviewed)
+    unrated = ListingSummary.objects.exclude(
+        seller_id__in=SellerProfile.objects.values('user_id')).exclude(seller_rating=prior_rating())
+    stale_summaries += unrated.count() if check_only else unrated.update(seller_rating=prior_rating())
+    return checked, stale, stale_summaries
@@ -0,0 +1,450 @@
+"""
+Saved-search matching.
+
+``BuyerProfile.saved_searches`` holds one criteria dict or a list of them::
+
+    {'make': 'Toyota', 'model': 'Corolla', 'fuel_type': 'hybrid', 'location': 'New York',
+     'min_price': 10000, 'max_price': 30000, 'min_year': 2018,
+     'max_mileage': 80000}
+
+Every key is optional. When a listing is created or repriced the searches
+it satisfies are found through ``SavedSearchIndex``, an inverted index
+keyed on the categorical criteria (make, model, fuel type, transmission,
+location city) with unset criteria as wildcards: a listing looks up the
+32 keys its values can match, which yields exactly the searches whose
+categorical criteria it satisfies, and the numeric ranges (price, year,
+mileage) of those candidates are checked at once on NumPy columns. No
+search whose categories differ from the listing's is looked at.
+
+Matching runs on a background thread (``notifier``): committed listing
+changes are queued, the index is loaded on first use and refreshed with
+the profiles changed since the last load every
+``SAVED_SEARCH_REFRESH_INTERVAL`` seconds (reaching
+``SAVED_SEARCH_REFRESH_OVERLAP`` seconds further back, for profiles
+committed after a later one was loaded), and the resulting
+``SavedSearchNotification`` rows are written with ``bulk_create`` in
+batches of ``SAVED_SEARCH_BATCH_SIZE``. ``match_saved_searches`` matches
+existing listings from the command line.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from itertools import product
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ('make', 'model', 'fuel_type', 'transmission', 'location')
+# (listing attribute, lower bound key, upper bound key)
+RANGES = (
+    ('price', 'min_price', 'max_price'),
+    ('year', 'min_year', 'max_year'),
+    ('mileage', 'min_mileage', 'max_mileage'),
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def searches_of(saved_searches):
+    """The criteria dicts stored in a ``saved_searches`` value"""
+    if isinstance(saved_searches, dict):
+        saved_searches = [saved_searches] if saved_searches else []
+    if not isinstance(saved_searches, list):
+        return []
+    return [search for search in saved_searches if isinstance(search, dict)]
+
+
+def category(field, value):
+    """Normalized value of a categorical criterion or listing attribute"""
+    if value in (None, ''):
+        return None
+    value = str(value).strip().lower()
+    if field == 'location':
+        # "New York, NY" and "new york" both match "New York"
+        value = value.split(',')[0].strip()
+    return value or None
+
+
+def _bound(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def listing_attributes(listing):
+    """What the index matches a listing (with its car) on"""
+    car = listing.car
+    return {
+        'make': car.make,
+        'model': car.model,
+        'fuel_type': car.fuel_type,
+        'transmission': car.transmission,
+        'location': listing.location,
+        'price': listing.price,
+        'year': car.year,
+        'mileage': car.mileage,
+    }
+
+
+class SavedSearchIndex:
+    """
+    In-memory inverted index of saved searches.
+
+    Each search occupies a slot; ``low``/``high`` hold its range bounds
+    (one row per entry of ``RANGES``, +-inf when unset) and ``owner`` and
+    ``position`` identify it. Each posting list is materialized with its
+    live slots' bounds copied next to each other, so a match scans
+    contiguous arrays. Replacing or removing a profile's searches marks its
+    slots dead; the index is compacted once most slots are dead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = defaultdict(list)  # categories key -> [slot, ...]
+        self._arrays = {}                   # categories key -> np.ndarray
+        self._slots = {}                    # profile id -> [slot, ...]
+        self._keys = {}                     # live slot -> categories key
+        self._size = 0
+        self._dead = 0
+        self.owner = np.zeros(0, dtype=np.int64)
+        self.position = np.zeros(0, dtype=np.int32)
+        self.low = np.zeros((len(RANGES), 0))
+        self.high = np.zeros((len(RANGES), 0))
+        self.alive = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return self._size - self._dead
+
+    def _grow(self, needed):
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        extra = capacity - len(self.alive)
+        self.owner = np.concatenate([self.owner, np.zeros(extra, dtype=np.int64)])
+        self.position = np.concatenate([self.position, np.zeros(extra, dtype=np.int32)])
+        self.low = np.concatenate([self.low, np.full((len(RANGES), extra), -np.inf)], axis=1)
+        self.high = np.concatenate([self.high, np.full((len(RANGES), extra), np.inf)], axis=1)
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def _add(self, profile_id, position, search):
+        slot = self._size
+        self._grow(slot + 1)
+        self._size += 1
+        self.owner[slot] = profile_id
+        self.position[slot] = position
+        for row, (_, low_key, high_key) in enumerate(RANGES):
+            low, high = _bound(search.get(low_key)), _bound(search.get(high_key))
+            self.low[row, slot] = -np.inf if low is None else low
+            self.high[row, slot] = np.inf if high is None else high
+        self.alive[slot] = True
+        key = tuple(category(field, search.get(field)) for field in CATEGORIES)
+        self._postings[key].append(slot)
+        self._keys[slot] = key
+        self._arrays.pop(key, None)
+        return slot
+
+    def _remove(self, profile_id):
+        slots = self._slots.pop(profile_id, ())
+        for slot in slots:
+            self.alive[slot] = False
+            self._arrays.pop(self._keys.pop(slot), None)
+        self._dead += len(slots)
+
+    def set(self, profile_id, saved_searches):
+        """Index (or re-index) the saved searches of one buyer profile"""
+        with self._lock:
+            self._remove(profile_id)
+            slots = [self._add(profile_id, position, search)
+                     for position, search in enumerate(searches_of(saved_searches))]
+            if slots:
+                self._slots[profile_id] = slots
+            if self._dead > 1024 and self._dead > len(self):
+                self._compact()
+
+    def remove(self, profile_id):
+        with self._lock:
+            self._remove(profile_id)
+
+    def _compact(self):
+        live = np.flatnonzero(self.alive[:self._size])
+        owner, position = self.owner[live], self.position[live]
+        low, high = self.low[:, live], self.high[:, live]
+        keys = [self._keys[old] for old in live.tolist()]
+        self._reset()
+        self._grow(len(live))
+        self._size = len(live)
+        self.owner[:self._size] = owner
+        self.position[:self._size] = position
+        self.low[:, :self._size] = low
+        self.high[:, :self._size] = high
+        self.alive[:self._size] = True
+        for slot, key in enumerate(keys):
+            self._postings[key].append(slot)
+            self._keys[slot] = key
+            self._slots.setdefault(int(owner[slot]), []).append(slot)
+
+    def _posting(self, key):
+        """
+        ``(slots, low, high, checks)`` of one key: its live slots ordered by
+        the upper bound of the first range, with their bounds copied next to
+        each other, and the ``(row, is_upper)`` bounds set on any of them.
+        """
+        posting = self._arrays.get(key)
+        if posting is None:
+            slots = self._postings.get(key)
+            if not slots:
+                return None
+            slots = np.fromiter(slots, dtype=np.int64, count=len(slots))
+            slots = slots[self.alive[slots]]
+            slots = slots[np.argsort(self.high[0, slots], kind='stable')]
+            low = np.ascontiguousarray(self.low[:, slots])
+            high = np.ascontiguousarray(self.high[:, slots])
+            checks = [(row, False) for row in range(len(RANGES))
+                      if np.isfinite(low[row]).any()]
+            checks += [(row, True) for row in range(1, len(RANGES))
+                       if np.isfinite(high[row]).any()]
+            posting = self._arrays[key] = (slots, low, high, checks)
+        return posting
+
+    def prepare(self):
+        """Materialize every posting list ahead of the first matches"""
+        with self._lock:
+            for key in list(self._postings):
+                self._posting(key)
+
+    def match(self, attributes):
+        """``[(profile_id, position), ...]`` of the searches a listing satisfies"""
+        values = [category(field, attributes.get(field)) for field in CATEGORIES]
+        bounds = [_bound(attributes.get(field)) for field, _, _ in RANGES]
+        with self._lock:
+            matched = []
+            for key in product(*[(value, None) if value else (None,) for value in values]):
+                posting = self._posting(key)
+                if posting is None:
+                    continue
+                slots, low, high, checks = posting
+                start = 0
+                if bounds[0] is not None:
+                    # Sorted on the first upper bound: the rest is a suffix
+                    start = np.searchsorted(high[0], bounds[0], side='left')
+                    if start == len(slots):
+                        continue
+                keep = None
+                for row, is_upper in checks:
+                    value = bounds[row]
+                    if value is None:
+                        continue
+                    inside = (high[row, start:] >= value if is_upper
+                              else low[row, start:] <= value)
+                    keep = inside if keep is None else keep & inside
+                slots = slots[start:]
+                matched.append(slots if keep is None else slots[keep])
+            if not matched:
+                return []
+            slots = np.concatenate(matched)
+            return list(zip(self.owner[slots].tolist(), self.position[slots].tolist()))
+
+
+def load(index, since=None, overlap=0, chunk_size=5000):
+    """
+    Index the saved searches of the buyer profiles updated at or after
+    ``since`` less ``overlap`` seconds (all when None). Returns the latest
+    ``updated_at`` seen, never before ``since``.
+    """
+    from .models import BuyerProfile
+
+    profiles = BuyerProfile.objects.order_by()
+    if since is not None:
+        # updated_at is stamped before commit: a profile committed after
+        # the last load may be stamped before its watermark
+        profiles = profiles.filter(updated_at__gte=since - timedelta(seconds=overlap))
+    latest = since
+    for pk, saved_searches, updated_at in profiles.values_list(
+            'pk', 'saved_searches', 'updated_at').iterator(chunk_size=chunk_size):
+        index.set(pk, saved_searches)
+        if latest is None or updated_at > latest:
+            latest = updated_at
+    return latest
+
+
+def write_notifications(rows, batch_size=500):
+    """
+    ``bulk_create`` notifications from ``(profile_id, position, listing_id,
+    reason, price)`` rows, skipping profiles deleted since they were indexed.
+    """
+    from .models import BuyerProfile, SavedSearchNotification
+
+    if not rows:
+        return 0
+    existing = set(BuyerProfile.objects.filter(
+        pk__in={row[0] for row in rows}).values_list('pk', flat=True))
+    now = timezone.now()
+    notifications = [
+        SavedSearchNotification(
+            buyer_id=profile_id, search=position, listing_id=listing_id,
+            reason=reason, price=price, created_at=now)
+        for profile_id, position, listing_id, reason, price in rows
+        if profile_id in existing
+    ]
+    SavedSearchNotification.objects.bulk_create(notifications, batch_size=batch_size)
+    return len(notifications)
+
+
+class SavedSearchNotifier:
+    """Matches queued listing changes against saved searches on a thread"""
+
+    def __init__(self, batch_size=None, max_size=None, flush_interval=None,
+                 refresh_interval=None):
+        self.batch_size = batch_size or _setting('SAVED_SEARCH_BATCH_SIZE', 500)
+        self.max_size = max_size or _setting('SAVED_SEARCH_QUEUE_SIZE', 10000)
+        self.flush_interval = flush_interval or _setting('SAVED_SEARCH_FLUSH_INTERVAL', 2)
+        self.refresh_interval = refresh_interval or _setting(
+            'SAVED_SEARCH_REFRESH_INTERVAL', 30)
+        self.refresh_overlap = _setting('SAVED_SEARCH_REFRESH_OVERLAP', 60)
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._thread = None
+        self.index = None
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self.listings = 0
+        self.notifications = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.last_match_ms = 0.0
+        self.max_match_ms = 0.0
+
+    def submit(self, attributes, listing_id, reason):
+        """Queue a committed listing change; False if the queue is full"""
+        if self._pid != os.getpid():
+            self._reset()
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((attributes, listing_id, reason))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def profile_changed(self, profile_id, saved_searches):
+        """Keep a loaded index current with a profile saved in this process"""
+        if self.index is not None and self._pid == os.getpid():
+            self.index.set(profile_id, saved_searches)
+
+    def profile_deleted(self, profile_id):
+        if self.index is not None and self._pid == os.getpid():
+            self.index.remove(profile_id)
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='saved-search-notifier', daemon=True)
+                self._thread.start()
+
+    def _ensure_index(self):
+        if self.index is None:
+            self.index = SavedSearchIndex()
+            self._watermark = load(self.index)
+            self.index.prepare()
+            self._refreshed_at = time.monotonic()
+        elif time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            # Profiles saved by other processes since the last load
+            self._watermark = load(self.index, since=self._watermark,
+                                   overlap=self.refresh_overlap)
+            self._refreshed_at = time.monotonic()
+
+    def _next_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch(self.flush_interval)
+            if batch:
+                self.process(batch)
+            close_old_connections()
+
+    def drain(self):
+        """Process everything currently queued from the calling thread"""
+        while True:
+            batch = self._next_batch(timeout=0.001)
+            if not batch:
+                return
+            self.process(batch)
+
+    def process(self, batch):
+        """Match ``(attributes, listing_id, reason)`` items and write notifications"""
+        try:
+            self._ensure_index()
+            rows = []
+            for attributes, listing_id, reason in batch:
+                start = time.perf_counter()
+                matches = self.index.match(attributes)
+                elapsed = (time.perf_counter() - start) * 1000
+                self.last_match_ms = elapsed
+                self.max_match_ms = max(self.max_match_ms, elapsed)
+                rows.extend((profile_id, position, listing_id, reason, attributes['price'])
+                            for profile_id, position in matches)
+                if len(rows) >= self.batch_size:
+                    self.notifications += write_notifications(rows, self.batch_size)
+                    rows = []
+            self.notifications += write_notifications(rows, self.batch_size)
+            self.listings += len(batch)
+        except Exception:
+            logger.exception("Matching %d listing(s) against saved searches failed",
+                             len(batch))
+            self.failed_batches += 1
+
+    def metrics(self):
+        """Queue depth and throughput figures for monitoring"""
+        return {
+            'queued': self._queue.qsize(),
+            'capacity': self.max_size,
+            'indexed_searches': len(self.index) if self.index is not None else 0,
+            'listings': self.listings,
+            'notifications': self.notifications,
+            'dropped': self.dropped,
+            'failed_batches': self.failed_batches,
+            'last_match_ms': round(self.last_match_ms, 3),
+            'max_match_ms': round(self.max_match_ms, 3),
+        }
+
+
+notifier = SavedSearchNotifier()
+
+
+@atexit.register
+def _drain_at_exit():
+    if notifier._pid == os.getpid() and not notifier._queue.empty():
+        notifier.drain()
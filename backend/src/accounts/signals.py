@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from cars.models import CarListing
+
+from . import ratings, saved_searches
+from .models import BuyerProfile, SellerReview
+
+
+@receiver(pre_save, sender=CarListing)
+def remember_listing_price(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Remember a listing's price before saving to notice repricing"""
+    instance._saved_search_price = None
+    if raw or instance.pk is None or (
+            update_fields is not None and 'price' not in update_fields):
+        return
+    instance._saved_search_price = (
+        CarListing.objects.filter(pk=instance.pk)
+        .values_list('price', flat=True).first())
+
+
+@receiver(post_save, sender=CarListing)
+def match_saved_searches(sender, instance, created, raw=False, **kwargs):
+    """Queue new and repriced available listings for saved-search matching"""
+    if raw or instance.status != 'available':
+        return
+    if created:
+        reason = 'new'
+    else:
+        previous = getattr(instance, '_saved_search_price', None)
+        if previous is None or previous == instance.price:
+            return
+        reason = 'repriced'
+    attributes = saved_searches.listing_attributes(instance)
+    transaction.on_commit(lambda: saved_searches.notifier.submit(
+        attributes, instance.pk, reason))
+
+
+@receiver(post_save, sender=BuyerProfile)
+def index_saved_searches(sender, instance, raw=False, **kwargs):
+    """Keep this process's saved-search index current"""
+    if not raw:
+        transaction.on_commit(lambda: saved_searches.notifier.profile_changed(
+            instance.pk, instance.saved_searches))
+
+
+@receiver(post_delete, sender=BuyerProfile)
+def unindex_saved_searches(sender, instance, **kwargs):
+    transaction.on_commit(lambda: saved_searches.notifier.profile_deleted(instance.pk))
+
+
+@receiver(post_delete, sender=SellerReview)
+def remove_review_rating(sender, instance, **kwargs):
+    """Take a deleted review off its seller's rating"""
+    ratings.review_deleted(instance)
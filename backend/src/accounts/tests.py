@@ -1,3 +1,281 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from cars.models import Car, CarListing, ListingSummary
+
+from . import ratings, saved_searches
+from .models import BuyerProfile, SavedSearchNotification, SellerProfile, SellerReview
+from .saved_searches import SavedSearchIndex, SavedSearchNotifier, listing_attributes
+
+User = get_user_model()
+
+
+def make_user(name):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='secret')
+
+
+def make_listing(seller, make='Toyota', model='Corolla', price=12000, year=2018,
+                 mileage=42000, location='New York, NY', fuel_type='hybrid'):
+    car = Car.objects.create(make=make, model=model, year=year, mileage=mileage,
+                             fuel_type=fuel_type, transmission='automatic', color='Blue',
+                             engine_size='1.8L')
+    return CarListing.objects.create(car=car, seller=seller, price=Decimal(price),
+                                     description='Clean car', location=location)
+
+
+def attributes(**values):
+    return {'make': 'Toyota', 'model': 'Corolla', 'fuel_type': 'hybrid',
+            'transmission': 'automatic', 'location': 'New York, NY', 'price': 15000,
+            'year': 2019, 'mileage': 30000, **values}
+
+
+class SavedSearchIndexTests(TestCase):
+    """The index finds exactly the searches whose criteria a listing satisfies"""
+
+    SEARCHES = [
+        {'make': 'Toyota', 'model': 'Corolla', 'fuel_type': 'hybrid', 'location': 'New York',
+         'min_price': 10000, 'max_price': 30000, 'min_year': 2018, 'max_mileage': 80000},
+        {'make': 'toyota'},
+        {'location': 'new york', 'max_price': 14000},
+        {'make': 'Honda'},
+        {},
+        {'min_year': 2020},
+    ]
+
+    def setUp(self):
+        self.index = SavedSearchIndex()
+        self.index.set(1, self.SEARCHES[:3])
+        self.index.set(2, self.SEARCHES[3:])
+
+    def test_categories_are_wildcards_and_normalized(self):
+        self.assertEqual(sorted(self.index.match(attributes())), [(1, 0), (1, 1), (2, 1)])
+        self.assertEqual(sorted(self.index.match(attributes(price=12000, year=2021))),
+                         [(1, 0), (1, 1), (1, 2), (2, 1), (2, 2)])
+        self.assertEqual(sorted(self.index.match(attributes(make='Honda', location=''))),
+                         [(2, 0), (2, 1)])
+
+    def test_ranges_are_inclusive(self):
+        self.assertIn((1, 0), self.index.match(attributes(price=30000, mileage=80000)))
+        self.assertNotIn((1, 0), self.index.match(attributes(price=30000.01)))
+        self.assertNotIn((1, 0), self.index.match(attributes(year=2017)))
+
+    def test_reindex_and_remove(self):
+        self.index.set(1, {'make': 'Honda'})
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(sorted(self.index.match(attributes(make='Honda'))),
+                         [(1, 0), (2, 0), (2, 1)])
+        self.index.remove(2)
+        self.assertEqual(self.index.match(attributes()), [])
+        self.assertEqual(self.index.match(attributes(make='Honda')), [(1, 0)])
+
+    def test_compaction_keeps_matches(self):
+        for _ in range(1100):
+            self.index.set(3, [{'make': 'Mazda'}, {}])
+        self.assertLess(self.index._size, 2000)
+        self.assertEqual(len(self.index), 8)
+        self.assertEqual(sorted(self.index.match(attributes(make='Mazda'))),
+                         [(2, 1), (3, 0), (3, 1)])
+
+    def test_invalid_searches_are_ignored(self):
+        self.index.set(4, ['not a search', {'make': 'Toyota', 'max_price': 'cheap'}])
+        self.assertIn((4, 0), self.index.match(attributes(price=99000)))
+        self.index.set(5, 'nothing')
+        self.assertEqual(len(self.index), 7)
+
+
+class SavedSearchNotificationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user('seller')
+        cls.buyer = BuyerProfile.objects.create(
+            user=make_user('buyer'),
+            saved_searches=[{'make': 'Toyota', 'max_price': 20000}, {'make': 'Honda'}])
+        cls.other = BuyerProfile.objects.create(
+            user=make_user('other'), saved_searches={'location': 'Boston'})
+
+    def notifications(self):
+        return sorted(SavedSearchNotification.objects.values_list(
+            'buyer_id', 'search', 'listing_id', 'reason', 'price'))
+
+    def queued(self, callbacks):
+        """What the listing callbacks captured on commit submit to the notifier"""
+        # The risk scorer would score the listing on its own thread
+        with mock.patch.object(saved_searches.notifier, 'submit') as submit, \
+                mock.patch('moderation.risk.scorer.submit'):
+            for callback in callbacks:
+                callback()
+        return [(call.args[1], call.args[2]) for call in submit.call_args_list]
+
+    def test_new_and_repriced_listings_are_queued(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            listing = make_listing(self.seller)
+        self.assertEqual(self.queued(callbacks), [(listing.pk, 'new')])
+        for change in ({'description': 'Still clean'}, {'price': Decimal(11000)}):
+            for field, value in change.items():
+                setattr(listing, field, value)
+            with self.captureOnCommitCallbacks() as callbacks:
+                listing.save()
+            queued = self.queued(callbacks)
+        self.assertEqual(queued, [(listing.pk, 'repriced')])
+        listing.status, listing.price = 'sold', Decimal(10000)
+        with self.captureOnCommitCallbacks() as callbacks:
+            listing.save()
+        self.assertEqual(self.queued(callbacks), [])
+
+    def test_process_writes_notifications(self):
+        toyota = make_listing(self.seller)
+        pricey = make_listing(self.seller, price=25000, location='Boston, MA')
+        notifier = SavedSearchNotifier()
+        notifier.process([(listing_attributes(toyota), toyota.pk, 'new'),
+                          (listing_attributes(pricey), pricey.pk, 'repriced')])
+        self.assertEqual(self.notifications(), [
+            (self.buyer.pk, 0, toyota.pk, 'new', Decimal(12000)),
+            (self.other.pk, 0, pricey.pk, 'repriced', Decimal(25000)),
+        ])
+        self.assertEqual(notifier.metrics()['indexed_searches'], 3)
+        self.assertEqual(notifier.metrics()['listings'], 2)
+
+    def test_refresh_and_deleted_profiles(self):
+        notifier = SavedSearchNotifier(refresh_interval=0.0001)
+        notifier._ensure_index()
+        self.other.saved_searches = {'make': 'Honda'}
+        self.other.save()
+        honda = make_listing(self.seller, make='Honda', model='Civic')
+        BuyerProfile.objects.filter(pk=self.buyer.pk).delete()
+        notifier.process([(listing_attributes(honda), honda.pk, 'new')])
+        # The refresh picked up the changed profile; the deleted one is skipped
+        self.assertEqual(self.notifications(),
+                         [(self.other.pk, 0, honda.pk, 'new', Decimal(12000))])
+        self.assertEqual(notifier.failed_batches, 0)
+
+    def test_refresh_rereads_late_commits(self):
+        notifier = SavedSearchNotifier(refresh_interval=3600)
+        notifier._ensure_index()
+        watermark = notifier._watermark
+        # Saved in another process before the last load, committed after it
+        BuyerProfile.objects.filter(pk=self.other.pk).update(
+            saved_searches={'make': 'Honda'}, updated_at=watermark - timedelta(seconds=5))
+        notifier._refreshed_at = 0.0
+        honda = make_listing(self.seller, make='Honda', model='Civic')
+        notifier.process([(listing_attributes(honda), honda.pk, 'new')])
+        self.assertEqual(sorted(row[:2] for row in self.notifications()),
+                         sorted([(self.buyer.pk, 1), (self.other.pk, 0)]))
+        self.assertEqual(notifier._watermark, watermark)
+
+    def test_failed_batch_is_counted(self):
+        notifier = SavedSearchNotifier()
+        with mock.patch.object(saved_searches, 'write_notifications',
+                               side_effect=RuntimeError('down')), \
+                self.assertLogs('accounts.saved_searches', 'ERROR'):
+            notifier.process([(attributes(), 0, 'new')])
+        self.assertEqual(notifier.failed_batches, 1)
+        self.assertEqual(notifier.listings, 0)
+
+    def test_match_command(self):
+        make_listing(self.seller, make='Honda', model='Civic')
+        call_command('match_saved_searches', stdout=mock.MagicMock())
+        self.assertEqual([row[:2] for row in self.notifications()], [(self.buyer.pk, 1)])
+
+
+@override_settings(SELLER_RATING_PRIOR_MEAN=4.0, SELLER_RATING_PRIOR_WEIGHT=5)
+class SellerRatingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user('seller')
+        cls.other_seller = make_user('other-seller')
+        cls.buyers = [make_user(f'buyer{i}') for i in range(4)]
+        cls.listing = make_listing(cls.seller)
+        cls.other_listing = make_listing(cls.other_seller, make='Honda', model='Civic')
+
+    def review(self, buyer, rating, seller=None):
+        return SellerReview.objects.create(
+            seller=seller or self.seller, reviewer=buyer, rating=rating)
+
+    def rating(self, seller):
+        return SellerProfile.objects.get(user=seller).rating
+
+    def assertConsistent(self):
+        self.assertEqual(ratings.recompute(check_only=True)[1:], (0, 0))
+        for summary in ListingSummary.objects.all():
+            self.assertEqual(summary.seller_rating, ratings.rating_of(summary.seller))
+
+    def test_smoothed(self):
+        self.assertEqual(ratings.prior_rating(), 4.0)
+        self.assertEqual(ratings.smoothed(5, 1), 4.1667)
+        self.assertEqual(ratings.smoothed(4.8 * 200, 200), round((20 + 960) / 205, 4))
+        with self.settings(SELLER_RATING_PRIOR_WEIGHT=0):
+            self.assertEqual(ratings.smoothed(0, 0), 0.0)
+        self.assertEqual(ratings.rating_of(self.seller), 4.0)
+
+    def test_reviews_move_the_rating(self):
+        reviews = [self.review(buyer, stars) for buyer, stars in zip(self.buyers, (5, 5, 3))]
+        profile = SellerProfile.objects.get(user=self.seller)
+        self.assertEqual((profile.rating_sum, profile.rating_count), (13, 3))
+        self.assertEqual(profile.rating, ratings.smoothed(13, 3))
+        self.assertEqual(ListingSummary.objects.get(listing=self.listing).seller_rating,
+                         profile.rating)
+        self.assertConsistent()
+        reviews[2].rating = 1
+        reviews[2].save()
+        self.assertEqual(self.rating(self.seller), ratings.smoothed(11, 3))
+        # Moved to another seller
+        reviews[0].seller = self.other_seller
+        reviews[0].save()
+        self.assertEqual(self.rating(self.seller), ratings.smoothed(6, 2))
+        self.assertEqual(self.rating(self.other_seller), ratings.smoothed(5, 1))
+        self.assertConsistent()
+        reviews[1].delete()
+        self.assertEqual(self.rating(self.seller), ratings.smoothed(1, 1))
+        self.assertConsistent()
+
+    def test_invalid_reviews(self):
+        with self.assertRaises(ValidationError):
+            self.review(self.seller, 5)
+        with self.assertRaises(ValidationError):
+            SellerReview.objects.create(seller=self.seller, reviewer=self.buyers[0], rating=5,
+                                        listing=self.other_listing)
+        self.assertFalse(SellerProfile.objects.exists())
+
+    def test_recompute_fixes_stale_ratings(self):
+        for buyer, stars in zip(self.buyers, (5, 4, 2)):
+            self.review(buyer, stars)
+        self.review(self.buyers[3], 1, seller=self.other_seller)
+        SellerProfile.objects.filter(user=self.seller).update(rating_sum=0, rating=1.0)
+        SellerProfile.objects.filter(user=self.other_seller).delete()
+        ListingSummary.objects.update(seller_rating=0)
+        self.assertEqual(ratings.recompute(check_only=True), (1, 2, 2))
+        # The missing profile is created, then filled in
+        self.assertEqual(ratings.recompute(batch_size=1), (2, 2, 2))
+        self.assertEqual(self.rating(self.seller), ratings.smoothed(11, 3))
+        self.assertEqual(self.rating(self.other_seller), ratings.smoothed(1, 1))
+        self.assertConsistent()
+
+    def test_recompute_command(self):
+        self.review(self.buyers[0], 5)
+        ListingSummary.objects.update(seller_rating=0)
+        out = StringIO()
+        call_command('recompute_seller_ratings', '--check', stdout=out)
+        self.assertIn('0 stale rating(s), 2 stale listing summary row(s).', out.getvalue())
+        call_command('recompute_seller_ratings', stdout=out)
+        self.assertIn('2 stale listing summary row(s) fixed.', out.getvalue())
+        self.assertConsistent()
+
+    @mock.patch('cars.views.log_search')
+    def test_search_sorts_by_rating(self, log_search):
+        self.review(self.buyers[0], 1)
+        self.review(self.buyers[1], 5, seller=self.other_seller)
+        response = self.client.get('/api/cars/search/', {'sort': 'rating'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['seller_rating'] for row in response.json()['results']],
+                         [self.rating(self.other_seller), self.rating(self.seller)])
 
-# Create your tests here.
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 import json
 from .models import Analytics, SearchLog
+from .sketches import top_items
 
 
 @admin.register(Analytics)
@@ -49,13 +50,9 @@ class AnalyticsAdmin(admin.ModelAdmin):
     def top_search_terms(self, obj):
         """Display top 3 search terms"""
         if obj.search_terms:
-            # Sort by frequency and take top 3
-            sorted_terms = sorted(
-                obj.search_terms.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:3]
-            terms = [f"{term} ({count})" for term, count in sorted_terms]
+            # Summaries are stored sorted by frequency
+            terms = [f"{term} ({count})"
+                     for term, count in top_items(obj.search_terms, 3)]
             return ", ".join(terms) if terms else "No data"
         return "No data"
     top_search_terms.short_description = 'Top Search Terms'  # type: ignore
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        from carzone.instrumentation import registry
+
+        from .ingest import search_log_queue
+        registry.register_provider('carzone_search_log_queue', search_log_queue.metrics)
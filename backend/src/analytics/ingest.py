@@ -0,0 +1,243 @@
+"""
+Asynchronous SearchLog ingestion.
+
+Requests hand search log entries to a bounded in-memory queue and return
+immediately; a background thread drains the queue and writes the entries
+with ``bulk_create`` in batches. When the queue is full (the database is not
+keeping up) or a batch cannot be written, entries are either dropped or
+spilled to a JSON-lines file in ``SEARCH_LOG_SPILL_DIR`` depending on
+``SEARCH_LOG_OVERFLOW``; spilled entries are loaded back with the
+``replay_search_logs`` management command.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop', 'spill')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class SearchLogQueue:
+    """Bounded queue of SearchLog entries drained by a writer thread"""
+
+    def __init__(self, batch_size=None, max_size=None, flush_interval=None,
+                 overflow=None, spill_dir=None):
+        self.batch_size = batch_size or _setting('SEARCH_LOG_BATCH_SIZE', 500)
+        self.max_size = max_size or _setting('SEARCH_LOG_QUEUE_SIZE', 10000)
+        self.flush_interval = flush_interval or _setting('SEARCH_LOG_FLUSH_INTERVAL', 2)
+        self.overflow = overflow or _setting('SEARCH_LOG_OVERFLOW', 'spill')
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"SEARCH_LOG_OVERFLOW must be one of {OVERFLOW_POLICIES}.")
+        self.spill_dir = Path(spill_dir or _setting(
+            'SEARCH_LOG_SPILL_DIR', settings.BASE_DIR / 'var' / 'search_logs'))
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._thread = None
+        self.accepted = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed_batches = 0
+        self.last_batch_ms = 0.0
+
+    def submit(self, query, results_count=0, user=None, ip_address=None):
+        """
+        Queue a search log entry without touching the database.
+
+        Returns False if the entry had to be dropped or spilled.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        entry = {
+            'query': query[:255],
+            'results_count': results_count,
+            'user_id': getattr(user, 'pk', user),
+            'ip_address': ip_address,
+            'timestamp': timezone.now().isoformat(),
+        }
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._overflow([entry])
+            return False
+        self.accepted += 1
+        return True
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='search-log-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+            close_old_connections()
+
+    def drain(self):
+        """Write everything currently queued from the calling thread"""
+        while True:
+            batch = self._next_batch(timeout=0.001)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            write_entries(batch, self.batch_size)
+        except Exception:
+            logger.exception("Writing %d search log entries failed", len(batch))
+            self.failed_batches += 1
+            self._overflow(batch)
+            return
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+        self.written += len(batch)
+
+    def _overflow(self, entries):
+        if self.overflow == 'drop':
+            self.dropped += len(entries)
+            return
+        try:
+            with self._spill_lock:
+                self.spill_dir.mkdir(parents=True, exist_ok=True)
+                path = self.spill_dir / f'search_log-{os.getpid()}.jsonl'
+                with open(path, 'a', encoding='utf-8') as spill:
+                    for entry in entries:
+                        spill.write(json.dumps(entry) + '\n')
+            self.spilled += len(entries)
+        except OSError:
+            logger.exception("Spilling %d search log entries failed", len(entries))
+            self.dropped += len(entries)
+
+    def metrics(self):
+        """Queue depth and throughput figures for monitoring"""
+        return {
+            'queued': self._queue.qsize(),
+            'capacity': self.max_size,
+            'accepted': self.accepted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'failed_batches': self.failed_batches,
+            'last_batch_ms': round(self.last_batch_ms, 3),
+        }
+
+
+def write_entries(entries, batch_size=500):
+    """``bulk_create`` SearchLog rows from queued entry dicts"""
+    from .models import SearchLog
+
+    SearchLog.objects.bulk_create(
+        [
+            SearchLog(
+                query=entry['query'],
+                results_count=entry['results_count'],
+                user_id=entry['user_id'],
+                ip_address=entry['ip_address'],
+                timestamp=parse_datetime(entry['timestamp']),
+            )
+            for entry in entries
+        ],
+        batch_size=batch_size,
+    )
+
+
+def replay_spilled(spill_dir=None, batch_size=500):
+    """
+    Load spilled entries back into the database.
+
+    Each spill file is renamed before it is read so writers start a new
+    file; a file is written in one transaction and deleted once it commits.
+    Returns the number of entries written.
+    """
+    spill_dir = Path(spill_dir or _setting(
+        'SEARCH_LOG_SPILL_DIR', settings.BASE_DIR / 'var' / 'search_logs'))
+    if not spill_dir.exists():
+        return 0
+
+    written = 0
+    for path in sorted(spill_dir.glob('search_log-*.jsonl')):
+        claimed = path.with_suffix('.replaying')
+        path.rename(claimed)
+        written += _replay_file(claimed, batch_size)
+    for claimed in sorted(spill_dir.glob('search_log-*.replaying')):
+        written += _replay_file(claimed, batch_size)
+    return written
+
+
+def _replay_file(path, batch_size):
+    if not path.exists():
+        return 0
+    batch = []
+    written = 0
+    with transaction.atomic():
+        with open(path, encoding='utf-8') as spill:
+            for line in spill:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    write_entries(batch, batch_size)
+                    written += len(batch)
+                    batch = []
+        if batch:
+            write_entries(batch, batch_size)
+            written += len(batch)
+    path.unlink()
+    return written
+
+
+search_log_queue = SearchLogQueue()
+
+
+@atexit.register
+def _drain_on_exit():
+    try:
+        search_log_queue.drain()
+    except Exception:
+        logger.exception("Draining the search log queue at exit failed")
+
+
+def log_search(query, results_count=0, user=None, ip_address=None):
+    """Record a search without adding the insert to the request latency"""
+    if user is not None and not getattr(user, 'is_authenticated', True):
+        user = None
+    return search_log_queue.submit(query, results_count, user, ip_address)
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from analytics.ingest import replay_spilled
+
+
+class Command(BaseCommand):
+    help = "Load search log entries spilled to disk back into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--spill-dir', default=None,
+            help="Directory holding spill files (default: SEARCH_LOG_SPILL_DIR)")
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=getattr(settings, 'SEARCH_LOG_BATCH_SIZE', 500))
+
+    def handle(self, *args, **options):
+        written = replay_spilled(options['spill_dir'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Replayed {written} search log entries."))
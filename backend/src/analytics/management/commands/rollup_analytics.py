@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll up users, listings, messages, reports and searches into the "
+        "daily Analytics rows. Without dates, rolls up yesterday and today; "
+        "safe to run from cron as often as needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat,
+                            help="Single day to roll up (YYYY-MM-DD)")
+        parser.add_argument('--start', type=date.fromisoformat,
+                            help="First day of a backfill range")
+        parser.add_argument('--end', type=date.fromisoformat,
+                            help="Last day of a backfill range (inclusive)")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Days rolled up in parallel when backfilling")
+        parser.add_argument('--full', action='store_true',
+                            help="Recompute the days instead of resuming from "
+                                 "their watermarks")
+
+    def handle(self, *args, **options):
+        if options['date']:
+            start = end = options['date']
+        elif options['start'] or options['end']:
+            if not (options['start'] and options['end']):
+                raise CommandError("--start and --end must be used together.")
+            start, end = options['start'], options['end']
+            if start > end:
+                raise CommandError("--start must not be after --end.")
+        else:
+            counts = rollup.run_scheduled_rollup()
+            self._report(counts)
+            return
+
+        counts = rollup.backfill(
+            start, end, workers=options['workers'], full=options['full'])
+        self._report(counts)
+
+    def _report(self, counts):
+        for day, counted in sorted(counts.items()):
+            self.stdout.write(f"{day}: {counted} new row(s)")
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {len(counts)} day(s)."))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_search_log_event_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('source', models.CharField(choices=[('users', 'Users'), ('listings', 'Listings'), ('messages', 'Messages'), ('reports', 'Reports'), ('searches', 'Searches')], max_length=20)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Rollup Watermark',
+                'verbose_name_plural': 'Rollup Watermarks',
+                'db_table': 'rollup_watermark',
+                'unique_together': {('date', 'source')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+import analytics.rollup
+
+SOURCES = {
+    'users': ('accounts', 'User', 'date_joined'),
+    'listings': ('cars', 'CarListing', 'created_at'),
+    'messages': ('messaging', 'Message', 'timestamp'),
+    'reports': ('moderation', 'Report', 'created_at'),
+    'searches': ('analytics', 'SearchLog', 'timestamp'),
+}
+
+
+def fill_recent_ids(apps, schema_editor):
+    """Rows at or below existing watermarks were counted already"""
+    RollupWatermark = apps.get_model('analytics', 'RollupWatermark')
+    for watermark in RollupWatermark.objects.filter(last_id__gt=0):
+        app_label, model_name, ts_field = SOURCES[watermark.source]
+        start, end = analytics.rollup.day_bounds(watermark.date)
+        watermark.recent_ids = sorted(
+            apps.get_model(app_label, model_name).objects.filter(
+                pk__gt=watermark.last_id - analytics.rollup.overlap(),
+                pk__lte=watermark.last_id,
+                **{f'{ts_field}__gte': start, f'{ts_field}__lt': end},
+            ).values_list('pk', flat=True))
+        watermark.save(update_fields=['recent_ids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_rollup_watermark'),
+        ('accounts', '0001_initial'),
+        ('cars', '0001_initial'),
+        ('messaging', '0001_initial'),
+        ('moderation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='recent_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(fill_recent_ids, migrations.RunPython.noop),
+    ]
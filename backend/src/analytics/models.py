@@ -72,7 +72,8 @@ class SearchLog(models.Model):
         related_name='search_logs'
     )
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the search happens, not when the batched insert runs
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         db_table = 'search_log'
@@ -86,3 +87,34 @@ class SearchLog(models.Model):
 
     def __str__(self):
         return f"Search: '{self.query}' ({self.results_count} results)"
+
+
+class RollupWatermark(models.Model):
+    """Highest source row id already folded into a day's Analytics row
+
+    ``recent_ids`` lists the ids counted within the overlap window below
+    ``last_id``, which the next rollup scans again (see ``analytics.rollup``).
+    """
+
+    SOURCE_CHOICES = [
+        ('users', 'Users'),
+        ('listings', 'Listings'),
+        ('messages', 'Messages'),
+        ('reports', 'Reports'),
+        ('searches', 'Searches'),
+    ]
+
+    date = models.DateField()
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    last_id = models.BigIntegerField(default=0)
+    recent_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'rollup_watermark'
+        verbose_name = 'Rollup Watermark'
+        verbose_name_plural = 'Rollup Watermarks'
+        unique_together = ['date', 'source']
+
+    def __str__(self):
+        return f"{self.source} rolled up to #{self.last_id} for {self.date}"
@@ -0,0 +1,167 @@
+"""
+Incremental daily rollups into ``Analytics``.
+
+For each day and source table a ``RollupWatermark`` records the highest row
+id already counted, so rolling up a day again only reads rows created since
+the previous run. Ids are handed out when rows are inserted, not when their
+transactions commit, so a row can become visible after a higher id was
+already counted. Each run therefore also scans the last
+``ANALYTICS_ROLLUP_OVERLAP`` ids below the watermark and skips the ones
+counted before, which the watermark keeps in ``recent_ids``. Search terms
+and locations are kept as bounded top-K summaries (see
+``analytics.sketches``); listings are counted under their resolved place
+(``cars.geo``) where there is one. Views (``total_views``) are written by
+the listing view counter and are not touched here.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Analytics, RollupWatermark, SearchLog
+from .sketches import SpaceSaving
+
+logger = logging.getLogger(__name__)
+
+
+def _sources():
+    """source name -> (model, timestamp field, counter field)"""
+    from cars.models import CarListing
+    from messaging.models import Message
+    from moderation.models import Report
+
+    return {
+        'users': (get_user_model(), 'date_joined', 'new_users'),
+        'listings': (CarListing, 'created_at', 'new_listings'),
+        'messages': (Message, 'timestamp', 'new_messages'),
+        'reports': (Report, 'created_at', 'new_reports'),
+        'searches': (SearchLog, 'timestamp', None),
+    }
+
+
+def day_bounds(day):
+    """Aware ``[start, end)`` datetimes of a local calendar day"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, start + timedelta(days=1)
+
+
+def _merge_counts(stored, rows, key):
+    """Offer grouped ``rows`` to the top-K summary ``stored`` as JSON"""
+    summary = SpaceSaving.from_json(stored)
+    summary.update((row[key], row['n']) for row in rows.iterator() if row[key])
+    return summary.to_json()
+
+
+def overlap():
+    """Ids below a watermark scanned again by the next rollup"""
+    return getattr(settings, 'ANALYTICS_ROLLUP_OVERLAP', 500)
+
+
+def rollup_day(day, full=False):
+    """
+    Fold rows created on ``day`` into its Analytics row.
+
+    With ``full`` the day is recomputed from scratch instead of resuming
+    from the stored watermarks. Returns the number of new rows counted.
+    """
+    start, end = day_bounds(day)
+    counted = 0
+
+    with transaction.atomic():
+        Analytics.get_or_create_for_date(day)
+        analytics = Analytics.objects.select_for_update().get(date=day)
+        watermarks = {
+            wm.source: wm for wm in
+            RollupWatermark.objects.select_for_update().filter(date=day)
+        }
+        if full:
+            analytics.new_users = analytics.new_listings = 0
+            analytics.new_messages = analytics.new_reports = 0
+            analytics.search_terms = {}
+            analytics.popular_locations = {}
+
+        for source, (model, ts_field, counter) in _sources().items():
+            watermark = watermarks.get(source) or RollupWatermark(
+                date=day, source=source)
+            last_id = 0 if full else watermark.last_id
+            recent = set() if full else set(watermark.recent_ids)
+            rows = model.objects.filter(
+                pk__gt=max(last_id - overlap(), 0),
+                **{f'{ts_field}__gte': start, f'{ts_field}__lt': end},
+            ).exclude(pk__in=recent).order_by()
+
+            summary = rows.aggregate(n=Count('pk'), max_id=Max('pk'))
+            if summary['n']:
+                counted += summary['n']
+                if counter:
+                    setattr(analytics, counter,
+                            getattr(analytics, counter) + summary['n'])
+                if source == 'listings':
+                    # Spelling variants of one city count together
+                    analytics.popular_locations = _merge_counts(
+                        analytics.popular_locations,
+                        rows.values(place_name=Coalesce('place__display_name', 'location'))
+                        .annotate(n=Count('pk')),
+                        'place_name')
+                elif source == 'searches':
+                    analytics.search_terms = _merge_counts(
+                        analytics.search_terms,
+                        rows.values('query').annotate(n=Count('pk')),
+                        'query')
+                last_id = max(last_id, summary['max_id'])
+                recent |= set(rows.filter(pk__gt=last_id - overlap())
+                              .values_list('pk', flat=True))
+            watermark.last_id = last_id
+            watermark.recent_ids = sorted(pk for pk in recent if pk > last_id - overlap())
+            watermark.save()
+
+        analytics.save()
+
+    return counted
+
+
+def _rollup_in_thread(day, full):
+    try:
+        return rollup_day(day, full=full)
+    finally:
+        connection.close()
+
+
+def backfill(start, end, workers=4, full=False):
+    """
+    Roll up every day from ``start`` to ``end`` inclusive, ``workers`` days
+    at a time. Returns ``{day: rows counted}``.
+    """
+    days = []
+    day = start
+    while day <= end:
+        days.append(day)
+        day += timedelta(days=1)
+
+    if connection.vendor == 'sqlite':
+        # SQLite allows a single writer; parallel days would just contend.
+        workers = 1
+    if workers <= 1:
+        return {day: rollup_day(day, full=full) for day in days}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(lambda d: _rollup_in_thread(d, full), days)
+        return dict(zip(days, counts))
+
+
+def run_scheduled_rollup():
+    """
+    Job entry point for cron/schedulers: roll up today and yesterday, so
+    rows created just before midnight are picked up by the next run.
+    """
+    today = timezone.localdate()
+    counts = backfill(today - timedelta(days=1), today, workers=1)
+    logger.info("Analytics rollup counted %s", counts)
+    return counts
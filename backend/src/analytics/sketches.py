@@ -0,0 +1,134 @@
+"""
+Bounded top-K summaries for the ``Analytics`` JSON fields.
+
+``SpaceSaving`` (Metwally et al.) keeps at most ``k`` counters regardless of
+how many distinct terms it sees. Every kept count over-estimates the true
+count by at most its recorded error, any term whose true count exceeds
+``total / k`` is guaranteed to be kept, and two summaries can be merged, so
+daily summaries combine into weekly/monthly ones without rereading logs.
+"""
+from django.conf import settings
+
+
+def default_k():
+    return getattr(settings, 'ANALYTICS_TOP_K', 100)
+
+
+class SpaceSaving:
+    """Mergeable top-K frequency summary"""
+
+    def __init__(self, k=None):
+        self.k = k or default_k()
+        self.counts = {}
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def full(self):
+        return len(self.counts) >= self.k
+
+    def min_count(self):
+        return min(self.counts.values()) if self.counts else 0
+
+    def offer(self, item, count=1):
+        """Count ``count`` occurrences of ``item``"""
+        if item in self.counts:
+            self.counts[item] += count
+        elif not self.full:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            # Replace the smallest counter; the new item inherits its count
+            # as the error bound.
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[item] = floor + count
+            self.errors[item] = floor
+
+    def update(self, pairs):
+        """Offer every ``(item, count)`` pair"""
+        for item, count in pairs:
+            self.offer(item, count)
+        return self
+
+    def merge(self, other):
+        """Combine with another summary (of any ``k``) into this one"""
+        # An item missing from a full summary may still have occurred up to
+        # that summary's smallest count.
+        mine = self.min_count() if self.full else 0
+        theirs = other.min_count() if other.full else 0
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = (self.counts.get(item, mine)
+                            + other.counts.get(item, theirs))
+            errors[item] = (self.errors.get(item, mine)
+                            + other.errors.get(item, theirs))
+        kept = sorted(counts, key=counts.get, reverse=True)[:self.k]
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        return self
+
+    def top(self, n=None):
+        """``[(item, count), ...]`` sorted by decreasing count"""
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        return ranked[:n] if n is not None else ranked
+
+    def to_json(self):
+        """Compact JSON form: ``{"k": k, "items": [[item, count, error]...]}``"""
+        return {
+            'k': self.k,
+            'items': [[item, count, self.errors[item]] for item, count in self.top()],
+        }
+
+    @classmethod
+    def from_json(cls, data, k=None):
+        """
+        Load a summary stored by ``to_json``. Plain ``{item: count}``
+        dictionaries, as written before summaries were introduced, are
+        accepted and truncated to ``k``.
+        """
+        data = data or {}
+        if 'items' in data and 'k' in data:
+            summary = cls(k or data['k'])
+            for item, count, error in data['items'][:summary.k]:
+                summary.counts[item] = count
+                summary.errors[item] = error
+            return summary
+        return cls(k).update(
+            sorted(data.items(), key=lambda kv: kv[1], reverse=True))
+
+
+def top_items(data, n):
+    """Top ``n`` ``(item, count)`` pairs of a stored summary"""
+    if data and 'items' in data and 'k' in data:
+        # Stored in decreasing order already
+        return [(item, count) for item, count, _ in data['items'][:n]]
+    return SpaceSaving.from_json(data).top(n)
+
+
+# Analytics fields holding top-K summaries
+SUMMARY_FIELDS = ('search_terms', 'top_models', 'popular_locations')
+
+
+def summary_for_range(field, start, end):
+    """
+    Merge the daily summaries stored in ``Analytics.<field>`` from ``start``
+    to ``end`` inclusive, e.g. for weekly top search terms.
+    """
+    from .models import Analytics
+
+    if field not in SUMMARY_FIELDS:
+        raise ValueError(f"field must be one of {', '.join(SUMMARY_FIELDS)}.")
+
+    summary = SpaceSaving()
+    stored = (
+        Analytics.objects.filter(date__gte=start, date__lte=end)
+        .values_list(field, flat=True)
+    )
+    for data in stored:
+        summary.merge(SpaceSaving.from_json(data))
+    return summary
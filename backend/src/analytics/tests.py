@@ -1,3 +1,182 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import ingest
+from .ingest import SearchLogQueue, replay_spilled
+from .models import Analytics, RollupWatermark, SearchLog
+from .rollup import day_bounds, rollup_day
+from .sketches import SpaceSaving, summary_for_range, top_items
+
+
+class SearchLogIngestTests(TestCase):
+
+    def setUp(self):
+        self.spill_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(lambda: [path.unlink() for path in self.spill_dir.iterdir()])
+
+    def make_queue(self, **options):
+        log_queue = SearchLogQueue(spill_dir=self.spill_dir, **options)
+        # Written by drain() from the test thread instead
+        log_queue._ensure_worker = lambda: None
+        return log_queue
+
+    def spill(self, count):
+        path = self.spill_dir / 'search_log-1.jsonl'
+        with open(path, 'a', encoding='utf-8') as spill:
+            for i in range(count):
+                spill.write(json.dumps({
+                    'query': f'spilled {i}', 'results_count': i, 'user_id': None,
+                    'ip_address': '10.0.0.1', 'timestamp': '2026-10-01T12:00:00+00:00',
+                }) + '\n')
+        return path
+
+    def test_drain_writes_in_batches(self):
+        log_queue = self.make_queue(batch_size=2)
+        for i in range(5):
+            self.assertTrue(log_queue.submit(f'make:Toyota {i}', results_count=i))
+        self.assertEqual(SearchLog.objects.count(), 0)
+        log_queue.drain()
+        self.assertEqual(SearchLog.objects.count(), 5)
+        self.assertEqual(log_queue.metrics()['written'], 5)
+        self.assertEqual(log_queue.metrics()['queued'], 0)
+
+    def test_full_queue_spills_and_replays(self):
+        log_queue = self.make_queue(max_size=2, overflow='spill')
+        results = [log_queue.submit(f'q{i}') for i in range(5)]
+        self.assertEqual(results, [True, True, False, False, False])
+        self.assertEqual(log_queue.metrics()['spilled'], 3)
+        log_queue.drain()
+        self.assertEqual(replay_spilled(self.spill_dir, batch_size=2), 3)
+        self.assertEqual(SearchLog.objects.count(), 5)
+        self.assertEqual(list(self.spill_dir.iterdir()), [])
+
+    def test_drop_policy(self):
+        log_queue = self.make_queue(max_size=1, overflow='drop')
+        log_queue.submit('kept')
+        self.assertFalse(log_queue.submit('dropped'))
+        self.assertEqual(log_queue.metrics()['dropped'], 1)
+        self.assertEqual(list(self.spill_dir.iterdir()), [])
+
+    def test_failed_write_spills_batch(self):
+        log_queue = self.make_queue(overflow='spill')
+        log_queue.submit('lost write')
+        with mock.patch.object(ingest, 'write_entries', side_effect=DatabaseError), \
+                self.assertLogs('analytics.ingest', 'ERROR'):
+            log_queue.drain()
+        self.assertEqual(log_queue.metrics()['failed_batches'], 1)
+        self.assertEqual(replay_spilled(self.spill_dir), 1)
+        self.assertEqual(SearchLog.objects.get().query, 'lost write')
+
+    def test_replay_is_all_or_nothing(self):
+        self.spill(5)
+        write_entries = ingest.write_entries
+        calls = []
+
+        def fail_last_batch(entries, batch_size):
+            calls.append(len(entries))
+            if len(entries) < batch_size:
+                raise DatabaseError
+            write_entries(entries, batch_size)
+
+        with mock.patch.object(ingest, 'write_entries', side_effect=fail_last_batch):
+            with self.assertRaises(DatabaseError):
+                replay_spilled(self.spill_dir, batch_size=2)
+        # The trailing partial batch rolls back the whole file, which is kept
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual(SearchLog.objects.count(), 0)
+        self.assertEqual([path.name for path in self.spill_dir.iterdir()],
+                         ['search_log-1.replaying'])
+        self.assertEqual(replay_spilled(self.spill_dir, batch_size=2), 5)
+        self.assertEqual(SearchLog.objects.count(), 5)
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.day = timezone.localdate()
+        self.noon = day_bounds(self.day)[0] + timedelta(hours=12)
+
+    def search(self, pk, query='make:Toyota'):
+        return SearchLog.objects.create(pk=pk, query=query, timestamp=self.noon)
+
+    def terms(self):
+        return dict(top_items(Analytics.objects.get(date=self.day).search_terms, 10))
+
+    def test_rerun_counts_only_new_rows(self):
+        self.search(1)
+        self.search(2, 'make:Honda')
+        self.assertEqual(rollup_day(self.day), 2)
+        self.assertEqual(rollup_day(self.day), 0)
+        self.search(3)
+        self.assertEqual(rollup_day(self.day), 1)
+        self.assertEqual(self.terms(), {'make:Toyota': 2, 'make:Honda': 1})
+        # Rows of other days are left alone
+        SearchLog.objects.create(query='yesterday', timestamp=self.noon - timedelta(days=1))
+        self.assertEqual(rollup_day(self.day), 0)
+
+    def test_late_commit_below_watermark(self):
+        self.search(10)
+        self.search(12)
+        self.assertEqual(rollup_day(self.day), 2)
+        self.assertEqual(RollupWatermark.objects.get(date=self.day, source='searches').last_id, 12)
+        # Id 11 was handed out first but its transaction committed last
+        self.search(11)
+        self.assertEqual(rollup_day(self.day), 1)
+        self.assertEqual(rollup_day(self.day), 0)
+        self.assertEqual(self.terms(), {'make:Toyota': 3})
+        self.assertEqual(rollup_day(self.day, full=True), 3)
+        self.assertEqual(self.terms(), {'make:Toyota': 3})
+
+    @override_settings(ANALYTICS_ROLLUP_OVERLAP=3)
+    def test_overlap_window_is_bounded(self):
+        for pk in range(1, 8):
+            self.search(pk)
+        rollup_day(self.day)
+        watermark = RollupWatermark.objects.get(date=self.day, source='searches')
+        self.assertEqual((watermark.last_id, watermark.recent_ids), (7, [5, 6, 7]))
+        self.assertEqual(rollup_day(self.day), 0)
+        self.assertEqual(self.terms(), {'make:Toyota': 7})
+
+
+class TopTermsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for offset, terms in enumerate(({'toyota': 5, 'honda': 1}, {'honda': 7}, {'bmw': 50})):
+            Analytics.objects.create(
+                date=date(2026, 10, 1) + timedelta(days=offset),
+                search_terms=SpaceSaving(k=2).update(terms.items()).to_json())
+        cls.staff = get_user_model().objects.create_user(
+            username='staff', email='staff@example.com', password='secret', is_staff=True)
+
+    def test_summaries_stay_bounded(self):
+        summary = SpaceSaving(k=2).update([('a', 5), ('b', 3), ('c', 1)])
+        self.assertEqual(len(summary), 2)
+        # 'c' takes over the smallest counter and inherits its count as error
+        self.assertEqual(summary.top(), [('a', 5), ('c', 4)])
+        self.assertEqual(summary.errors['c'], 3)
+
+    def test_range_merges_days(self):
+        summary = summary_for_range('search_terms', date(2026, 10, 1), date(2026, 10, 2))
+        self.assertEqual(summary.top(), [('honda', 8), ('toyota', 5)])
+        with self.assertRaises(ValueError):
+            summary_for_range('revenue_data', date(2026, 10, 1), date(2026, 10, 2))
+
+    def test_endpoint(self):
+        url = '/api/analytics/top/search_terms/'
+        params = {'start': '2026-10-01', 'end': '2026-10-02', 'page_size': 1}
+        self.assertEqual(self.client.get(url, params).status_code, 302)
+        self.client.force_login(self.staff)
+        body = self.client.get(url, params).json()
+        self.assertEqual(body['results'], [{'item': 'honda', 'count': 8, 'error': 0}])
+        for params in ({'start': 'yesterday'}, {'start': '2026-10-03', 'end': '2026-10-01'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/top/revenue_data/').status_code, 400)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'analytics'
+
+urlpatterns = [
+    path('search-logs/', views.search_log_feed, name='search-log-feed'),
+    path('top/<str:field>/', views.top_terms, name='top-terms'),
+]
@@ -1,3 +1,82 @@
-from django.shortcuts import render
+from datetime import timedelta
 
-# Create your views here.
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_GET
+
+from carzone.pagination import CursorPaginator, page_size_from
+
+from .models import SearchLog
+from .sketches import summary_for_range
+
+
+@require_GET
+@staff_member_required
+def search_log_feed(request):
+    """Most recent search log entries, for staff"""
+    try:
+        paginator = CursorPaginator(
+            SearchLog.objects.select_related('user'),
+            ordering=('-timestamp', '-id'),
+            page_size=page_size_from(request),
+        )
+        page = paginator.page(request.GET.get('cursor'))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({
+        'next_cursor': page.next_cursor,
+        'results': [
+            {
+                'id': log.id,
+                'query': log.query,
+                'results_count': log.results_count,
+                'user': log.user.username if log.user else None,
+                'ip_address': log.ip_address,
+                'timestamp': log.timestamp.isoformat(),
+            }
+            for log in page
+        ],
+    })
+
+
+def _date_param(request, name, default):
+    value = request.GET.get(name)
+    if not value:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f"'{name}' must be a date (YYYY-MM-DD).")
+    return day
+
+
+@require_GET
+@staff_member_required
+def top_terms(request, field):
+    """
+    Top search terms, viewed models or listing locations over a date range
+    (the last 7 days by default), merged from the daily summaries.
+    """
+    try:
+        end = _date_param(request, 'end', timezone.localdate())
+        start = _date_param(request, 'start', end - timedelta(days=6))
+        if start > end:
+            raise ValueError("'start' must not be after 'end'.")
+        n = page_size_from(request)
+        summary = summary_for_range(field, start, end)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({
+        'field': field,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'results': [
+            # A count over-estimates the true count by at most its error
+            {'item': item, 'count': count, 'error': summary.errors[item]}
+            for item, count in summary.top(n)
+        ],
+    })
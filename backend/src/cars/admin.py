@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Count
-from .models import Car, CarListing, Favorite
+from django.db.models import Count, OuterRef, Q, Subquery
+from moderation import counters
+from . import fulltext, geo, services
+from .models import Car, CarListing, Favorite, ListingSummary, Place, PriceStatistics
 
 
 class CarListingInline(admin.TabularInline):
@@ -52,14 +54,18 @@ class CarListingAdmin(admin.ModelAdmin):
     """Admin for CarListing model"""
 
     list_display = (
-        'car_info', 'seller', 'price', 'status', 'location',
-        'views', 'favorites_count', 'created_at'
+        'car_info', 'seller', 'price', 'market_price', 'status', 'location',
+        'views', 'favorites_count', 'open_reports', 'created_at'
     )
     list_filter = ('status', 'car__make', 'car__fuel_type', 'created_at')
     search_fields = (
         'car__make', 'car__model', 'seller__username',
         'seller__email', 'location', 'description'
     )
+    search_help_text = (
+        "Words of the make, model, location or description (the last one may be "
+        "cut short), or the start of the seller's username or email"
+    )
     ordering = ('-created_at',)
     date_hierarchy = 'created_at'
 
@@ -68,10 +74,10 @@ class CarListingAdmin(admin.ModelAdmin):
             'fields': ('car',)
         }),
         ('Listing Details', {
-            'fields': ('seller', 'price', 'description', 'location', 'status')
+            'fields': ('seller', 'price', 'description', 'location', 'place', 'status')
         }),
         ('Statistics', {
-            'fields': ('views',),
+            'fields': ('views', 'report_breakdown'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
@@ -80,14 +86,39 @@ class CarListingAdmin(admin.ModelAdmin):
         }),
     )
 
-    readonly_fields = ('views', 'created_at', 'updated_at')
+    readonly_fields = ('place', 'views', 'report_breakdown', 'created_at', 'updated_at')
 
     def get_queryset(self, request):
-        """Optimize queryset with select_related and annotations"""
+        """
+        Optimize queryset with select_related; counts come from the summary,
+        open reports from the report counters and the median price of
+        comparable listings from a subquery on the price statistics.
+        """
         queryset = super().get_queryset(request)
-        return queryset.select_related('car', 'seller').annotate(
-            favorites_count=Count('favorited_by')
+        median = PriceStatistics.objects.filter(
+            make=OuterRef('car__make'), model=OuterRef('car__model'),
+            year=OuterRef('car__year'), fuel_type=OuterRef('car__fuel_type'),
+        ).values('p50')[:1]
+        return (queryset.select_related('car', 'seller', 'summary')
+                .annotate(market_median=Subquery(median),
+                          open_report_count=counters.open_reports('listing')))
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Match make, model, location and description through the full-text
+        index instead of one LIKE scan per search field; seller username and
+        email match by prefix, which their indexes can serve.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        matches = fulltext.matching(CarListing.objects.all(), search_term).values('pk')
+        queryset = queryset.filter(
+            Q(pk__in=matches)
+            | Q(seller__username__istartswith=search_term)
+            | Q(seller__email__istartswith=search_term)
         )
+        return queryset, False
 
     def car_info(self, obj):
         """Display formatted car information"""
@@ -97,15 +128,37 @@ class CarListingAdmin(admin.ModelAdmin):
 
     def favorites_count(self, obj):
         """Display number of users who favorited this listing"""
-        return obj.favorites_count
+        summary = getattr(obj, 'summary', None)
+        return summary.favorites_count if summary else 0
     favorites_count.short_description = 'Favorites'  # type: ignore
-    favorites_count.admin_order_field = 'favorites_count'  # type: ignore
+    favorites_count.admin_order_field = 'summary__favorites_count'  # type: ignore
+
+    def market_price(self, obj):
+        """Display the median price of comparable available listings"""
+        median = getattr(obj, 'market_median', None)
+        if not median:
+            return '-'
+        difference = (obj.price - median) / median * 100
+        return f"${median} ({difference:+.0f}%)"
+    market_price.short_description = 'Market median'  # type: ignore
+    market_price.admin_order_field = 'market_median'  # type: ignore
+
+    def open_reports(self, obj):
+        """Display number of pending or reviewed reports about this listing"""
+        return getattr(obj, 'open_report_count', 0)
+    open_reports.short_description = 'Open reports'  # type: ignore
+    open_reports.admin_order_field = 'open_report_count'  # type: ignore
+
+    def report_breakdown(self, obj):
+        """Display reports about this listing by status and reason"""
+        return counters.describe(counters.breakdown(listing_id=obj.pk))
+    report_breakdown.short_description = 'Reports'  # type: ignore
 
     actions = ['mark_as_sold', 'mark_as_available']
 
     def mark_as_sold(self, request, queryset):
         """Admin action to mark listings as sold"""
-        updated = queryset.update(status='sold')
+        updated = services.update_listings(queryset, status='sold')
         self.message_user(
             request,
             f"{updated} listing(s) marked as sold."
@@ -114,7 +167,7 @@ class CarListingAdmin(admin.ModelAdmin):
 
     def mark_as_available(self, request, queryset):
         """Admin action to mark listings as available"""
-        updated = queryset.update(status='available')
+        updated = services.update_listings(queryset, status='available')
         self.message_user(
             request,
             f"{updated} listing(s) marked as available."
@@ -147,3 +200,82 @@ class FavoriteAdmin(admin.ModelAdmin):
         return f"{obj.listing.car} - ${obj.listing.price}"
     listing_info.short_description = 'Listing'  # type: ignore
     listing_info.admin_order_field = 'listing__car__make'  # type: ignore
+
+
+@admin.register(ListingSummary)
+class ListingSummaryAdmin(admin.ModelAdmin):
+    """Read-only admin for the denormalized listing summaries"""
+
+    list_display = (
+        'listing_id', 'year', 'make', 'model', 'seller_username', 'price',
+        'status', 'location', 'views', 'favorites_count', 'messages_count',
+        'reports_count', 'created_at'
+    )
+    list_filter = ('status', 'fuel_type', 'transmission')
+    search_fields = ('make', 'model', 'seller_username', 'location')
+    ordering = ('-created_at',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        """Summaries are maintained automatically"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """Make summaries read-only"""
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        """Summaries are deleted with their listing"""
+        return False
+
+
+@admin.register(PriceStatistics)
+class PriceStatisticsAdmin(admin.ModelAdmin):
+    """Read-only admin for the precomputed price distributions"""
+
+    list_display = (
+        'year', 'make', 'model', 'fuel_type', 'count', 'minimum', 'p10',
+        'p50', 'p90', 'maximum', 'mean', 'updated_at'
+    )
+    list_filter = ('fuel_type', 'year')
+    search_fields = ('make', 'model')
+    ordering = ('make', 'model', '-year', 'fuel_type')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        """Statistics are maintained automatically"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """Make statistics read-only"""
+        return False
+
+
+@admin.register(Place)
+class PlaceAdmin(admin.ModelAdmin):
+    """Admin for the gazetteer places listings resolve to"""
+
+    list_display = (
+        'display_name', 'region_name', 'country', 'latitude', 'longitude',
+        'geohash', 'population', 'listing_count'
+    )
+    list_filter = ('country', 'region')
+    search_fields = ('name', 'region_name')
+    ordering = ('-population',)
+    readonly_fields = ('geohash',)
+
+    def get_queryset(self, request):
+        """Annotate the number of listings resolved to each place"""
+        return super().get_queryset(request).annotate(listing_count=Count('listings'))
+
+    def listing_count(self, obj):
+        """Display the number of listings at this place"""
+        return obj.listing_count
+    listing_count.short_description = 'Listings'  # type: ignore
+    listing_count.admin_order_field = 'listing_count'  # type: ignore
+
+    def save_model(self, request, obj, form, change):
+        """Keep the geohash in step with the coordinates"""
+        obj.geohash = geo.geohash(obj.latitude, obj.longitude)
+        super().save_model(request, obj, form, change)
+        geo.reset_resolver()
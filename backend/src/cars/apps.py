@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class CarsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cars'
+
+    def ready(self):
+        from carzone.instrumentation import registry
+
+        from . import signals  # noqa: F401
+        from .counters import view_counter
+        from .similarity import recommender
+        from .trending import tracker
+        registry.register_provider('carzone_view_counter', view_counter.metrics)
+        registry.register_provider('carzone_similar_listings', recommender.metrics)
+        registry.register_provider('carzone_trending_tracker', tracker.metrics)
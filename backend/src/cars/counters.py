@@ -0,0 +1,197 @@
+"""
+Buffered listing view counter.
+
+Page views are accumulated in memory and written periodically by a
+background thread as one ``UPDATE car_listing SET views = views + CASE ...``
+per chunk of listings (mirrored to ``listing_summary``). Each day's
+``Analytics`` row gets the total added to ``total_views`` and the views per
+make/model offered to its ``top_models`` top-K summary. Increments are only
+removed from the buffer once the transaction that applies them has
+committed, so a failed flush is retried on the next one.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from analytics.sketches import SpaceSaving
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Process-wide buffer of listing views flushed on an interval"""
+
+    chunk_size = 500
+
+    def __init__(self, flush_interval=None, max_pending=None):
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (local date, listing id) -> views
+        self._pending = Counter()
+        self._backlog = 0
+        self._pending_since = None
+        self._thread = None
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed_views = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.last_flush_at = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is None:
+            return getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 5)
+        return self._flush_interval
+
+    @property
+    def max_pending(self):
+        if self._max_pending is None:
+            return getattr(settings, 'VIEW_COUNTER_MAX_PENDING', 10000)
+        return self._max_pending
+
+    def record(self, listing_id, count=1):
+        """Count ``count`` views of a listing"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent flushes what it had buffered.
+                self._reset()
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self._pending[(timezone.localdate(), listing_id)] += count
+            self._backlog += count
+            backlog = self._backlog
+            self._ensure_worker()
+        if backlog >= self.max_pending:
+            self._wakeup.set()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='view-counter-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing listing view counts failed")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write buffered views to the database; return the number written"""
+        from analytics.models import Analytics
+
+        from .models import CarListing, ListingSummary
+
+        with self._flush_lock:
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+                pending = self._pending.copy()
+            if not pending:
+                return 0
+
+            per_listing = Counter()
+            per_day = defaultdict(Counter)
+            for (day, pk), count in pending.items():
+                per_listing[pk] += count
+                per_day[day][pk] += count
+
+            start = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    models = {}
+                    ids = list(per_listing)
+                    for i in range(0, len(ids), self.chunk_size):
+                        chunk = ids[i:i + self.chunk_size]
+                        increment = Case(
+                            *[When(pk=pk, then=Value(per_listing[pk])) for pk in chunk],
+                            output_field=IntegerField(),
+                        )
+                        CarListing.objects.filter(pk__in=chunk).update(
+                            views=F('views') + increment)
+                        ListingSummary.objects.filter(listing_id__in=chunk).update(
+                            views=F('views') + increment)
+                        models.update(
+                            (pk, f"{make} {model}") for pk, make, model in
+                            CarListing.objects.filter(pk__in=chunk)
+                            .values_list('pk', 'car__make', 'car__model'))
+
+                    for day, views in per_day.items():
+                        Analytics.get_or_create_for_date(day)
+                        analytics = Analytics.objects.select_for_update().get(date=day)
+                        top_models = SpaceSaving.from_json(analytics.top_models)
+                        top_models.update(
+                            (models[pk], count) for pk, count in views.items()
+                            if pk in models)
+                        Analytics.objects.filter(pk=analytics.pk).update(
+                            total_views=F('total_views') + sum(views.values()),
+                            top_models=top_models.to_json(),
+                        )
+            except Exception:
+                self.failed_flushes += 1
+                raise
+
+            elapsed = (time.perf_counter() - start) * 1000
+            written = sum(pending.values())
+            with self._lock:
+                self._pending.subtract(pending)
+                self._pending = +self._pending
+                self._backlog -= written
+                self._pending_since = time.monotonic() if self._pending else None
+            self.flushes += 1
+            self.flushed_views += written
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.last_flush_at = timezone.now()
+            return written
+
+    def metrics(self):
+        """Backlog and flush latency figures for monitoring"""
+        with self._lock:
+            pending_views = self._backlog
+            pending_listings = len({pk for _, pk in self._pending})
+            age = (time.monotonic() - self._pending_since
+                   if self._pending_since is not None else 0.0)
+        return {
+            'pending_views': pending_views,
+            'pending_listings': pending_listings,
+            'oldest_pending_seconds': round(age, 3),
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'flushed_views': self.flushed_views,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None,
+        }
+
+
+view_counter = ViewCounter()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        logger.exception("Flushing listing view counts at exit failed")
@@ -0,0 +1,307 @@
+"""
+Maintained facet counts for available car listings.
+
+Each available listing has a *cell*: its tuple of facet values (make,
+model, year, fuel type, transmission, location, price band, mileage band).
+Counting cells would keep one row per distinct combination, which on a
+real catalog is close to one row per listing. ``ListingFacetCount``
+instead keeps marginal counts, one row per ``(facet, value)``, both over
+all available listings (the empty scope) and within each single-filter
+scope such as ``make = Toyota``. The number of rows a search reads is the
+number of distinct values of the facets in its scope, whatever the size of
+the catalog, and every listing is counted under ``len(SCOPES) + 1`` scopes.
+
+Counts are adjusted whenever a listing (or its car) changes, one
+``UPDATE`` per distinct delta. Searches with several filters (or free-form
+bounds, free text or a radius) are counted with one grouped ``UNION ALL``
+query over the matching listings, aggregated in the database.
+"""
+from bisect import bisect_right
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Cast
+
+from .models import CarListing, ListingFacetCount
+
+# Lower edges of the price and mileage bands used for range facets.
+PRICE_BANDS = (0, 5000, 10000, 15000, 20000, 30000,
+               40000, 50000, 75000, 100000)
+MILEAGE_BANDS = (0, 10000, 25000, 50000, 75000,
+                 100000, 150000, 200000)
+
+CELL_FIELDS = ('make', 'model', 'year', 'fuel_type', 'transmission',
+               'location', 'price_band', 'mileage_band')
+
+# Cell field -> CarListing field path, for counting listings per cell
+LISTING_PATHS = {
+    'make': 'car__make',
+    'model': 'car__model',
+    'year': 'car__year',
+    'fuel_type': 'car__fuel_type',
+    'transmission': 'car__transmission',
+    'location': 'location',
+    'price': 'price',
+    'mileage': 'car__mileage',
+}
+
+# Facet name -> cell field
+FACETS = {
+    'make': 'make',
+    'model': 'model',
+    'year': 'year',
+    'fuel_type': 'fuel_type',
+    'transmission': 'transmission',
+    'location': 'location',
+    'price': 'price_band',
+    'mileage': 'mileage_band',
+}
+INT_FACETS = ('year', 'price', 'mileage')
+
+# Single-filter scopes counts are kept for: search filter -> facet
+SCOPES = {
+    'make': 'make',
+    'model': 'model',
+    'fuel_type': 'fuel_type',
+    'transmission': 'transmission',
+    'location': 'location',
+    'price_band': 'price',
+    'mileage_band': 'mileage',
+}
+
+# Keys per UPDATE/SELECT, well below SQLite's expression depth limit
+KEY_BATCH = 100
+
+
+def band_for(value, edges):
+    """Return the index of the band ``value`` falls in"""
+    return max(bisect_right(edges, value) - 1, 0)
+
+
+def band_label(index, edges):
+    """Human readable label for a band index, e.g. '10000-15000'"""
+    low = edges[index]
+    if index + 1 < len(edges):
+        return f"{low}-{edges[index + 1]}"
+    return f"{low}+"
+
+
+def band_range(index, edges):
+    """Return the (inclusive low, exclusive high) bounds of a band"""
+    high = edges[index + 1] if index + 1 < len(edges) else None
+    return edges[index], high
+
+
+def cell_key(car, location, price):
+    """Build the cell key for a listing of ``car`` at ``location``/``price``"""
+    return (
+        car.make, car.model, car.year, car.fuel_type, car.transmission,
+        location, band_for(price, PRICE_BANDS),
+        band_for(car.mileage, MILEAGE_BANDS),
+    )
+
+
+def listing_key(listing):
+    """Cell key for a listing, or None if it is not counted"""
+    if listing.status != 'available':
+        return None
+    return cell_key(listing.car, listing.location, listing.price)
+
+
+def band_expression(field, edges):
+    """SQL expression computing the band index of ``field``"""
+    whens = [When(**{f'{field}__gte': low}, then=Value(index))
+             for index, low in reversed(list(enumerate(edges)))]
+    return Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def collect_cells(queryset, paths=None):
+    """
+    Count the available listings of ``queryset`` per cell in one query.
+
+    ``paths`` maps each of ``CELL_FIELDS`` (plus ``'price'`` and
+    ``'mileage'`` in place of the bands) to a field path of the queryset's
+    model; defaults to ``CarListing`` paths.
+    """
+    paths = paths or LISTING_PATHS
+    rows = (
+        queryset.filter(status='available')
+        .order_by()
+        .annotate(
+            facet_price_band=band_expression(paths['price'], PRICE_BANDS),
+            facet_mileage_band=band_expression(paths['mileage'], MILEAGE_BANDS),
+        )
+        .values_list(
+            *(paths[field] for field in CELL_FIELDS[:6]),
+            'facet_price_band', 'facet_mileage_band',
+        )
+        .annotate(n=Count('pk'))
+    )
+    return Counter({tuple(row[:-1]): row[-1] for row in rows})
+
+
+def count_keys(cell):
+    """
+    ``(scope, scope_value, facet, value)`` keys a listing in ``cell`` is
+    counted under: every facet within the empty scope and within the scope
+    of each of its own values.
+    """
+    values = dict(zip(CELL_FIELDS, cell))
+    values = {facet: str(values[field]) for facet, field in FACETS.items()}
+    scopes = [('', '')] + [(facet, values[facet]) for facet in SCOPES.values()]
+    return [(scope, scope_value, facet, value)
+            for scope, scope_value in scopes for facet, value in values.items()]
+
+
+def _key_filter(keys):
+    condition = Q()
+    for scope, scope_value, facet, value in keys:
+        condition |= Q(scope=scope, scope_value=scope_value, facet=facet, value=value)
+    return condition
+
+
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), KEY_BATCH):
+        yield items[start:start + KEY_BATCH]
+
+
+def _count_ids(keys):
+    ids = {}
+    for batch in _batches(keys):
+        rows = ListingFacetCount.objects.filter(_key_filter(batch)).values_list(
+            'pk', 'scope', 'scope_value', 'facet', 'value')
+        ids.update({tuple(row[1:]): row[0] for row in rows})
+    return ids
+
+
+def apply_deltas(deltas):
+    """Add ``deltas`` (cell key -> change) to the stored marginal counts"""
+    counts = Counter()
+    for cell, delta in deltas.items():
+        if delta:
+            for key in count_keys(cell):
+                counts[key] += delta
+    counts = {key: delta for key, delta in counts.items() if delta}
+    if not counts:
+        return
+
+    with transaction.atomic():
+        ids = _count_ids(counts)
+        missing = [key for key, delta in counts.items() if key not in ids and delta > 0]
+        if missing:
+            # A concurrent insert of the same key is fine: both add below
+            ListingFacetCount.objects.bulk_create(
+                [ListingFacetCount(scope=scope, scope_value=scope_value, facet=facet,
+                                   value=value, count=0)
+                 for scope, scope_value, facet, value in missing],
+                batch_size=KEY_BATCH, ignore_conflicts=True)
+            ids.update(_count_ids(missing))
+        by_delta = defaultdict(list)
+        for key, delta in counts.items():
+            if key in ids:
+                by_delta[delta].append(ids[key])
+        for delta, pks in by_delta.items():
+            for batch in _batches(pks):
+                ListingFacetCount.objects.filter(pk__in=batch).update(
+                    count=F('count') + delta)
+
+
+def move(old_key, new_key):
+    """Move one listing from ``old_key`` to ``new_key`` (either may be None)"""
+    if old_key == new_key:
+        return
+    deltas = Counter()
+    if old_key is not None:
+        deltas[old_key] -= 1
+    if new_key is not None:
+        deltas[new_key] += 1
+    apply_deltas(deltas)
+
+
+def rebuild(model=None):
+    """
+    Recompute every marginal count from ``car_listing``; returns the number
+    of rows. ``model`` lets migrations pass their historical model.
+    """
+    model = model or ListingFacetCount
+    counts = Counter()
+    for cell, n in collect_cells(CarListing.objects.all()).items():
+        for key in count_keys(cell):
+            counts[key] += n
+    with transaction.atomic():
+        model.objects.all().delete()
+        model.objects.bulk_create(
+            [model(scope=scope, scope_value=scope_value, facet=facet, value=value, count=n)
+             for (scope, scope_value, facet, value), n in counts.items()],
+            batch_size=1000,
+        )
+    return len(counts)
+
+
+def facet_counts(scope='', scope_value=''):
+    """
+    Read facet counts for the available listings in a scope (a facet and
+    value of ``SCOPES``, or the empty scope for every available listing)
+    from the maintained counts.
+    """
+    rows = (
+        ListingFacetCount.objects.filter(scope=scope, scope_value=scope_value, count__gt=0)
+        .order_by()
+        .values_list('facet', 'value', 'count')
+    )
+    return summarize(rows)
+
+
+def grouped_counts(queryset, paths=None):
+    """
+    ``[(facet, value, count)]`` of the available listings of ``queryset``,
+    grouped per facet in the database with one ``UNION ALL`` query.
+    ``paths`` maps the facet fields to field paths as for ``collect_cells``.
+    """
+    paths = paths or LISTING_PATHS
+    available = queryset.filter(status='available').order_by()
+    parts = []
+    for facet, field in FACETS.items():
+        if field == 'price_band':
+            expression = band_expression(paths['price'], PRICE_BANDS)
+        elif field == 'mileage_band':
+            expression = band_expression(paths['mileage'], MILEAGE_BANDS)
+        else:
+            expression = F(paths[field])
+        parts.append(
+            available.annotate(
+                facet_name=Value(facet, output_field=CharField()),
+                facet_value=Cast(expression, output_field=CharField()),
+            ).values_list('facet_name', 'facet_value').annotate(n=Count('pk'))
+        )
+    return list(parts[0].union(*parts[1:], all=True))
+
+
+def summarize(rows):
+    """
+    Turn ``(facet, value, count)`` rows (values as text) into
+    ``(total, {facet: [(value, label, count), ...]})``.
+    """
+    totals = {facet: Counter() for facet in FACETS}
+    for facet, value, n in rows:
+        if facet in INT_FACETS:
+            value = int(value)
+        totals[facet][value] += n
+    # Every listing has exactly one make
+    total = sum(totals['make'].values())
+
+    facets = {}
+    for facet, counts in totals.items():
+        entries = []
+        for value, count in counts.most_common():
+            if facet == 'price':
+                label = band_label(value, PRICE_BANDS)
+            elif facet == 'mileage':
+                label = band_label(value, MILEAGE_BANDS)
+            else:
+                label = str(value)
+            entries.append((value, label, count))
+        facets[facet] = entries
+    return total, facets
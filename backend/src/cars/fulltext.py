@@ -0,0 +1,177 @@
+"""
+Full-text index over listing make, model, location and description.
+
+On PostgreSQL the index is the ``car_listing_search`` table holding a
+weighted ``tsvector`` per listing with a GIN index; on SQLite (local and test
+runs) it is the ``car_listing_fts`` FTS5 virtual table. Both are created by
+migration ``cars.0004`` and kept current by ``cars.signals``; ``rebuild()``
+reindexes everything. Other databases fall back to ``icontains`` matching.
+On every backend all words of the text must match, the last one as a
+prefix.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+PG_DOCUMENT = """
+    setweight(to_tsvector('english', coalesce(c.make, '') || ' ' || coalesce(c.model, '')), 'A')
+    || setweight(to_tsvector('english', coalesce(l.location, '')), 'B')
+    || setweight(to_tsvector('english', coalesce(l.description, '')), 'C')
+"""
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def vendor():
+    return connection.vendor
+
+
+def supported():
+    return vendor() in ('postgresql', 'sqlite')
+
+
+def _in_clause(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def index_listings(ids):
+    """(Re)index the listings with the given ids"""
+    ids = list(ids)
+    if not ids or not supported():
+        return
+    with connection.cursor() as cursor:
+        if vendor() == 'postgresql':
+            cursor.execute(f"""
+                INSERT INTO car_listing_search (listing_id, document)
+                SELECT l.id, {PG_DOCUMENT}
+                FROM car_listing l JOIN car c ON c.id = l.car_id
+                WHERE l.id = ANY(%s)
+                ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document
+            """, [ids])
+        else:
+            cursor.execute(
+                f"DELETE FROM car_listing_fts WHERE rowid IN ({_in_clause(ids)})", ids)
+            cursor.execute(f"""
+                INSERT INTO car_listing_fts (rowid, make, model, location, description)
+                SELECT l.id, c.make, c.model, l.location, l.description
+                FROM car_listing l JOIN car c ON c.id = l.car_id
+                WHERE l.id IN ({_in_clause(ids)})
+            """, ids)
+
+
+def index_car(car_id):
+    """Reindex every listing of a car whose make/model changed"""
+    from .models import CarListing
+    ids = list(CarListing.objects.filter(car_id=car_id).values_list('pk', flat=True))
+    for start in range(0, len(ids), 500):
+        index_listings(ids[start:start + 500])
+
+
+def remove_listing(listing_id):
+    """Drop a deleted listing from the index"""
+    if vendor() == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM car_listing_fts WHERE rowid = %s", [listing_id])
+    # PostgreSQL rows go with the listing (ON DELETE CASCADE).
+
+
+def rebuild():
+    """Reindex every listing"""
+    if not supported():
+        return
+    with connection.cursor() as cursor:
+        if vendor() == 'postgresql':
+            cursor.execute("TRUNCATE car_listing_search")
+            cursor.execute(f"""
+                INSERT INTO car_listing_search (listing_id, document)
+                SELECT l.id, {PG_DOCUMENT}
+                FROM car_listing l JOIN car c ON c.id = l.car_id
+            """)
+        else:
+            cursor.execute("DELETE FROM car_listing_fts")
+            cursor.execute("""
+                INSERT INTO car_listing_fts (rowid, make, model, location, description)
+                SELECT l.id, c.make, c.model, l.location, l.description
+                FROM car_listing l JOIN car c ON c.id = l.car_id
+            """)
+
+
+def fts5_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, the last
+    one as a prefix (so 'toyo' finds 'Toyota' while typing).
+    """
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def pg_tsquery(text):
+    """
+    The same query for PostgreSQL's ``to_tsquery``: every word must match,
+    the last one as a prefix (``websearch_to_tsquery`` has no prefixes).
+    """
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    terms = [f"'{token}'" for token in tokens]
+    terms[-1] += ':*'
+    return ' & '.join(terms)
+
+
+def matching(queryset, text):
+    """
+    Restrict ``queryset`` (of ``CarListing`` or a model whose primary key is
+    the listing id) to listings matching ``text`` and annotate each row with
+    ``search_rank`` (higher is better).
+
+    The index table is joined into the query rather than probed once per
+    row, so ranking costs one index scan however many listings match.
+    Text without any word (``"``, ``*``) matches nothing.
+    """
+    if not TOKEN_RE.search(text):
+        # Still annotated, so callers can sort by rank
+        return queryset.none().annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+
+    if vendor() == 'postgresql':
+        query = pg_tsquery(text)
+        return queryset.extra(
+            tables=['car_listing_search'],
+            where=["car_listing_search.document @@ to_tsquery('english', %s)"],
+            params=[query],
+        ).filter(
+            pk=RawSQL('car_listing_search.listing_id', ()),
+        ).annotate(search_rank=RawSQL(
+            "ts_rank_cd(car_listing_search.document, to_tsquery('english', %s))",
+            (query,), output_field=FloatField(),
+        ))
+
+    if vendor() == 'sqlite':
+        return queryset.extra(
+            tables=['car_listing_fts'],
+            where=['car_listing_fts MATCH %s'],
+            params=[fts5_query(text)],
+        ).filter(
+            pk=RawSQL('car_listing_fts.rowid', ()),
+        ).annotate(search_rank=RawSQL(
+            # bm25() is lower-is-better; negate it so ranks sort like tsvector's
+            '-bm25(car_listing_fts, 10.0, 10.0, 4.0, 1.0)', (),
+            output_field=FloatField(),
+        ))
+
+    from .models import CarListing
+    condition = Q()
+    for token in TOKEN_RE.findall(text):
+        condition &= (
+            Q(car__make__icontains=token) | Q(car__model__icontains=token)
+            | Q(location__icontains=token) | Q(description__icontains=token)
+        )
+    ids = CarListing.objects.filter(condition).values('pk')
+    return queryset.filter(pk__in=ids).annotate(
+        search_rank=RawSQL('0', (), output_field=FloatField()))
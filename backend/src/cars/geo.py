@@ -0,0 +1,325 @@
+"""
+Normalized listing locations and radius search.
+
+``CarListing.location`` is free text ("New York, NY", "NYC", "new york",
+"Portland OR"), so listings of one city were counted apart and "within 50
+km" could not be asked. ``Place`` holds one row per city of the gazetteer
+(``cars/data/gazetteer.csv``, loaded by migration and by the
+``load_gazetteer`` command) with its coordinates, and listings point at the
+place their text resolves to.
+
+Resolution normalizes the text (case, punctuation, "Saint"/"St",
+"Fort"/"Ft"), splits off a region ("Portland, OR", "Portland Oregon",
+"Portland OR") and looks the name up among place names and aliases; a name
+shared by several places without a region goes to the most populous one.
+Misspellings fall back to the closest known name above a similarity
+cutoff. The lookup table is built from ``Place`` once per process and
+rebuilt after ``PLACE_RESOLVER_TTL`` seconds, so resolving costs no query.
+
+Radius search needs no spatial extension: each place stores the geohash of
+its coordinates, and a circle is covered by at most a handful of geohash
+cells of the coarsest precision that keeps the cover small. Candidate
+places are those whose geohash starts with one of the cells (an indexed
+prefix match), filtered by exact haversine distance. Listings are then
+matched on the indexed ``place_id``.
+"""
+import csv
+import difflib
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+GAZETTEER = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+ABBREVIATIONS = {'saint': 'st', 'ste': 'st', 'fort': 'ft', 'mount': 'mt'}
+FUZZY_CUTOFF = 0.85
+
+
+# Geohash
+
+def geohash(latitude, longitude, precision=9):
+    """Geohash of a point, ``precision`` characters long"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            middle = (lon_range[0] + lon_range[1]) / 2
+            bit = longitude >= middle
+            lon_range[0 if bit else 1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            bit = latitude >= middle
+            lat_range[0 if bit else 1] = middle
+        value = value * 2 + bit
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """``(height, width)`` in degrees of a geohash cell of ``precision``"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def _steps(low, high, step):
+    values = []
+    value = low
+    while value < high:
+        values.append(value)
+        value += step
+    values.append(high)
+    return values
+
+
+def covering_cells(latitude, longitude, radius_km, max_cells=16):
+    """
+    Geohash prefixes whose cells together cover the circle of
+    ``radius_km`` around the point: the finest precision whose grid covers
+    the circle's bounding box in at most ``max_cells`` cells (or the
+    single-character cells, near the poles).
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    widest = max(abs(south), abs(north))
+    if widest >= 89.9:
+        lon_delta = 180.0
+    else:
+        lon_delta = min(lat_delta / math.cos(math.radians(widest)), 180.0)
+    west, east = longitude - lon_delta, longitude + lon_delta
+
+    for precision in range(12, 0, -1):
+        height, width = cell_size(precision)
+        estimate = ((north - south) / height + 2) * ((east - west) / width + 2)
+        if estimate > max_cells and precision > 1:
+            continue
+        cells = set()
+        for lat in _steps(south, north, height):
+            for lon in _steps(west, east, width):
+                # Wrap across the antimeridian
+                lon = (lon + 180.0) % 360.0 - 180.0
+                cells.add(geohash(lat, lon, precision))
+        if len(cells) <= max_cells or precision == 1:
+            return sorted(cells)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Resolution
+
+def normalize(text):
+    """Lookup form of a place name: lowercase words, common abbreviations"""
+    words = re.sub(r"[^\w\s]", ' ', (text or '').lower()).split()
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+class PlaceResolver:
+    """Name -> place lookup over every ``Place``, built once per process"""
+
+    def __init__(self, places):
+        self.by_name = defaultdict(list)
+        self.regions = {}
+        self.places = {}
+        for place in sorted(places, key=lambda p: -p.population):
+            self.places[place.pk] = place
+            for name in {place.name, *place.aliases}:
+                self.by_name[normalize(name)].append(place)
+            self.regions[normalize(place.region)] = place.region
+            self.regions[normalize(place.region_name)] = place.region
+        self.names = list(self.by_name)
+
+    def _candidates(self, name):
+        places = self.by_name.get(name)
+        if places is None:
+            close = difflib.get_close_matches(name, self.names, n=1, cutoff=FUZZY_CUTOFF)
+            places = self.by_name[close[0]] if close else []
+        return places
+
+    def _pick(self, name, region):
+        places = self._candidates(name)
+        if region is not None:
+            places = [place for place in places if place.region == region]
+        return places[0] if places else None
+
+    def resolve(self, text):
+        """The place ``text`` names, or None"""
+        parts = [normalize(part) for part in (text or '').split(',')]
+        parts = [part for part in parts if part]
+        if not parts:
+            return None
+        name, rest = parts[0], parts[1:]
+        if rest:
+            region = self.regions.get(rest[0])
+            return self._pick(name, region) or self._pick(name, None)
+        if name in self.by_name:
+            return self.by_name[name][0]
+        # "Portland OR" / "Kansas City Kansas": a trailing region without a comma
+        words = name.split()
+        for split in (len(words) - 1, len(words) - 2):
+            if split < 1:
+                continue
+            region = self.regions.get(' '.join(words[split:]))
+            if region is not None:
+                place = self._pick(' '.join(words[:split]), region)
+                if place is not None:
+                    return place
+        return self._pick(name, None)
+
+
+_resolver = None
+_resolver_built = 0.0
+_resolver_lock = threading.Lock()
+
+
+def _ttl():
+    return getattr(settings, 'PLACE_RESOLVER_TTL', 300)
+
+
+def resolver():
+    """The process's ``PlaceResolver``, rebuilt after ``PLACE_RESOLVER_TTL``"""
+    global _resolver, _resolver_built
+    with _resolver_lock:
+        if _resolver is None or time.monotonic() - _resolver_built > _ttl():
+            from .models import Place
+
+            _resolver = PlaceResolver(Place.objects.all())
+            _resolver_built = time.monotonic()
+        return _resolver
+
+
+def reset_resolver():
+    """Drop the cached lookup, e.g. after the gazetteer was reloaded"""
+    global _resolver
+    with _resolver_lock:
+        _resolver = None
+
+
+def resolve(text):
+    """The ``Place`` a free-text location names, or None"""
+    return resolver().resolve(text)
+
+
+def load_gazetteer(path=GAZETTEER, model=None):
+    """
+    Insert or update the places of a gazetteer CSV (``name, region,
+    region_name, country, latitude, longitude, population, aliases`` with
+    ``|``-separated aliases); returns the number of rows read. ``model``
+    lets migrations pass their historical ``Place``.
+    """
+    if model is None:
+        from .models import Place as model
+    with open(path, newline='', encoding='utf-8') as handle:
+        rows = list(csv.DictReader(handle))
+    existing = {(p.country, p.region, p.name): p for p in model.objects.all()}
+    created, updated = [], []
+    for row in rows:
+        latitude, longitude = float(row['latitude']), float(row['longitude'])
+        values = {
+            'region_name': row['region_name'],
+            'display_name': f"{row['name']}, {row['region']}",
+            'latitude': latitude,
+            'longitude': longitude,
+            'geohash': geohash(latitude, longitude),
+            'population': int(row['population'] or 0),
+            'aliases': [alias for alias in row['aliases'].split('|') if alias],
+        }
+        key = (row['country'], row['region'], row['name'])
+        place = existing.get(key)
+        if place is None:
+            created.append(model(country=key[0], region=key[1], name=key[2], **values))
+            continue
+        for field, value in values.items():
+            setattr(place, field, value)
+        updated.append(place)
+    with transaction.atomic():
+        model.objects.bulk_create(created, batch_size=500)
+        model.objects.bulk_update(updated, list(values), batch_size=500)
+    reset_resolver()
+    return len(rows)
+
+
+# Radius search
+
+def places_within(latitude, longitude, radius_km):
+    """``[(place, distance_km)]`` of the places within ``radius_km``, nearest first"""
+    from .models import Place
+
+    prefixes = Q()
+    for cell in covering_cells(latitude, longitude, radius_km):
+        prefixes |= Q(geohash__startswith=cell)
+    found = []
+    for place in Place.objects.filter(prefixes):
+        distance = haversine_km(latitude, longitude, place.latitude, place.longitude)
+        if distance <= radius_km:
+            found.append((place, distance))
+    found.sort(key=lambda pair: pair[1])
+    return found
+
+
+def place_ids_near(text, radius_km):
+    """Ids of the places within ``radius_km`` of the place ``text`` names, or None"""
+    origin = resolve(text)
+    if origin is None:
+        return None
+    return [place.pk for place, _ in
+            places_within(origin.latitude, origin.longitude, radius_km)]
+
+
+# Batch resolution
+
+def resolve_listings(everything=False):
+    """
+    Resolve the location of listings that have no place yet (or of every
+    listing with ``everything``), one UPDATE per place over its distinct
+    location texts; the listing summaries are updated alongside. Returns
+    ``(listings updated, {unresolved text: listings})``.
+    """
+    from .models import CarListing, ListingSummary
+
+    listings = CarListing.objects.order_by()
+    if not everything:
+        listings = listings.filter(place__isnull=True)
+    texts = defaultdict(int)
+    for location in listings.values_list('location', flat=True).iterator(chunk_size=10000):
+        texts[location] += 1
+
+    lookup = resolver()
+    by_place, unresolved = defaultdict(list), {}
+    for text, count in texts.items():
+        place = lookup.resolve(text)
+        if place is None:
+            unresolved[text] = count
+        by_place[place.pk if place else None].append(text)
+
+    updated = 0
+    with transaction.atomic():
+        for place_id, group in by_place.items():
+            if place_id is None and not everything:
+                continue
+            changed = listings.filter(location__in=group).update(place_id=place_id)
+            if place_id is not None:
+                updated += changed
+            summaries = ListingSummary.objects.filter(location__in=group)
+            if not everything:
+                summaries = summaries.filter(place__isnull=True)
+            summaries.update(place_id=place_id)
+    return updated, unresolved
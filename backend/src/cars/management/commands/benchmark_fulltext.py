@@ -0,0 +1,115 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from cars import facets, fulltext, summaries
+from cars.models import Car, CarListing
+
+WORDS = (
+    'clean', 'title', 'low', 'mileage', 'one', 'owner', 'garage', 'kept',
+    'service', 'history', 'new', 'tyres', 'brakes', 'leather', 'seats',
+    'sunroof', 'navigation', 'bluetooth', 'camera', 'heated', 'alloy',
+    'wheels', 'warranty', 'accident', 'free', 'non', 'smoker', 'family',
+    'economical', 'reliable', 'sport', 'package', 'towbar', 'cruise',
+    'control', 'parking', 'sensors', 'recently', 'serviced', 'timing', 'belt',
+)
+LOCATIONS = ('Dhaka', 'Chittagong', 'Sylhet', 'Khulna', 'Rajshahi',
+             'Barisal', 'Rangpur', 'Comilla', 'Gazipur', 'Narayanganj')
+TERMS = ('toyota', 'leather seats', 'sylhet', 'timing belt', 'honda civic',
+         'warranty', 'sunroof camera')
+
+
+def _timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def _like_search(term):
+    """What the admin did before: every word ILIKE'd against every column"""
+    condition = Q()
+    for word in term.split():
+        condition &= (
+            Q(car__make__icontains=word) | Q(car__model__icontains=word)
+            | Q(location__icontains=word) | Q(description__icontains=word)
+        )
+    return CarListing.objects.filter(condition)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare multi-column ILIKE search with the full-text index, "
+        "optionally after generating synthetic listings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--populate', type=int, default=0, metavar='N',
+            help="First create N synthetic listings (e.g. 1000000) for "
+                 "existing cars and sellers and rebuild the derived tables")
+        parser.add_argument('--terms', nargs='+', default=list(TERMS))
+        parser.add_argument('--limit', type=int, default=20,
+                            help="Rows fetched per search (a results page)")
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def populate(self, count, seed, batch_size=5000):
+        rng = random.Random(seed)
+        cars = list(Car.objects.values_list('pk', flat=True))
+        sellers = list(get_user_model().objects.values_list('pk', flat=True))
+        if not cars or not sellers:
+            raise CommandError("Populating needs at least one car and one user.")
+
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            CarListing.objects.bulk_create([
+                CarListing(
+                    car_id=rng.choice(cars),
+                    seller_id=rng.choice(sellers),
+                    price=Decimal(rng.randrange(2000, 90000)),
+                    location=rng.choice(LOCATIONS),
+                    description=' '.join(rng.choices(WORDS, k=rng.randint(8, 40))),
+                )
+                for _ in range(size)
+            ], batch_size=batch_size)
+            created += size
+            self.stdout.write(f"  created {created}/{count}")
+
+        # bulk_create skips signals, so refresh everything derived
+        facets.rebuild()
+        summaries.rebuild()
+        fulltext.rebuild()
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            self.stdout.write(f"Creating {options['populate']} listing(s)...")
+            self.populate(options['populate'], options['seed'])
+
+        limit = options['limit']
+        repeat = options['repeat']
+        self.stdout.write(
+            f"{CarListing.objects.count()} listing(s) on {connection.vendor}, "
+            f"{limit} row(s) per search, median of {repeat} run(s)")
+        self.stdout.write(
+            f"{'term':<20} {'matches':>9} {'ilike ms':>10} {'fts ms':>10} {'ranked ms':>10}")
+
+        for term in options['terms']:
+            like = _like_search(term)
+            matched = fulltext.matching(CarListing.objects.all(), term)
+            matches = matched.count()
+            like_ms = _timed(lambda: list(like.order_by('-created_at')[:limit]), repeat)
+            fts_ms = _timed(lambda: list(matched.order_by('-created_at')[:limit]), repeat)
+            ranked_ms = _timed(
+                lambda: list(matched.order_by('-search_rank', '-pk')[:limit]), repeat)
+            self.stdout.write(
+                f"{term:<20} {matches:>9} {like_ms:>10.2f} {fts_ms:>10.2f} {ranked_ms:>10.2f}")
@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from analytics.models import SearchLog
+from carzone.pagination import CursorPaginator
+from cars.models import CarListing
+from messaging.models import Message
+
+
+def _timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare OFFSET and keyset pagination latency at increasing page "
+        "depths for the listing, inbox and search-log feeds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--feed', choices=['listings', 'messages', 'searches'],
+            default='listings')
+        parser.add_argument(
+            '--pages', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def get_feed(self, feed):
+        if feed == 'listings':
+            return CarListing.objects.all(), ('-created_at', '-id')
+        if feed == 'searches':
+            return SearchLog.objects.all(), ('-timestamp', '-id')
+
+        # The inbox of the user with the most received messages
+        busiest = (
+            Message.objects.values('receiver')
+            .annotate(n=Count('id')).order_by('-n').first()
+        )
+        if busiest is None:
+            raise CommandError("There are no messages to paginate.")
+        return (Message.objects.filter(receiver_id=busiest['receiver']),
+                ('-timestamp', '-id'))
+
+    def handle(self, *args, **options):
+        queryset, ordering = self.get_feed(options['feed'])
+        size = options['page_size']
+        repeat = options['repeat']
+        total = queryset.count()
+        paginator = CursorPaginator(queryset, ordering=ordering, page_size=size)
+        ordered = queryset.order_by(*ordering)
+
+        self.stdout.write(
+            f"{options['feed']}: {total} row(s), page size {size}, "
+            f"median of {repeat} run(s)")
+        self.stdout.write(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+
+        for page in options['pages']:
+            offset = (page - 1) * size
+            if offset >= total:
+                self.stdout.write(f"{page:>8} {'(beyond last page)':>25}")
+                continue
+
+            offset_ms = _timed(lambda: list(ordered[offset:offset + size]), repeat)
+
+            # The cursor a client would hold after reading the previous page;
+            # fetching it is not part of the measurement.
+            cursor = None
+            if offset:
+                cursor = paginator.cursor_for(ordered[offset - 1])
+            keyset_ms = _timed(lambda: paginator.page(cursor), repeat)
+
+            self.stdout.write(f"{page:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from cars import similarity
+from loadtest import generator
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure similar-listing queries: index N synthetic listings in "
+        "memory and time nearest-neighbour queries for some of them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--results', type=int, default=10)
+        parser.add_argument('--metric', choices=similarity.METRICS, default='euclidean')
+        parser.add_argument('--batch', type=int, default=100,
+                            help="Queries per batch in the batched run")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        plan = generator.Plan(listings=options['listings'], seed=options['seed'])
+        plan.base = dict.fromkeys(generator.generated_models(), 1)
+        sample_every = max(options['listings'] // options['queries'], 1)
+
+        index = similarity.SimilarityIndex()
+        queries = []
+        start = time.perf_counter()
+        for offset in range(0, options['listings'], 50000):
+            chunk = range(offset, min(offset + 50000, options['listings']))
+            cars, listings = generator.build_listings(plan, rng, chunk).values()
+            rows = [similarity.listing_row(listing)
+                    for car, listing in zip(cars, listings)
+                    if not setattr(listing, 'car', car)]
+            features, makes, models = similarity.encode(rows)
+            index.set_many([listing.pk for listing in listings], features, makes, models)
+            queries.extend((features[i], *models[i]) for i in range(0, len(rows), sample_every))
+        index.prepare()
+        self.stdout.write(
+            f"Indexed {len(index)} listing(s) in {time.perf_counter() - start:.1f} s")
+
+        n, metric = options['results'], options['metric']
+        queries = queries[:options['queries']]
+        samples = []
+        for features, make, model in queries:
+            start = time.perf_counter()
+            index.search(features, make, model, n, metric)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        self.stdout.write(
+            f"{len(samples)} {metric} quer(ies) for {n} result(s), ms: median "
+            f"{statistics.median(samples):.3f}, p99 "
+            f"{samples[int(len(samples) * 0.99) - 1]:.3f}, max {samples[-1]:.3f}")
+
+        by_model = {}
+        for features, make, model in queries:
+            by_model.setdefault((make, model), []).append(features)
+        start = time.perf_counter()
+        for (make, model), group in by_model.items():
+            for i in range(0, len(group), options['batch']):
+                index.search(group[i:i + options['batch']], make, model, n, metric)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(
+            f"Batched by model: {elapsed / len(queries):.3f} ms per query")
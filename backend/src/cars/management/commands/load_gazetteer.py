@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cars import geo
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert or update the places of a gazetteer CSV (the bundled "
+        "cars/data/gazetteer.csv by default)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(geo.GAZETTEER),
+                            help="Gazetteer CSV with name, region, region_name, "
+                                 "country, latitude, longitude, population, aliases")
+
+    def handle(self, *args, **options):
+        try:
+            places = geo.load_gazetteer(options['path'])
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"Could not load {options['path']}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Loaded {places} place(s)."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cars import facets
+
+
+class Command(BaseCommand):
+    help = "Recompute the listing facet counts from the car_listing table"
+
+    def handle(self, *args, **options):
+        counts = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {counts} facet count(s)."))
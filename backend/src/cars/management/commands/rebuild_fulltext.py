@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from cars import fulltext
+from cars.models import CarListing
+
+
+class Command(BaseCommand):
+    help = "Reindex every listing in the full-text search index"
+
+    def handle(self, *args, **options):
+        if not fulltext.supported():
+            self.stdout.write(self.style.WARNING(
+                f"No full-text index on {fulltext.vendor()}; nothing to do."))
+            return
+        fulltext.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {CarListing.objects.count()} listing(s)."))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from cars import summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the listing_summary read model against the source tables and "
+        "rebuild missing or stale rows"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report differences, do not fix them")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--verbose-mismatches', action='store_true',
+                            help="Print every missing or stale row")
+
+    def handle(self, *args, **options):
+        def report(listing_id, fields):
+            if fields is None:
+                self.stdout.write(f"listing {listing_id}: missing summary")
+            else:
+                self.stdout.write(f"listing {listing_id}: stale {', '.join(fields)}")
+
+        checked, missing, stale = summaries.rebuild(
+            batch_size=options['batch_size'],
+            check_only=options['check'],
+            on_mismatch=report if options['verbose_mismatches'] else None,
+        )
+        message = (f"Checked {checked} listing(s): {missing} missing, "
+                   f"{stale} stale summary row(s)")
+        if options['check']:
+            style = self.style.SUCCESS if not (missing or stale) else self.style.WARNING
+            self.stdout.write(style(message + "."))
+        else:
+            self.stdout.write(self.style.SUCCESS(message + " rebuilt."))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cars import pricestats
+
+
+class Command(BaseCommand):
+    help = "Recompute the listing price statistics from the car_listing table"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        groups = pricestats.rebuild()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {groups} price statistics group(s) in {elapsed:.2f}s."))
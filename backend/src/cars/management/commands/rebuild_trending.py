@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from cars import trending
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the trending scores from favorites, messages and view "
+        "totals, and refill the cached trending lists"
+    )
+
+    def handle(self, *args, **options):
+        scores = trending.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {scores} trending score(s)."))
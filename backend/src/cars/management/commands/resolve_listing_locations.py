@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from cars import geo
+
+
+class Command(BaseCommand):
+    help = (
+        "Resolve the free-text location of listings without a place to the "
+        "gazetteer places, and list the texts that did not resolve"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Re-resolve every listing, e.g. after loading a new gazetteer")
+        parser.add_argument('--show', type=int, default=20,
+                            help="Unresolved location texts to list, most common first")
+
+    def handle(self, *args, **options):
+        updated, unresolved = geo.resolve_listings(everything=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Resolved {updated} listing(s); {sum(unresolved.values())} listing(s) "
+            f"in {len(unresolved)} location(s) did not resolve."))
+        common = sorted(unresolved.items(), key=lambda item: -item[1])
+        for text, count in common[:options['show']]:
+            self.stdout.write(f"  {count:>7}  {text}")
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:34
+
+from bisect import bisect_right
+from collections import Counter
+
+from django.db import migrations, models
+
+
+PRICE_BANDS = (0, 5000, 10000, 15000, 20000, 30000,
+               40000, 50000, 75000, 100000)
+MILEAGE_BANDS = (0, 10000, 25000, 50000, 75000,
+                 100000, 150000, 200000)
+
+
+def populate_cells(apps, schema_editor):
+    CarListing = apps.get_model('cars', 'CarListing')
+    ListingFacetCell = apps.get_model('cars', 'ListingFacetCell')
+
+    cells = Counter()
+    listings = CarListing.objects.filter(status='available').select_related('car')
+    for listing in listings.iterator():
+        car = listing.car
+        cells[(car.make, car.model, car.year, car.fuel_type, car.transmission,
+               listing.location,
+               bisect_right(PRICE_BANDS, listing.price) - 1,
+               bisect_right(MILEAGE_BANDS, car.mileage) - 1)] += 1
+
+    fields = ('make', 'model', 'year', 'fuel_type', 'transmission',
+              'location', 'price_band', 'mileage_band')
+    ListingFacetCell.objects.bulk_create(
+        [ListingFacetCell(count=count, **dict(zip(fields, key)))
+         for key, count in cells.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingFacetCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('make', models.CharField(max_length=100)),
+                ('model', models.CharField(max_length=100)),
+                ('year', models.IntegerField()),
+                ('fuel_type', models.CharField(max_length=20)),
+                ('transmission', models.CharField(max_length=20)),
+                ('location', models.CharField(max_length=255)),
+                ('price_band', models.PositiveSmallIntegerField()),
+                ('mileage_band', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Listing Facet Cell',
+                'verbose_name_plural': 'Listing Facet Cells',
+                'db_table': 'listing_facet_cell',
+                'indexes': [models.Index(fields=['fuel_type'], name='listing_fac_fuel_ty_7c24ad_idx'), models.Index(fields=['transmission'], name='listing_fac_transmi_a257ae_idx'), models.Index(fields=['location'], name='listing_fac_locatio_8f3a01_idx')],
+                'constraints': [models.UniqueConstraint(fields=('make', 'model', 'year', 'fuel_type', 'transmission', 'location', 'price_band', 'mileage_band'), name='listing_facet_cell_unique')],
+            },
+        ),
+        migrations.RunPython(populate_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(model, fk):
+    rows = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by().values(fk).annotate(c=Count('pk')).values('c')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def populate_summaries(apps, schema_editor):
+    CarListing = apps.get_model('cars', 'CarListing')
+    ListingSummary = apps.get_model('cars', 'ListingSummary')
+    Favorite = apps.get_model('cars', 'Favorite')
+    Message = apps.get_model('messaging', 'Message')
+    Report = apps.get_model('moderation', 'Report')
+
+    listings = (
+        CarListing.objects.select_related('car', 'seller')
+        .annotate(
+            n_favorites=_count(Favorite, 'listing'),
+            n_messages=_count(Message, 'listing'),
+            n_reports=_count(Report, 'reported_listing'),
+        )
+        .order_by('pk')
+    )
+    batch = []
+    for listing in listings.iterator(chunk_size=1000):
+        car = listing.car
+        batch.append(ListingSummary(
+            listing_id=listing.pk,
+            make=car.make, model=car.model, year=car.year,
+            mileage=car.mileage, fuel_type=car.fuel_type,
+            transmission=car.transmission, color=car.color,
+            engine_size=car.engine_size,
+            seller_id=listing.seller_id,
+            seller_username=listing.seller.username,
+            price=listing.price, location=listing.location,
+            status=listing.status, views=listing.views,
+            created_at=listing.created_at,
+            favorites_count=listing.n_favorites,
+            messages_count=listing.n_messages,
+            reports_count=listing.n_reports,
+        ))
+        if len(batch) >= 1000:
+            ListingSummary.objects.bulk_create(batch)
+            batch = []
+    ListingSummary.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0002_listing_facet_cell'),
+        ('messaging', '0001_initial'),
+        ('moderation', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSummary',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='cars.carlisting')),
+                ('make', models.CharField(max_length=100)),
+                ('model', models.CharField(max_length=100)),
+                ('year', models.IntegerField()),
+                ('mileage', models.PositiveIntegerField()),
+                ('fuel_type', models.CharField(max_length=20)),
+                ('transmission', models.CharField(max_length=20)),
+                ('color', models.CharField(max_length=50)),
+                ('engine_size', models.CharField(max_length=20)),
+                ('seller_username', models.CharField(max_length=150)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('location', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=20)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('favorites_count', models.PositiveIntegerField(default=0)),
+                ('messages_count', models.PositiveIntegerField(default=0)),
+                ('reports_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listing_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Listing Summary',
+                'verbose_name_plural': 'Listing Summaries',
+                'db_table': 'listing_summary',
+                'indexes': [models.Index(fields=['status', '-created_at'], name='listing_sum_status_38bbd5_idx'), models.Index(fields=['status', 'price'], name='listing_sum_status_ec9599_idx'), models.Index(fields=['make', 'model'], name='listing_sum_make_6b5c14_idx'), models.Index(fields=['location'], name='listing_sum_locatio_7afacc_idx')],
+            },
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
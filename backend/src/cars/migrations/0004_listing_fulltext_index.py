@@ -0,0 +1,59 @@
+from django.db import migrations
+
+PG_DOCUMENT = """
+    setweight(to_tsvector('english', coalesce(c.make, '') || ' ' || coalesce(c.model, '')), 'A')
+    || setweight(to_tsvector('english', coalesce(l.location, '')), 'B')
+    || setweight(to_tsvector('english', coalesce(l.description, '')), 'C')
+"""
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("""
+            CREATE TABLE car_listing_search (
+                listing_id bigint PRIMARY KEY
+                    REFERENCES car_listing (id) ON DELETE CASCADE
+                    DEFERRABLE INITIALLY DEFERRED,
+                document tsvector NOT NULL
+            )
+        """)
+        schema_editor.execute(
+            "CREATE INDEX car_listing_search_document_gin "
+            "ON car_listing_search USING GIN (document)")
+        schema_editor.execute(f"""
+            INSERT INTO car_listing_search (listing_id, document)
+            SELECT l.id, {PG_DOCUMENT}
+            FROM car_listing l JOIN car c ON c.id = l.car_id
+        """)
+    elif vendor == 'sqlite':
+        schema_editor.execute("""
+            CREATE VIRTUAL TABLE car_listing_fts USING fts5 (
+                make, model, location, description,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        schema_editor.execute("""
+            INSERT INTO car_listing_fts (rowid, make, model, location, description)
+            SELECT l.id, c.make, c.model, l.location, l.description
+            FROM car_listing l JOIN car c ON c.id = l.car_id
+        """)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS car_listing_search")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS car_listing_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0003_listing_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
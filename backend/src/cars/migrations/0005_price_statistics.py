@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0004_listing_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('make', models.CharField(max_length=100)),
+                ('model', models.CharField(max_length=100)),
+                ('year', models.IntegerField()),
+                ('fuel_type', models.CharField(max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('mean', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('p10', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('p50', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('p90', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('histogram', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Price Statistics',
+                'verbose_name_plural': 'Price Statistics',
+                'db_table': 'price_statistics',
+                'constraints': [models.UniqueConstraint(fields=('make', 'model', 'year', 'fuel_type'), name='price_statistics_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0005_price_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='cars.carlisting')),
+                ('score', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Trending Score',
+                'verbose_name_plural': 'Trending Scores',
+                'db_table': 'trending_score',
+                'indexes': [models.Index(fields=['-score'], name='trending_sc_score_bb5380_idx')],
+            },
+        ),
+    ]
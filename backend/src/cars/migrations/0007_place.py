@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def load_places(apps, schema_editor):
+    from cars import geo
+
+    geo.load_gazetteer(model=apps.get_model('cars', 'Place'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0006_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Place',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('region', models.CharField(help_text="e.g. 'NY'", max_length=10)),
+                ('region_name', models.CharField(max_length=100)),
+                ('country', models.CharField(default='US', max_length=2)),
+                ('display_name', models.CharField(max_length=150)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geohash', models.CharField(db_index=True, max_length=12)),
+                ('population', models.PositiveIntegerField(default=0)),
+                ('aliases', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'verbose_name': 'Place',
+                'verbose_name_plural': 'Places',
+                'db_table': 'place',
+                'constraints': [models.UniqueConstraint(fields=('country', 'region', 'name'), name='place_unique')],
+            },
+        ),
+        migrations.AddField(
+            model_name='carlisting',
+            name='place',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Resolved from location on save; see resolve_listing_locations', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='listings', to='cars.place'),
+        ),
+        migrations.AddField(
+            model_name='listingsummary',
+            name='place',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cars.place'),
+        ),
+        migrations.RunPython(load_places, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:18
+
+import accounts.ratings
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0007_place'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingsummary',
+            name='seller_rating',
+            field=models.FloatField(default=accounts.ratings.prior_rating),
+        ),
+        migrations.AddIndex(
+            model_name='listingsummary',
+            index=models.Index(fields=['status', '-seller_rating', '-listing'], name='listing_sum_status_e11977_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+import cars.facets
+
+
+def populate_counts(apps, schema_editor):
+    cars.facets.rebuild(model=apps.get_model('cars', 'ListingFacetCount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0008_listingsummary_seller_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(blank=True, max_length=20)),
+                ('scope_value', models.CharField(blank=True, max_length=255)),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Listing Facet Count',
+                'verbose_name_plural': 'Listing Facet Counts',
+                'db_table': 'listing_facet_count',
+            },
+        ),
+        migrations.DeleteModel(
+            name='ListingFacetCell',
+        ),
+        migrations.AddConstraint(
+            model_name='listingfacetcount',
+            constraint=models.UniqueConstraint(fields=('scope', 'scope_value', 'facet', 'value'), name='listing_facet_count_unique'),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
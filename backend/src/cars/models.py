@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
+from accounts import ratings
+
 User = get_user_model()
 
 
@@ -49,6 +51,37 @@ class Car(models.Model):
         return f"{self.year} {self.make} {self.model}"
 
 
+class Place(models.Model):
+    """A normalized location (city) with coordinates, from the gazetteer.
+
+    Listings' free-text ``location`` is resolved to a place on save (see
+    ``cars.geo``); ``geohash`` indexes the coordinates for radius searches.
+    """
+
+    name = models.CharField(max_length=100)
+    region = models.CharField(max_length=10, help_text="e.g. 'NY'")
+    region_name = models.CharField(max_length=100)
+    country = models.CharField(max_length=2, default='US')
+    display_name = models.CharField(max_length=150)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geohash = models.CharField(max_length=12, db_index=True)
+    population = models.PositiveIntegerField(default=0)
+    aliases = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        db_table = 'place'
+        verbose_name = 'Place'
+        verbose_name_plural = 'Places'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['country', 'region', 'name'], name='place_unique'),
+        ]
+
+    def __str__(self):
+        return self.display_name
+
+
 class CarListing(models.Model):
 
     STATUS_CHOICES = [
@@ -69,6 +102,10 @@ class CarListing(models.Model):
     )
     description = models.TextField()
     location = models.CharField(max_length=255)
+    place = models.ForeignKey(
+        Place, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='listings', editable=False,
+        help_text="Resolved from location on save; see resolve_listing_locations")
     status = models.CharField(
         max_length=20, choices=STATUS_CHOICES, default='available')
     views = models.PositiveIntegerField(default=0)
@@ -90,9 +127,33 @@ class CarListing(models.Model):
     def __str__(self):
         return f"{self.car} - ${self.price} ({self.status})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The location text ``place`` was resolved from, see save()
+        instance._saved_location = instance.__dict__.get('location')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self.location != getattr(self, '_saved_location', None) and (
+                update_fields is None or 'location' in update_fields):
+            from .geo import resolve
+
+            place = resolve(self.location)
+            self.place_id = place.pk if place else None
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'place'}
+        super().save(*args, **kwargs)
+        self._saved_location = self.location
+
     def increment_views(self):
+        """Count a page view; the database is updated by the next flush"""
+        from .counters import view_counter
+        from .trending import tracker
+        view_counter.record(self.pk)
+        tracker.record(self.pk, 'view')
         self.views += 1
-        self.save(update_fields=['views'])
 
 
 class Favorite(models.Model):
@@ -114,3 +175,146 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f"{self.user.username} favorited {self.listing.car}"
+
+
+class ListingFacetCount(models.Model):
+    """Number of available listings with one facet value within a scope.
+
+    The scope is empty for counts over every available listing, or one
+    single-filter search such as ``make = Toyota``. Kept in sync by
+    ``cars.signals`` so search facet counts are read from this table instead
+    of being counted over ``car_listing``.
+    """
+
+    scope = models.CharField(max_length=20, blank=True)
+    scope_value = models.CharField(max_length=255, blank=True)
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'listing_facet_count'
+        verbose_name = 'Listing Facet Count'
+        verbose_name_plural = 'Listing Facet Counts'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope', 'scope_value', 'facet', 'value'],
+                name='listing_facet_count_unique',
+            ),
+        ]
+
+    def __str__(self):
+        scope = f" where {self.scope} = {self.scope_value}" if self.scope else ''
+        return f"{self.facet} = {self.value}{scope}: {self.count}"
+
+
+class ListingSummary(models.Model):
+    """Denormalized, single-table read model of a listing for list pages.
+
+    One row per ``CarListing``, kept in sync by ``cars.signals``; rebuilt or
+    checked with the ``rebuild_listing_summaries`` command.
+    """
+
+    listing = models.OneToOneField(
+        CarListing, on_delete=models.CASCADE, primary_key=True,
+        related_name='summary')
+    make = models.CharField(max_length=100)
+    model = models.CharField(max_length=100)
+    year = models.IntegerField()
+    mileage = models.PositiveIntegerField()
+    fuel_type = models.CharField(max_length=20)
+    transmission = models.CharField(max_length=20)
+    color = models.CharField(max_length=50)
+    engine_size = models.CharField(max_length=20)
+    seller = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='listing_summaries')
+    seller_username = models.CharField(max_length=150)
+    seller_rating = models.FloatField(default=ratings.prior_rating)
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    location = models.CharField(max_length=255)
+    place = models.ForeignKey(
+        Place, on_delete=models.SET_NULL, null=True, related_name='+')
+    status = models.CharField(max_length=20)
+    views = models.PositiveIntegerField(default=0)
+    favorites_count = models.PositiveIntegerField(default=0)
+    messages_count = models.PositiveIntegerField(default=0)
+    reports_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'listing_summary'
+        verbose_name = 'Listing Summary'
+        verbose_name_plural = 'Listing Summaries'
+        indexes = [
+            models.Index(fields=['status', '-created_at']),
+            models.Index(fields=['status', 'price']),
+            models.Index(fields=['status', '-seller_rating', '-listing']),
+            models.Index(fields=['make', 'model']),
+            models.Index(fields=['location']),
+        ]
+
+    def __str__(self):
+        return f"{self.year} {self.make} {self.model} - ${self.price} ({self.status})"
+
+
+class PriceStatistics(models.Model):
+    """Price distribution of the available listings of one kind of car.
+
+    One row per (make, model, year, fuel_type) with at least one available
+    listing, maintained by ``cars.pricestats``. ``histogram`` holds the
+    listing counts of ``PRICE_STATISTICS_BUCKETS`` equal-width buckets
+    spanning ``minimum`` to ``maximum``.
+    """
+
+    make = models.CharField(max_length=100)
+    model = models.CharField(max_length=100)
+    year = models.IntegerField()
+    fuel_type = models.CharField(max_length=20)
+    count = models.PositiveIntegerField(default=0)
+    mean = models.DecimalField(max_digits=12, decimal_places=2)
+    minimum = models.DecimalField(max_digits=12, decimal_places=2)
+    p10 = models.DecimalField(max_digits=12, decimal_places=2)
+    p50 = models.DecimalField(max_digits=12, decimal_places=2)
+    p90 = models.DecimalField(max_digits=12, decimal_places=2)
+    maximum = models.DecimalField(max_digits=12, decimal_places=2)
+    histogram = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'price_statistics'
+        verbose_name = 'Price Statistics'
+        verbose_name_plural = 'Price Statistics'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['make', 'model', 'year', 'fuel_type'],
+                name='price_statistics_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.year} {self.make} {self.model} ({self.fuel_type}): {self.count}"
+
+
+class TrendingScore(models.Model):
+    """Forward-decayed trending score of a listing, as a natural logarithm.
+
+    Maintained by ``cars.trending`` from views, favorites and messages; see
+    there for how to turn it into the current score.
+    """
+
+    listing = models.OneToOneField(
+        CarListing, on_delete=models.CASCADE, primary_key=True,
+        related_name='trending')
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'trending_score'
+        verbose_name = 'Trending Score'
+        verbose_name_plural = 'Trending Scores'
+        indexes = [
+            models.Index(fields=['-score']),
+        ]
+
+    def __str__(self):
+        return f"Listing {self.listing_id}: {self.score:.3f}"
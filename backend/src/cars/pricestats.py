@@ -0,0 +1,243 @@
+"""
+Precomputed price statistics per kind of car.
+
+"Is this price fair" compares an asking price with the available listings
+of the same make, model, year and fuel type. Percentiles over
+``car_listing.price`` on demand read every price of the group on each
+request, so ``PriceStatistics`` keeps count, mean, minimum, p10/p50/p90,
+maximum and a histogram per group.
+
+Listing saves and deletes that move a listing into or out of a group, or
+change its price while it is in one, mark the groups dirty, as do car
+edits that change the group of a car's listings (``cars.signals``) and
+bulk admin actions (``cars.services``). Dirty groups are recomputed from
+their available listings once the transaction commits; a group has few
+listings, so this is one indexed query per change. ``rebuild`` recomputes
+every group from a single scan of the available listings: prices are
+sorted by group and the statistics of all groups are computed at once with
+NumPy over the group boundaries; Python only turns the results into rows.
+
+Percentiles interpolate linearly between closest ranks (NumPy's default
+method) in both paths, so an incremental refresh and a rebuild agree.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import CarListing, PriceStatistics
+
+KEY_FIELDS = ('make', 'model', 'year', 'fuel_type')
+LISTING_PATHS = tuple(f'car__{field}' for field in KEY_FIELDS)
+PERCENTILES = {'p10': 0.1, 'p50': 0.5, 'p90': 0.9}
+CENT = Decimal('0.01')
+
+
+def _buckets():
+    return getattr(settings, 'PRICE_STATISTICS_BUCKETS', 10)
+
+
+def car_key(car):
+    """Statistics group of ``car``'s listings"""
+    return tuple(getattr(car, field) for field in KEY_FIELDS)
+
+
+def listing_key(listing):
+    """Statistics group a listing counts in, or None if it is not available"""
+    if listing.status != 'available':
+        return None
+    return car_key(listing.car)
+
+
+def _key_filter(keys, paths=KEY_FIELDS):
+    condition = Q()
+    for key in keys:
+        condition |= Q(**dict(zip(paths, key)))
+    return condition
+
+
+def _money(value):
+    return Decimal(float(value)).quantize(CENT)
+
+
+def compute(rows, buckets=None):
+    """
+    Statistics of ``(make, model, year, fuel_type, price)`` rows, as
+    ``{key: field values of its PriceStatistics row}``.
+    """
+    buckets = buckets or _buckets()
+    codes = {}
+    group = np.fromiter((codes.setdefault(tuple(row[:4]), len(codes)) for row in rows),
+                        dtype=np.int64, count=len(rows))
+    if not codes:
+        return {}
+    prices = np.fromiter((row[4] for row in rows), dtype=np.float64, count=len(rows))
+
+    order = np.lexsort((prices, group))
+    group, prices = group[order], prices[order]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    counts = np.diff(np.r_[starts, len(prices)])
+    ends = starts + counts - 1
+
+    stats = {
+        'mean': np.add.reduceat(prices, starts) / counts,
+        'minimum': prices[starts],
+        'maximum': prices[ends],
+    }
+    for name, q in PERCENTILES.items():
+        position = starts + q * (counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        stats[name] = prices[low] + (prices[high] - prices[low]) * (position - low)
+
+    # Equal-width buckets between each group's minimum and maximum
+    rank = np.repeat(np.arange(len(starts)), counts)
+    span = (stats['maximum'] - stats['minimum'])[rank]
+    offset = prices - stats['minimum'][rank]
+    bucket = np.zeros(len(prices), dtype=np.int64)
+    spread = span > 0
+    bucket[spread] = np.minimum(
+        (offset[spread] / span[spread] * buckets).astype(np.int64), buckets - 1)
+    histogram = np.bincount(rank * buckets + bucket,
+                            minlength=len(starts) * buckets).reshape(-1, buckets)
+
+    keys = list(codes)
+    result = {}
+    for index, code in enumerate(group[starts]):
+        values = {name: _money(column[index]) for name, column in stats.items()}
+        values['count'] = int(counts[index])
+        values['histogram'] = histogram[index].tolist()
+        result[keys[code]] = values
+    return result
+
+
+def price_rows(queryset):
+    """``(make, model, year, fuel_type, price)`` of the available listings of ``queryset``"""
+    return list(queryset.filter(status='available').order_by()
+                .values_list(*LISTING_PATHS, 'price'))
+
+
+def refresh(keys):
+    """Recompute the statistics of the groups ``keys``; returns the number stored"""
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return 0
+    computed = compute(price_rows(
+        CarListing.objects.filter(_key_filter(keys, LISTING_PATHS))))
+    with transaction.atomic():
+        empty = keys - computed.keys()
+        if empty:
+            PriceStatistics.objects.filter(_key_filter(empty)).delete()
+        for key, values in computed.items():
+            PriceStatistics.objects.update_or_create(
+                defaults=values, **dict(zip(KEY_FIELDS, key)))
+    return len(computed)
+
+
+def mark_dirty(keys):
+    """Refresh the groups ``keys`` once the current transaction commits"""
+    keys = {key for key in keys if key is not None}
+    if keys:
+        transaction.on_commit(lambda: refresh(keys))
+
+
+def rebuild():
+    """Recompute every group from the available listings; returns the group count"""
+    computed = compute(price_rows(CarListing.objects.all()))
+    with transaction.atomic():
+        PriceStatistics.objects.all().delete()
+        PriceStatistics.objects.bulk_create(
+            [PriceStatistics(**dict(zip(KEY_FIELDS, key)), **values)
+             for key, values in computed.items()],
+            batch_size=1000,
+        )
+    return len(computed)
+
+
+# Service API
+
+def statistics_for(make, model, year, fuel_type):
+    """The ``PriceStatistics`` of one group, or None if it has no available listings"""
+    return PriceStatistics.objects.filter(
+        make=make, model=model, year=year, fuel_type=fuel_type).first()
+
+
+def statistics_for_keys(keys):
+    """The ``PriceStatistics`` of the ``(make, model, year, fuel_type)`` groups ``keys``"""
+    return PriceStatistics.objects.filter(_key_filter(keys))
+
+
+def bucket_edges(statistics):
+    """The ``len(histogram) + 1`` price edges of the histogram buckets"""
+    buckets = len(statistics.histogram)
+    width = (statistics.maximum - statistics.minimum) / buckets
+    return [_money(statistics.minimum + width * i) for i in range(buckets)] + [
+        statistics.maximum]
+
+
+def percentile_rank(statistics, price):
+    """
+    Approximate share (0-100) of the group's listings priced below
+    ``price``, interpolated within its histogram bucket.
+    """
+    price = Decimal(price)
+    if price <= statistics.minimum:
+        return 0.0
+    if price >= statistics.maximum:
+        return 100.0
+    edges = bucket_edges(statistics)
+    below = 0
+    for count, low, high in zip(statistics.histogram, edges, edges[1:]):
+        if price >= high:
+            below += count
+            continue
+        below += count * float((price - low) / (high - low))
+        break
+    return round(100 * below / statistics.count, 1)
+
+
+def assess(price, statistics):
+    """``'low'`` below the group's p10, ``'high'`` above its p90, else ``'fair'``"""
+    if price < statistics.p10:
+        return 'low'
+    if price > statistics.p90:
+        return 'high'
+    return 'fair'
+
+
+def price_position(listing):
+    """
+    How ``listing``'s price compares with its group, as
+    ``{'statistics', 'assessment', 'percentile'}``; the statistics are None
+    when no listing of the group is available.
+    """
+    statistics = statistics_for(*car_key(listing.car))
+    if statistics is None:
+        return {'statistics': None, 'assessment': None, 'percentile': None}
+    return {
+        'statistics': statistics,
+        'assessment': assess(listing.price, statistics),
+        'percentile': percentile_rank(statistics, listing.price),
+    }
+
+
+def serialize_statistics(statistics):
+    """Plain-dict representation of a ``PriceStatistics`` row for JSON responses"""
+    edges = bucket_edges(statistics)
+    return {
+        **{field: getattr(statistics, field) for field in KEY_FIELDS},
+        'count': statistics.count,
+        'mean': str(statistics.mean),
+        'min': str(statistics.minimum),
+        'p10': str(statistics.p10),
+        'p50': str(statistics.p50),
+        'p90': str(statistics.p90),
+        'max': str(statistics.maximum),
+        'histogram': [
+            {'low': str(low), 'high': str(high), 'count': count}
+            for count, low, high in zip(statistics.histogram, edges, edges[1:])
+        ],
+        'updated_at': statistics.updated_at.isoformat(),
+    }
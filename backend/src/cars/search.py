@@ -0,0 +1,265 @@
+"""
+Faceted search over available car listings.
+
+Results are read from the single-table ``ListingSummary`` read model. Facet
+counts are read from the maintained ``ListingFacetCount`` table when the
+search has no filter or a single equality filter (make, model, fuel type,
+transmission, location or a price/mileage band); otherwise they are
+computed with one grouped query over the matching listings, aggregated in
+the database. Either way a results page costs a fixed number of queries,
+and results are keyset paginated so deep pages stay cheap.
+``near``/``radius_km`` match listings whose resolved place lies within the
+radius (``cars.geo``).
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+from carzone.pagination import CursorPaginator
+
+from . import facets, fulltext, geo
+from .models import ListingSummary
+
+# Cell field -> ListingSummary field, for counting summaries per facet
+SUMMARY_PATHS = {field: field for field in facets.LISTING_PATHS}
+
+
+class SearchError(ValueError):
+    """Raised for malformed search parameters"""
+
+
+class ListingSearch:
+    """Filters, sorts and facets available car listings"""
+
+    SORTS = {
+        'relevance': ('-search_rank', '-pk'),
+        'newest': ('-created_at', '-pk'),
+        'oldest': ('created_at', 'pk'),
+        'price_asc': ('price', 'pk'),
+        'price_desc': ('-price', '-pk'),
+        'year_desc': ('-year', '-pk'),
+        'mileage_asc': ('mileage', 'pk'),
+        # Smoothed seller rating, copied onto the summaries (accounts.ratings)
+        'rating': ('-seller_rating', '-pk'),
+    }
+
+    # 'q' is free text matched against the full-text index (cars.fulltext)
+    TEXT_FILTERS = ('q', 'make', 'model', 'fuel_type', 'transmission', 'location')
+    INT_FILTERS = ('min_year', 'max_year', 'min_mileage', 'max_mileage',
+                   'price_band', 'mileage_band')
+    DECIMAL_FILTERS = ('min_price', 'max_price')
+    # 'near' names a place; 'radius_km' defaults to LISTING_SEARCH_RADIUS_KM
+    GEO_FILTERS = ('near', 'radius_km')
+
+    def __init__(self, sort=None, **filters):
+        if sort is None:
+            sort = 'relevance' if filters.get('q') else 'newest'
+        if sort not in self.SORTS:
+            raise SearchError(f"Unknown sort '{sort}'.")
+        known = set(self.TEXT_FILTERS + self.INT_FILTERS + self.DECIMAL_FILTERS
+                    + self.GEO_FILTERS)
+        unknown = set(filters) - known
+        if unknown:
+            raise SearchError(f"Unknown filter(s): {', '.join(sorted(unknown))}.")
+        self.filters = {k: v for k, v in filters.items()
+                        if v not in (None, '')}
+        if sort == 'relevance' and 'q' not in self.filters:
+            raise SearchError("Sorting by relevance needs a 'q' search.")
+        if 'radius_km' in self.filters and 'near' not in self.filters:
+            raise SearchError("'radius_km' needs a 'near' place.")
+        self.sort = sort
+        self._place_ids = None
+
+    @classmethod
+    def from_params(cls, params):
+        """Build a search from request parameters (a QueryDict or dict)"""
+        filters = {}
+        for name in cls.TEXT_FILTERS:
+            value = params.get(name)
+            if value:
+                filters[name] = value.strip()
+        for name in cls.INT_FILTERS:
+            value = params.get(name)
+            if value not in (None, ''):
+                try:
+                    filters[name] = int(value)
+                except (TypeError, ValueError):
+                    raise SearchError(f"'{name}' must be an integer.")
+        for name in cls.DECIMAL_FILTERS:
+            value = params.get(name)
+            if value not in (None, ''):
+                try:
+                    filters[name] = Decimal(value)
+                except (InvalidOperation, TypeError):
+                    raise SearchError(f"'{name}' must be a number.")
+                if not filters[name].is_finite():
+                    raise SearchError(f"'{name}' must be a finite number.")
+        if params.get('near'):
+            filters['near'] = params['near'].strip()
+        radius = params.get('radius_km')
+        if radius not in (None, ''):
+            try:
+                filters['radius_km'] = float(radius)
+            except (TypeError, ValueError):
+                raise SearchError("'radius_km' must be a number.")
+        return cls(sort=params.get('sort') or None, **filters)
+
+    def describe(self):
+        """Compact text form of the filters, used as the SearchLog query"""
+        return ' '.join(f"{name}:{self.filters[name]}" for name in sorted(self.filters))
+
+    def _band(self, name, edges):
+        index = self.filters.get(name)
+        if index is None:
+            return None
+        if not 0 <= index < len(edges):
+            raise SearchError(f"'{name}' must be between 0 and {len(edges) - 1}.")
+        return facets.band_range(index, edges)
+
+    def place_ids(self):
+        """Ids of the places within the 'near' radius"""
+        if self._place_ids is None:
+            radius = self.filters.get(
+                'radius_km', getattr(settings, 'LISTING_SEARCH_RADIUS_KM', 50))
+            limit = getattr(settings, 'LISTING_SEARCH_MAX_RADIUS_KM', 500)
+            if not 0 < radius <= limit:
+                raise SearchError(f"'radius_km' must be between 0 and {limit}.")
+            ids = geo.place_ids_near(self.filters['near'], radius)
+            if ids is None:
+                raise SearchError(f"Unknown place '{self.filters['near']}'.")
+            self._place_ids = ids
+        return self._place_ids
+
+    def queryset(self):
+        """Summaries of the matching available listings, sorted"""
+        f = self.filters
+        qs = ListingSummary.objects.filter(status='available')
+        if 'q' in f:
+            qs = fulltext.matching(qs, f['q'])
+        for name in self.TEXT_FILTERS[1:]:
+            if name in f:
+                qs = qs.filter(**{name: f[name]})
+        if 'near' in f:
+            qs = qs.filter(place_id__in=self.place_ids())
+        if 'min_year' in f:
+            qs = qs.filter(year__gte=f['min_year'])
+        if 'max_year' in f:
+            qs = qs.filter(year__lte=f['max_year'])
+        if 'min_price' in f:
+            qs = qs.filter(price__gte=f['min_price'])
+        if 'max_price' in f:
+            qs = qs.filter(price__lte=f['max_price'])
+        if 'min_mileage' in f:
+            qs = qs.filter(mileage__gte=f['min_mileage'])
+        if 'max_mileage' in f:
+            qs = qs.filter(mileage__lte=f['max_mileage'])
+
+        for name, field, edges in (
+            ('price_band', 'price', facets.PRICE_BANDS),
+            ('mileage_band', 'mileage', facets.MILEAGE_BANDS),
+        ):
+            bounds = self._band(name, edges)
+            if bounds is not None:
+                low, high = bounds
+                qs = qs.filter(**{f'{field}__gte': low})
+                if high is not None:
+                    qs = qs.filter(**{f'{field}__lt': high})
+
+        return qs.order_by(*self.SORTS[self.sort])
+
+    def facet_scope(self):
+        """
+        The ``(scope, scope_value)`` of ``ListingFacetCount`` holding the
+        facet counts of this search, or None if they cannot be read from
+        the maintained counts.
+        """
+        f = self.filters
+        scoped = [name for name in facets.SCOPES if name in f]
+        if len(scoped) != len(f) or len(scoped) > 1:
+            return None
+        if not scoped:
+            return '', ''
+        name = scoped[0]
+        if name == 'price_band':
+            self._band(name, facets.PRICE_BANDS)
+        elif name == 'mileage_band':
+            self._band(name, facets.MILEAGE_BANDS)
+        return facets.SCOPES[name], str(f[name])
+
+    def facets(self):
+        """Return ``(total, facets)`` for the current filters in one query"""
+        scope = self.facet_scope()
+        if scope is not None:
+            return facets.facet_counts(*scope)
+        return facets.summarize(facets.grouped_counts(self.queryset(), SUMMARY_PATHS))
+
+    def results(self, cursor=None, page_size=20):
+        """
+        Return one page of results (keyset paginated, see
+        ``carzone.pagination``) together with the facet counts.
+        """
+        total, facet_counts = self.facets()
+        paginator = CursorPaginator(
+            self.queryset(), ordering=self.SORTS[self.sort], page_size=page_size)
+        page = paginator.page(cursor)
+        return {
+            'total': total,
+            'results': page.items,
+            'next_cursor': page.next_cursor,
+            'facets': facet_counts,
+        }
+
+
+def serialize_summary(summary):
+    """Plain-dict representation of a search result for JSON responses"""
+    return {
+        'id': summary.pk,
+        'make': summary.make,
+        'model': summary.model,
+        'year': summary.year,
+        'mileage': summary.mileage,
+        'fuel_type': summary.fuel_type,
+        'transmission': summary.transmission,
+        'engine_size': summary.engine_size,
+        'color': summary.color,
+        'price': str(summary.price),
+        'location': summary.location,
+        'status': summary.status,
+        'views': summary.views,
+        'favorites': summary.favorites_count,
+        'seller': summary.seller_username,
+        'seller_rating': summary.seller_rating,
+        'created_at': summary.created_at.isoformat(),
+    }
+
+
+def serialize_listing(listing):
+    """Plain-dict representation of a full listing for JSON responses"""
+    car = listing.car
+    return {
+        'id': listing.id,
+        'make': car.make,
+        'model': car.model,
+        'year': car.year,
+        'mileage': car.mileage,
+        'fuel_type': car.fuel_type,
+        'transmission': car.transmission,
+        'engine_size': car.engine_size,
+        'color': car.color,
+        'price': str(listing.price),
+        'location': listing.location,
+        'status': listing.status,
+        'views': listing.views,
+        'seller': listing.seller.username,
+        'description': listing.description,
+        'created_at': listing.created_at.isoformat(),
+    }
+
+
+def serialize_facets(facet_counts):
+    """Plain-dict representation of facet counts for JSON responses"""
+    return {
+        facet: [{'value': value, 'label': label, 'count': count}
+                for value, label, count in entries]
+        for facet, entries in facet_counts.items()
+    }
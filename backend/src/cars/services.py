@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.utils import timezone
+
+from . import facets, geo, pricestats, trending
+from .models import CarListing, ListingSummary
+from .similarity import recommender
+from .summaries import LISTING_FIELDS
+
+
+def update_listings(queryset, **changes):
+    """
+    ``queryset.update(**changes)`` that keeps the resolved place, facet
+    counts, listing summaries, price statistics, trending lists and
+    similarity index in sync.
+
+    Used by bulk admin actions, which bypass the model signals.
+    """
+    # update() skips auto_now; other processes reload what changed by it
+    changes = {'updated_at': timezone.now(), **changes}
+    if 'location' in changes:
+        place = geo.resolve(changes['location'])
+        changes = {**changes, 'place_id': place.pk if place else None}
+    with transaction.atomic():
+        ids = list(queryset.values_list('pk', flat=True))
+        scoped = CarListing.objects.filter(pk__in=ids)
+        before = facets.collect_cells(scoped)
+        updated = scoped.update(**changes)
+        after = facets.collect_cells(scoped)
+        after.subtract(before)
+        facets.apply_deltas(after)
+
+        if changes.keys() & {'car', 'car_id', 'price', 'status'}:
+            groups = set(before) | set(after)
+            pricestats.mark_dirty({cell[:4] for cell in groups})
+
+        mirrored = {field: value for field, value in changes.items()
+                    if field in LISTING_FIELDS}
+        if mirrored:
+            ListingSummary.objects.filter(listing_id__in=ids).update(**mirrored)
+    if changes.keys() & {'car', 'car_id', 'location', 'status'}:
+        transaction.on_commit(lambda: trending.listings_changed(ids))
+    if recommender.index is not None:
+        transaction.on_commit(lambda: recommender.listings_changed(ids))
+    return updated
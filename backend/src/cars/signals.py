@@ -0,0 +1,248 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import facets, fulltext, pricestats, summaries, trending
+from .similarity import recommender
+from .models import Car, CarListing, Favorite
+
+LISTING_FACET_FIELDS = {'car', 'car_id', 'price', 'location', 'status'}
+CAR_FACET_FIELDS = {'make', 'model', 'year', 'fuel_type',
+                    'transmission', 'mileage'}
+CAR_PRICE_FIELDS = set(pricestats.KEY_FIELDS)
+LISTING_SIMILARITY_FIELDS = {'car', 'car_id', 'price', 'status'}
+CAR_SIMILARITY_FIELDS = {'make', 'model', 'year', 'mileage', 'fuel_type',
+                         'transmission', 'engine_size'}
+
+
+def _touches(update_fields, fields):
+    return update_fields is None or bool(set(update_fields) & fields)
+
+
+@receiver(pre_save, sender=CarListing)
+def remember_listing_cell(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Remember the facet cell a listing was counted in before saving"""
+    instance._facet_key = None
+    instance._price_entry = None
+    if raw or instance.pk is None or not _touches(update_fields, LISTING_FACET_FIELDS):
+        instance._facet_touched = False
+        return
+    instance._facet_touched = True
+    previous = (
+        CarListing.objects.select_related('car')
+        .filter(pk=instance.pk).first()
+    )
+    if previous is not None:
+        instance._facet_key = facets.listing_key(previous)
+        instance._price_entry = (pricestats.listing_key(previous), previous.price)
+
+
+@receiver(post_save, sender=CarListing)
+def update_listing_cell(sender, instance, created, raw=False, **kwargs):
+    """Move the listing to its new facet cell"""
+    if raw or not (created or getattr(instance, '_facet_touched', False)):
+        return
+    facets.move(getattr(instance, '_facet_key', None),
+                facets.listing_key(instance))
+
+
+@receiver(post_delete, sender=CarListing)
+def remove_listing_cell(sender, instance, **kwargs):
+    """Stop counting a deleted listing"""
+    facets.move(facets.listing_key(instance), None)
+
+
+@receiver(pre_save, sender=Car)
+def remember_car_cells(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Remember the facet cells of a car's listings before it changes"""
+    instance._facet_cells = None
+    if raw or instance.pk is None or not _touches(update_fields, CAR_FACET_FIELDS):
+        return
+    instance._facet_cells = facets.collect_cells(
+        CarListing.objects.filter(car_id=instance.pk))
+
+
+@receiver(post_save, sender=Car)
+def update_car_cells(sender, instance, raw=False, **kwargs):
+    """Move a car's listings to the cells matching its new attributes"""
+    before = getattr(instance, '_facet_cells', None)
+    if raw or not before:
+        return
+    after = facets.collect_cells(CarListing.objects.filter(car_id=instance.pk))
+    deltas = Counter(after)
+    deltas.subtract(before)
+    facets.apply_deltas(deltas)
+
+
+# Price statistics
+
+@receiver(post_save, sender=CarListing)
+def update_price_statistics(sender, instance, created, raw=False, **kwargs):
+    """Refresh the price statistics of the groups a listing left or joined"""
+    if raw or not (created or getattr(instance, '_facet_touched', False)):
+        return
+    before = getattr(instance, '_price_entry', None) or (None, None)
+    after = (pricestats.listing_key(instance), instance.price)
+    if before != after:
+        pricestats.mark_dirty({before[0], after[0]})
+
+
+@receiver(post_delete, sender=CarListing)
+def remove_listing_price(sender, instance, **kwargs):
+    """Drop a deleted listing from its group's price statistics"""
+    pricestats.mark_dirty({pricestats.listing_key(instance)})
+
+
+@receiver(pre_save, sender=Car)
+def remember_price_group(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Remember the price statistics group of a car before it changes"""
+    instance._price_key = None
+    if raw or instance.pk is None or not _touches(update_fields, CAR_PRICE_FIELDS):
+        return
+    previous = Car.objects.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._price_key = pricestats.car_key(previous)
+
+
+@receiver(post_save, sender=Car)
+def move_price_group(sender, instance, raw=False, **kwargs):
+    """Refresh both groups when a car with available listings changes group"""
+    before = getattr(instance, '_price_key', None)
+    after = pricestats.car_key(instance)
+    if raw or before is None or before == after:
+        return
+    if CarListing.objects.filter(car_id=instance.pk, status='available').exists():
+        pricestats.mark_dirty({before, after})
+
+
+# Similar-listings index
+
+@receiver(post_save, sender=CarListing)
+def reindex_listing_features(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Re-encode a saved listing in this process's similarity index"""
+    if (not raw and recommender.index is not None
+            and _touches(update_fields, LISTING_SIMILARITY_FIELDS)):
+        listing_id = instance.pk
+        transaction.on_commit(lambda: recommender.listings_changed([listing_id]))
+
+
+@receiver(post_save, sender=Car)
+def reindex_car_features(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Re-encode the listings of a changed car"""
+    if (not (raw or created) and recommender.index is not None
+            and _touches(update_fields, CAR_SIMILARITY_FIELDS)):
+        listing_ids = list(instance.listings.values_list('pk', flat=True))
+        transaction.on_commit(lambda: recommender.listings_changed(listing_ids))
+
+
+@receiver(post_delete, sender=CarListing)
+def unindex_listing_features(sender, instance, **kwargs):
+    """Drop a deleted listing from this process's similarity index"""
+    if recommender.index is not None:
+        listing_id = instance.pk
+        transaction.on_commit(lambda: recommender.listings_deleted([listing_id]))
+
+
+# Trending scores
+
+def _trending_receiver(model, kind):
+    def created(sender, instance, created, raw=False, **kwargs):
+        if created and not raw and instance.listing_id is not None:
+            listing_id = instance.listing_id
+            transaction.on_commit(lambda: trending.tracker.record(listing_id, kind))
+
+    post_save.connect(created, sender=model, weak=False,
+                      dispatch_uid=f'trending-{kind}-created')
+
+
+_trending_receiver(Favorite, 'favorite')
+_trending_receiver('messaging.Message', 'message')
+
+
+@receiver(post_save, sender=CarListing)
+def update_trending_lists(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Add a listing back to or drop it from the trending lists it belongs to"""
+    if not (raw or created) and _touches(update_fields, LISTING_FACET_FIELDS):
+        listing_id = instance.pk
+        transaction.on_commit(lambda: trending.listings_changed([listing_id]))
+
+
+# ListingSummary read model
+
+@receiver(post_save, sender=CarListing)
+def sync_listing_summary(sender, instance, raw=False, **kwargs):
+    """Rewrite the summary row of a saved listing"""
+    if not raw:
+        summaries.sync_listing(instance)
+
+
+@receiver(post_save, sender=Car)
+def sync_car_summaries(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Push changed car attributes to the summaries of its listings"""
+    if not (raw or created) and _touches(update_fields, set(summaries.CAR_FIELDS)):
+        summaries.sync_car(instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def sync_seller_summaries(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Push a changed username to the summaries of the user's listings"""
+    if not (raw or created) and _touches(update_fields, {'username'}):
+        summaries.sync_seller(instance)
+
+
+def _counter_receivers(model, fk, field, previous=None):
+    """
+    Count ``model`` rows in ``field`` of the summary of their ``fk`` listing.
+    ``previous(instance)`` is the listing a saved row had, for rows that
+    can move to another listing.
+    """
+    def saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+        if raw:
+            return
+        if created:
+            summaries.adjust(getattr(instance, fk), field, 1)
+        elif previous is not None and _touches(update_fields, {fk, fk.removesuffix('_id')}):
+            before, after = previous(instance), getattr(instance, fk)
+            if before != after:
+                summaries.adjust(before, field, -1)
+                summaries.adjust(after, field, 1)
+
+    def deleted(sender, instance, **kwargs):
+        summaries.adjust(getattr(instance, fk), field, -1)
+
+    post_save.connect(saved, sender=model, weak=False,
+                      dispatch_uid=f'summary-{field}-saved')
+    post_delete.connect(deleted, sender=model, weak=False,
+                        dispatch_uid=f'summary-{field}-deleted')
+
+
+_counter_receivers(Favorite, 'listing_id', 'favorites_count')
+_counter_receivers('messaging.Message', 'listing_id', 'messages_count')
+_counter_receivers(
+    'moderation.Report', 'reported_listing_id', 'reports_count',
+    previous=lambda report: report.saved_value('reported_listing_id'))
+
+
+# Full-text index
+
+@receiver(post_save, sender=CarListing)
+def index_listing_text(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Reindex the searchable text of a saved listing"""
+    if not raw and _touches(update_fields, {'car', 'car_id', 'location', 'description'}):
+        fulltext.index_listings([instance.pk])
+
+
+@receiver(post_save, sender=Car)
+def index_car_text(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Reindex the listings of a car whose make or model changed"""
+    if not (raw or created) and _touches(update_fields, {'make', 'model'}):
+        fulltext.index_car(instance.pk)
+
+
+@receiver(post_delete, sender=CarListing)
+def unindex_listing_text(sender, instance, **kwargs):
+    """Drop a deleted listing from the full-text index"""
+    fulltext.remove_listing(instance.pk)
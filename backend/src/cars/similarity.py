@@ -0,0 +1,476 @@
+"""
+Similar-listings recommendations.
+
+Every available listing is encoded once into a row of a float32 feature
+matrix: year, mileage, log price and engine size (parsed from strings such
+as ``'1.8L'``), each shifted and scaled so that one ``SCALES`` unit of
+difference adds one to the distance, followed by one-hot fuel type and
+transmission columns weighted by ``CATEGORY_WEIGHTS``. Make and model are
+not columns: a candidate of another model of the same make has
+``PENALTIES[metric][0]`` added to its distance, one of another make
+``PENALTIES[metric][1]``.
+
+Because a penalty is a lower bound on the score of every candidate it
+applies to, nearest neighbours are searched level by level: the listings
+of the same model first, then of the same make, then all listings, and the
+search stops as soon as the N-th best score found is no worse than the
+penalty of the next level. Most queries only scan their model's rows,
+which are kept contiguous per model and make; the scores of a batch of
+queries on the same model come from one matrix product. Results are exact
+for both metrics (Euclidean distance, or cosine distance on the same
+features).
+
+The index lives in memory in each process (``recommender``), is loaded on
+first use and then kept current by ``cars.signals`` for changes made in
+this process and by reloading the listings updated since the last load
+every ``SIMILAR_LISTINGS_REFRESH_INTERVAL`` seconds for changes made by
+other processes. Each reload reaches ``SIMILAR_LISTINGS_REFRESH_OVERLAP``
+seconds further back, for saves committed after a later one was loaded.
+Listings deleted elsewhere may linger in the index, so results are re-read
+from ``ListingSummary`` and filtered.
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+FIELDS = ('car__make', 'car__model', 'car__year', 'car__mileage', 'car__fuel_type',
+          'car__transmission', 'car__engine_size', 'price')
+FUEL_TYPES = ('petrol', 'diesel', 'hybrid', 'electric')
+TRANSMISSIONS = ('manual', 'automatic')
+
+# Numeric feature -> (typical value, difference worth one distance unit)
+SCALES = {
+    'year': (2015, 2),
+    'mileage': (60000, 20000),
+    'price': (math.log(20000), math.log(1.15)),
+    'engine_size': (2.0, 0.4),
+}
+# Distance between two listings differing only in this attribute
+CATEGORY_WEIGHTS = {'fuel_type': 1.5, 'transmission': 1.0}
+# Metric -> (other model of the same make, other make)
+PENALTIES = {'euclidean': (2.0, 4.0), 'cosine': (0.2, 0.4)}
+METRICS = tuple(PENALTIES)
+DIMENSIONS = len(SCALES) + len(FUEL_TYPES) + len(TRANSMISSIONS)
+
+ENGINE_SIZE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(cc|l)?', re.IGNORECASE)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+@lru_cache(maxsize=1024)
+def parse_engine_size(value):
+    """Displacement in litres of an ``engine_size`` string, 0 when unknown"""
+    match = ENGINE_SIZE_RE.search(value or '')
+    if match is None:
+        return 0.0
+    size = float(match.group(1))
+    if (match.group(2) or '').lower() == 'cc' or size > 20:
+        size /= 1000
+    return size
+
+
+def _one_hot(values, choices, weight):
+    columns = np.zeros((len(values), len(choices)), dtype=np.float32)
+    positions = {choice: i for i, choice in enumerate(choices)}
+    for row, value in enumerate(values):
+        column = positions.get(value)
+        if column is not None:
+            columns[row, column] = weight / math.sqrt(2)
+    return columns
+
+
+def encode(rows):
+    """
+    Feature matrix of ``(make, model, year, mileage, fuel_type,
+    transmission, engine_size, price)`` rows, with their make and model
+    names.
+    """
+    count = len(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(FIELDS)
+    makes, models, years, mileages, fuels, transmissions, engines, prices = columns
+    numeric = np.empty((count, len(SCALES)), dtype=np.float64)
+    numeric[:, 0] = np.fromiter(years, dtype=np.float64, count=count)
+    numeric[:, 1] = np.fromiter(mileages, dtype=np.float64, count=count)
+    numeric[:, 2] = np.log(np.maximum(
+        np.fromiter(prices, dtype=np.float64, count=count), 1))
+    numeric[:, 3] = np.fromiter(map(parse_engine_size, engines),
+                                dtype=np.float64, count=count)
+    offsets, scales = np.array(list(SCALES.values())).T
+    features = np.hstack([
+        ((numeric - offsets) / scales).astype(np.float32),
+        _one_hot(fuels, FUEL_TYPES, CATEGORY_WEIGHTS['fuel_type']),
+        _one_hot(transmissions, TRANSMISSIONS, CATEGORY_WEIGHTS['transmission']),
+    ])
+    return features, list(makes), list(zip(makes, models))
+
+
+def _top(scores, n):
+    """Positions of the ``n`` lowest scores of each row, best first"""
+    if scores.shape[-1] > n:
+        part = np.argpartition(scores, n - 1, axis=-1)[..., :n]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, part, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def _distances(features, sqnorm, queries, qsq, metric):
+    """``(queries, rows)`` matrix of unpenalized distances"""
+    dots = queries @ features.T
+    if metric == 'cosine':
+        return 1 - dots / np.sqrt(np.maximum(qsq[:, None] * sqnorm[None, :], 1e-12))
+    return np.sqrt(np.maximum(qsq[:, None] + sqnorm[None, :] - 2 * dots, 0))
+
+
+class SimilarityIndex:
+    """
+    In-memory feature matrix of the available listings.
+
+    Each listing occupies a slot of ``features`` (with its squared norm in
+    ``sqnorm``, make and model codes in ``make``/``model``); the rows of
+    each model and make are materialized contiguously on first use.
+    Updating or removing a listing marks its slot dead; the index is
+    compacted once most slots are dead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._slots = {}                         # listing id -> slot
+        self._codes = {'make': {}, 'model': {}}  # name -> code
+        self._members = {'make': defaultdict(list), 'model': defaultdict(list)}
+        self._groups = {}                        # (level, code) -> arrays
+        self._size = 0
+        self._dead = 0
+        self.listing = np.zeros(0, dtype=np.int64)
+        self.features = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.sqnorm = np.zeros(0, dtype=np.float32)
+        self.make = np.zeros(0, dtype=np.int32)
+        self.model = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return self._size - self._dead
+
+    def _grow(self, needed):
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+
+        def grown(array):
+            bigger = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            bigger[:self._size] = array[:self._size]
+            return bigger
+
+        self.listing, self.features, self.sqnorm = (
+            grown(self.listing), grown(self.features), grown(self.sqnorm))
+        self.make, self.model, self.alive = (
+            grown(self.make), grown(self.model), grown(self.alive))
+
+    def _code(self, level, name):
+        codes = self._codes[level]
+        return codes.setdefault(name, len(codes))
+
+    def codes(self, make, model):
+        """``(make code, model code)`` of a make and model, -1 if not indexed"""
+        return (self._codes['make'].get(make, -1),
+                self._codes['model'].get((make, model), -1))
+
+    def _remove(self, listing_ids):
+        for listing_id in listing_ids:
+            slot = self._slots.pop(listing_id, None)
+            if slot is None:
+                continue
+            self.alive[slot] = False
+            self._dead += 1
+            self._groups.pop(('make', int(self.make[slot])), None)
+            self._groups.pop(('model', int(self.model[slot])), None)
+
+    def set_many(self, listing_ids, features, makes, models):
+        """Index (or re-index) listings from ``encode`` output"""
+        with self._lock:
+            self._remove(listing_ids)
+            start = self._size
+            self._grow(start + len(listing_ids))
+            self._size += len(listing_ids)
+            end = self._size
+            self.listing[start:end] = listing_ids
+            self.features[start:end] = features
+            self.sqnorm[start:end] = np.einsum('ij,ij->i', features, features)
+            self.alive[start:end] = True
+            for slot, listing_id, make, model in zip(
+                    range(start, end), listing_ids, makes, models):
+                self._slots[listing_id] = slot
+                for level, name in (('make', make), ('model', model)):
+                    code = self._code(level, name)
+                    getattr(self, level)[slot] = code
+                    self._members[level][code].append(slot)
+                    self._groups.pop((level, code), None)
+            if self._dead > 1024 and self._dead > len(self):
+                self._compact()
+
+    def remove(self, listing_ids):
+        with self._lock:
+            self._remove(listing_ids)
+
+    def _compact(self):
+        live = np.flatnonzero(self.alive[:self._size])
+        arrays = [array[live] for array in (
+            self.listing, self.features, self.sqnorm, self.make, self.model)]
+        codes = self._codes
+        self._reset()
+        self._codes = codes
+        self._grow(len(live))
+        self._size = len(live)
+        (self.listing[:self._size], self.features[:self._size], self.sqnorm[:self._size],
+         self.make[:self._size], self.model[:self._size]) = arrays
+        self.alive[:self._size] = True
+        for slot, listing_id in enumerate(self.listing[:self._size].tolist()):
+            self._slots[listing_id] = slot
+        for level in ('make', 'model'):
+            for slot, code in enumerate(getattr(self, level)[:self._size].tolist()):
+                self._members[level][code].append(slot)
+
+    def _group(self, level, code):
+        """
+        ``(slots, features, sqnorm, model codes)`` of a make or model's live
+        rows, or of every slot (dead ones included) for level ``'all'``.
+        """
+        if level == 'all':
+            size = self._size
+            return (np.arange(size), self.features[:size], self.sqnorm[:size],
+                    self.model[:size])
+        group = self._groups.get((level, code))
+        if group is None:
+            slots = np.fromiter(self._members[level].get(code, ()), dtype=np.int64)
+            slots = slots[self.alive[slots]]
+            self._members[level][code] = slots.tolist()
+            group = self._groups[(level, code)] = (
+                slots, np.ascontiguousarray(self.features[slots]),
+                self.sqnorm[slots], self.model[slots])
+        return group
+
+    def prepare(self):
+        """Materialize every model and make group ahead of the first queries"""
+        with self._lock:
+            for level in ('make', 'model'):
+                for code in list(self._members[level]):
+                    self._group(level, code)
+
+    def _widen(self, query, qsq, found, level, make_code, model_code, n, metric):
+        """
+        Merge into ``found`` (scores, slots) the better candidates of a
+        level's rows outside the previous level: other models of the make,
+        or other makes.
+        """
+        model_penalty, make_penalty = PENALTIES[metric]
+        best, best_slots = found
+        limit = best[-1] if len(best) == n else np.inf
+        if level == 'make':
+            slots, features, sqnorm, models = self._group('make', make_code)
+            outside, penalty = models != model_code, model_penalty
+        else:
+            slots, features, sqnorm, _ = self._group('all', None)
+            outside = (self.make[:self._size] != make_code) & self.alive[:self._size]
+            penalty = make_penalty
+        distances = _distances(features, sqnorm, query[None], qsq[None], metric)[0]
+        candidates = np.flatnonzero(outside & (distances + penalty < limit))
+        scores = np.concatenate([best, distances[candidates] + penalty])
+        slots = np.concatenate([best_slots, slots[candidates]])
+        keep = _top(scores, n)
+        return scores[keep], slots[keep]
+
+    def search(self, queries, make, model, n, metric='euclidean'):
+        """
+        The ``n`` nearest listings of each row of ``queries`` (features of
+        listings that all have ``make`` and ``model``), as one
+        ``[(listing_id, score), ...]`` list per query, best first.
+        """
+        if metric not in PENALTIES:
+            raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, DIMENSIONS)
+        qsq = np.einsum('ij,ij->i', queries, queries)
+        model_penalty, make_penalty = PENALTIES[metric]
+        empty = (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+        results = []
+        with self._lock:
+            make_code, model_code = self.codes(make, model)
+            found = [empty] * len(queries)
+            if model_code >= 0:
+                # One matrix product for the whole batch
+                slots, features, sqnorm, _ = self._group('model', model_code)
+                scores = _distances(features, sqnorm, queries, qsq, metric)
+                top = _top(scores, n)
+                found = [(scores[i, top[i]], slots[top[i]]) for i in range(len(queries))]
+            for i, query in enumerate(queries):
+                # Other levels only while they may hold a better candidate
+                for level, penalty in (('make', model_penalty), ('all', make_penalty)):
+                    best = found[i][0]
+                    if len(best) == n and best[-1] <= penalty:
+                        break
+                    if level == 'make' and make_code < 0:
+                        continue
+                    found[i] = self._widen(query, qsq[i], found[i], level,
+                                           make_code, model_code, n, metric)
+                scores, slots = found[i]
+                results.append(list(zip(self.listing[slots].tolist(), scores.tolist())))
+        return results
+
+
+def listing_row(listing):
+    """The ``FIELDS`` values of a listing with its car, as ``encode`` takes them"""
+    car = listing.car
+    return (car.make, car.model, car.year, car.mileage, car.fuel_type,
+            car.transmission, car.engine_size, listing.price)
+
+
+def _rows(queryset, *extra):
+    return queryset.order_by().values_list('pk', 'status', *FIELDS, *extra)
+
+
+def _apply(index, rows):
+    available = [row for row in rows if row[1] == 'available']
+    index.remove([row[0] for row in rows if row[1] != 'available'])
+    if available:
+        features, makes, models = encode([row[2:] for row in available])
+        index.set_many([row[0] for row in available], features, makes, models)
+
+
+def load(index, since=None, overlap=0, chunk_size=20000):
+    """
+    Index the listings updated at or after ``since`` less ``overlap``
+    seconds (all when None), dropping those no longer available. Returns
+    the latest ``updated_at`` seen, never before ``since``.
+    """
+    from .models import CarListing
+
+    listings = CarListing.objects.all()
+    if since is not None:
+        # updated_at is stamped before commit: a listing committed after
+        # the last load may be stamped before its watermark
+        listings = listings.filter(updated_at__gte=since - timedelta(seconds=overlap))
+    latest = since
+    chunk = []
+    for row in _rows(listings, 'updated_at').iterator(chunk_size=chunk_size):
+        chunk.append(row[:-1])
+        if latest is None or row[-1] > latest:
+            latest = row[-1]
+        if len(chunk) >= chunk_size:
+            _apply(index, chunk)
+            chunk = []
+    _apply(index, chunk)
+    return latest
+
+
+class SimilarListings:
+    """The process's similarity index and the queries made against it"""
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval or _setting(
+            'SIMILAR_LISTINGS_REFRESH_INTERVAL', 30)
+        self.refresh_overlap = _setting('SIMILAR_LISTINGS_REFRESH_OVERLAP', 60)
+        self._load_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self.index = None
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self.queries = 0
+        self.last_query_ms = 0.0
+        self.max_query_ms = 0.0
+
+    def _ensure_index(self):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._load_lock:
+            if self.index is None:
+                index = SimilarityIndex()
+                self._watermark = load(index)
+                index.prepare()
+                self.index = index
+                self._refreshed_at = time.monotonic()
+            elif time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                # Listings saved by other processes since the last load
+                self._watermark = load(self.index, since=self._watermark,
+                                       overlap=self.refresh_overlap)
+                self._refreshed_at = time.monotonic()
+        return self.index
+
+    def listings_changed(self, listing_ids):
+        """Re-index committed changes to listings made in this process"""
+        from .models import CarListing
+
+        if self.index is None or self._pid != os.getpid():
+            return
+        rows = list(_rows(CarListing.objects.filter(pk__in=listing_ids)))
+        self.index.remove(set(listing_ids) - {row[0] for row in rows})
+        _apply(self.index, rows)
+
+    def listings_deleted(self, listing_ids):
+        if self.index is not None and self._pid == os.getpid():
+            self.index.remove(listing_ids)
+
+    def similar_many(self, listings, n=10, metric='euclidean'):
+        """
+        ``{listing id: [(listing id, score), ...]}`` with the ``n`` most
+        similar available listings of each of ``listings`` (with their
+        cars), searched in one batch per model.
+        """
+        index = self._ensure_index()
+        by_model = defaultdict(list)
+        for listing in listings:
+            by_model[(listing.car.make, listing.car.model)].append(listing)
+        results = {}
+        for (make, model), group in by_model.items():
+            features, _, _ = encode([listing_row(listing) for listing in group])
+            start = time.perf_counter()
+            found = index.search(features, make, model, n + 1, metric)
+            elapsed = (time.perf_counter() - start) * 1000 / len(group)
+            self.queries += len(group)
+            self.last_query_ms = elapsed
+            self.max_query_ms = max(self.max_query_ms, elapsed)
+            for listing, neighbours in zip(group, found):
+                results[listing.pk] = [
+                    (listing_id, score) for listing_id, score in neighbours
+                    if listing_id != listing.pk][:n]
+        return results
+
+    def similar(self, listing, n=10, metric='euclidean'):
+        """The ``n`` most similar available listings, as ``ListingSummary`` rows"""
+        from .models import ListingSummary
+
+        # Over-fetch: listings deleted by other processes are dropped below
+        neighbours = self.similar_many([listing], n + 5, metric)[listing.pk]
+        # By primary key only; a status filter lets planners pick its index
+        summaries = ListingSummary.objects.in_bulk(
+            [listing_id for listing_id, _ in neighbours])
+        found = [summaries.get(listing_id) for listing_id, _ in neighbours]
+        return [summary for summary in found
+                if summary is not None and summary.status == 'available'][:n]
+
+    def metrics(self):
+        """Index size and query latency figures for monitoring"""
+        return {
+            'indexed_listings': len(self.index) if self.index is not None else 0,
+            'queries': self.queries,
+            'last_query_ms': round(self.last_query_ms, 3),
+            'max_query_ms': round(self.max_query_ms, 3),
+        }
+
+
+recommender = SimilarListings()
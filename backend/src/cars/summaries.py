@@ -0,0 +1,141 @@
+"""
+Maintenance of the ``ListingSummary`` read model.
+
+The row for a listing is rewritten whenever the listing is saved, car and
+seller attributes are pushed to all affected rows when those change (the
+seller's rating by ``accounts.ratings``), and the favorites/messages/reports
+counters are adjusted by one as related rows are created or deleted (see
+``cars.signals``). ``rebuild`` recomputes rows from the source tables in
+batches, optionally only reporting differences.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from accounts import ratings
+
+from .models import CarListing, ListingSummary
+
+CAR_FIELDS = ('make', 'model', 'year', 'mileage', 'fuel_type',
+              'transmission', 'color', 'engine_size')
+LISTING_FIELDS = ('seller_id', 'price', 'location', 'place_id', 'status',
+                  'views', 'created_at')
+COUNTER_FIELDS = ('favorites_count', 'messages_count', 'reports_count')
+SUMMARY_FIELDS = (CAR_FIELDS + LISTING_FIELDS + ('seller_username', 'seller_rating')
+                  + COUNTER_FIELDS)
+
+
+def summary_values(listing):
+    """Attribute values of the summary row for ``listing`` (no counters)"""
+    values = {field: getattr(listing.car, field) for field in CAR_FIELDS}
+    values.update({field: getattr(listing, field) for field in LISTING_FIELDS})
+    values['seller_username'] = listing.seller.username
+    values['seller_rating'] = ratings.rating_of(listing.seller)
+    return values
+
+
+def sync_listing(listing):
+    """Create or refresh the summary row of ``listing``"""
+    ListingSummary.objects.update_or_create(
+        listing_id=listing.pk, defaults=summary_values(listing))
+
+
+def sync_car(car):
+    """Push the attributes of ``car`` to the summaries of its listings"""
+    ListingSummary.objects.filter(listing__car_id=car.pk).update(
+        **{field: getattr(car, field) for field in CAR_FIELDS})
+
+
+def sync_seller(user):
+    """Push a changed username to the summaries of the user's listings"""
+    (ListingSummary.objects
+     .filter(seller_id=user.pk)
+     .exclude(seller_username=user.username)
+     .update(seller_username=user.username))
+
+
+def adjust(listing_id, field, delta):
+    """Add ``delta`` to one of the counters of a listing's summary"""
+    if listing_id is None:
+        return
+    ListingSummary.objects.filter(listing_id=listing_id).update(
+        **{field: F(field) + delta})
+
+
+def _count(model, fk):
+    rows = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by().values(fk).annotate(c=Count('pk')).values('c')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def with_counters(queryset):
+    """Annotate listings with the counters a summary row should hold"""
+    return queryset.annotate(
+        expected_favorites=_count(apps.get_model('cars', 'Favorite'), 'listing'),
+        expected_messages=_count(apps.get_model('messaging', 'Message'), 'listing'),
+        expected_reports=_count(apps.get_model('moderation', 'Report'),
+                                'reported_listing'),
+    )
+
+
+def expected_summary(listing):
+    """Unsaved summary row computed from an annotated listing"""
+    return ListingSummary(
+        listing_id=listing.pk,
+        favorites_count=listing.expected_favorites,
+        messages_count=listing.expected_messages,
+        reports_count=listing.expected_reports,
+        **summary_values(listing),
+    )
+
+
+def rebuild(batch_size=1000, check_only=False, on_mismatch=None):
+    """
+    Compare every summary row with the source tables, fixing differences
+    unless ``check_only``. ``on_mismatch(listing_id, fields)`` is called for
+    each row that is missing (``fields`` is None) or differs.
+
+    Returns ``(checked, missing, stale)``.
+    """
+    checked = missing = stale = 0
+    last_pk = 0
+    while True:
+        listings = list(
+            with_counters(CarListing.objects.filter(pk__gt=last_pk))
+            .select_related('car', 'seller', 'seller__seller_profile')
+            .order_by('pk')[:batch_size]
+        )
+        if not listings:
+            break
+        last_pk = listings[-1].pk
+
+        current = ListingSummary.objects.in_bulk([l.pk for l in listings])
+        to_create, to_update = [], []
+        for listing in listings:
+            expected = expected_summary(listing)
+            existing = current.get(listing.pk)
+            if existing is None:
+                missing += 1
+                to_create.append(expected)
+                if on_mismatch:
+                    on_mismatch(listing.pk, None)
+                continue
+            differing = [field for field in SUMMARY_FIELDS
+                         if getattr(existing, field) != getattr(expected, field)]
+            if differing:
+                stale += 1
+                to_update.append(expected)
+                if on_mismatch:
+                    on_mismatch(listing.pk, differing)
+
+        checked += len(listings)
+        if not check_only:
+            with transaction.atomic():
+                ListingSummary.objects.bulk_create(to_create, batch_size=batch_size)
+                ListingSummary.objects.bulk_update(
+                    to_update, SUMMARY_FIELDS, batch_size=batch_size)
+
+    return checked, missing, stale
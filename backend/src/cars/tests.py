@@ -1,3 +1,755 @@
-from django.test import TestCase
+import math
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from analytics.models import Analytics
+from analytics.sketches import top_items
+from carzone.instrumentation import registry
+from carzone.pagination import MAX_PAGE_SIZE, CursorPaginator, InvalidCursor, page_size_from
+
+from messaging.models import Message
+from moderation.models import Report
+
+from . import facets, fulltext, geo, pricestats, similarity, summaries, trending
+from .counters import ViewCounter
+from .models import (
+    Car, CarListing, Favorite, ListingFacetCount, ListingSummary, PriceStatistics,
+    TrendingScore,
+)
+from .search import SUMMARY_PATHS, ListingSearch, SearchError
+from .services import update_listings
+from .similarity import SimilarListings
+
+User = get_user_model()
+
+
+def make_user(name='seller', **fields):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='secret', **fields)
+
+
+def make_car(make='Toyota', model='Corolla', year=2018, mileage=42000, **fields):
+    fields = {'fuel_type': 'petrol', 'transmission': 'automatic', 'color': 'Blue',
+              'engine_size': '1.8L', **fields}
+    return Car.objects.create(make=make, model=model, year=year, mileage=mileage, **fields)
+
+
+def make_listing(seller, car=None, price=12000, location='Boston, MA', **fields):
+    return CarListing.objects.create(
+        car=car or make_car(), seller=seller, price=Decimal(price),
+        description=fields.pop('description', 'Clean car, one owner'),
+        location=location, **fields)
+
+
+def normalized(result):
+    total, counts = result
+    return total, {facet: sorted(entries) for facet, entries in counts.items()}
+
+
+class FacetCountTests(TestCase):
+    """The maintained facet counts match a recount after every kind of change"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.toyota = make_listing(cls.seller)
+        cls.honda = make_listing(cls.seller, make_car('Honda', 'Civic', 2020), price=18500,
+                                 location='Denver, CO')
+        make_listing(cls.seller, make_car('Honda', 'Accord', 2015, 120000), price=9000)
+
+    def assertConsistent(self):
+        stored = list(ListingFacetCount.objects.order_by().values_list(
+            'scope', 'scope_value', 'facet', 'value', 'count'))
+        stored = {tuple(row[:4]): row[4] for row in stored if row[4]}
+        facets.rebuild()
+        rebuilt = dict(((row[:4]), row[4]) for row in ListingFacetCount.objects.values_list(
+            'scope', 'scope_value', 'facet', 'value', 'count'))
+        self.assertEqual(stored, rebuilt)
+        for filters in ({}, {'make': 'Honda'}, {'location': 'Boston, MA'}, {'price_band': 3}):
+            search = ListingSearch(**filters)
+            self.assertEqual(
+                normalized(search.facets()),
+                normalized(facets.summarize(
+                    facets.grouped_counts(search.queryset(), SUMMARY_PATHS))))
+
+    def test_counts_are_marginal(self):
+        total, counts = facets.facet_counts()
+        self.assertEqual(total, 3)
+        self.assertEqual(dict((value, n) for value, _, n in counts['make']),
+                         {'Honda': 2, 'Toyota': 1})
+        self.assertEqual(facets.facet_counts('make', 'Honda')[0], 2)
+        # One row per scope, facet and value, not per listing
+        self.assertLessEqual(ListingFacetCount.objects.filter(scope='').count(), 3 * 8)
+
+    def test_save_and_delete(self):
+        self.toyota.price = Decimal(31000)
+        self.toyota.location = 'Denver, CO'
+        self.toyota.save()
+        self.assertConsistent()
+        self.honda.status = 'sold'
+        self.honda.save()
+        self.assertEqual(facets.facet_counts('make', 'Honda')[0], 1)
+        self.toyota.delete()
+        self.assertConsistent()
+        self.assertEqual(facets.facet_counts()[0], 1)
+
+    def test_car_change(self):
+        car = self.toyota.car
+        car.make, car.mileage = 'Mazda', 5000
+        car.save()
+        self.assertEqual(facets.facet_counts('make', 'Mazda')[0], 1)
+        self.assertEqual(facets.facet_counts('make', 'Toyota')[0], 0)
+        self.assertConsistent()
+
+    def test_bulk_update(self):
+        update_listings(CarListing.objects.filter(car__make='Honda'), status='sold')
+        self.assertEqual(facets.facet_counts()[0], 1)
+        update_listings(CarListing.objects.all(), status='available', price=Decimal(45000))
+        self.assertEqual(facets.facet_counts('price', '6')[0], 3)
+        self.assertConsistent()
+
+    def test_search_reads_maintained_counts(self):
+        self.assertEqual(ListingSearch(make='Honda').facet_scope(), ('make', 'Honda'))
+        self.assertEqual(ListingSearch().facet_scope(), ('', ''))
+        self.assertIsNone(ListingSearch(make='Honda', location='Boston, MA').facet_scope())
+        self.assertIsNone(ListingSearch(min_year=2016).facet_scope())
+        total, counts = ListingSearch(make='Honda', min_year=2016).facets()
+        self.assertEqual(total, 1)
+        self.assertEqual([value for value, _, _ in counts['model']], ['Civic'])
+
+
+# Search requests queue a SearchLog write for a background thread
+@mock.patch('cars.views.log_search')
+class SearchParamTests(TestCase):
+
+    def test_non_finite_prices_are_rejected(self, log_search):
+        for value in ('NaN', 'Infinity', '-inf', 'sNaN'):
+            with self.assertRaises(SearchError):
+                ListingSearch.from_params({'min_price': value})
+            response = self.client.get('/api/cars/search/', {'max_price': value})
+            self.assertEqual(response.status_code, 400)
+
+    def test_bad_band(self, log_search):
+        response = self.client.get('/api/cars/search/', {'price_band': 99})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_endpoint(self, log_search):
+        seller = make_user()
+        make_listing(seller)
+        response = self.client.get('/api/cars/search/', {'make': 'Toyota'})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['total'], 1)
+        self.assertEqual(ListingSummary.objects.count(), 1)
+        log_search.assert_called_once()
+
+
+class CursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = make_user()
+        car = make_car()
+        cls.listings = [make_listing(seller, car, price=10000 + 500 * (i % 3)) for i in range(7)]
+        # Ties on the leading sort key are broken by id
+        CarListing.objects.update(created_at=timezone.now())
+
+    def walk(self, ordering, page_size):
+        paginator = CursorPaginator(CarListing.objects.all(), ordering=ordering,
+                                    page_size=page_size)
+        seen, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            seen += [listing.pk for listing in page]
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once(self):
+        ids = [listing.pk for listing in self.listings]
+        for ordering, expected in (
+            (('-created_at', '-id'), sorted(ids, reverse=True)),
+            (('price', 'id'), [listing.pk for listing in
+                               sorted(self.listings, key=lambda l: (l.price, l.pk))]),
+        ):
+            for page_size in (1, 3, 7, 8):
+                self.assertEqual(self.walk(ordering, page_size), expected)
+
+    def test_last_page_has_no_cursor(self):
+        page = CursorPaginator(CarListing.objects.all(), page_size=7).page()
+        self.assertEqual(len(page), 7)
+        self.assertIsNone(page.next_cursor)
+        empty = CursorPaginator(CarListing.objects.none()).page()
+        self.assertEqual((len(empty), empty.has_next), (0, False))
+
+    def test_bad_cursors(self):
+        paginator = CursorPaginator(CarListing.objects.all(), page_size=2)
+        other = CursorPaginator(CarListing.objects.all(), ordering=('price', 'id'), page_size=2)
+        for cursor in ('not-a-cursor', other.page().next_cursor, 'W10',
+                       paginator.encode(['yesterday', 1])):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+        with self.assertRaises(ValueError):
+            CursorPaginator(CarListing.objects.all(), ordering=('-created_at',))
+
+    def test_page_size(self):
+        factory = RequestFactory()
+        self.assertEqual(page_size_from(factory.get('/')), 20)
+        self.assertEqual(page_size_from(factory.get('/', {'page_size': 0})), 1)
+        self.assertEqual(page_size_from(factory.get('/', {'page_size': 10 ** 6})), MAX_PAGE_SIZE)
+        with self.assertRaisesMessage(ValueError, 'page_size must be an integer'):
+            page_size_from(factory.get('/', {'page_size': 'ten'}))
+
+    @mock.patch('cars.views.log_search')
+    def test_search_pages(self, log_search):
+        seen, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get('/api/cars/search/', {'page_size': 3, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.json()['results']]
+            cursor = response.json()['next_cursor']
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), 7)
+        for params in ({'page_size': 'x'}, {'cursor': 'garbage'}):
+            response = self.client.get('/api/cars/search/', params)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            self.client.get('/api/cars/trending/', {'page_size': 'x'}).json(),
+            {'error': 'page_size must be an integer.'})
+
+
+class ViewCounterTests(TestCase):
+
+    def setUp(self):
+        seller = make_user()
+        self.listing = make_listing(seller)
+        self.other = make_listing(seller, make_car('Honda', 'Civic'))
+        # Long enough that only the explicit flushes below write
+        self.counter = ViewCounter(flush_interval=3600, max_pending=10 ** 6)
+
+    def test_flush_applies_buffered_views(self):
+        for _ in range(3):
+            self.counter.record(self.listing.pk)
+        self.counter.record(self.other.pk, count=2)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 0)
+        self.assertEqual(self.counter.metrics()['pending_views'], 5)
+
+        self.assertEqual(self.counter.flush(), 5)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 3)
+        self.assertEqual(ListingSummary.objects.get(listing=self.other).views, 2)
+        analytics = Analytics.objects.get(date=timezone.localdate())
+        self.assertEqual(analytics.total_views, 5)
+        self.assertEqual(top_items(analytics.top_models, 2),
+                         [('Toyota Corolla', 3), ('Honda Civic', 2)])
+        self.assertEqual(self.counter.metrics()['pending_views'], 0)
+        self.assertEqual(self.counter.flush(), 0)
+
+    def test_failed_flush_keeps_views(self):
+        self.counter.record(self.listing.pk, count=4)
+        with mock.patch.object(Analytics, 'get_or_create_for_date', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.counter.flush()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 0)
+        self.assertEqual(self.counter.metrics()['failed_flushes'], 1)
+        self.assertEqual(self.counter.flush(), 4)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 4)
+
+
+class ListingSummaryTests(TestCase):
+
+    def setUp(self):
+        self.seller = make_user()
+        self.buyer = make_user('buyer')
+        self.listing = make_listing(self.seller)
+
+    def assertInSync(self):
+        mismatches = []
+        checked, missing, stale = summaries.rebuild(
+            check_only=True, on_mismatch=lambda pk, fields: mismatches.append((pk, fields)))
+        self.assertEqual((missing, stale, mismatches), (0, 0, []))
+        return checked
+
+    def summary(self):
+        return ListingSummary.objects.get(listing=self.listing)
+
+    def test_follows_listing_car_and_seller(self):
+        self.listing.price = Decimal('9999.50')
+        self.listing.status = 'pending'
+        self.listing.save()
+        car = self.listing.car
+        car.color = 'Red'
+        car.save(update_fields=['color'])
+        self.seller.username = 'renamed'
+        self.seller.save()
+        summary = self.summary()
+        self.assertEqual((summary.price, summary.status, summary.color, summary.seller_username),
+                         (Decimal('9999.50'), 'pending', 'Red', 'renamed'))
+        self.assertEqual(self.assertInSync(), 1)
+
+    def test_counters(self):
+        favorite = Favorite.objects.create(user=self.buyer, listing=self.listing)
+        Message.objects.create(sender=self.buyer, receiver=self.seller,
+                               listing=self.listing, content='Still available?')
+        self.assertEqual((self.summary().favorites_count, self.summary().messages_count), (1, 1))
+        favorite.delete()
+        self.assertEqual(self.summary().favorites_count, 0)
+        report = Report.objects.create(reporter=self.buyer, reported_listing=self.listing,
+                                       reason='spam')
+        other = make_listing(self.seller)
+        # Moved to another listing, then to the seller alone
+        for listing, counts in ((other, (0, 1)), (None, (0, 0))):
+            report.reported_listing, report.reported_user = listing, self.seller
+            report.save()
+            self.assertEqual(tuple(ListingSummary.objects.get(listing=pk).reports_count
+                                   for pk in (self.listing, other)), counts)
+        self.assertInSync()
+
+    def test_bulk_update_and_delete(self):
+        other = make_listing(self.seller, make_car('Honda', 'Civic'))
+        update_listings(CarListing.objects.all(), price=Decimal(15000), location='Denver, CO')
+        self.assertEqual(set(ListingSummary.objects.values_list('price', 'location')),
+                         {(Decimal(15000), 'Denver, CO')})
+        self.assertInSync()
+        other.delete()
+        self.assertEqual(ListingSummary.objects.count(), 1)
+
+    def test_rebuild_repairs(self):
+        ListingSummary.objects.update(price=1, favorites_count=5)
+        make_listing(self.seller)
+        ListingSummary.objects.filter(listing__price=12000).exclude(listing=self.listing).delete()
+        self.assertEqual(summaries.rebuild(), (2, 1, 1))
+        self.assertInSync()
+
+
+@mock.patch('cars.views.log_search')
+class FullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = make_user('dealer')
+        cls.corolla = make_listing(seller, description='Low mileage, new tyres')
+        cls.civic = make_listing(seller, make_car('Honda', 'Civic'), location='Denver, CO',
+                                 description='Sunroof and leather seats')
+
+    def search(self, **params):
+        response = self.client.get('/api/cars/search/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_queries(self, log_search):
+        # Both backends: every word must match, the last one as a prefix
+        self.assertEqual(fulltext.fts5_query('leather den'), '"leather" "den"*')
+        self.assertEqual(fulltext.pg_tsquery("leather' den"), "'leather' & 'den':*")
+        self.assertIsNone(fulltext.pg_tsquery('-- !'))
+
+    def test_matches_and_ranks(self, log_search):
+        self.assertEqual(self.search(q='toyo'), [self.corolla.pk])
+        self.assertEqual(self.search(q='leather denver'), [self.civic.pk])
+        self.assertEqual(self.search(q='honda', make='Toyota'), [])
+
+    def test_index_follows_changes(self, log_search):
+        self.civic.description = 'Panoramic roof'
+        self.civic.save()
+        self.assertEqual(self.search(q='leather'), [])
+        self.assertEqual(self.search(q='panoramic'), [self.civic.pk])
+        self.civic.delete()
+        self.assertEqual(self.search(q='panoramic'), [])
+
+    def test_text_without_words(self, log_search):
+        for q in ('"', '*', '-- !'):
+            self.assertEqual(self.search(q=q), [])
+            self.assertEqual(self.search(q=q, sort='relevance'), [])
+            self.assertFalse(fulltext.matching(CarListing.objects.all(), q).exists())
+
+    def test_admin_search(self, log_search):
+        admin = User.objects.create_superuser(
+            username='root', email='root@example.com', password='secret')
+        self.client.force_login(admin)
+        for q in ('*', 'sunroof', 'dealer@example.com', 'Deal'):
+            response = self.client.get('/admin/cars/carlisting/', {'q': q})
+            self.assertEqual(response.status_code, 200)
+        self.assertContains(
+            self.client.get('/admin/cars/carlisting/', {'q': 'sunroof'}), '1 result')
+        # Sellers match by the start of their username or email
+        response = self.client.get('/admin/cars/carlisting/', {'q': 'deal'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+
+@mock.patch('cars.views.log_search')
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        seller = make_user()
+        for _ in range(3):
+            make_listing(seller)
+
+    def test_server_timing_and_totals(self, log_search):
+        response = self.client.get('/api/cars/search/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('queries', response['Server-Timing'])
+        self.assertEqual(registry.requests[('cars:listing-search', 'GET', '200')], 1)
+        self.assertGreater(registry.queries['cars:listing-search'], 0)
+
+    @override_settings(REQUEST_METRICS_DUPLICATE_THRESHOLD=2)
+    def test_repeated_statements_are_flagged(self, log_search):
+        listing = CarListing.objects.first()
+        # The same lookup three times, as a loop over related rows would
+        repeat = mock.patch('cars.views.serialize_listing', side_effect=lambda l: {
+            'ids': [CarListing.objects.get(pk=listing.pk).pk for _ in range(3)]})
+        # Buffered process-wide; keep this view out of the shared counters
+        no_views = mock.patch.object(CarListing, 'increment_views')
+        with repeat, no_views, self.assertLogs('carzone.instrumentation', 'WARNING'):
+            response = self.client.get(f'/api/cars/listings/{listing.pk}/')
+        self.assertIn('nplus1', response['Server-Timing'])
+        self.assertEqual(registry.n_plus_one['cars:listing-detail'], 1)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests(self, log_search):
+        response = self.client.get('/api/cars/search/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(sum(registry.requests.values()), 0)
+
+    def test_metrics_view_renders_providers(self, log_search):
+        registry.register_provider('carzone_test', lambda: {'depth': 3, 'state': 'idle',
+                                                            'running': True})
+        self.addCleanup(registry._providers.pop, 'carzone_test')
+        self.client.get('/api/cars/search/')
+        # Staff only by default, even from loopback (as behind a proxy)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user(
+            username='ops', password='secret', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.client.logout()
+        with override_settings(REQUEST_METRICS_ALLOWED_IPS=('127.0.0.1',)):
+            body = self.client.get('/metrics').content.decode()
+        self.assertIn('carzone_requests_total{view="cars:listing-search",method="GET",'
+                      'status="200"} 1', body)
+        self.assertIn('carzone_test_depth 3', body)
+        self.assertNotIn('carzone_test_state', body)
+        self.assertNotIn('carzone_test_running', body)
+        # Registered by the apps' AppConfig.ready
+        for prefix in ('carzone_view_counter_', 'carzone_search_log_queue_',
+                       'carzone_saved_search_notifier_', 'carzone_risk_scorer_'):
+            self.assertIn(prefix, body)
+
+
+# Dirty groups are refreshed on commit, which TestCase never reaches
+@mock.patch.object(pricestats, 'mark_dirty', side_effect=pricestats.refresh)
+class PriceStatisticsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.key = ('Toyota', 'Corolla', 2018, 'petrol')
+        cls.listings = [make_listing(cls.seller, price=price)
+                        for price in (10000, 12000, 14000, 20000)]
+        pricestats.rebuild()
+
+    def assertConsistent(self):
+        stored = {pricestats.car_key(row): row for row in PriceStatistics.objects.all()}
+        rebuilt = pricestats.compute(pricestats.price_rows(CarListing.objects.all()))
+        self.assertEqual(stored.keys(), rebuilt.keys())
+        for key, values in rebuilt.items():
+            for field, value in values.items():
+                self.assertEqual(getattr(stored[key], field), value, (key, field))
+
+    def test_statistics(self, mark_dirty):
+        statistics = pricestats.statistics_for(*self.key)
+        self.assertEqual(statistics.count, 4)
+        self.assertEqual((statistics.minimum, statistics.p50, statistics.maximum),
+                         (Decimal(10000), Decimal(13000), Decimal(20000)))
+        self.assertEqual(statistics.p10, Decimal(10600))
+        self.assertEqual(statistics.mean, Decimal(14000))
+        self.assertEqual(sum(statistics.histogram), 4)
+        self.assertEqual(pricestats.bucket_edges(statistics)[-1], Decimal(20000))
+        self.assertEqual(pricestats.assess(Decimal(9000), statistics), 'low')
+        self.assertEqual(pricestats.assess(Decimal(21000), statistics), 'high')
+        self.assertEqual(pricestats.percentile_rank(statistics, 12000), 25.0)
+        self.assertEqual(pricestats.percentile_rank(statistics, 25000), 100.0)
+
+    def test_listing_changes_refresh_groups(self, mark_dirty):
+        first, second = self.listings[:2]
+        first.price = Decimal(30000)
+        first.save()
+        self.assertEqual(pricestats.statistics_for(*self.key).maximum, Decimal(30000))
+        second.status = 'sold'
+        second.save()
+        self.assertEqual(pricestats.statistics_for(*self.key).count, 3)
+        make_listing(self.seller, make_car(year=2020), price=9000)
+        self.assertEqual(pricestats.statistics_for('Toyota', 'Corolla', 2020, 'petrol').count, 1)
+        first.delete()
+        self.assertConsistent()
+
+    def test_car_change_moves_listing(self, mark_dirty):
+        car = self.listings[0].car
+        car.fuel_type = 'hybrid'
+        car.save()
+        self.assertEqual(pricestats.statistics_for(*self.key).count, 3)
+        self.assertEqual(pricestats.statistics_for('Toyota', 'Corolla', 2018, 'hybrid').count, 1)
+        self.assertConsistent()
+
+    def test_bulk_update(self, mark_dirty):
+        update_listings(CarListing.objects.filter(price__lt=15000), status='sold')
+        self.assertEqual(pricestats.statistics_for(*self.key).count, 1)
+        update_listings(CarListing.objects.all(), status='sold')
+        self.assertIsNone(pricestats.statistics_for(*self.key))
+        update_listings(CarListing.objects.all(), status='available', price=Decimal(11000))
+        self.assertEqual(pricestats.statistics_for(*self.key).histogram[0], 4)
+        self.assertConsistent()
+
+    def test_endpoints(self, mark_dirty):
+        params = dict(zip(pricestats.KEY_FIELDS, self.key))
+        body = self.client.get('/api/cars/price-statistics/', params).json()
+        self.assertEqual((body['count'], body['p50']), (4, '13000.00'))
+        self.assertEqual(len(body['histogram']), 10)
+        response = self.client.get('/api/cars/price-statistics/', {**params, 'year': 'new'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/cars/price-statistics/', {'make': 'Toyota'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/cars/price-statistics/', {**params, 'year': 1990})
+        self.assertEqual(response.status_code, 404)
+        body = self.client.get(f'/api/cars/listings/{self.listings[0].pk}/price/').json()
+        self.assertEqual((body['assessment'], body['percentile']), ('low', 0.0))
+
+
+class SimilarListingsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.corolla = make_listing(cls.seller)
+        cls.twin = make_listing(cls.seller, make_car(mileage=45000), price=12500)
+        cls.camry = make_listing(cls.seller, make_car(model='Camry', mileage=40000))
+        cls.civic = make_listing(cls.seller, make_car('Honda', 'Civic', mileage=42000))
+        cls.old = make_listing(cls.seller, make_car(year=2016, mileage=60000), price=11000)
+
+    def setUp(self):
+        self.recommender = SimilarListings(refresh_interval=3600)
+
+    def neighbours(self, listing, n=10, metric='euclidean'):
+        return [pk for pk, _ in self.recommender.similar_many([listing], n, metric)[listing.pk]]
+
+    def test_nearest_by_model_then_make(self):
+        for metric in similarity.METRICS:
+            self.assertEqual(self.neighbours(self.corolla, metric=metric),
+                             [self.twin.pk, self.old.pk, self.camry.pk, self.civic.pk])
+        self.assertEqual(self.neighbours(self.corolla, n=1), [self.twin.pk])
+        self.assertEqual(similarity.parse_engine_size('1998cc'), 1.998)
+
+    def test_signals_keep_index_current(self):
+        self.recommender._ensure_index()
+        self.twin.status = 'sold'
+        with mock.patch('cars.signals.recommender', self.recommender), \
+                mock.patch('moderation.risk.scorer.submit'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.twin.save()
+        self.assertNotIn(self.twin.pk, self.neighbours(self.corolla))
+
+    def test_refresh_sees_bulk_updates(self):
+        index = similarity.SimilarityIndex()
+        watermark = similarity.load(index)
+        update_listings(CarListing.objects.filter(pk=self.twin.pk), status='sold')
+        update_listings(CarListing.objects.filter(pk=self.camry.pk), price=Decimal(90000))
+        similarity.load(index, since=watermark)
+        self.assertEqual(len(index), 4)
+        features, _, _ = similarity.encode([similarity.listing_row(
+            CarListing.objects.select_related('car').get(pk=self.corolla.pk))])
+        found = index.search(features, 'Toyota', 'Corolla', 4)[0]
+        self.assertEqual([pk for pk, _ in found],
+                         [self.corolla.pk, self.old.pk, self.civic.pk, self.camry.pk])
+
+    def test_refresh_rereads_late_commits(self):
+        self.recommender._ensure_index()
+        watermark = self.recommender._watermark
+        # Saved in another process before the last load, committed after it
+        CarListing.objects.filter(pk=self.twin.pk).update(
+            status='sold', updated_at=watermark - timedelta(seconds=5))
+        self.recommender._refreshed_at = 0.0
+        self.recommender._ensure_index()
+        self.assertNotIn(self.twin.pk, self.neighbours(self.corolla))
+        self.assertEqual(self.recommender._watermark, watermark)
+
+    def test_endpoint(self):
+        with mock.patch.object(similarity, 'recommender', self.recommender):
+            response = self.client.get(f'/api/cars/listings/{self.corolla.pk}/similar/',
+                                       {'page_size': 2, 'metric': 'cosine'})
+            self.assertEqual([row['id'] for row in response.json()['results']],
+                             [self.twin.pk, self.old.pk])
+            for params in ({'metric': 'manhattan'}, {'page_size': 'x'}):
+                response = self.client.get(
+                    f'/api/cars/listings/{self.corolla.pk}/similar/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class TrendingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user()
+        cls.boston = make_listing(cls.seller)
+        cls.denver = make_listing(cls.seller, make_car('Honda', 'Civic'), location='Denver, CO')
+
+    def setUp(self):
+        cache.clear()
+        # Flushed from the test thread instead
+        self.tracker = trending.TrendingTracker(flush_interval=3600)
+        self.tracker._ensure_worker = lambda: None
+        self.at = timezone.now()
+
+    def score(self, listing):
+        return TrendingScore.objects.get(listing=listing).score
+
+    def test_flush_adds_events(self):
+        self.tracker.record(self.boston.pk, 'view', at=self.at)
+        self.tracker.record(self.boston.pk, 'favorite', at=self.at)
+        self.assertEqual(self.tracker.flush(), 2)
+        self.tracker.record(self.boston.pk, 'message', at=self.at)
+        self.tracker.record(self.denver.pk, 'view', count=3, at=self.at)
+        self.assertEqual(self.tracker.flush(), 4)
+        self.assertAlmostEqual(self.score(self.boston), trending.log_weight(16, self.at))
+        self.assertAlmostEqual(self.score(self.denver), trending.log_weight(3, self.at))
+        self.assertAlmostEqual(trending.current_score(self.score(self.boston), self.at), 16)
+        self.assertEqual(self.tracker.metrics()['pending_events'], 0)
+
+    def test_concurrent_insert_keeps_both_increments(self):
+        self.tracker.record(self.boston.pk, 'favorite', at=self.at)
+        bulk_create = TrendingScore.objects.bulk_create
+
+        def insert_first(objs, **options):
+            # Another process flushed the same new listing in the meantime
+            TrendingScore.objects.create(listing=self.boston,
+                                         score=trending.log_weight(10, self.at))
+            return bulk_create(objs, **options)
+
+        with mock.patch.object(TrendingScore.objects, 'bulk_create', side_effect=insert_first):
+            self.tracker.flush()
+        self.assertAlmostEqual(self.score(self.boston), trending.log_weight(15, self.at))
+
+    def test_failed_flush_keeps_events(self):
+        self.tracker.record(self.boston.pk, 'view', at=self.at)
+        with mock.patch.object(trending, '_listing_rows', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.tracker.flush()
+        self.assertFalse(TrendingScore.objects.exists())
+        self.tracker.record(self.boston.pk, 'view', at=self.at)
+        self.assertEqual(self.tracker.flush(), 2)
+        self.assertAlmostEqual(self.score(self.boston), trending.log_weight(2, self.at))
+
+    def test_lists_follow_scores_and_changes(self):
+        self.tracker.record(self.boston.pk, 'view', at=self.at)
+        self.tracker.record(self.denver.pk, 'favorite', at=self.at)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tracker.flush()
+        self.assertEqual([summary.pk for summary in trending.trending()],
+                         [self.denver.pk, self.boston.pk])
+        self.assertEqual([summary.pk for summary in trending.trending(location='boston')],
+                         [self.boston.pk])
+        self.tracker.record(self.boston.pk, 'message', at=self.at)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tracker.flush()
+        self.assertEqual(trending.trending(n=1)[0].pk, self.boston.pk)
+        update_listings(CarListing.objects.filter(pk=self.boston.pk), status='sold')
+        trending.listings_changed([self.boston.pk])
+        self.assertEqual([summary.pk for summary in trending.trending()], [self.denver.pk])
+        body = self.client.get('/api/cars/trending/', {'make': 'honda'}).json()
+        self.assertEqual([row['id'] for row in body['results']], [self.denver.pk])
+        self.assertEqual(self.client.get('/api/cars/trending/',
+                                         {'page_size': 'x'}).status_code, 400)
+
+    def test_rebuild_recounts_events(self):
+        Favorite.objects.create(user=make_user('buyer'), listing=self.denver)
+        CarListing.objects.filter(pk=self.boston.pk).update(views=4)
+        self.assertEqual(trending.rebuild(), 2)
+        self.assertAlmostEqual(trending.current_score(self.score(self.boston)), 4,
+                               delta=0.1 * 4)
+        self.assertEqual(len(trending.trending()), 2)
+
+
+class GeoTests(TestCase):
+    """Location text resolves to gazetteer places (loaded by migration)"""
+
+    def setUp(self):
+        geo.reset_resolver()
+        self.seller = make_user()
+
+    def place(self, text):
+        place = geo.resolve(text)
+        return place and place.display_name
+
+    def test_resolution(self):
+        for text in ('New York, NY', 'NYC', 'new york', ' New-York ', 'new yrok'):
+            self.assertEqual(self.place(text), 'New York, NY', text)
+        self.assertEqual(self.place('Portland'), 'Portland, OR')
+        self.assertEqual(self.place('Portland, ME'), 'Portland, ME')
+        self.assertEqual(self.place('Portland Maine'), 'Portland, ME')
+        self.assertEqual(self.place('Springfield Illinois'), 'Springfield, IL')
+        self.assertEqual(self.place('Saint Louis'), 'St. Louis, MO')
+        self.assertEqual(self.place('Ft Worth'), 'Fort Worth, TX')
+        self.assertEqual(self.place('Portland, Narnia'), 'Portland, OR')
+        for text in ('', ',', 'Atlantis'):
+            self.assertIsNone(geo.resolve(text))
+
+    def test_geohash_cover(self):
+        self.assertEqual(geo.geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        lat, lon = 40.7128, -74.0060
+        cells = geo.covering_cells(lat, lon, 50)
+        self.assertLessEqual(len(cells), 16)
+        # Points on the circle in every direction fall in a covering cell
+        for bearing in range(0, 360, 15):
+            d_lat = 50 / geo.KM_PER_DEGREE * math.cos(math.radians(bearing))
+            d_lon = (50 / geo.KM_PER_DEGREE * math.sin(math.radians(bearing))
+                     / math.cos(math.radians(lat + d_lat)))
+            point = geo.geohash(lat + d_lat * 0.999, lon + d_lon * 0.999)
+            self.assertTrue(any(point.startswith(cell) for cell in cells), bearing)
+        self.assertTrue(geo.covering_cells(89.99, 0, 100))
+        self.assertTrue(geo.covering_cells(0, 179.9, 100))
+
+    def test_places_within(self):
+        found = [(place.display_name, round(distance)) for place, distance in
+                 geo.places_within(40.7128, -74.0060, 20)]
+        self.assertEqual(found, [('New York, NY', 0), ('Jersey City, NJ', 3),
+                                 ('Newark, NJ', 14)])
+        self.assertEqual(round(geo.haversine_km(42.3601, -71.0589, 40.7128, -74.0060)), 306)
+
+    def test_listings_resolve_on_save_and_in_bulk(self):
+        listing = make_listing(self.seller, location='NYC')
+        self.assertEqual(listing.place.display_name, 'New York, NY')
+        listing.location = 'Newark NJ'
+        listing.save(update_fields=['location'])
+        listing.refresh_from_db()
+        self.assertEqual(listing.place.display_name, 'Newark, NJ')
+        update_listings(CarListing.objects.filter(pk=listing.pk), location='Atlantis')
+        self.assertIsNone(ListingSummary.objects.get(listing=listing).place_id)
+        CarListing.objects.filter(pk=listing.pk).update(location='boston', place=None)
+        ListingSummary.objects.filter(listing=listing).update(location='boston')
+        self.assertEqual(geo.resolve_listings(), (1, {}))
+        self.assertEqual(ListingSummary.objects.get(listing=listing).place.name, 'Boston')
+        CarListing.objects.filter(pk=listing.pk).update(location='Atlantis', place=None)
+        self.assertEqual(geo.resolve_listings(), (0, {'Atlantis': 1}))
+
+    @mock.patch('cars.views.log_search')
+    def test_radius_search(self, log_search):
+        make_listing(self.seller, location='Jersey City, NJ')
+        make_listing(self.seller, location='Newark')
+        make_listing(self.seller, location='Boston, MA')
+        self.assertEqual(ListingSearch(near='New York').queryset().count(), 2)
+        self.assertEqual(ListingSearch(near='New York', radius_km=5).queryset().count(), 1)
+        self.assertEqual(ListingSearch(near='Springfield, MA', radius_km=150).queryset().count(), 1)
+        for params in ({'near': 'Atlantis'}, {'radius_km': 10},
+                       {'near': 'NYC', 'radius_km': 5000},
+                       {'near': 'NYC', 'radius_km': 'nan'}):
+            response = self.client.get('/api/cars/search/', params)
+            self.assertEqual(response.status_code, 400, params)
@@ -0,0 +1,429 @@
+"""
+Trending listings.
+
+A listing's trending score is the sum of the weights (``TRENDING_WEIGHTS``)
+of its recent events (page views, favorites, messages), each decayed
+exponentially with a half-life of ``TRENDING_HALF_LIFE`` hours. Scores are
+kept with forward decay: an event at time ``t`` adds
+``weight * 2 ** ((t - EPOCH) / half-life)`` instead of decaying every score
+as time passes, so stored scores never need rewriting and the order of two
+listings does not change until one of them gets new events. The decayed
+score at ``now`` is the stored one times ``2 ** -((now - EPOCH) /
+half-life)``. Scores are stored as natural logarithms so they never
+overflow, and events combine with ``logaddexp``.
+
+Events are recorded in memory by ``tracker`` (from ``increment_views`` and
+the favorite/message signals) and flushed by a background thread: the
+missing ``TrendingScore`` rows of a chunk of listings are inserted with
+``EMPTY_SCORE`` (a row another process inserts first is kept), one
+``UPDATE`` adds the buffered increments to every row of the chunk, then
+the bounded top lists of the affected locations, makes and the whole site
+are merged in the cache. Because the order only changes when a listing
+has events, merging the updated listings into a list is enough to keep it
+exact. Each list holds ``2 * TRENDING_TOP_N`` entries so listings sold or
+moved elsewhere can be dropped when read; a list that is missing or runs
+short is refilled from ``TrendingScore``, as is every list by ``rebuild``
+(the ``rebuild_trending`` command). "Trending near you" reads one cache
+key and the listed summaries by primary key.
+
+With a per-process cache backend each process keeps its own lists; use a
+shared backend (Redis, Memcached) so every process sees the same ones.
+Concurrent merges of one list by several processes can lose an entry until
+that listing's next event or the next rebuild.
+"""
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+DEFAULT_WEIGHTS = {'view': 1.0, 'favorite': 5.0, 'message': 10.0}
+# Stored score of no events: logaddexp(EMPTY_SCORE, score) == score
+EMPTY_SCORE = -1e9
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def weights():
+    return {**DEFAULT_WEIGHTS, **_setting('TRENDING_WEIGHTS', {})}
+
+
+def decay_rate():
+    """Natural-log decay per second"""
+    return math.log(2) / (_setting('TRENDING_HALF_LIFE', 24) * 3600)
+
+
+def top_n():
+    return _setting('TRENDING_TOP_N', 20)
+
+
+def log_weight(weight, at):
+    """Stored (log, forward-decayed) score of one event of ``weight`` at ``at``"""
+    return math.log(weight) + decay_rate() * (at - EPOCH).total_seconds()
+
+
+def current_score(stored, now=None):
+    """The decayed score at ``now`` of a stored score"""
+    now = now or timezone.now()
+    return math.exp(stored - decay_rate() * (now - EPOCH).total_seconds())
+
+
+def normalize_location(location):
+    """Group key of a location: "New York, NY" and "new york" are one city"""
+    return (location or '').split(',')[0].strip().lower()
+
+
+def group_keys(make, location):
+    """The top lists a listing of ``make`` at ``location`` belongs to"""
+    return [('all', ''), ('make', make.strip().lower()),
+            ('location', normalize_location(location))]
+
+
+def cache_key(group, value):
+    # Quoted: memcached keys cannot contain spaces
+    return f'trending:{group}:{quote(value)}'
+
+
+def _logaddexp(field, value):
+    """SQL ``logaddexp(field, value)`` that cannot overflow"""
+    return Greatest(F(field), value) + Ln(Value(1.0) + Exp(-Abs(F(field) - value)))
+
+
+# Top lists
+
+def _listing_rows(listing_ids):
+    from .models import TrendingScore
+
+    return list(
+        TrendingScore.objects.filter(listing_id__in=listing_ids)
+        .values_list('listing_id', 'score', 'listing__status',
+                     'listing__car__make', 'listing__location'))
+
+
+def merge(rows):
+    """
+    Merge ``(listing_id, score, status, make, location)`` rows into the
+    cached top lists of their groups; unavailable listings are removed.
+    """
+    by_key = defaultdict(list)
+    for listing_id, score, status, make, location in rows:
+        for group, value in group_keys(make, location):
+            by_key[cache_key(group, value)].append((listing_id, score, status))
+    if not by_key:
+        return 0
+    capacity = 2 * top_n()
+    lists = cache.get_many(list(by_key))
+    updated = {}
+    for key, entries in by_key.items():
+        current = lists.get(key)
+        if current is None:
+            # Filled from the scores table on its first read
+            continue
+        scores = dict(current)
+        for listing_id, score, status in entries:
+            if status == 'available':
+                scores[listing_id] = score
+            else:
+                scores.pop(listing_id, None)
+        updated[key] = sorted(scores.items(), key=lambda item: -item[1])[:capacity]
+    cache.set_many(updated, _setting('TRENDING_CACHE_TIMEOUT', None))
+    return len(updated)
+
+
+def listings_changed(listing_ids):
+    """Re-merge listings whose status, make or location may have changed"""
+    merge(_listing_rows(listing_ids))
+
+
+def _matches(group, value, make, location):
+    if group == 'make':
+        return make.strip().lower() == value
+    if group == 'location':
+        return normalize_location(location) == value
+    return True
+
+
+def fill(group, value):
+    """Recompute one top list from ``TrendingScore`` and cache it"""
+    from .models import TrendingScore
+
+    capacity = 2 * top_n()
+    scores = TrendingScore.objects.filter(listing__status='available')
+    if group == 'make':
+        scores = scores.filter(listing__car__make__iexact=value)
+    elif group == 'location':
+        scores = scores.filter(listing__location__istartswith=value)
+    entries = []
+    rows = scores.order_by('-score').values_list(
+        'listing_id', 'score', 'listing__car__make', 'listing__location')
+    for listing_id, score, make, location in rows.iterator(chunk_size=capacity * 4):
+        if _matches(group, value, make, location):
+            entries.append((listing_id, score))
+            if len(entries) >= capacity:
+                break
+    cache.set(cache_key(group, value), entries,
+              _setting('TRENDING_CACHE_TIMEOUT', None))
+    return entries
+
+
+def trending(location=None, make=None, n=None):
+    """
+    The ``n`` (default ``TRENDING_TOP_N``) top trending available listings
+    at ``location``, of ``make`` or site-wide, as ``ListingSummary`` rows
+    annotated with their current ``trending_score``.
+    """
+    from .models import ListingSummary
+
+    n = n or top_n()
+    if location:
+        group, value = 'location', normalize_location(location)
+    elif make:
+        group, value = 'make', make.strip().lower()
+    else:
+        group, value = 'all', ''
+    entries = cache.get(cache_key(group, value))
+    for _ in range(2):
+        if entries is None:
+            entries = fill(group, value)
+        summaries = ListingSummary.objects.in_bulk([pk for pk, _ in entries])
+        now = timezone.now()
+        results = []
+        for listing_id, score in entries:
+            summary = summaries.get(listing_id)
+            # Entries go stale when a listing is sold or moved elsewhere
+            if (summary is not None and summary.status == 'available'
+                    and _matches(group, value, summary.make, summary.location)):
+                summary.trending_score = current_score(score, now)
+                results.append(summary)
+        if len(results) >= n or len(entries) < 2 * top_n():
+            return results[:n]
+        entries = None
+    return results[:n]
+
+
+# Event buffer
+
+class TrendingTracker:
+    """Process-wide buffer of listing events flushed on an interval"""
+
+    chunk_size = 500
+
+    def __init__(self, flush_interval=None):
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pending = {}  # listing id -> log score increment
+        self._events = 0
+        self._thread = None
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed_events = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is None:
+            return _setting('TRENDING_FLUSH_INTERVAL', 10)
+        return self._flush_interval
+
+    def record(self, listing_id, kind, count=1, at=None):
+        """Count ``count`` events of ``kind`` (a ``weights()`` key) on a listing"""
+        increment = log_weight(weights()[kind] * count, at or timezone.now())
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            previous = self._pending.get(listing_id)
+            self._pending[listing_id] = (increment if previous is None
+                                         else np.logaddexp(previous, increment))
+            self._events += count
+            self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='trending-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing trending scores failed")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Add buffered events to the scores and top lists; returns the events written"""
+        from .models import TrendingScore
+
+        with self._flush_lock:
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+                pending, self._pending = self._pending, {}
+                events, self._events = self._events, 0
+            if not pending:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    ids = list(pending)
+                    for i in range(0, len(ids), self.chunk_size):
+                        chunk = ids[i:i + self.chunk_size]
+                        existing = set(TrendingScore.objects.filter(
+                            listing_id__in=chunk).values_list('listing_id', flat=True))
+                        # Rows a concurrent flush inserts first are kept and
+                        # added to below like any other
+                        TrendingScore.objects.bulk_create(
+                            [TrendingScore(listing_id=pk, score=EMPTY_SCORE)
+                             for pk in chunk if pk not in existing],
+                            ignore_conflicts=True)
+                        increment = Case(
+                            *[When(listing_id=pk, then=Value(float(pending[pk])))
+                              for pk in chunk],
+                            output_field=FloatField(),
+                        )
+                        TrendingScore.objects.filter(listing_id__in=chunk).update(
+                            score=_logaddexp('score', increment),
+                            updated_at=timezone.now())
+                    rows = _listing_rows(ids)
+                transaction.on_commit(lambda: merge(rows))
+            except Exception:
+                # Put the events back for the next flush
+                with self._lock:
+                    for pk, increment in pending.items():
+                        previous = self._pending.get(pk)
+                        self._pending[pk] = (increment if previous is None
+                                             else np.logaddexp(previous, increment))
+                    self._events += events
+                self.failed_flushes += 1
+                raise
+
+            elapsed = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.flushed_events += events
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            return events
+
+    def metrics(self):
+        """Backlog and flush latency figures for monitoring"""
+        with self._lock:
+            pending_events = self._events
+            pending_listings = len(self._pending)
+        return {
+            'pending_events': pending_events,
+            'pending_listings': pending_listings,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'flushed_events': self.flushed_events,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+        }
+
+
+tracker = TrendingTracker()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        tracker.flush()
+    except Exception:
+        logger.exception("Flushing trending scores at exit failed")
+
+
+# Full recomputation
+
+def _log_sums(listing_ids, logs):
+    """``(listing ids, logsumexp of their logs)``, vectorised per listing"""
+    order = np.argsort(listing_ids, kind='stable')
+    listing_ids, logs = listing_ids[order], logs[order]
+    starts = np.flatnonzero(np.r_[True, listing_ids[1:] != listing_ids[:-1]])
+    peaks = np.maximum.reduceat(logs, starts)
+    counts = np.diff(np.r_[starts, len(logs)])
+    sums = np.add.reduceat(np.exp(logs - np.repeat(peaks, counts)), starts)
+    return listing_ids[starts], peaks + np.log(sums)
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute every score from favorites and messages at their times and
+    each listing's view total at its creation time (view times are not
+    kept), then refill the cached top lists. Returns the number of scores.
+    """
+    from messaging.models import Message
+
+    from .models import CarListing, Favorite, TrendingScore
+
+    kinds = weights()
+    rate = decay_rate()
+    sources = (
+        (Favorite.objects.values_list('listing_id', 'created_at'), kinds['favorite']),
+        (Message.objects.filter(listing__isnull=False)
+         .values_list('listing_id', 'timestamp'), kinds['message']),
+    )
+    ids, logs = [], []
+    for queryset, weight in sources:
+        for listing_id, at in queryset.order_by().iterator(chunk_size=10000):
+            ids.append(listing_id)
+            logs.append(math.log(weight) + rate * (at - EPOCH).total_seconds())
+    for listing_id, views, at in (CarListing.objects.filter(views__gt=0).order_by()
+                                  .values_list('pk', 'views', 'created_at')
+                                  .iterator(chunk_size=10000)):
+        ids.append(listing_id)
+        logs.append(math.log(kinds['view'] * views) + rate * (at - EPOCH).total_seconds())
+
+    listing_ids, scores = (_log_sums(np.array(ids, dtype=np.int64), np.array(logs))
+                           if ids else ([], []))
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(listing_id=int(pk), score=float(score))
+             for pk, score in zip(listing_ids, scores)],
+            batch_size=batch_size)
+    refill()
+    return len(listing_ids)
+
+
+def refill():
+    """Recompute every cached top list from ``TrendingScore``"""
+    from .models import TrendingScore
+
+    capacity = 2 * top_n()
+    lists = defaultdict(list)
+    rows = (TrendingScore.objects.filter(listing__status='available')
+            .order_by('-score')
+            .values_list('listing_id', 'score', 'listing__car__make', 'listing__location'))
+    for listing_id, score, make, location in rows.iterator(chunk_size=10000):
+        for group, value in group_keys(make, location):
+            entries = lists[cache_key(group, value)]
+            if len(entries) < capacity:
+                entries.append((listing_id, score))
+    cache.set_many(dict(lists), _setting('TRENDING_CACHE_TIMEOUT', None))
+    return len(lists)
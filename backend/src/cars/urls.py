@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'cars'
+
+urlpatterns = [
+    path('search/', views.listing_search, name='listing-search'),
+    path('listings/<int:pk>/', views.listing_detail, name='listing-detail'),
+    path('listings/<int:pk>/price/', views.listing_price, name='listing-price'),
+    path('listings/<int:pk>/similar/', views.similar_listings, name='similar-listings'),
+    path('trending/', views.trending_listings, name='trending-listings'),
+    path('price-statistics/', views.price_statistics, name='price-statistics'),
+]
@@ -1,3 +1,120 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from analytics.ingest import log_search
+from carzone.pagination import page_size_from
+
+from . import pricestats, similarity, trending
+from .models import CarListing
+from .search import (
+    ListingSearch, SearchError, serialize_facets, serialize_listing,
+    serialize_summary,
+)
+
+
+@require_GET
+def listing_search(request):
+    """Faceted search over available listings"""
+    cursor = request.GET.get('cursor')
+    try:
+        search = ListingSearch.from_params(request.GET)
+        result = search.results(cursor=cursor, page_size=page_size_from(request))
+    except (SearchError, ValueError) as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    if not cursor:
+        # Queued and written in batches by analytics.ingest
+        log_search(
+            search.describe(),
+            results_count=result['total'],
+            user=request.user,
+            ip_address=request.META.get('REMOTE_ADDR'),
+        )
+
+    return JsonResponse({
+        'total': result['total'],
+        'next_cursor': result['next_cursor'],
+        'results': [serialize_summary(summary) for summary in result['results']],
+        'facets': serialize_facets(result['facets']),
+    })
+
+
+@require_GET
+def listing_detail(request, pk):
+    """A single listing; counts as a page view"""
+    listing = get_object_or_404(
+        CarListing.objects.select_related('car', 'seller'), pk=pk)
+    listing.increment_views()
+    return JsonResponse(serialize_listing(listing))
+
+
+@require_GET
+def listing_price(request, pk):
+    """How a listing's price compares with comparable available listings"""
+    listing = get_object_or_404(CarListing.objects.select_related('car'), pk=pk)
+    position = pricestats.price_position(listing)
+    statistics = position['statistics']
+    return JsonResponse({
+        'id': listing.pk,
+        'price': str(listing.price),
+        'assessment': position['assessment'],
+        'percentile': position['percentile'],
+        'statistics': (pricestats.serialize_statistics(statistics)
+                       if statistics else None),
+    })
+
+
+@require_GET
+def price_statistics(request):
+    """Price distribution of the available listings of a make, model, year and fuel type"""
+    try:
+        key = [request.GET[field] for field in pricestats.KEY_FIELDS]
+        key[2] = int(key[2])
+    except KeyError as exc:
+        return JsonResponse({'error': f"{exc.args[0]} is required"}, status=400)
+    except ValueError:
+        return JsonResponse({'error': "year must be an integer"}, status=400)
+    statistics = pricestats.statistics_for(*key)
+    if statistics is None:
+        return JsonResponse({'error': "No available listings"}, status=404)
+    return JsonResponse(pricestats.serialize_statistics(statistics))
+
+
+@require_GET
+def similar_listings(request, pk):
+    """The available listings most similar to a listing"""
+    listing = get_object_or_404(CarListing.objects.select_related('car'), pk=pk)
+    metric = request.GET.get('metric', 'euclidean')
+    if metric not in similarity.METRICS:
+        return JsonResponse(
+            {'error': f"metric must be one of {', '.join(similarity.METRICS)}"},
+            status=400)
+    try:
+        n = page_size_from(request, default=10)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    results = similarity.recommender.similar(listing, n=n, metric=metric)
+    return JsonResponse({
+        'id': listing.pk,
+        'metric': metric,
+        'results': [serialize_summary(summary) for summary in results],
+    })
+
+
+@require_GET
+def trending_listings(request):
+    """Top trending available listings at a location, of a make or site-wide"""
+    try:
+        n = page_size_from(request, default=trending.top_n())
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    results = trending.trending(location=request.GET.get('location'),
+                                make=request.GET.get('make'), n=n)
+    return JsonResponse({
+        'results': [
+            {**serialize_summary(summary),
+             'trending_score': round(summary.trending_score, 3)}
+            for summary in results
+        ],
+    })
@@ -0,0 +1,262 @@
+"""
+Per-request database instrumentation.
+
+``QueryMetricsMiddleware`` installs a ``connection.execute_wrapper`` hook
+for a sample of requests (``REQUEST_METRICS_SAMPLE_RATE``) and records how
+many statements the request ran, the time spent in the database, the
+slowest statement and statements repeated at least
+``REQUEST_METRICS_DUPLICATE_THRESHOLD`` times, the usual sign of an N+1
+query pattern. The figures are returned in a ``Server-Timing`` header
+(shown by browser dev tools), repeated statements are logged, and per-view
+totals are kept in memory and served in the Prometheus text format by
+``metrics_view``. Apps add the gauges of their buffered writers and
+background workers by registering a metrics provider with
+``registry.register_provider`` from their ``AppConfig.ready``.
+
+Unsampled requests cost one random number. Totals are per process, as with
+any in-process Prometheus exporter; scrape every worker or aggregate.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+SPACE_RE = re.compile(r'\s+')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def fingerprint(sql):
+    """SQL with ``IN`` lists of any length collapsed, to group repeats"""
+    return SPACE_RE.sub(' ', IN_LIST_RE.sub('(...)', sql)).strip()
+
+
+class RequestProfile:
+    """Database work of one request, filled in by ``execute_wrapper``"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.slowest_sql = None
+        self.slowest_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += elapsed
+            self.statements[fingerprint(sql)] += 1
+            if elapsed > self.slowest_time:
+                self.slowest_time = elapsed
+                self.slowest_sql = sql
+
+    def duplicates(self, threshold):
+        """``[(sql, count), ...]`` of statements run at least ``threshold`` times"""
+        return [(sql, count) for sql, count in self.statements.most_common()
+                if count >= threshold]
+
+
+class MetricsRegistry:
+    """Process-wide per-view totals, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers = {}
+        self.reset()
+
+    def register_provider(self, prefix, metrics):
+        """
+        Render the numeric values of the dict returned by ``metrics()`` as
+        ``<prefix>_<key>`` gauges. Registering a prefix again replaces it.
+        """
+        with self._lock:
+            self._providers[prefix] = metrics
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()         # (view, method, status) -> n
+            self.duration_sum = Counter()     # view -> seconds
+            self.duration_buckets = defaultdict(Counter)  # view -> le -> n
+            self.queries = Counter()          # view -> statements
+            self.db_time = Counter()          # view -> seconds
+            self.n_plus_one = Counter()       # view -> requests with repeats
+            self.slowest = {}                 # view -> (seconds, sql)
+
+    def record(self, view, method, status, duration, profile, repeated):
+        with self._lock:
+            self.requests[(view, method, str(status))] += 1
+            self.duration_sum[view] += duration
+            buckets = self.duration_buckets[view]
+            for bound in DURATION_BUCKETS:
+                if duration <= bound:
+                    buckets[bound] += 1
+            buckets['+Inf'] += 1
+            self.queries[view] += profile.queries
+            self.db_time[view] += profile.db_time
+            if repeated:
+                self.n_plus_one[view] += 1
+            if profile.slowest_sql and profile.slowest_time > self.slowest.get(view, (0,))[0]:
+                self.slowest[view] = (profile.slowest_time, profile.slowest_sql)
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('carzone_requests_total', 'counter', 'Sampled requests.')
+            for (view, method, status), n in sorted(self.requests.items()):
+                lines.append(
+                    f'carzone_requests_total{{view="{_label(view)}",'
+                    f'method="{method}",status="{status}"}} {n}')
+
+            family('carzone_request_duration_seconds', 'histogram',
+                   'Duration of sampled requests.')
+            for view in sorted(self.duration_buckets):
+                label = _label(view)
+                buckets = self.duration_buckets[view]
+                for bound in DURATION_BUCKETS + ('+Inf',):
+                    lines.append(
+                        f'carzone_request_duration_seconds_bucket{{view="{label}",'
+                        f'le="{bound}"}} {buckets[bound]}')
+                lines.append(f'carzone_request_duration_seconds_sum{{view="{label}"}} '
+                             f'{self.duration_sum[view]:.6f}')
+                lines.append(f'carzone_request_duration_seconds_count{{view="{label}"}} '
+                             f'{buckets["+Inf"]}')
+
+            family('carzone_db_queries_total', 'counter',
+                   'SQL statements run by sampled requests.')
+            for view, n in sorted(self.queries.items()):
+                lines.append(f'carzone_db_queries_total{{view="{_label(view)}"}} {n}')
+
+            family('carzone_db_time_seconds_total', 'counter',
+                   'Time sampled requests spent in the database.')
+            for view, seconds in sorted(self.db_time.items()):
+                lines.append(
+                    f'carzone_db_time_seconds_total{{view="{_label(view)}"}} {seconds:.6f}')
+
+            family('carzone_n_plus_one_requests_total', 'counter',
+                   'Sampled requests that repeated a statement past the threshold.')
+            for view, n in sorted(self.n_plus_one.items()):
+                lines.append(
+                    f'carzone_n_plus_one_requests_total{{view="{_label(view)}"}} {n}')
+
+            family('carzone_slowest_query_seconds', 'gauge',
+                   'Slowest statement seen per view (statement in the sql label).')
+            for view, (seconds, sql) in sorted(self.slowest.items()):
+                lines.append(
+                    f'carzone_slowest_query_seconds{{view="{_label(view)}",'
+                    f'sql="{_label(fingerprint(sql)[:200])}"}} {seconds:.6f}')
+
+            providers = sorted(self._providers.items())
+        lines.extend(_provider_metrics(providers))
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _provider_metrics(providers):
+    """Gauges of the registered providers (see ``register_provider``)"""
+    lines = []
+    for prefix, metrics in providers:
+        for key, value in sorted(metrics().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f'# TYPE {prefix}_{key} gauge')
+            lines.append(f'{prefix}_{key} {value}')
+    return lines
+
+
+registry = MetricsRegistry()
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    # The route pattern keeps the label set bounded (no ids)
+    return match.view_name or match.route or '<unnamed>'
+
+
+class QueryMetricsMiddleware:
+    """Measure the database work of a sample of requests"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _setting('REQUEST_METRICS_ENABLED', True) or \
+                random.random() >= _setting('REQUEST_METRICS_SAMPLE_RATE', 1.0):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        threshold = _setting('REQUEST_METRICS_DUPLICATE_THRESHOLD', 5)
+        repeated = profile.duplicates(threshold)
+        view = _view_name(request)
+        registry.record(view, request.method, response.status_code,
+                        duration, profile, bool(repeated))
+
+        for sql, count in repeated:
+            logger.warning("%s ran the same statement %d times (N+1?): %s",
+                           view, count, sql[:500])
+
+        if _setting('REQUEST_METRICS_SERVER_TIMING', True):
+            timings = [
+                f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"',
+                f'app;dur={(duration - profile.db_time) * 1000:.1f}',
+            ]
+            if profile.slowest_sql:
+                timings.append(f'slowest;dur={profile.slowest_time * 1000:.1f}')
+            if repeated:
+                worst = repeated[0][1]
+                timings.append(
+                    f'nplus1;desc="{len(repeated)} repeated statement(s), up to {worst}x"')
+            response['Server-Timing'] = ', '.join(timings)
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for staff only unless the client's
+    ``REMOTE_ADDR`` is in ``REQUEST_METRICS_ALLOWED_IPS`` (empty by default).
+    Behind a reverse proxy every request comes from the proxy's address, so
+    list only a scraper that reaches the application server directly
+    (e.g. over the private network), never the proxy or loopback.
+    """
+    allowed = _setting('REQUEST_METRICS_ALLOWED_IPS', ())
+    user = getattr(request, 'user', None)
+    if request.META.get('REMOTE_ADDR') not in allowed and not (user and user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
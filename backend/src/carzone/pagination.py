@@ -0,0 +1,163 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` the next page is selected with a ``WHERE`` clause on
+the sort key of the last row already returned, so fetching page 10,000 costs
+the same index range scan as fetching page 1. The sort key must be unique,
+which is why every ordering ends with ``id``.
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the paginator's ordering"""
+
+
+class CursorPage:
+    """One page of results plus the cursor of the page after it"""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by ``ordering`` using opaque cursors.
+
+    ``ordering`` is a sequence of field names (``'-created_at'``,
+    ``'car__year'``...) whose last entry must make it unique, normally
+    ``'id'``/``'-id'``. Fields must not be nullable. Names that are not
+    model fields are taken to be annotations on ``queryset`` (such as a
+    search rank) and stored in the cursor as plain JSON values.
+    """
+
+    def __init__(self, queryset, ordering=('-created_at', '-id'), page_size=20):
+        if not ordering or ordering[-1].lstrip('-') not in ('id', 'pk'):
+            raise ValueError("Cursor ordering must end with 'id' or '-id'.")
+        if page_size < 1:
+            raise ValueError("page_size must be 1 or greater.")
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+        self.fields = [self._resolve(name.lstrip('-')) for name in self.ordering]
+
+    def _resolve(self, path):
+        """
+        Return the model field at the end of a ``__`` lookup path, or None
+        for an annotation.
+        """
+        if path in self.queryset.query.annotations:
+            return None
+        model = self.queryset.model
+        field = None
+        for part in path.split('__'):
+            field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+            if field.is_relation:
+                model = field.related_model
+        return field
+
+    def _key(self, obj):
+        values = []
+        for name in self.ordering:
+            value = obj
+            for part in name.lstrip('-').split('__'):
+                value = getattr(value, part)
+            values.append(value)
+        return values
+
+    def encode(self, values):
+        raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, TypeError):
+            raise InvalidCursor("Malformed cursor.")
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor("Cursor does not match this ordering.")
+        try:
+            return [field.to_python(value) if field is not None else value
+                    for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor("Cursor does not match this ordering.")
+
+    def _after(self, values):
+        """
+        ``Q`` selecting rows strictly after ``values`` in sort order.
+
+        Expanded as ``k1 <= v1 AND (k1 < v1 OR (k1 = v1 AND k2 < v2) ...)``
+        (for descending keys) so the database can drive the scan from an
+        index range on the leading column.
+        """
+        lookups = []
+        for name in self.ordering:
+            field = name.lstrip('-')
+            lookups.append((field, 'lt' if name.startswith('-') else 'gt'))
+
+        condition = Q()
+        for i in range(len(lookups) - 1, -1, -1):
+            field, op = lookups[i]
+            strict = Q(**{f'{field}__{op}': values[i]})
+            if i == len(lookups) - 1:
+                condition = strict
+            else:
+                condition = strict | (Q(**{field: values[i]}) & condition)
+
+        leading, op = lookups[0]
+        bound = Q(**{f'{leading}__{op}e': values[0]})
+        return bound & condition
+
+    def page(self, cursor=None):
+        """Return the page that starts after ``cursor`` (None for the first)"""
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode(cursor)))
+
+        items = list(queryset[:self.page_size + 1])
+        next_cursor = None
+        if len(items) > self.page_size:
+            items = items[:self.page_size]
+            next_cursor = self.encode(self._key(items[-1]))
+        return CursorPage(items, next_cursor)
+
+    def cursor_for(self, obj):
+        """Cursor of the page that starts right after ``obj``"""
+        return self.encode(self._key(obj))
+
+
+def page_size_from(request, default=20):
+    """Read a bounded ``page_size`` from the request's query string"""
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        raise ValueError("page_size must be an integer.")
+    return min(max(page_size, 1), MAX_PAGE_SIZE)
@@ -20,9 +20,11 @@ INSTALLED_APPS = [
     'cars',
     'messaging',
     'moderation',
+    'loadtest',
 ]
 
 MIDDLEWARE = [
+    'carzone.instrumentation.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,3 +97,90 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Buffered listing view counter (cars.counters)
+VIEW_COUNTER_FLUSH_INTERVAL = 5  # seconds between flushes
+VIEW_COUNTER_MAX_PENDING = 10000  # buffered views that trigger an early flush
+
+# Precomputed listing price distributions (cars.pricestats)
+PRICE_STATISTICS_BUCKETS = 10  # equal-width histogram buckets per group
+
+# In-memory similar-listings index (cars.similarity)
+SIMILAR_LISTINGS_REFRESH_INTERVAL = 30  # seconds between reloads of listings changed elsewhere
+SIMILAR_LISTINGS_REFRESH_OVERLAP = 60  # seconds each reload re-reads, for late commits
+
+# Time-decayed trending listings (cars.trending)
+TRENDING_HALF_LIFE = 24  # hours for an event's weight to halve
+TRENDING_WEIGHTS = {'view': 1.0, 'favorite': 5.0, 'message': 10.0}
+TRENDING_TOP_N = 20  # listings served per location, make or site-wide list
+TRENDING_FLUSH_INTERVAL = 10  # seconds between writes of buffered events
+TRENDING_CACHE_TIMEOUT = None  # seconds the top lists are cached; None keeps them
+
+# Normalized listing locations and radius search (cars.geo)
+PLACE_RESOLVER_TTL = 300  # seconds before the in-process place lookup is rebuilt
+LISTING_SEARCH_RADIUS_KM = 50  # default 'radius_km' of a 'near' search
+LISTING_SEARCH_MAX_RADIUS_KM = 500
+
+# Moderation work queue (moderation.queue)
+MODERATION_REASON_WEIGHTS = {
+    'scam': 10.0, 'fake': 6.0, 'offensive': 5.0, 'inappropriate': 4.0,
+    'spam': 2.0, 'other': 1.0,
+}
+MODERATION_CLAIM_BATCH = 20  # reports claimed per request
+MODERATION_CLAIM_TIMEOUT = 1800  # seconds before an unfinished claim returns to the queue
+
+# Automated risk scoring of new listings and messages (moderation.risk)
+RISK_WEIGHTS = {'bias': -5.0, 'price_drop': 6.0, 'contact': 2.0, 'reports': 1.2, 'burst': 2.5}
+RISK_REPORT_THRESHOLD = 0.8  # score at which an automated report is filed
+RISK_REPORTER_USERNAME = 'risk-scorer'  # inactive account filing the reports
+RISK_MIN_GROUP_SIZE = 5  # available listings a price group needs to be compared with
+RISK_BURST_WINDOW = 600  # seconds of a sender's messages counted as a burst
+RISK_BURST_LIMIT = 20  # messages (or receivers) per window before it counts
+RISK_WORKERS = 2  # scoring threads per process
+RISK_BATCH_SIZE = 200
+RISK_QUEUE_SIZE = 10000  # rows queued before new ones are dropped
+
+# Smoothed seller ratings (accounts.ratings): the mean of a seller's reviews
+# plus PRIOR_WEIGHT imaginary reviews of PRIOR_MEAN stars
+SELLER_RATING_PRIOR_MEAN = 4.0
+SELLER_RATING_PRIOR_WEIGHT = 5
+
+# Terms kept per day in the Analytics top-K summaries (analytics.sketches)
+ANALYTICS_TOP_K = 100
+# Ids below each rollup watermark that are scanned again for rows whose
+# transactions committed after a higher id was counted (analytics.rollup)
+ANALYTICS_ROLLUP_OVERLAP = 500
+
+# Asynchronous SearchLog ingestion (analytics.ingest)
+SEARCH_LOG_BATCH_SIZE = 500  # rows per bulk_create
+SEARCH_LOG_QUEUE_SIZE = 10000  # entries buffered before overflowing
+SEARCH_LOG_FLUSH_INTERVAL = 2  # seconds the writer waits for a batch
+SEARCH_LOG_OVERFLOW = 'spill'  # 'spill' to SEARCH_LOG_SPILL_DIR or 'drop'
+SEARCH_LOG_SPILL_DIR = BASE_DIR / 'var' / 'search_logs'
+
+# Maintained unread message counters (messaging.unread)
+MESSAGING_UNREAD_CACHE_TIMEOUT = 60  # seconds a cached count may be served
+
+# Saved-search matching and notifications (accounts.saved_searches)
+SAVED_SEARCH_BATCH_SIZE = 500  # notifications per bulk_create
+SAVED_SEARCH_QUEUE_SIZE = 10000  # listing changes queued before dropping
+SAVED_SEARCH_FLUSH_INTERVAL = 2  # seconds the matcher waits for a batch
+SAVED_SEARCH_REFRESH_INTERVAL = 30  # seconds between reloads of changed saved searches
+SAVED_SEARCH_REFRESH_OVERLAP = 60  # seconds each reload re-reads, for late commits
+
+# Real-time message delivery over WebSockets (messaging.delivery)
+MESSAGING_DELIVERY_BACKEND = 'messaging.delivery.InProcessBroker'  # RelayBroker for several processes
+MESSAGING_DELIVERY_RELAY = ('127.0.0.1', 8765)  # address of run_delivery_relay
+MESSAGING_DELIVERY_QUEUE_SIZE = 100  # undelivered payloads kept per connection
+
+# Result files of the run_benchmarks command (loadtest.bench)
+BENCHMARK_RESULTS_DIR = BASE_DIR / 'var' / 'benchmarks'
+
+# Per-request database instrumentation (carzone.instrumentation)
+REQUEST_METRICS_ENABLED = True
+REQUEST_METRICS_SAMPLE_RATE = 1.0  # fraction of requests measured; lower in production
+REQUEST_METRICS_DUPLICATE_THRESHOLD = 5  # repeats of one statement flagged as N+1
+REQUEST_METRICS_SERVER_TIMING = True  # add a Server-Timing response header
+# Addresses that may scrape /metrics without a staff login: a scraper that
+# reaches the app server directly, never a reverse proxy (see metrics_view)
+REQUEST_METRICS_ALLOWED_IPS = ()
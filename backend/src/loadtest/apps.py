@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+
+class LoadtestConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'loadtest'
+    verbose_name = 'Load Testing'
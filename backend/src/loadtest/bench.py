@@ -0,0 +1,251 @@
+"""
+A small asv-style benchmark harness for ORM hot paths.
+
+Benchmarks are plain functions registered with ``@benchmark``. An optional
+``setup`` callable runs once, untimed, and its return value is passed to
+the benchmark; it may raise ``Skip`` when the dataset lacks what the
+benchmark needs. Every run happens inside a transaction that is rolled back,
+so benchmarks that write leave the dataset unchanged.
+
+For each benchmark the wall time of ``repeat`` runs (after ``warmup``
+runs), the number of SQL queries and what the database had to read to
+answer them are recorded: ``table_scans``, the number of full table scans
+in the query plans, and on PostgreSQL ``rows_scanned``, the rows the scan
+nodes of ``EXPLAIN ANALYZE`` read (including those their filters removed).
+SQLite keeps no per-statement row counts, so there the field is left out.
+Results are stored as JSON so runs on two commits can be compared with
+``compare``.
+"""
+import fnmatch
+import json
+import platform
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+REGISTRY = {}
+
+
+class Skip(Exception):
+    """Raised by a benchmark's setup when it cannot run on this dataset"""
+
+
+class Benchmark:
+
+    def __init__(self, name, func, setup=None):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.doc = (func.__doc__ or '').strip().split('\n')[0]
+
+
+def benchmark(name, setup=None):
+    """Register the decorated function as the benchmark ``name``"""
+    def decorator(func):
+        REGISTRY[name] = Benchmark(name, func, setup)
+        return func
+    return decorator
+
+
+def select(patterns=None):
+    """Registered benchmarks whose names match any of the glob ``patterns``"""
+    names = sorted(REGISTRY)
+    if patterns:
+        names = [name for name in names
+                 if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+    return [REGISTRY[name] for name in names]
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` hook keeping every statement run"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params, many))
+        return execute(sql, params, many, context)
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from _plan_nodes(child)
+
+
+def explain(queries):
+    """
+    ``(rows_scanned, table_scans)`` for the SELECT statements in
+    ``queries``. Reading rows needs ``EXPLAIN ANALYZE``, which only
+    PostgreSQL offers; elsewhere ``rows_scanned`` is None.
+    """
+    rows_scanned = 0 if connection.vendor == 'postgresql' else None
+    table_scans = 0
+    with connection.cursor() as cursor:
+        for sql, params, many in queries:
+            if many or not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                for node in _plan_nodes(plan[0]['Plan']):
+                    if node['Node Type'].endswith('Scan'):
+                        rows_scanned += ((node.get('Actual Rows', 0)
+                                          + node.get('Rows Removed by Filter', 0))
+                                         * node.get('Actual Loops', 1))
+                    if node['Node Type'] == 'Seq Scan':
+                        table_scans += 1
+            elif connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if detail.startswith('SCAN ') and ' INDEX ' not in detail \
+                            and 'VIRTUAL TABLE' not in detail:
+                        table_scans += 1
+    return rows_scanned, table_scans
+
+
+def _run_once(bench, state, recorder=None):
+    with transaction.atomic():
+        start = time.perf_counter()
+        if recorder is None:
+            bench.func(state)
+        else:
+            with connection.execute_wrapper(recorder):
+                bench.func(state)
+        elapsed = (time.perf_counter() - start) * 1000
+        transaction.set_rollback(True)
+    return elapsed
+
+
+def run_benchmark(bench, repeat=5, warmup=1):
+    """Measure one benchmark; returns its result dict"""
+    try:
+        state = bench.setup() if bench.setup else None
+    except Skip as exc:
+        return {'skipped': str(exc) or 'skipped'}
+
+    for _ in range(warmup):
+        _run_once(bench, state)
+
+    recorder = QueryRecorder()
+    samples = [_run_once(bench, state, recorder)]
+    samples += [_run_once(bench, state) for _ in range(repeat - 1)]
+
+    # Re-running the statements for their plans is not part of the timing
+    with transaction.atomic():
+        rows_scanned, table_scans = explain(recorder.queries)
+        transaction.set_rollback(True)
+
+    result = {
+        'wall_ms': {
+            'min': round(min(samples), 3),
+            'median': round(statistics.median(samples), 3),
+            'mean': round(statistics.fmean(samples), 3),
+            'max': round(max(samples), 3),
+        },
+        'repeat': repeat,
+        'queries': len(recorder.queries),
+        'table_scans': table_scans,
+    }
+    if rows_scanned is not None:
+        result['rows_scanned'] = rows_scanned
+    return result
+
+
+def run(benchmarks, repeat=5, warmup=1, progress=None):
+    """Run ``benchmarks``; ``progress(name, result)`` is called after each"""
+    results = {}
+    for bench in benchmarks:
+        results[bench.name] = run_benchmark(bench, repeat=repeat, warmup=warmup)
+        if progress:
+            progress(bench.name, results[bench.name])
+    return results
+
+
+def git_commit():
+    """Short hash of the checked-out commit, suffixed ``-dirty`` if modified"""
+    def git(*args):
+        return subprocess.run(
+            ['git', *args], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+
+    try:
+        commit = git('rev-parse', '--short', 'HEAD')
+        if git('status', '--porcelain', '--untracked-files=no'):
+            commit += '-dirty'
+        return commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_size():
+    """Row counts of the main tables, recorded with every result file"""
+    from loadtest.generator import generated_models
+
+    return {table: model.objects.count() for table, model in generated_models().items()}
+
+
+def report(results):
+    """The JSON document written for a run"""
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'dataset': dataset_size(),
+        },
+        'results': results,
+    }
+
+
+def default_output(document):
+    directory = Path(getattr(settings, 'BENCHMARK_RESULTS_DIR',
+                             settings.BASE_DIR / 'var' / 'benchmarks'))
+    stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+    commit = document['meta']['commit'] or 'nocommit'
+    return directory / f'{stamp}-{commit}.json'
+
+
+def save(document, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(document, indent=2, sort_keys=True))
+    return path
+
+
+def load(path):
+    return json.loads(Path(path).read_text())
+
+
+def compare(baseline, current, threshold=0.10):
+    """
+    Compare two result documents benchmark by benchmark. Returns a list of
+    ``(name, before_ms, after_ms, ratio, before_queries, after_queries,
+    regressed)``; a benchmark regressed when its median wall time grew by
+    more than ``threshold`` or it issues more queries.
+    """
+    rows = []
+    before_results = baseline['results']
+    for name, after in sorted(current['results'].items()):
+        before = before_results.get(name)
+        if not before or 'skipped' in before or 'skipped' in after:
+            continue
+        before_ms = before['wall_ms']['median']
+        after_ms = after['wall_ms']['median']
+        ratio = after_ms / before_ms if before_ms else float('inf')
+        regressed = ratio > 1 + threshold or after['queries'] > before['queries']
+        rows.append((name, before_ms, after_ms, ratio,
+                     before['queries'], after['queries'], regressed))
+    return rows
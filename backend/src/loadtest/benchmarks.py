@@ -0,0 +1,334 @@
+"""
+Benchmarks of the ORM hot paths, registered with ``loadtest.bench``.
+
+Run them with ``python manage.py run_benchmarks`` against a dataset made by
+``generate_data``. Names are ``<area>.<case>`` so areas can be selected
+with globs, e.g. ``--filter 'admin.*'``.
+"""
+from datetime import timedelta
+from functools import partial
+
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.test import RequestFactory
+from django.utils import timezone
+
+from analytics import rollup
+from analytics.models import SearchLog
+from analytics.sketches import summary_for_range
+from cars import pricestats, similarity, trending
+from cars.models import CarListing, ListingSummary
+from cars.search import ListingSearch
+from messaging import unread, views as messaging_views
+from messaging.models import Message
+from moderation import counters, queue as moderation_queue, risk
+from moderation.models import Report
+
+from .bench import Skip, benchmark
+
+factory = RequestFactory()
+
+
+def _staff_user():
+    # Never saved: superusers pass every permission check without queries
+    return get_user_model()(
+        pk=0, username='benchmark', is_staff=True, is_superuser=True, is_active=True)
+
+
+def _most_common(queryset, field):
+    row = (queryset.values(field).annotate(n=Count('pk'))
+           .order_by('-n').first())
+    if row is None:
+        raise Skip(f"no {queryset.model._meta.verbose_name_plural}")
+    return row[field]
+
+
+# Admin changelists
+
+ADMIN_CHANGELISTS = {
+    'carlisting': ('cars.CarListing', {}),
+    'carlisting_search': ('cars.CarListing', {'q': 'toyota'}),
+    'car': ('cars.Car', {}),
+    'favorite': ('cars.Favorite', {}),
+    'listingsummary': ('cars.ListingSummary', {}),
+    'message': ('messaging.Message', {}),
+    'message_unread': ('messaging.Message', {'is_read__exact': '0'}),
+    'report': ('moderation.Report', {}),
+    'report_pending': ('moderation.Report', {'status__exact': 'pending'}),
+    'user': ('accounts.User', {}),
+    'searchlog': ('analytics.SearchLog', {}),
+    'analytics': ('analytics.Analytics', {}),
+}
+
+
+def _changelist_setup(label, params):
+    model = apps.get_model(label)
+    model_admin = admin.site._registry[model]
+    return model_admin, params, _staff_user()
+
+
+def render_changelist(state):
+    """Build and render one admin changelist page"""
+    model_admin, params, user = state
+    request = factory.get('/admin/', params)
+    request.user = user
+    response = model_admin.changelist_view(request)
+    response.render()
+
+
+for name, (label, params) in ADMIN_CHANGELISTS.items():
+    benchmark(f'admin.{name}', setup=partial(_changelist_setup, label, params))(
+        render_changelist)
+
+
+# Listing search
+
+def _search_setup(params):
+    if not ListingSummary.objects.exists():
+        raise Skip("no listings")
+    params = dict(params)
+    available = ListingSummary.objects.filter(status='available')
+    if params.get('make') == '<most common>':
+        params['make'] = _most_common(available, 'make')
+    if params.get('q') == '<most common>':
+        params['q'] = _most_common(available, 'make').lower()
+    return ListingSearch.from_params(params)
+
+
+def search_page(search):
+    """First results page of a listing search, facets included"""
+    results = search.results()
+    list(results['results'])
+
+
+SEARCHES = {
+    'default': {},
+    'make': {'make': '<most common>'},
+    'make_price_band': {'make': '<most common>', 'price_band': '2'},
+    'price_range': {'min_price': '10000', 'max_price': '20000', 'sort': 'price_asc'},
+    'text': {'q': '<most common>'},
+    'near': {'near': 'Dallas, TX', 'radius_km': '100'},
+    'rating': {'sort': 'rating'},
+}
+
+for name, params in SEARCHES.items():
+    benchmark(f'search.{name}', setup=partial(_search_setup, params))(search_page)
+
+
+def _deep_search_setup(depth=50, page_size=20):
+    search = _search_setup({})
+    cursor = None
+    for _ in range(depth):
+        cursor = search.results(cursor=cursor, page_size=page_size)['next_cursor']
+        if cursor is None:
+            raise Skip(f"fewer than {depth} result pages")
+    return search, cursor
+
+
+@benchmark('search.deep_page', setup=_deep_search_setup)
+def search_deep_page(state):
+    """Results page 51 of the unfiltered search"""
+    search, cursor = state
+    list(search.results(cursor=cursor)['results'])
+
+
+# Inbox
+
+def _inbox_setup(view, field):
+    user_id = _most_common(Message.objects.all(), field)
+    user = get_user_model().objects.get(pk=user_id)
+    return view, user
+
+
+def message_feed(state):
+    """First page of a message feed of the busiest user"""
+    view, user = state
+    request = factory.get('/api/messages/')
+    request.user = user
+    view(request)
+
+
+benchmark('inbox.received', setup=partial(
+    _inbox_setup, messaging_views.inbox, 'receiver'))(message_feed)
+benchmark('inbox.sent', setup=partial(
+    _inbox_setup, messaging_views.sent, 'sender'))(message_feed)
+
+
+@benchmark('inbox.unread_count', setup=partial(
+    _inbox_setup, None, 'receiver'))
+def inbox_unread_count(state):
+    """Unread message count of the busiest user"""
+    _, user = state
+    Message.objects.filter(receiver=user, is_read=False).count()
+
+
+@benchmark('inbox.unread_counter', setup=partial(
+    _inbox_setup, None, 'receiver'))
+def inbox_unread_counter(state):
+    """Maintained unread count of the busiest user, cache bypassed"""
+    _, user = state
+    cache.delete(unread.cache_key(user.pk))
+    unread.count(user.pk)
+
+
+# Price statistics
+
+def _price_group():
+    available = CarListing.objects.filter(status='available')
+    row = (available.values(*pricestats.LISTING_PATHS).annotate(n=Count('pk'))
+           .order_by('-n').values_list(*pricestats.LISTING_PATHS).first())
+    if row is None:
+        raise Skip("no available listings")
+    return row
+
+
+@benchmark('prices.on_demand', setup=_price_group)
+def prices_on_demand(key):
+    """Percentiles of the largest make/model/year/fuel group from its listings"""
+    rows = pricestats.price_rows(CarListing.objects.filter(
+        **dict(zip(pricestats.LISTING_PATHS, key))))
+    pricestats.compute(rows)
+
+
+@benchmark('prices.stored', setup=_price_group)
+def prices_stored(key):
+    """Precomputed statistics of the largest make/model/year/fuel group"""
+    pricestats.statistics_for(*key)
+
+
+@benchmark('prices.rebuild')
+def prices_rebuild(state):
+    """Vectorised recomputation of every price statistics group"""
+    pricestats.compute(pricestats.price_rows(CarListing.objects.all()))
+
+
+# Similar listings
+
+def _similar_setup():
+    listing = (CarListing.objects.filter(status='available')
+               .select_related('car').order_by('-views').first())
+    if listing is None:
+        raise Skip("no available listings")
+    similarity.recommender.similar(listing)  # loads the index
+    return listing
+
+
+@benchmark('similar.listing', setup=_similar_setup)
+def similar_listing(listing):
+    """Ten listings most similar to the most viewed one, summaries included"""
+    similarity.recommender.similar(listing)
+
+
+# Trending listings
+
+def _trending_location():
+    location = _most_common(CarListing.objects.filter(status='available'), 'location')
+    trending.trending(location=location)  # fills the cached list
+    return location
+
+
+@benchmark('trending.near', setup=_trending_location)
+def trending_near(location):
+    """Top trending listings at the busiest location from the cached list"""
+    trending.trending(location=location)
+
+
+@benchmark('trending.join', setup=_trending_location)
+def trending_join(location):
+    """The same ranking computed from favorites and messages with joins"""
+    since = timezone.now() - timedelta(days=7)
+    list(
+        CarListing.objects.filter(status='available', location=location)
+        .annotate(
+            recent_favorites=Count('favorited_by', filter=Q(
+                favorited_by__created_at__gte=since), distinct=True),
+            recent_messages=Count('messages', filter=Q(
+                messages__timestamp__gte=since), distinct=True),
+        )
+        .order_by('-recent_messages', '-recent_favorites', '-views')[:20]
+    )
+
+
+# Moderation queue
+
+@benchmark('moderation.pending_queue')
+def moderation_pending_queue(state):
+    """Oldest 50 pending reports with their targets"""
+    list(
+        Report.objects.filter(status='pending')
+        .select_related('reporter', 'reported_user', 'reported_listing__car')
+        .order_by('created_at')[:50]
+    )
+
+
+def _moderator():
+    if not Report.objects.filter(status='pending').exists():
+        raise Skip("no pending reports")
+    return get_user_model().objects.order_by('-is_staff', 'pk').first()
+
+
+@benchmark('moderation.claim_batch', setup=_moderator)
+def moderation_claim_batch(moderator):
+    """Claim the next 20 reports of the prioritized work queue"""
+    moderation_queue.claim(moderator, size=20)
+
+
+def _risk_batch(size=2000):
+    ids = list(CarListing.objects.order_by('-pk').values_list('pk', flat=True)[:size])
+    if not ids:
+        raise Skip("no listings")
+    return CarListing.objects.filter(pk__in=ids)
+
+
+@benchmark('moderation.risk_batch', setup=_risk_batch)
+def moderation_risk_batch(listings):
+    """Risk-score the 2000 newest listings as the backlog command does"""
+    risk.score_listings(risk.listing_rows(listings))
+
+
+@benchmark('moderation.reports_per_target')
+def moderation_reports_per_target(state):
+    """Listings with the most pending reports"""
+    list(
+        Report.objects.filter(status='pending', reported_listing__isnull=False)
+        .values('reported_listing').annotate(n=Count('pk')).order_by('-n')[:50]
+    )
+
+
+@benchmark('moderation.open_reports_per_seller')
+def moderation_open_reports_per_seller(state):
+    """Sellers with the most open reports, as the user admin sorts them"""
+    list(
+        get_user_model().objects.annotate(n=counters.open_reports('user'))
+        .order_by('-n').values_list('pk', 'n')[:50]
+    )
+
+
+# Analytics rollups
+
+def _busiest_day():
+    latest = SearchLog.objects.order_by('-timestamp').values_list('timestamp', flat=True).first()
+    if latest is None:
+        raise Skip("no search logs")
+    return timezone.localdate(latest) - timedelta(days=1)
+
+
+@benchmark('analytics.rollup_day_full', setup=_busiest_day)
+def analytics_rollup_day_full(day):
+    """Recompute one day's Analytics row from the raw tables"""
+    rollup.rollup_day(day, full=True)
+
+
+@benchmark('analytics.rollup_day_incremental', setup=_busiest_day)
+def analytics_rollup_day_incremental(day):
+    """Roll up a day that has no new rows since its watermark"""
+    rollup.rollup_day(day)
+
+
+@benchmark('analytics.top_terms_30_days', setup=_busiest_day)
+def analytics_top_terms_30_days(day):
+    """Merge 30 daily top search term summaries"""
+    summary_for_range('search_terms', day - timedelta(days=29), day).top(20)
@@ -0,0 +1,608 @@
+"""
+Synthetic data for load testing.
+
+Rows are generated in fixed-size chunks with explicit primary keys, each
+chunk from its own RNG seeded with ``(seed, table, chunk)``, so a seed always
+produces the same rows whatever the number of worker processes. Popularity
+is skewed the way it is on a real marketplace: makes, locations, sellers and
+the listings that attract favorites, messages and reports follow Zipf
+distributions. Timestamps grow with the primary key, spread over the
+``days`` days before midnight.
+
+Rows are written with ``bulk_create``, which skips signals, so the derived
+tables (facet counts, seller ratings, listing summaries, full-text index,
+conversations, analytics rollups) are rebuilt once at the end by
+``rebuild_derived``.
+"""
+import bisect
+import multiprocessing
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from math import gcd
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+# Make -> (models, typical new price), most popular first
+CATALOG = {
+    'Toyota': (('Corolla', 'Camry', 'RAV4', 'Prius', 'Highlander', 'Tacoma'), 28000),
+    'Honda': (('Civic', 'Accord', 'CR-V', 'Fit', 'Pilot'), 27000),
+    'Ford': (('F-150', 'Focus', 'Escape', 'Explorer', 'Mustang'), 32000),
+    'Chevrolet': (('Silverado', 'Malibu', 'Equinox', 'Cruze', 'Tahoe'), 31000),
+    'Nissan': (('Altima', 'Sentra', 'Rogue', 'Leaf', 'Pathfinder'), 26000),
+    'Hyundai': (('Elantra', 'Sonata', 'Tucson', 'Santa Fe', 'Kona'), 25000),
+    'Volkswagen': (('Golf', 'Jetta', 'Passat', 'Tiguan'), 27000),
+    'BMW': (('3 Series', '5 Series', 'X3', 'X5', 'i3'), 48000),
+    'Mercedes-Benz': (('C-Class', 'E-Class', 'GLC', 'GLE'), 52000),
+    'Kia': (('Rio', 'Optima', 'Sportage', 'Sorento', 'Soul'), 24000),
+    'Audi': (('A3', 'A4', 'A6', 'Q5', 'Q7'), 47000),
+    'Subaru': (('Impreza', 'Outback', 'Forester', 'WRX'), 29000),
+    'Mazda': (('Mazda3', 'Mazda6', 'CX-5', 'MX-5'), 27000),
+    'Tesla': (('Model 3', 'Model S', 'Model X', 'Model Y'), 55000),
+    'Jeep': (('Wrangler', 'Cherokee', 'Compass'), 35000),
+    'Lexus': (('IS', 'ES', 'RX', 'NX'), 45000),
+    'Volvo': (('S60', 'XC60', 'XC90'), 46000),
+    'Porsche': (('911', 'Cayenne', 'Macan'), 85000),
+}
+MAKES = tuple(CATALOG)
+ELECTRIC_MAKES = {'Tesla'}
+
+LOCATIONS = (
+    'New York, NY', 'Los Angeles, CA', 'Chicago, IL', 'Houston, TX',
+    'Phoenix, AZ', 'Philadelphia, PA', 'San Antonio, TX', 'San Diego, CA',
+    'Dallas, TX', 'San Jose, CA', 'Austin, TX', 'Jacksonville, FL',
+    'Columbus, OH', 'Charlotte, NC', 'Indianapolis, IN', 'Seattle, WA',
+    'Denver, CO', 'Boston, MA', 'Nashville, TN', 'Detroit, MI',
+    'Portland, OR', 'Las Vegas, NV', 'Miami, FL', 'Atlanta, GA',
+)
+COLORS = ('White', 'Black', 'Silver', 'Gray', 'Blue', 'Red', 'Green', 'Brown')
+ENGINE_SIZES = ('1.4L', '1.6L', '1.8L', '2.0L', '2.5L', '3.0L', '3.5L', '5.0L')
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer',
+               'Michael', 'Linda', 'David', 'Sarah', 'Ahmed', 'Mei', 'Carlos')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia',
+              'Miller', 'Davis', 'Rahman', 'Chen', 'Lopez', 'Wilson')
+PHRASES = (
+    'one owner', 'clean title', 'full service history', 'new tires',
+    'no accidents', 'garage kept', 'non smoker', 'leather seats', 'sunroof',
+    'backup camera', 'bluetooth', 'recently serviced', 'warranty remaining',
+    'heated seats', 'navigation', 'minor scratches', 'price negotiable',
+)
+MESSAGES = (
+    'Is this still available?', 'What is your best price?',
+    'Can I schedule a test drive this weekend?',
+    'Has it been in any accidents?', 'Are the service records available?',
+    'Would you consider a trade-in?', 'Yes, it is still available.',
+    'I can do a small discount for cash.', 'Sure, Saturday morning works.',
+)
+REVIEW_COMMENTS = (
+    '', 'Smooth sale, car exactly as described.', 'Quick replies, fair price.',
+    'Some issues were not mentioned in the listing.', 'Friendly and honest seller.',
+    'Took a long time to answer.',
+)
+
+# (value, weight) tables
+FUEL_TYPES = (('petrol', 70), ('diesel', 12), ('hybrid', 13), ('electric', 5))
+STATUSES = (('available', 80), ('sold', 15), ('pending', 3), ('rejected', 2))
+REPORT_REASONS = (('spam', 35), ('scam', 20), ('fake', 15),
+                  ('inappropriate', 10), ('offensive', 8), ('other', 12))
+REPORT_STATUSES = (('pending', 40), ('reviewed', 20), ('resolved', 25),
+                   ('dismissed', 15))
+REVIEW_RATINGS = ((5, 55), (4, 25), (3, 8), (2, 4), (1, 8))
+
+# Every SELLER_EVERY-th generated user is a seller
+SELLER_EVERY = 5
+TABLES = ('users', 'seller_profiles', 'listings', 'favorites', 'messages',
+          'reports', 'reviews', 'searches')
+PASSWORD = 'loadtest'
+
+
+class Plan:
+    """How many rows of each table to generate and where their keys start"""
+
+    def __init__(self, listings, seed=0, users=None, favorites=None,
+                 messages=None, reports=None, reviews=None, searches=None, days=365,
+                 chunk_size=5000):
+        users = users if users is not None else max(listings // 5, 10)
+        if users < SELLER_EVERY + 1:
+            raise ValueError(f"At least {SELLER_EVERY + 1} users are needed.")
+        # Each generated user reviews at most once (one review per seller and reviewer)
+        reviews = reviews if reviews is not None else min(listings // 10, users)
+        if reviews > users:
+            raise ValueError(f"At most {users} reviews (one per user) can be generated.")
+        self.seed = seed
+        self.days = days
+        self.chunk_size = chunk_size
+        self.counts = {
+            'users': users,
+            'seller_profiles': len(range(0, users, SELLER_EVERY)),
+            'listings': listings,
+            'favorites': favorites if favorites is not None else listings * 2,
+            'messages': messages if messages is not None else listings * 3,
+            'reports': reports if reports is not None else listings // 50,
+            'reviews': reviews,
+            'searches': searches if searches is not None else listings * 5,
+        }
+        if listings == 0:
+            for table in ('favorites', 'messages', 'reports', 'reviews'):
+                self.counts[table] = 0
+        # Anchored to midnight so the same seed gives the same rows all day
+        self.now = timezone.make_aware(
+            datetime.combine(timezone.localdate(), time.min))
+        self.password = make_password(PASSWORD, salt=f'loadtest{seed}')
+        self.base = {}
+
+    @property
+    def sellers(self):
+        return self.counts['seller_profiles']
+
+    def locate(self):
+        """Start the new primary keys after the existing rows"""
+        for table, model in generated_models().items():
+            self.base[table] = (model.objects.aggregate(m=Max('pk'))['m'] or 0) + 1
+
+    def chunks(self, table):
+        return range(0, -(-self.counts[table] // self.chunk_size))
+
+    def moment(self, table, index, rng):
+        """Timestamp of row ``index``: spread over ``days``, growing with it"""
+        span = self.days * 86400
+        offset = (index + rng.random()) / max(self.counts[table], 1) * span
+        return self.now - timedelta(seconds=span - offset)
+
+    # Keys of generated rows
+
+    def user_pk(self, index):
+        return self.base['users'] + index
+
+    def seller_pk(self, seller):
+        return self.user_pk(seller * SELLER_EVERY)
+
+    def listing_seller(self, listing):
+        """Seller of a listing, skewed towards a few large dealers"""
+        rank = _zipf(self.sellers, 1.05).at(_unit(self.seed, listing))
+        return _scatter(rank, self.sellers)
+
+    def popular_listing(self, rng):
+        """Index of a listing drawn by popularity"""
+        rank = _zipf(self.counts['listings'], 1.0).sample(rng)
+        return _scatter(rank, self.counts['listings'])
+
+
+class Zipf:
+    """Samples ranks ``0..n-1`` with P(rank r) proportional to ``1 / (r + 1) ** s``"""
+
+    def __init__(self, n, s):
+        self.cumulative = []
+        total = 0.0
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** s
+            self.cumulative.append(total)
+        self.total = total
+
+    def at(self, u):
+        """Rank at quantile ``u`` in ``[0, 1)``"""
+        rank = bisect.bisect_left(self.cumulative, u * self.total)
+        return min(rank, len(self.cumulative) - 1)
+
+    def sample(self, rng):
+        return self.at(rng.random())
+
+
+@lru_cache(maxsize=None)
+def _zipf(n, s):
+    return Zipf(n, s)
+
+
+def _unit(seed, index):
+    """Deterministic pseudo-random number in [0, 1) for ``index`` (splitmix64)"""
+    x = (index + seed * 0x9E3779B97F4A7C15 + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return (x ^ (x >> 31)) / 2 ** 64
+
+
+@lru_cache(maxsize=None)
+def _stride(n):
+    stride = 2654435761 % n or 1
+    while gcd(stride, n) != 1:
+        stride += 1
+    return stride
+
+
+def _scatter(rank, n):
+    """Map popularity ranks onto indexes so popular rows are not all adjacent"""
+    return rank * _stride(n) % n
+
+
+def _weighted(rng, table):
+    values, weights = zip(*table)
+    return rng.choices(values, weights)[0]
+
+
+def _pick(rng, values, s=1.1):
+    """Zipf-skewed choice from a sequence ordered by popularity"""
+    return values[_zipf(len(values), s).sample(rng)]
+
+
+def generated_models():
+    from accounts.models import SellerProfile, SellerReview
+    from analytics.models import SearchLog
+    from cars.models import Car, CarListing, Favorite
+    from messaging.models import Message
+    from moderation.models import Report
+
+    return {
+        'users': get_user_model(),
+        'seller_profiles': SellerProfile,
+        'cars': Car,
+        'listings': CarListing,
+        'favorites': Favorite,
+        'messages': Message,
+        'reports': Report,
+        'reviews': SellerReview,
+        'searches': SearchLog,
+    }
+
+
+# Row builders: (plan, rng, indexes) -> {model: [instances]}
+
+def build_users(plan, rng, indexes):
+    User = get_user_model()
+    rows = []
+    for i in indexes:
+        pk = plan.user_pk(i)
+        rows.append(User(
+            pk=pk,
+            username=f'lt{pk}',
+            email=f'lt{pk}@loadtest.invalid',
+            password=plan.password,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            role='seller' if i % SELLER_EVERY == 0 else 'buyer',
+            date_joined=plan.moment('users', i, rng),
+        ))
+    return {User: rows}
+
+
+def build_seller_profiles(plan, rng, indexes):
+    from accounts.models import SellerProfile
+
+    rows = []
+    for i in indexes:
+        joined = plan.moment('users', i * SELLER_EVERY, rng)
+        rows.append(SellerProfile(
+            pk=plan.base['seller_profiles'] + i,
+            user_id=plan.seller_pk(i),
+            company_name=(f"{rng.choice(LAST_NAMES)} Motors"
+                          if rng.random() < 0.3 else None),
+            created_at=joined,
+            updated_at=joined,
+        ))
+    return {SellerProfile: rows}
+
+
+def build_listings(plan, rng, indexes):
+    from cars.models import Car, CarListing
+
+    cars, listings = [], []
+    year_now = plan.now.year
+    for i in indexes:
+        make = _pick(rng, MAKES)
+        models, new_price = CATALOG[make]
+        age = min(int(rng.expovariate(1 / 5)), 25)
+        fuel = 'electric' if make in ELECTRIC_MAKES else _weighted(rng, FUEL_TYPES)
+        mileage = int(age * rng.gauss(14000, 4000)) + rng.randrange(0, 3000)
+        car = Car(
+            pk=plan.base['cars'] + i,
+            make=make,
+            model=_pick(rng, models, 0.8),
+            year=year_now - age,
+            mileage=max(mileage, 0),
+            fuel_type=fuel,
+            transmission='automatic' if rng.random() < 0.8 else 'manual',
+            color=_pick(rng, COLORS, 0.7),
+            engine_size='' if fuel == 'electric' else rng.choice(ENGINE_SIZES),
+        )
+        price = new_price * 0.85 ** age * rng.uniform(0.8, 1.2)
+        cars.append(car)
+        listings.append(CarListing(
+            pk=plan.base['listings'] + i,
+            car_id=car.pk,
+            seller_id=plan.seller_pk(plan.listing_seller(i)),
+            price=Decimal(max(int(price / 50) * 50, 500)),
+            description=', '.join(rng.sample(PHRASES, rng.randint(2, 6))).capitalize() + '.',
+            location=_pick(rng, LOCATIONS),
+            status=_weighted(rng, STATUSES),
+            views=int(rng.paretovariate(1.3) * 10),
+            created_at=plan.moment('listings', i, rng),
+        ))
+        listings[-1].updated_at = listings[-1].created_at
+    return {Car: cars, CarListing: listings}
+
+
+def saved_search(rng, year_now):
+    """Saved-search criteria as a buyer would set them (see accounts.saved_searches)"""
+    criteria = {}
+    if rng.random() < 0.9:
+        make = _pick(rng, MAKES)
+        criteria['make'] = make
+        models, new_price = CATALOG[make]
+        if rng.random() < 0.6:
+            criteria['model'] = _pick(rng, models, 0.8)
+    else:
+        new_price = 30000
+    if rng.random() < 0.2:
+        criteria['fuel_type'] = _weighted(rng, FUEL_TYPES)
+    if rng.random() < 0.3:
+        criteria['transmission'] = 'automatic' if rng.random() < 0.8 else 'manual'
+    if rng.random() < 0.6:
+        criteria['location'] = _pick(rng, LOCATIONS).split(',')[0]
+    if rng.random() < 0.8:
+        criteria['max_price'] = int(new_price * rng.uniform(0.2, 0.9) / 500) * 500
+        if rng.random() < 0.3:
+            criteria['min_price'] = criteria['max_price'] // 2
+    if rng.random() < 0.5:
+        criteria['min_year'] = year_now - rng.randrange(1, 10)
+    if rng.random() < 0.3:
+        criteria['max_mileage'] = rng.randrange(20, 150) * 1000
+    return criteria
+
+
+def _buyer(plan, rng, avoid):
+    """A random generated user other than ``avoid``"""
+    while True:
+        pk = plan.user_pk(rng.randrange(plan.counts['users']))
+        if pk != avoid:
+            return pk
+
+
+def build_favorites(plan, rng, indexes):
+    from cars.models import Favorite
+
+    rows = []
+    for i in indexes:
+        listing = plan.popular_listing(rng)
+        rows.append(Favorite(
+            pk=plan.base['favorites'] + i,
+            user_id=_buyer(plan, rng, None),
+            listing_id=plan.base['listings'] + listing,
+            created_at=plan.moment('favorites', i, rng),
+        ))
+    return {Favorite: rows}
+
+
+def build_messages(plan, rng, indexes):
+    from messaging.models import Message
+
+    rows = []
+    for i in indexes:
+        listing = plan.popular_listing(rng)
+        seller = plan.seller_pk(plan.listing_seller(listing))
+        buyer = _buyer(plan, rng, seller)
+        sender, receiver = (seller, buyer) if rng.random() < 0.4 else (buyer, seller)
+        rows.append(Message(
+            pk=plan.base['messages'] + i,
+            sender_id=sender,
+            receiver_id=receiver,
+            listing_id=plan.base['listings'] + listing,
+            content=rng.choice(MESSAGES),
+            timestamp=plan.moment('messages', i, rng),
+            # Older messages have mostly been read
+            is_read=rng.random() < 0.3 + 0.65 * (1 - i / plan.counts['messages']),
+        ))
+    return {Message: rows}
+
+
+def build_reports(plan, rng, indexes):
+    from moderation.models import Report
+
+    rows = []
+    for i in indexes:
+        created_at = plan.moment('reports', i, rng)
+        if rng.random() < 0.7:
+            listing = plan.popular_listing(rng)
+            target = {'reported_listing_id': plan.base['listings'] + listing}
+            owner = plan.seller_pk(plan.listing_seller(listing))
+        else:
+            owner = plan.seller_pk(_scatter(_zipf(plan.sellers, 1.2).sample(rng), plan.sellers))
+            target = {'reported_user_id': owner}
+        status = _weighted(rng, REPORT_STATUSES)
+        reviewed = status != 'pending'
+        rows.append(Report(
+            pk=plan.base['reports'] + i,
+            reporter_id=_buyer(plan, rng, owner),
+            reason=_weighted(rng, REPORT_REASONS),
+            status=status,
+            reviewed_at=created_at + timedelta(hours=rng.uniform(1, 72)) if reviewed else None,
+            created_at=created_at,
+            **target,
+        ))
+    return {Report: rows}
+
+
+def build_reviews(plan, rng, indexes):
+    from accounts.models import SellerReview
+
+    rows = []
+    for i in indexes:
+        # Distinct reviewers, so no (seller, reviewer) pair repeats
+        reviewer = plan.user_pk(_scatter(i, plan.counts['users']))
+        while True:
+            listing = plan.popular_listing(rng)
+            seller = plan.seller_pk(plan.listing_seller(listing))
+            if seller != reviewer:
+                break
+        created_at = plan.moment('reviews', i, rng)
+        rows.append(SellerReview(
+            pk=plan.base['reviews'] + i,
+            seller_id=seller,
+            reviewer_id=reviewer,
+            listing_id=plan.base['listings'] + listing,
+            rating=_weighted(rng, REVIEW_RATINGS),
+            comment=rng.choice(REVIEW_COMMENTS),
+            created_at=created_at,
+            updated_at=created_at,
+        ))
+    return {SellerReview: rows}
+
+
+def build_searches(plan, rng, indexes):
+    from analytics.models import SearchLog
+
+    rows = []
+    for i in indexes:
+        make = _pick(rng, MAKES)
+        terms = [f'make:{make}']
+        if rng.random() < 0.5:
+            terms.append(f'model:{_pick(rng, CATALOG[make][0], 0.8)}')
+        if rng.random() < 0.3:
+            terms.append(f'location:{_pick(rng, LOCATIONS)}')
+        rows.append(SearchLog(
+            pk=plan.base['searches'] + i,
+            query=' '.join(sorted(terms)),
+            results_count=int(rng.paretovariate(1.1) * 5),
+            user_id=(plan.user_pk(rng.randrange(plan.counts['users']))
+                     if rng.random() < 0.5 else None),
+            ip_address=f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+            timestamp=plan.moment('searches', i, rng),
+        ))
+    return {SearchLog: rows}
+
+
+BUILDERS = {
+    'users': build_users,
+    'seller_profiles': build_seller_profiles,
+    'listings': build_listings,
+    'favorites': build_favorites,
+    'messages': build_messages,
+    'reports': build_reports,
+    'reviews': build_reviews,
+    'searches': build_searches,
+}
+
+
+@contextmanager
+def _given_timestamps(models):
+    """Let ``bulk_create`` keep the generated auto_now/auto_now_add values"""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def generate_chunk(plan, table, chunk):
+    """Generate and insert one chunk of ``table``; returns the rows written"""
+    start = chunk * plan.chunk_size
+    indexes = range(start, min(start + plan.chunk_size, plan.counts[table]))
+    rng = random.Random(f'{plan.seed}:{table}:{chunk}')
+    rows = BUILDERS[table](plan, rng, indexes)
+    with _given_timestamps(rows), transaction.atomic():
+        for model, instances in rows.items():
+            # Favorites are unique per (user, listing); drop repeats
+            model.objects.bulk_create(
+                instances, batch_size=1000,
+                ignore_conflicts=table == 'favorites')
+    return len(indexes)
+
+
+def _chunk_job(args):
+    try:
+        return generate_chunk(*args)
+    finally:
+        connections.close_all()
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Forked workers must not share the parent's connection
+    connections.close_all()
+
+
+def reset_sequences():
+    """Move PostgreSQL id sequences past the explicitly inserted keys"""
+    statements = connection.ops.sequence_reset_sql(no_style(), list(generated_models().values()))
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def generate(plan, workers=1, progress=None):
+    """
+    Insert every table of ``plan``, chunks spread over ``workers``
+    processes. ``progress(table, written, total)`` is called as chunks
+    complete. Returns ``{table: rows}``.
+    """
+    if connection.vendor == 'sqlite':
+        # SQLite allows a single writer
+        workers = 1
+    plan.locate()
+    written = {}
+    for table in TABLES:
+        total = plan.counts[table]
+        jobs = [(plan, table, chunk) for chunk in plan.chunks(table)]
+        done = 0
+        if workers > 1 and len(jobs) > 1:
+            connections.close_all()
+            with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+                for count in pool.imap_unordered(_chunk_job, jobs):
+                    done += count
+                    if progress:
+                        progress(table, done, total)
+        else:
+            for job in jobs:
+                done += generate_chunk(*job)
+                if progress:
+                    progress(table, done, total)
+        written[table] = done
+    reset_sequences()
+    return written
+
+
+def derived_steps(plan):
+    """``(label, callable)`` pairs rebuilding what signals would maintain"""
+    from accounts import ratings
+    from analytics import rollup
+    from cars import facets, fulltext, geo, pricestats, summaries, trending
+    from messaging import threads, unread
+    from moderation import cases, counters, queue
+
+    start = timezone.localdate(plan.now - timedelta(days=plan.days))
+    end = timezone.localdate(plan.now)
+    return [
+        ('listing places', lambda: geo.resolve_listings(everything=True)),
+        ('listing facet counts', facets.rebuild),
+        ('seller ratings', ratings.recompute),
+        ('listing summaries', summaries.rebuild),
+        ('full-text index', fulltext.rebuild),
+        ('price statistics', pricestats.rebuild),
+        ('message threads', threads.backfill),
+        ('unread counters', unread.reconcile),
+        ('trending scores', trending.rebuild),
+        ('report cases', cases.rebuild),
+        ('report counters', counters.rebuild),
+        ('report priorities', queue.rebuild),
+        ('analytics rollups', lambda: rollup.backfill(start, end, full=True)),
+    ]
+
+
+def rebuild_derived(plan, progress=None):
+    """Run every step of ``derived_steps``; ``progress(label)`` before each"""
+    for label, step in derived_steps(plan):
+        if progress:
+            progress(label)
+        step()
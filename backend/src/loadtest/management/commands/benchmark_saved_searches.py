@@ -0,0 +1,56 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.saved_searches import SavedSearchIndex
+from loadtest import generator
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure saved-search matching: index N synthetic saved searches in "
+        "memory and time matching synthetic new listings against them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--searches', type=int, default=1000000)
+        parser.add_argument('--listings', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        plan = generator.Plan(listings=options['listings'], seed=options['seed'])
+        plan.base = dict.fromkeys(generator.generated_models(), 1)
+
+        index = SavedSearchIndex()
+        start = time.perf_counter()
+        for profile_id in range(options['searches']):
+            index.set(profile_id, generator.saved_search(rng, plan.now.year))
+        index.prepare()
+        self.stdout.write(
+            f"Indexed {len(index)} saved search(es) in "
+            f"{time.perf_counter() - start:.1f} s")
+
+        built = generator.build_listings(plan, rng, range(options['listings']))
+        cars, listings = built.values()
+        samples = []
+        matched = 0
+        for car, listing in zip(cars, listings):
+            attributes = {
+                'make': car.make, 'model': car.model, 'fuel_type': car.fuel_type,
+                'transmission': car.transmission, 'location': listing.location,
+                'price': listing.price, 'year': car.year, 'mileage': car.mileage,
+            }
+            start = time.perf_counter()
+            matched += len(index.match(attributes))
+            samples.append((time.perf_counter() - start) * 1000)
+
+        samples.sort()
+        self.stdout.write(
+            f"Matched {len(samples)} listing(s): {matched / len(samples):.1f} "
+            f"notification(s) per listing")
+        self.stdout.write(
+            f"match ms: median {statistics.median(samples):.3f}, "
+            f"p99 {samples[int(len(samples) * 0.99) - 1]:.3f}, max {samples[-1]:.3f}")
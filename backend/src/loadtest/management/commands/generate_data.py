@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loadtest import generator
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset (users, cars, listings, "
+        "favorites, messages, reports, seller reviews, search logs) for load "
+        "testing. New rows are added after the existing ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=10000,
+                            help="Listings (and cars) to create; other tables "
+                                 "scale from this unless given")
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--favorites', type=int)
+        parser.add_argument('--messages', type=int)
+        parser.add_argument('--reports', type=int)
+        parser.add_argument('--reviews', type=int,
+                            help="Seller reviews, at most one per user")
+        parser.add_argument('--searches', type=int)
+        parser.add_argument('--days', type=int, default=365,
+                            help="Spread timestamps over this many past days")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Worker processes (PostgreSQL only)")
+        parser.add_argument('--skip-derived', action='store_true',
+                            help="Do not rebuild facets, summaries, the "
+                                 "full-text index and analytics afterwards")
+
+    def handle(self, *args, **options):
+        try:
+            plan = generator.Plan(
+                options['listings'],
+                seed=options['seed'],
+                users=options['users'],
+                favorites=options['favorites'],
+                messages=options['messages'],
+                reports=options['reports'],
+                reviews=options['reviews'],
+                searches=options['searches'],
+                days=options['days'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        last = {}
+
+        def progress(table, done, total):
+            # Report roughly every tenth of a table
+            step = max(total // 10, 1)
+            if done == total or done // step != last.get(table, 0) // step:
+                self.stdout.write(f"  {table}: {done}/{total}")
+            last[table] = done
+
+        written = generator.generate(plan, workers=options['workers'], progress=progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Generated {sum(written.values())} row(s) in {elapsed:.1f}s "
+            f"({', '.join(f'{table} {count}' for table, count in written.items())}).")
+
+        if not options['skip_derived']:
+            generator.rebuild_derived(
+                plan, progress=lambda label: self.stdout.write(f"Rebuilding {label}..."))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.perf_counter() - started:.1f}s "
+            f"(password for generated users: '{generator.PASSWORD}')."))
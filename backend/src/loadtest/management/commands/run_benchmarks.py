@@ -0,0 +1,90 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from loadtest import bench, benchmarks  # noqa: F401 (registers the benchmarks)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the ORM benchmarks (admin changelists, listing search, inbox, "
+        "moderation queue, analytics rollups) against the current database "
+        "and store the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filter', nargs='+', metavar='GLOB',
+                            help="Only run benchmarks matching these globs")
+        parser.add_argument('--list', action='store_true',
+                            help="List the benchmarks and exit")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument('--output', help="Result file (default: "
+                            "BENCHMARK_RESULTS_DIR/<time>-<commit>.json)")
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help="Result file of an earlier run to compare with")
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help="Relative slowdown reported as a regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--generate', type=int, metavar='LISTINGS',
+                            help="First run generate_data with this many listings")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed for --generate")
+
+    def handle(self, *args, **options):
+        selected = bench.select(options['filter'])
+        if not selected:
+            raise CommandError("No benchmark matches the filter.")
+        if options['list']:
+            for item in selected:
+                self.stdout.write(f"{item.name:<36} {item.doc}")
+            return
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+
+        if options['generate']:
+            call_command('generate_data', listings=options['generate'],
+                         seed=options['seed'], stdout=self.stdout)
+
+        # Only PostgreSQL reports the rows its plans read
+        show_rows = connection.vendor == 'postgresql'
+        self.stdout.write(
+            f"{'benchmark':<36} {'median ms':>10} {'min ms':>9} {'queries':>8} "
+            + (f"{'rows':>10} " if show_rows else '') + f"{'scans':>6}")
+
+        def progress(name, result):
+            if 'skipped' in result:
+                self.stdout.write(f"{name:<36} skipped: {result['skipped']}")
+                return
+            wall = result['wall_ms']
+            self.stdout.write(
+                f"{name:<36} {wall['median']:>10.2f} {wall['min']:>9.2f} "
+                f"{result['queries']:>8} "
+                + (f"{result['rows_scanned']:>10} " if show_rows else '')
+                + f"{result['table_scans']:>6}")
+
+        results = bench.run(selected, repeat=options['repeat'],
+                            warmup=options['warmup'], progress=progress)
+        document = bench.report(results)
+        path = bench.save(document, options['output'] or bench.default_output(document))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+        if options['compare']:
+            self.compare(bench.load(options['compare']), document, options)
+
+    def compare(self, baseline, document, options):
+        rows = bench.compare(baseline, document, threshold=options['threshold'])
+        self.stdout.write(
+            f"\nAgainst {baseline['meta'].get('commit') or options['compare']}:")
+        self.stdout.write(
+            f"{'benchmark':<36} {'before':>10} {'after':>10} {'ratio':>7} {'queries':>11}")
+        regressions = []
+        for name, before, after, ratio, q_before, q_after, regressed in rows:
+            line = (f"{name:<36} {before:>10.2f} {after:>10.2f} {ratio:>6.2f}x "
+                    f"{q_before:>5}->{q_after:<5}")
+            if regressed:
+                regressions.append(name)
+                line = self.style.ERROR(line + " REGRESSION")
+            self.stdout.write(line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} benchmark(s) regressed.")
@@ -0,0 +1,123 @@
+import random
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+
+from accounts.models import SellerProfile
+from cars import summaries
+from cars.models import CarListing, ListingFacetCount, ListingSummary
+from messaging.models import Conversation
+from moderation.models import ReportCounter
+
+from . import bench, generator
+from .generator import Plan
+
+
+def small_plan(seed=0, **counts):
+    return Plan(**{'listings': 60, 'users': 30, 'chunk_size': 25, 'days': 30,
+                   'seed': seed, **counts})
+
+
+class GeneratorTests(TestCase):
+
+    def rows(self, plan, table, chunk):
+        start = chunk * plan.chunk_size
+        rng = random.Random(f'{plan.seed}:{table}:{chunk}')
+        indexes = range(start, min(start + plan.chunk_size, plan.counts[table]))
+        rows = generator.BUILDERS[table](plan, rng, indexes)
+        return [(row.pk, row.price, row.location)
+                for row in rows[CarListing]]
+
+    def test_plan_validation(self):
+        with self.assertRaises(ValueError):
+            Plan(listings=10, users=3)
+        with self.assertRaises(ValueError):
+            Plan(listings=10, users=10, reviews=11)
+        self.assertEqual(Plan(listings=0, users=10).counts['messages'], 0)
+
+    def test_rows_depend_only_on_seed_and_chunk(self):
+        first, second, other = small_plan(), small_plan(), small_plan(seed=1)
+        for plan in (first, second, other):
+            plan.locate()
+        self.assertEqual(self.rows(first, 'listings', 1), self.rows(second, 'listings', 1))
+        self.assertNotEqual(self.rows(first, 'listings', 1), self.rows(other, 'listings', 1))
+
+    def test_generate_and_rebuild(self):
+        plan = small_plan()
+        written = generator.generate(plan)
+        self.assertEqual(written, plan.counts)
+        self.assertEqual(CarListing.objects.count(), 60)
+        self.assertEqual(SellerProfile.objects.count(), plan.sellers)
+        generator.rebuild_derived(plan)
+
+        self.assertEqual(summaries.rebuild(check_only=True), (60, 0, 0))
+        available = CarListing.objects.filter(status='available').count()
+        self.assertEqual(sum(ListingFacetCount.objects.filter(
+            scope='', facet='make').values_list('count', flat=True)), available)
+        self.assertTrue(Conversation.objects.exists())
+        self.assertEqual(
+            ReportCounter.objects.filter(listing__isnull=False).aggregate(n=Sum('count'))['n'],
+            ListingSummary.objects.aggregate(n=Sum('reports_count'))['n'])
+
+        # A second run adds rows after the existing keys
+        more = generator.generate(small_plan(seed=2, listings=10, users=10))
+        self.assertEqual(more['listings'], 10)
+        self.assertEqual(CarListing.objects.count(), 70)
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        registry = dict(bench.REGISTRY)
+        self.addCleanup(lambda: (bench.REGISTRY.clear(), bench.REGISTRY.update(registry)))
+        bench.REGISTRY.clear()
+
+        @bench.benchmark('test.scan')
+        def scan(state):
+            """Read every listing"""
+            list(CarListing.objects.all())
+            CarListing.objects.filter(description__contains='owner').count()
+
+        @bench.benchmark('test.write', setup=lambda: make_dataset())
+        def write(state):
+            """Delete the listings"""
+            CarListing.objects.all().delete()
+
+        @bench.benchmark('test.skip', setup=lambda: (_ for _ in ()).throw(bench.Skip('no data')))
+        def skip(state):
+            """Never runs"""
+
+        def make_dataset():
+            generator.generate(small_plan(listings=10, users=10))
+
+    def test_run_records_queries_and_rolls_back(self):
+        results = bench.run(bench.select(['test.*']), repeat=3, warmup=0)
+        self.assertEqual(results['test.skip'], {'skipped': 'no data'})
+        scan = results['test.scan']
+        self.assertEqual((scan['repeat'], scan['queries']), (3, 2))
+        self.assertGreaterEqual(scan['table_scans'], 1)
+        self.assertEqual('rows_scanned' in scan, connection.vendor == 'postgresql')
+        self.assertEqual(CarListing.objects.count(), 10)
+
+    def test_compare(self):
+        def document(ms, queries):
+            return {'results': {'a': {'wall_ms': {'median': ms}, 'queries': queries},
+                                'b': {'skipped': 'no data'}}}
+        rows = bench.compare(document(10, 2), document(10.5, 2))
+        self.assertEqual(rows, [('a', 10, 10.5, 1.05, 2, 2, False)])
+        self.assertTrue(bench.compare(document(10, 2), document(12, 2))[0][-1])
+        self.assertTrue(bench.compare(document(10, 2), document(9, 3))[0][-1])
+
+    def test_command(self):
+        output = Path(tempfile.mkdtemp()) / 'run.json'
+        self.addCleanup(output.unlink)
+        out = StringIO()
+        call_command('run_benchmarks', filter=['test.scan'], repeat=1, output=str(output),
+                     stdout=out)
+        self.assertIn('test.scan', out.getvalue())
+        self.assertEqual(list(bench.load(output)['results']), ['test.scan'])
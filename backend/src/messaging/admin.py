@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.db.models import Q
-from .models import Message
+from . import unread
+from .models import Conversation, Message
 
 
 @admin.register(Message)
@@ -64,7 +65,7 @@ class MessageAdmin(admin.ModelAdmin):
 
     def mark_as_read(self, request, queryset):
         """Admin action to mark messages as read"""
-        updated = queryset.update(is_read=True)
+        updated = unread.mark(queryset, is_read=True)
         self.message_user(
             request,
             f"{updated} message(s) marked as read."
@@ -73,9 +74,30 @@ class MessageAdmin(admin.ModelAdmin):
 
     def mark_as_unread(self, request, queryset):
         """Admin action to mark messages as unread"""
-        updated = queryset.update(is_read=False)
+        updated = unread.mark(queryset, is_read=False)
         self.message_user(
             request,
             f"{updated} message(s) marked as unread."
         )
     mark_as_unread.short_description = "Mark selected messages as unread"  # type: ignore
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    """Admin for Conversation model"""
+
+    list_display = (
+        'id', 'first_user', 'second_user', 'listing', 'message_count',
+        'last_message_at'
+    )
+    search_fields = (
+        'first_user__username', 'second_user__username',
+    )
+    ordering = ('-last_message_at',)
+    raw_id_fields = ('first_user', 'second_user', 'listing', 'last_message')
+    readonly_fields = ('message_count', 'last_message_at', 'created_at')
+
+    def get_queryset(self, request):
+        """Optimize queryset with select_related"""
+        queryset = super().get_queryset(request)
+        return queryset.select_related('first_user', 'second_user', 'listing__car')
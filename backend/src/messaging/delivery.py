@@ -0,0 +1,227 @@
+"""
+Real-time message delivery.
+
+When a message is created its receiver's open WebSockets
+(``messaging.websocket``) get it pushed, so clients need not poll the
+inbox. Delivery goes through a broker with two operations:
+``publish(channel, payload)``, callable from any thread (messages are saved
+in synchronous code) once the message's transaction has committed, and
+``subscribe(channel)``, used by the WebSocket handlers on the event loop.
+Channels are ``user:<id>``.
+
+``MESSAGING_DELIVERY_BACKEND`` names the broker class:
+
+* ``InProcessBroker`` fans publications out to the subscribers of this
+  process. Enough when one ASGI process serves every WebSocket.
+* ``RelayBroker`` sends publications to a relay (``run_delivery_relay``,
+  address ``MESSAGING_DELIVERY_RELAY``) that forwards them to every
+  connected process, each of which then fans out locally. The relay is a
+  small stand-in for a real broker; another backend (Redis pub/sub, say)
+  only has to implement ``publish`` and deliver what it receives with
+  ``deliver``.
+
+Each subscriber has a bounded queue (``MESSAGING_DELIVERY_QUEUE_SIZE``);
+when a slow client lets it fill up the oldest payloads are dropped, as the
+client can catch up from the inbox API.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """Payloads published to one channel, read on the subscriber's loop"""
+
+    def __init__(self, broker, channel, max_size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def put(self, payload):
+        # Runs on self.loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(payload)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan-out to the subscribers of this process"""
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or _setting('MESSAGING_DELIVERY_QUEUE_SIZE', 100)
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # channel -> set of Subscription
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, channel):
+        """Subscribe the running event loop to ``channel``"""
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, payload):
+        """Send ``payload`` (JSON-serializable) to the subscribers of ``channel``"""
+        self.published += 1
+        self.deliver(channel, payload)
+
+    def deliver(self, channel, payload):
+        """Hand a publication to the local subscribers of ``channel``"""
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, payload)
+            except RuntimeError:
+                # The subscriber's loop has closed
+                self.unsubscribe(subscription)
+            else:
+                self.delivered += 1
+
+    def metrics(self):
+        with self._lock:
+            channels = len(self._subscriptions)
+            subscribers = sum(len(s) for s in self._subscriptions.values())
+        return {'channels': channels, 'subscribers': subscribers,
+                'published': self.published, 'delivered': self.delivered}
+
+
+class RelayBroker(InProcessBroker):
+    """
+    Publications go through the relay so every process sees them; a reader
+    thread delivers what the relay forwards to the local subscribers.
+    Publications made while the relay is unreachable are lost.
+    """
+
+    reconnect_delay = 1.0
+
+    def __init__(self, address=None, queue_size=None):
+        super().__init__(queue_size)
+        self.address = tuple(address or _setting(
+            'MESSAGING_DELIVERY_RELAY', ('127.0.0.1', 8765)))
+        self._socket = None
+        self._send_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._thread = threading.Thread(
+            target=self._read, name='delivery-relay', daemon=True)
+        self._thread.start()
+        self.lost = 0
+
+    def publish(self, channel, payload):
+        self.published += 1
+        line = json.dumps({'channel': channel, 'payload': payload}).encode() + b'\n'
+        with self._send_lock:
+            try:
+                if self._socket is None:
+                    raise OSError("not connected")
+                self._socket.sendall(line)
+            except OSError:
+                self.lost += 1
+                logger.warning("Delivery relay %s unreachable; publication to %s lost",
+                               self.address, channel)
+
+    def _read(self):
+        while True:
+            try:
+                with socket.create_connection(self.address) as sock:
+                    self._socket = sock
+                    self._connected.set()
+                    for line in sock.makefile('rb'):
+                        publication = json.loads(line)
+                        self.deliver(publication['channel'], publication['payload'])
+            except (OSError, ValueError) as exc:
+                logger.debug("Delivery relay connection: %s", exc)
+            finally:
+                self._socket = None
+                self._connected.clear()
+            time.sleep(self.reconnect_delay)
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def metrics(self):
+        return {**super().metrics(), 'connected': self._connected.is_set(),
+                'lost': self.lost}
+
+
+async def serve_relay(host, port):
+    """Forward every line a client sends to all connected clients"""
+    clients = set()
+
+    async def handle(reader, writer):
+        clients.add(writer)
+        try:
+            while line := await reader.readline():
+                for client in list(clients):
+                    try:
+                        client.write(line)
+                    except (ConnectionError, RuntimeError):
+                        clients.discard(client)
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+_broker = None
+_broker_pid = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process's broker, built from ``MESSAGING_DELIVERY_BACKEND``"""
+    global _broker, _broker_pid
+    with _broker_lock:
+        if _broker is None or _broker_pid != os.getpid():
+            backend = import_string(_setting(
+                'MESSAGING_DELIVERY_BACKEND', 'messaging.delivery.InProcessBroker'))
+            _broker = backend()
+            _broker_pid = os.getpid()
+        return _broker
+
+
+def message_created(message):
+    """Push a new message to its receiver"""
+    from .views import serialize_message
+
+    payload = {'type': 'message', 'conversation': message.conversation_id,
+               'message': serialize_message(message)}
+    get_broker().publish(user_channel(message.receiver_id), payload)
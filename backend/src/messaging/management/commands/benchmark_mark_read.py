@@ -0,0 +1,107 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from messaging import threads, unread
+from messaging.models import ConversationParticipant, Message, UnreadCounter
+
+
+class Rollback(Exception):
+    pass
+
+
+def _counters(receiver_id, conversation_id):
+    return (
+        UnreadCounter.objects.get(user_id=receiver_id).unread_count,
+        ConversationParticipant.objects.get(
+            conversation_id=conversation_id, user_id=receiver_id).unread_count,
+        Message.objects.filter(receiver_id=receiver_id, is_read=False).count(),
+        Message.objects.filter(conversation_id=conversation_id,
+                               receiver_id=receiver_id, is_read=False).count(),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare marking a long thread read message by message with the "
+        "single-UPDATE mark_thread_read, on a synthetic thread that is "
+        "rolled back afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000,
+                            help="Messages in the synthetic thread")
+        parser.add_argument('--read-fraction', type=float, default=0.9,
+                            help="Share of the thread (oldest first) marked read")
+
+    def measure(self, label, func, receiver_id, conversation_id):
+        """Time ``func`` in a transaction that is rolled back"""
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                updated = func()
+                elapsed = (time.perf_counter() - start) * 1000
+                user, participant, user_actual, participant_actual = _counters(
+                    receiver_id, conversation_id)
+                consistent = (user, participant) == (user_actual, participant_actual)
+                self.stdout.write(
+                    f"{label:<12} {updated:>9} {elapsed:>10.1f} "
+                    f"{user:>8} {participant:>8} {'yes' if consistent else 'NO':>11}")
+                raise Rollback
+        except Rollback:
+            pass
+
+    def handle(self, *args, **options):
+        users = list(get_user_model().objects.order_by('pk')[:2])
+        if len(users) < 2:
+            raise CommandError("The benchmark needs at least two users.")
+        sender, receiver = users
+        count = options['messages']
+
+        try:
+            with transaction.atomic():
+                # The thread is created here and rolled back at the end
+                first = Message.objects.create(
+                    sender=sender, receiver=receiver, content='benchmark')
+                Message.objects.bulk_create([
+                    Message(sender=sender, receiver=receiver, content='benchmark',
+                            conversation_id=first.conversation_id)
+                    for _ in range(count - 1)
+                ], batch_size=2000)
+                threads.refresh([first.conversation_id])
+                unread.reconcile_users()
+                # Every message got its own auto_now_add timestamp
+                until = (
+                    Message.objects.filter(conversation_id=first.conversation_id)
+                    .order_by('timestamp', 'pk').values_list('timestamp', flat=True)
+                )[max(int(count * options['read_fraction']) - 1, 0)]
+                self.report(sender, receiver, first.conversation_id, until, count)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, sender, receiver, conversation_id, until, count):
+        self.stdout.write(
+            f"{count} message(s) in one thread on {connection.vendor}, "
+            f"marking those up to {until.isoformat()} read")
+        self.stdout.write(
+            f"{'method':<12} {'updated':>9} {'ms':>10} {'counter':>8} "
+            f"{'thread':>8} {'consistent':>11}")
+
+        def per_object():
+            messages = Message.objects.filter(
+                receiver=receiver, sender=sender, is_read=False, timestamp__lte=until)
+            updated = 0
+            for message in messages:
+                message.mark_as_read()
+                updated += 1
+            return updated
+
+        def single_update():
+            return unread.mark_thread_read(
+                receiver.pk, sender_id=sender.pk, until=until)['messages']
+
+        self.measure('per-object', per_object, receiver.pk, conversation_id)
+        self.measure('bulk', single_update, receiver.pk, conversation_id)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from messaging import unread
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-user and per-conversation unread message counters "
+        "from the messages and correct any that drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users, participants = unread.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Corrected {users} user counter(s) and "
+            f"{participants} conversation counter(s)."))
@@ -0,0 +1,25 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from messaging.delivery import serve_relay
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the relay that forwards real-time message deliveries between "
+        "ASGI processes using MESSAGING_DELIVERY_BACKEND = RelayBroker"
+    )
+
+    def add_arguments(self, parser):
+        host, port = getattr(settings, 'MESSAGING_DELIVERY_RELAY', ('127.0.0.1', 8765))
+        parser.add_argument('--host', default=host)
+        parser.add_argument('--port', type=int, default=port)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Relaying on {options['host']}:{options['port']}")
+        try:
+            asyncio.run(serve_relay(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from messaging import threads
+from messaging.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Attach messages without a conversation to their threads in batches, "
+        "creating conversations and participants as needed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--refresh-all', action='store_true',
+                            help="Afterwards recompute the counters and last "
+                                 "message of every conversation")
+
+    def handle(self, *args, **options):
+        threaded = threads.backfill(
+            batch_size=options['batch_size'],
+            progress=lambda n: self.stdout.write(f"  threaded {n} message(s)"))
+
+        if options['refresh_all']:
+            ids = list(Conversation.objects.values_list('pk', flat=True))
+            for start in range(0, len(ids), options['batch_size']):
+                threads.refresh(ids[start:start + options['batch_size']])
+            self.stdout.write(f"Refreshed {len(ids)} conversation(s).")
+
+        self.stdout.write(self.style.SUCCESS(f"Threaded {threaded} message(s)."))
@@ -1,10 +1,112 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.utils import timezone
 
 User = get_user_model()
 
 
+class Conversation(models.Model):
+    """A thread between two users, optionally about one listing.
+
+    ``first_user`` always has the lower id so each pair of users (per
+    listing) maps to one row. The last message and message count are kept
+    current as messages are saved (see ``messaging.threads``).
+    """
+
+    first_user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+')
+    second_user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+')
+    listing = models.ForeignKey(
+        'cars.CarListing',
+        on_delete=models.CASCADE,
+        related_name='conversations',
+        null=True,
+        blank=True
+    )
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    last_message_at = models.DateTimeField(default=timezone.now)
+    message_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'conversation'
+        verbose_name = 'Conversation'
+        verbose_name_plural = 'Conversations'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['first_user', 'second_user', 'listing'],
+                condition=Q(listing__isnull=False),
+                name='conversation_unique_listing_thread',
+            ),
+            models.UniqueConstraint(
+                fields=['first_user', 'second_user'],
+                condition=Q(listing__isnull=True),
+                name='conversation_unique_direct_thread',
+            ),
+            models.CheckConstraint(
+                condition=Q(first_user__lt=F('second_user')),
+                name='conversation_users_ordered',
+            ),
+        ]
+
+    def __str__(self):
+        about = f" about listing #{self.listing_id}" if self.listing_id else ""
+        return f"Conversation #{self.pk}{about}"
+
+
+class ConversationParticipant(models.Model):
+    """One user's view of a conversation: what the inbox lists"""
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    unread_count = models.PositiveIntegerField(default=0)
+    # Copy of Conversation.last_message_at so the inbox is one index scan
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'conversation_participant'
+        verbose_name = 'Conversation Participant'
+        verbose_name_plural = 'Conversation Participants'
+        unique_together = ['conversation', 'user']
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in conversation #{self.conversation_id}"
+
+
+class UnreadCounter(models.Model):
+    """Number of unread messages a user has received (see ``messaging.unread``)"""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='unread_counter'
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'unread_counter'
+        verbose_name = 'Unread Counter'
+        verbose_name_plural = 'Unread Counters'
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread_count} unread"
+
+
 class Message(models.Model):
 
     sender = models.ForeignKey(
@@ -25,6 +127,16 @@ class Message(models.Model):
         blank=True,
         help_text="Optional: message related to a specific listing"
     )
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='messages',
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,  # covered by the (conversation, timestamp) index
+        help_text="Set when the message is saved; see the thread_messages command"
+    )
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
@@ -39,6 +151,7 @@ class Message(models.Model):
             models.Index(fields=['receiver', 'timestamp']),
             models.Index(fields=['listing']),
             models.Index(fields=['is_read']),
+            models.Index(fields=['conversation', 'timestamp']),
         ]
 
     def clean(self):
@@ -46,9 +159,35 @@ class Message(models.Model):
             raise ValidationError(
                 "Sender and receiver cannot be the same user.")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the unread counters currently reflect, see save()
+        instance._saved_is_read = instance.__dict__.get('is_read')
+        return instance
+
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        from . import threads, unread
+
+        with transaction.atomic():
+            if self._state.adding:
+                if self.conversation_id is None:
+                    self.conversation = threads.conversation_for(
+                        self.sender_id, self.receiver_id, self.listing_id)
+                super().save(*args, **kwargs)
+                threads.record_message(self)
+            else:
+                super().save(*args, **kwargs)
+                saved = getattr(self, '_saved_is_read', None)
+                update_fields = kwargs.get('update_fields')
+                if saved is not None and saved != self.is_read and (
+                        update_fields is None or 'is_read' in update_fields):
+                    delta = -1 if self.is_read else 1
+                    unread.adjust({self.receiver_id: delta},
+                                  {(self.conversation_id, self.receiver_id): delta}
+                                  if self.conversation_id else None)
+        self._saved_is_read = self.is_read
 
     def __str__(self):
         listing_info = f" (about {self.listing.car})" if self.listing else ""
@@ -56,5 +195,7 @@ class Message(models.Model):
 
     def mark_as_read(self):
         if not self.is_read:
-            self.is_read = True
-            self.save(update_fields=['is_read'])
+            from . import unread
+
+            unread.mark(Message.objects.filter(pk=self.pk), is_read=True)
+            self.is_read = self._saved_is_read = True
@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import delivery, threads, unread
+from .models import Message
+
+
+@receiver(post_save, sender=Message)
+def push_message(sender, instance, created, raw=False, **kwargs):
+    """Deliver a new message to its receiver's WebSockets once committed"""
+    if created and not raw:
+        transaction.on_commit(lambda: delivery.message_created(instance))
+
+
+@receiver(post_delete, sender=Message)
+def refresh_conversation(sender, instance, **kwargs):
+    """Recompute the counters of a deleted message's thread and receiver"""
+    if instance.conversation_id:
+        threads.refresh([instance.conversation_id])
+    if not instance.is_read:
+        unread.adjust({instance.receiver_id: -1})
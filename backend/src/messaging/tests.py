@@ -1,3 +1,328 @@
+import asyncio
+import json
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from cars.models import Car, CarListing
+
+from . import delivery, threads, unread, websocket
+from .models import Conversation, ConversationParticipant, Message, UnreadCounter
+
+User = get_user_model()
+
+
+def make_user(name):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='secret')
+
+
+def make_listing(seller):
+    car = Car.objects.create(make='Toyota', model='Corolla', year=2018, mileage=42000,
+                             fuel_type='petrol', transmission='automatic', color='Blue',
+                             engine_size='1.8L')
+    return CarListing.objects.create(car=car, seller=seller, price=12000,
+                                     description='Clean car', location='Boston, MA')
+
+
+class MessagingTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user('seller')
+        cls.buyer = make_user('buyer')
+        cls.other = make_user('other')
+        cls.listing = make_listing(cls.seller)
+
+    def send(self, sender, receiver, content='Hello', listing=None, **fields):
+        return Message.objects.create(sender=sender, receiver=receiver, content=content,
+                                      listing=listing, **fields)
+
+    def thread_state(self):
+        conversations = list(Conversation.objects.order_by('pk').values_list(
+            'pk', 'last_message_id', 'last_message_at', 'message_count'))
+        participants = list(ConversationParticipant.objects.order_by('pk').values_list(
+            'pk', 'unread_count', 'last_message_at'))
+        return conversations, participants
+
+    def assertThreadsConsistent(self):
+        """The maintained conversation fields match a recomputation"""
+        maintained = self.thread_state()
+        threads.refresh(Conversation.objects.values_list('pk', flat=True))
+        self.assertEqual(maintained, self.thread_state())
+
+
+class ConversationTests(MessagingTestCase):
+
+    def test_messages_share_a_thread_per_pair_and_listing(self):
+        first = self.send(self.buyer, self.seller, listing=self.listing)
+        reply = self.send(self.seller, self.buyer, 'Yes', listing=self.listing)
+        general = self.send(self.buyer, self.seller)
+        self.assertEqual(first.conversation_id, reply.conversation_id)
+        self.assertNotEqual(first.conversation_id, general.conversation_id)
+
+        conversation = first.conversation
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.last_message_id), (2, reply.pk))
+        self.assertEqual(
+            dict(conversation.participants.values_list('user__username', 'unread_count')),
+            {'seller': 1, 'buyer': 1})
+        self.assertThreadsConsistent()
+
+    def test_deleted_messages(self):
+        first = self.send(self.buyer, self.seller, 'First')
+        latest = self.send(self.seller, self.buyer, 'Latest')
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.last_message_id, latest.pk)
+        latest.delete()
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.last_message_id, conversation.message_count), (first.pk, 1))
+        self.assertEqual(unread.count(self.buyer.pk), 0)
+        self.assertThreadsConsistent()
+
+    def test_backfill_threads_bulk_created_messages(self):
+        now = timezone.now()
+        Message.objects.bulk_create([
+            Message(sender=self.buyer, receiver=self.seller, content=str(i),
+                    listing=self.listing, timestamp=now + timedelta(minutes=i))
+            for i in range(3)
+        ] + [Message(sender=self.other, receiver=self.seller, content='Hi', timestamp=now)])
+        self.assertEqual(threads.backfill(batch_size=2), 4)
+        self.assertFalse(Message.objects.filter(conversation__isnull=True).exists())
+        self.assertEqual(Conversation.objects.count(), 2)
+        conversation = Conversation.objects.get(listing=self.listing)
+        self.assertEqual(conversation.message_count, 3)
+        self.assertEqual(conversation.last_message.content, '2')
+        self.assertEqual(threads.backfill(), 0)
+        self.assertThreadsConsistent()
+
+    def test_inbox_endpoint(self):
+        for i in range(3):
+            self.send(self.buyer, self.seller, f'General {i}')
+        self.send(self.other, self.seller, 'About the car', listing=self.listing)
+        self.assertEqual(self.client.get('/api/messages/conversations/').status_code, 401)
+        self.client.force_login(self.seller)
+        body = self.client.get('/api/messages/conversations/', {'page_size': 1}).json()
+        self.assertEqual([(c['with'], c['unread_count']) for c in body['results']],
+                         [('other', 1)])
+        body = self.client.get('/api/messages/conversations/',
+                               {'page_size': 1, 'cursor': body['next_cursor']}).json()
+        self.assertEqual([(c['with'], c['message_count']) for c in body['results']],
+                         [('buyer', 3)])
+        self.assertIsNone(body['next_cursor'])
+
+        conversation = body['results'][0]['id']
+        messages = self.client.get(f'/api/messages/conversations/{conversation}/').json()
+        self.assertEqual([m['content'] for m in messages['results']],
+                         ['General 2', 'General 1', 'General 0'])
+        self.client.force_login(self.other)
+        response = self.client.get(f'/api/messages/conversations/{conversation}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class UnreadCounterTests(MessagingTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def stored(self, user):
+        return UnreadCounter.objects.get(user=user).unread_count
+
+    def assertCountersConsistent(self):
+        self.assertEqual(unread.reconcile(), (0, 0))
+        self.assertThreadsConsistent()
+
+    def test_counter_follows_messages(self):
+        # Computed from the messages the first time it is read
+        self.send(self.buyer, self.seller)
+        self.assertEqual(unread.count(self.seller.pk), 1)
+        message = self.send(self.other, self.seller, listing=self.listing)
+        self.assertEqual(self.stored(self.seller), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message.is_read = True
+            message.save()
+        self.assertEqual(unread.count(self.seller.pk), 1)
+        # Saving other fields leaves the counter alone
+        message.content = 'Edited'
+        message.save(update_fields=['content'])
+        self.assertEqual(self.stored(self.seller), 1)
+        message.delete()
+        self.assertEqual(self.stored(self.seller), 1)
+        self.assertCountersConsistent()
+
+    def test_cached_count_is_dropped_on_commit(self):
+        self.send(self.buyer, self.seller)
+        self.assertEqual(unread.count(self.seller.pk), 1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            unread.mark(Message.objects.all(), is_read=True)
+        # Served from the cache until the transaction commits
+        self.assertEqual(unread.count(self.seller.pk), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(unread.count(self.seller.pk), 0)
+
+    def test_bulk_mark(self):
+        unread.count(self.seller.pk)
+        for i in range(4):
+            self.send(self.buyer, self.seller, str(i), listing=self.listing if i % 2 else None)
+        self.assertEqual(unread.mark(Message.objects.filter(content__in=['0', '1', '2']),
+                                     is_read=True), 3)
+        self.assertEqual(unread.mark(Message.objects.all(), is_read=True), 1)
+        self.assertEqual(self.stored(self.seller), 0)
+        self.assertEqual(unread.mark(Message.objects.filter(content='3'), is_read=False), 1)
+        self.assertEqual(self.stored(self.seller), 1)
+        self.assertCountersConsistent()
+
+    def test_admin_actions(self):
+        admin = User.objects.create_superuser(
+            username='root', email='root@example.com', password='secret')
+        unread.count(self.seller.pk)
+        messages = [self.send(self.buyer, self.seller, str(i)) for i in range(2)]
+        self.client.force_login(admin)
+        response = self.client.post('/admin/messaging/message/', {
+            'action': 'mark_as_read', '_selected_action': [m.pk for m in messages]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stored(self.seller), 0)
+        self.assertCountersConsistent()
+
+    def test_reconcile_fixes_drift(self):
+        unread.count(self.seller.pk)
+        self.send(self.buyer, self.seller)
+        # queryset.update() bypasses the counters
+        Message.objects.update(is_read=True)
+        self.assertEqual(unread.reconcile(), (1, 1))
+        self.assertEqual(self.stored(self.seller), 0)
+        self.assertCountersConsistent()
+        self.assertTrue(UnreadCounter.objects.filter(user=self.other).exists())
+
+    def test_endpoint(self):
+        self.send(self.buyer, self.seller)
+        self.assertEqual(self.client.get('/api/messages/unread/').status_code, 401)
+        self.client.force_login(self.seller)
+        self.assertEqual(self.client.get('/api/messages/unread/').json(), {'unread': 1})
+
+
+class DeliveryTests(MessagingTestCase):
+
+    def test_broker_fans_out_and_bounds_queues(self):
+        broker = delivery.InProcessBroker(queue_size=2)
+
+        async def scenario():
+            first = broker.subscribe('user:1')
+            second = broker.subscribe('user:1')
+            other = broker.subscribe('user:2')
+            for i in range(3):
+                broker.publish('user:1', {'n': i})
+            await asyncio.sleep(0)
+            received = [await first.get(), await first.get()]
+            self.assertEqual(received, [{'n': 1}, {'n': 2}])
+            self.assertEqual((first.dropped, second.dropped, other.queue.qsize()), (1, 1, 0))
+            for subscription in (first, second, other):
+                subscription.close()
+
+        async_to_sync(scenario)()
+        self.assertEqual(broker.metrics(), {'channels': 0, 'subscribers': 0,
+                                            'published': 3, 'delivered': 6})
+
+    def session_cookie(self, user):
+        self.client.force_login(user)
+        name = settings.SESSION_COOKIE_NAME
+        return f'{name}={self.client.cookies[name].value}'
+
+    def connect(self, headers, path=websocket.PATH):
+        """Run a WebSocket session; returns the frames sent before it ended"""
+        async def scenario():
+            receive, sent = asyncio.Queue(), asyncio.Queue()
+            await receive.put({'type': 'websocket.connect'})
+            scope = {'type': 'websocket', 'path': path,
+                     'headers': [(k.encode(), v.encode()) for k, v in headers.items()]}
+            session = asyncio.create_task(websocket.application(scope, receive.get, sent.put))
+            frames = [await sent.get()]
+            if frames[0]['type'] == 'websocket.accept':
+                message = await sync_to_async(self.send)(self.buyer, self.seller, 'Ping')
+                await sync_to_async(delivery.message_created)(message)
+                frames.append(await asyncio.wait_for(sent.get(), 5))
+                await receive.put({'type': 'websocket.disconnect'})
+            await asyncio.wait_for(session, 5)
+            return frames
+
+        return async_to_sync(scenario)()
+
+    def test_websocket_pushes_new_messages(self):
+        cookie = self.session_cookie(self.seller)
+        accepted, pushed = self.connect({'cookie': cookie})
+        self.assertEqual(accepted, {'type': 'websocket.accept'})
+        payload = json.loads(pushed['text'])
+        self.assertEqual((payload['type'], payload['message']['content']), ('message', 'Ping'))
+        self.assertEqual(delivery.get_broker().metrics()['subscribers'], 0)
+
+    def test_websocket_refusals(self):
+        cookie = self.session_cookie(self.seller)
+        for headers, path, code in (
+            ({'cookie': cookie}, '/ws/other/', websocket.CLOSE_NOT_FOUND),
+            ({'cookie': cookie, 'origin': 'https://evil.example'}, websocket.PATH,
+             websocket.CLOSE_FORBIDDEN),
+            ({}, websocket.PATH, websocket.CLOSE_UNAUTHORIZED),
+            ({'cookie': f'{settings.SESSION_COOKIE_NAME}=stale'}, websocket.PATH,
+             websocket.CLOSE_UNAUTHORIZED),
+        ):
+            self.assertEqual(self.connect(headers, path),
+                             [{'type': 'websocket.close', 'code': code}])
+
+
+class MarkReadTests(MessagingTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.general = [self.send(self.buyer, self.seller, f'General {i}') for i in range(3)]
+        self.about = self.send(self.other, self.seller, 'About the car', listing=self.listing)
+        self.client.force_login(self.seller)
+
+    def post(self, **data):
+        # Runs the cache invalidation queued for the end of the transaction
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/messages/read/', data)
+
+    def assertCountersConsistent(self):
+        self.assertEqual(unread.reconcile(), (0, 0))
+
+    def test_mark_one_sender(self):
+        body = self.post(sender=self.buyer.pk).json()
+        self.assertEqual(body, {'messages': 3, 'conversations': 1, 'unread': 1})
+        self.assertEqual(Message.objects.filter(is_read=False).get(), self.about)
+        self.assertCountersConsistent()
+
+    def test_mark_listing_and_conversation(self):
+        self.assertEqual(self.post(listing=self.listing.pk).json()['messages'], 1)
+        conversation = self.general[0].conversation_id
+        self.assertEqual(self.post(conversation=conversation).json()['messages'], 3)
+        self.assertEqual(self.post().json(), {'messages': 0, 'conversations': 0, 'unread': 0})
+        self.assertCountersConsistent()
+
+    def test_until_keeps_later_messages(self):
+        middle = self.general[1].timestamp
+        Message.objects.filter(pk=self.general[2].pk).update(
+            timestamp=middle + timedelta(minutes=5))
+        body = self.post(sender=self.buyer.pk, until=middle.isoformat()).json()
+        self.assertEqual(body['messages'], 2)
+        self.assertEqual(ConversationParticipant.objects.get(
+            user=self.seller, conversation=self.general[0].conversation_id).unread_count, 1)
+        self.assertCountersConsistent()
+
+    def test_only_received_messages(self):
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.post().json()['messages'], 0)
+        self.assertEqual(Message.objects.filter(is_read=False).count(), 4)
 
-# Create your tests here.
+    def test_errors(self):
+        for data in ({'sender': 'x'}, {'until': 'tomorrow'}):
+            self.assertEqual(self.post(**data).status_code, 400)
+        self.assertEqual(self.client.get('/api/messages/read/').status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.post().status_code, 401)
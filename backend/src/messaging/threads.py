@@ -0,0 +1,202 @@
+"""
+Conversation threading.
+
+Every message belongs to the ``Conversation`` of its two users and listing.
+When a message is created (``Message.save``) the conversation's last
+message, message count and per-participant unread counts and
+``last_message_at`` are updated in the same transaction, so an inbox is one
+indexed query on ``conversation_participant``. Messages that bypass
+``save()`` (``bulk_create``, data from before conversations existed) are
+threaded by ``backfill`` (the ``thread_messages`` command); ``refresh``
+recomputes the maintained fields of given conversations from their
+messages with set-based updates.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from . import unread
+from .models import Conversation, ConversationParticipant, Message
+
+
+def conversation_key(sender_id, receiver_id, listing_id):
+    """``(first_user_id, second_user_id, listing_id)`` of a message's thread"""
+    first, second = sorted((sender_id, receiver_id))
+    return first, second, listing_id
+
+
+def _key_lookup(key):
+    first, second, listing_id = key
+    return {'first_user_id': first, 'second_user_id': second,
+            'listing_id': listing_id}
+
+
+def conversation_for(sender_id, receiver_id, listing_id):
+    """The conversation a new message belongs to, created if needed"""
+    lookup = _key_lookup(conversation_key(sender_id, receiver_id, listing_id))
+    conversation = Conversation.objects.filter(**lookup).first()
+    if conversation is not None:
+        return conversation
+    try:
+        with transaction.atomic():
+            conversation = Conversation.objects.create(**lookup)
+            ConversationParticipant.objects.bulk_create([
+                ConversationParticipant(conversation=conversation, user_id=user_id,
+                                        last_message_at=conversation.last_message_at)
+                for user_id in (lookup['first_user_id'], lookup['second_user_id'])
+            ])
+    except IntegrityError:
+        # Created concurrently by the other participant
+        conversation = Conversation.objects.get(**lookup)
+    return conversation
+
+
+def record_message(message):
+    """Move a conversation's pointers and counters past a new message"""
+    timestamp = message.timestamp
+    Conversation.objects.filter(pk=message.conversation_id).update(
+        message_count=F('message_count') + 1)
+    # Messages can be saved out of order (e.g. imports); only move forward
+    newer = Q(last_message_at__lte=timestamp) | Q(last_message__isnull=True)
+    Conversation.objects.filter(newer, pk=message.conversation_id).update(
+        last_message=message, last_message_at=timestamp)
+    participants = ConversationParticipant.objects.filter(
+        conversation_id=message.conversation_id)
+    participants.filter(last_message_at__lte=timestamp).update(
+        last_message_at=timestamp)
+    if not message.is_read:
+        participants.filter(user_id=message.receiver_id).update(
+            unread_count=F('unread_count') + 1)
+        unread.adjust({message.receiver_id: 1})
+
+
+def _subquery(queryset, output_field=None):
+    return Subquery(queryset[:1], output_field=output_field)
+
+
+def refresh(conversation_ids):
+    """
+    Recompute the last message, message count, unread counts and
+    ``last_message_at`` of the given conversations from their messages.
+    """
+    conversation_ids = list(conversation_ids)
+    if not conversation_ids:
+        return
+    messages = Message.objects.filter(conversation_id=OuterRef('pk'))
+    latest = messages.order_by('-timestamp', '-pk')
+    Conversation.objects.filter(pk__in=conversation_ids).update(
+        last_message_id=_subquery(latest.values('pk')),
+        last_message_at=Coalesce(_subquery(latest.values('timestamp')), F('created_at')),
+        message_count=Coalesce(_subquery(
+            messages.order_by().values('conversation_id')
+            .annotate(n=Count('pk')).values('n'),
+            IntegerField()), Value(0)),
+    )
+    participants = ConversationParticipant.objects.filter(
+        conversation_id__in=conversation_ids)
+    participants.update(
+        unread_count=0,
+        last_message_at=Subquery(
+            Conversation.objects.filter(pk=OuterRef('conversation_id'))
+            .values('last_message_at')[:1]),
+    )
+    # One grouped scan of the conversations' messages rather than a count
+    # per participant, then one UPDATE per distinct count
+    unread = (
+        Message.objects.filter(conversation_id__in=conversation_ids, is_read=False)
+        .order_by().values_list('conversation_id', 'receiver_id')
+        .annotate(n=Count('pk'))
+    )
+    counts = {(conversation_id, user_id): n for conversation_id, user_id, n in unread}
+    by_count = defaultdict(list)
+    for pk, conversation_id, user_id in participants.values_list(
+            'pk', 'conversation_id', 'user_id'):
+        n = counts.get((conversation_id, user_id))
+        if n:
+            by_count[n].append(pk)
+    for n, pks in by_count.items():
+        ConversationParticipant.objects.filter(pk__in=pks).update(unread_count=n)
+
+
+def thread_batch(messages):
+    """
+    Attach unthreaded ``messages`` to their conversations, creating the
+    missing ones. Returns the ids of the conversations touched.
+    """
+    keys = {conversation_key(m.sender_id, m.receiver_id, m.listing_id): None
+            for m in messages}
+    firsts = {key[0] for key in keys}
+    existing = Conversation.objects.filter(
+        first_user_id__in=firsts,
+        second_user_id__in={key[1] for key in keys},
+    ).values_list('pk', 'first_user_id', 'second_user_id', 'listing_id')
+    for pk, first, second, listing_id in existing:
+        if (first, second, listing_id) in keys:
+            keys[(first, second, listing_id)] = pk
+
+    missing = [key for key, pk in keys.items() if pk is None]
+    if missing:
+        Conversation.objects.bulk_create(
+            [Conversation(**_key_lookup(key)) for key in missing],
+            ignore_conflicts=True)
+        created = Conversation.objects.filter(
+            first_user_id__in={key[0] for key in missing},
+            second_user_id__in={key[1] for key in missing},
+        ).values_list('pk', 'first_user_id', 'second_user_id', 'listing_id')
+        for pk, first, second, listing_id in created:
+            if keys.get((first, second, listing_id), 0) is None:
+                keys[(first, second, listing_id)] = pk
+        ConversationParticipant.objects.bulk_create(
+            [ConversationParticipant(conversation_id=keys[key], user_id=user_id)
+             for key in missing for user_id in key[:2]],
+            ignore_conflicts=True)
+
+    # Point the messages at their conversations with a correlated UPDATE
+    # rather than a CASE over every message
+    thread = Conversation.objects.filter(
+        first_user_id=Least(OuterRef('sender_id'), OuterRef('receiver_id')),
+        second_user_id=Greatest(OuterRef('sender_id'), OuterRef('receiver_id')),
+    )
+    batch = Message.objects.filter(pk__in=[message.pk for message in messages])
+    batch.filter(listing__isnull=False).update(conversation_id=_subquery(
+        thread.filter(listing_id=OuterRef('listing_id')).values('pk')))
+    batch.filter(listing__isnull=True).update(conversation_id=_subquery(
+        thread.filter(listing__isnull=True).values('pk')))
+    return set(keys.values())
+
+
+def backfill(batch_size=1000, progress=None):
+    """
+    Thread every message without a conversation, oldest first, one batch
+    per transaction. ``progress(threaded)`` is called after each batch.
+    Returns the number of messages threaded.
+    """
+    threaded = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            Message.objects.filter(conversation__isnull=True, pk__gt=last_pk)
+            .only('pk', 'sender_id', 'receiver_id', 'listing_id')
+            .order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return threaded
+        last_pk = batch[-1].pk
+        with transaction.atomic():
+            refresh(thread_batch(batch))
+        threaded += len(batch)
+        if progress:
+            progress(threaded)
+
+
+def inbox(user_id):
+    """Inbox entries of a user; order by ``('-last_message_at', '-id')``"""
+    return (
+        ConversationParticipant.objects.filter(user_id=user_id)
+        .select_related(
+            'conversation__first_user', 'conversation__second_user',
+            'conversation__last_message', 'conversation__listing__car',
+        )
+    )
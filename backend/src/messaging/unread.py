@@ -0,0 +1,229 @@
+"""
+Maintained unread-message counters.
+
+Each user's unread count is kept in ``UnreadCounter`` and each
+conversation participant's in ``ConversationParticipant.unread_count``, so
+"how many unread messages do I have" is a primary key lookup (usually a
+cache hit) rather than ``COUNT(*) WHERE receiver = ? AND NOT is_read``.
+
+Counters move by deltas in the transaction that changes the messages:
+sending (``threads.record_message``), ``Message.save``/``mark_as_read``
+and the admin bulk actions (``mark``), which lock the affected messages,
+update them in one statement and apply one ``UPDATE`` per distinct delta.
+``mark_thread_read`` marks a whole thread or listing read up to a time
+without selecting the messages at all.
+Cached counts are dropped once that transaction commits, and expire after
+``MESSAGING_UNREAD_CACHE_TIMEOUT`` seconds so a read racing a commit can
+only serve a stale count briefly. A user's counter row is created from the
+messages the first time it is read; ``reconcile`` (the
+``reconcile_unread_counts`` command) recomputes every counter and fixes any
+drift, e.g. from ``queryset.update()`` calls elsewhere.
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Conversation, ConversationParticipant, Message, UnreadCounter
+
+
+def cache_key(user_id):
+    return f'messaging:unread:{user_id}'
+
+
+def _invalidate(user_ids):
+    keys = [cache_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def count(user_id):
+    """Number of unread messages received by a user"""
+    key = cache_key(user_id)
+    unread = cache.get(key)
+    if unread is not None:
+        return unread
+    unread = (UnreadCounter.objects.filter(user_id=user_id)
+              .values_list('unread_count', flat=True).first())
+    if unread is None:
+        unread = Message.objects.filter(receiver_id=user_id, is_read=False).count()
+        UnreadCounter.objects.get_or_create(
+            user_id=user_id, defaults={'unread_count': unread})
+    cache.set(key, unread, getattr(settings, 'MESSAGING_UNREAD_CACHE_TIMEOUT', 60))
+    return unread
+
+
+def _apply(queryset, pks_by_delta):
+    for delta, pks in pks_by_delta.items():
+        if delta:
+            queryset.filter(pk__in=pks).update(
+                unread_count=Greatest(F('unread_count') + Value(delta), Value(0)))
+
+
+def adjust(user_deltas, participant_deltas=None):
+    """
+    Add ``{user_id: delta}`` to user counters and
+    ``{(conversation_id, user_id): delta}`` to participant counters, one
+    UPDATE per distinct delta. Users without a counter row are skipped;
+    theirs is computed when first read.
+    """
+    by_delta = defaultdict(list)
+    for user_id, delta in user_deltas.items():
+        by_delta[delta].append(user_id)
+    _apply(UnreadCounter.objects.all(), by_delta)
+    _invalidate(user_deltas)
+
+    if participant_deltas:
+        by_delta = defaultdict(list)
+        participants = ConversationParticipant.objects.filter(
+            conversation_id__in={key[0] for key in participant_deltas},
+        ).values_list('pk', 'conversation_id', 'user_id')
+        for pk, conversation_id, user_id in participants:
+            delta = participant_deltas.get((conversation_id, user_id))
+            if delta:
+                by_delta[delta].append(pk)
+        _apply(ConversationParticipant.objects.all(), by_delta)
+
+
+def mark(queryset, is_read):
+    """
+    Set ``is_read`` on the messages of ``queryset`` and move the counters
+    of their receivers and conversations. Returns the number of messages
+    changed.
+    """
+    sign = -1 if is_read else 1
+    with transaction.atomic():
+        rows = list(
+            queryset.exclude(is_read=is_read).select_for_update().order_by()
+            .values_list('pk', 'conversation_id', 'receiver_id')
+        )
+        if not rows:
+            return 0
+        Message.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(is_read=is_read)
+        users = Counter()
+        participants = Counter()
+        for _, conversation_id, receiver_id in rows:
+            users[receiver_id] += sign
+            if conversation_id:
+                participants[(conversation_id, receiver_id)] += sign
+        adjust(users, participants)
+    return len(rows)
+
+
+def mark_thread_read(receiver_id, sender_id=None, listing_id=None,
+                     conversation_id=None, until=None):
+    """
+    Mark read every unread message received by ``receiver_id`` up to
+    ``until`` (default: now), optionally only those from ``sender_id``,
+    about ``listing_id`` or in ``conversation_id``, with a single UPDATE
+    driven by the ``(receiver, timestamp)`` index; no message is loaded.
+
+    The receiver's counter drops by the number of messages updated and the
+    unread counts of the receiver's affected conversations are recomputed
+    in one more UPDATE. Returns ``{'messages': updated, 'conversations':
+    conversations recounted}``.
+    """
+    filters = {'receiver_id': receiver_id, 'is_read': False,
+               'timestamp__lte': until or timezone.now()}
+    participants = ConversationParticipant.objects.filter(
+        user_id=receiver_id, unread_count__gt=0)
+    if sender_id is not None:
+        filters['sender_id'] = sender_id
+        with_sender = (Q(conversation__first_user_id=sender_id)
+                       | Q(conversation__second_user_id=sender_id))
+        participants = participants.filter(with_sender)
+    if listing_id is not None:
+        filters['listing_id'] = listing_id
+        participants = participants.filter(conversation__listing_id=listing_id)
+    if conversation_id is not None:
+        filters['conversation_id'] = conversation_id
+        participants = participants.filter(conversation_id=conversation_id)
+
+    with transaction.atomic():
+        updated = Message.objects.filter(**filters).update(is_read=True)
+        conversations = 0
+        if updated:
+            adjust({receiver_id: -updated})
+            remaining = (
+                Message.objects.filter(
+                    conversation_id=OuterRef('conversation_id'),
+                    receiver_id=receiver_id, is_read=False)
+                .order_by().values('conversation_id')
+                .annotate(n=Count('pk')).values('n')[:1]
+            )
+            conversations = participants.update(unread_count=Coalesce(
+                Subquery(remaining, output_field=IntegerField()), Value(0)))
+    return {'messages': updated, 'conversations': conversations}
+
+
+def _fix(queryset, stored, actual):
+    """Set the counters (``{pk: value}``) whose stored value is not the actual one"""
+    by_value = defaultdict(list)
+    for pk, value in stored.items():
+        if value != actual.get(pk, 0):
+            by_value[actual.get(pk, 0)].append(pk)
+    for value, pks in by_value.items():
+        queryset.filter(pk__in=pks).update(unread_count=value)
+    return sum(len(pks) for pks in by_value.values())
+
+
+def reconcile_users(batch_size=1000):
+    """Recompute every user counter; returns the number corrected"""
+    corrected = 0
+    users = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+    last_pk = 0
+    while True:
+        pks = list(users.filter(pk__gt=last_pk)[:batch_size])
+        if not pks:
+            return corrected
+        last_pk = pks[-1]
+        with transaction.atomic():
+            actual = dict(
+                Message.objects.filter(receiver_id__in=pks, is_read=False)
+                .order_by().values_list('receiver_id').annotate(n=Count('pk')))
+            stored = dict(
+                UnreadCounter.objects.filter(user_id__in=pks)
+                .values_list('user_id', 'unread_count'))
+            missing = [UnreadCounter(user_id=pk, unread_count=actual.get(pk, 0))
+                       for pk in pks if pk not in stored]
+            UnreadCounter.objects.bulk_create(missing, ignore_conflicts=True)
+            corrected += _fix(UnreadCounter.objects.all(), stored, actual)
+            _invalidate(pks)
+
+
+def reconcile_participants(batch_size=1000):
+    """Recompute every participant counter; returns the number corrected"""
+    corrected = 0
+    last_pk = 0
+    while True:
+        conversation_ids = list(
+            Conversation.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size])
+        if not conversation_ids:
+            return corrected
+        last_pk = conversation_ids[-1]
+        with transaction.atomic():
+            unread = dict(
+                ((conversation_id, receiver_id), n) for conversation_id, receiver_id, n in
+                Message.objects.filter(conversation_id__in=conversation_ids, is_read=False)
+                .order_by().values_list('conversation_id', 'receiver_id')
+                .annotate(n=Count('pk')))
+            stored = {}
+            actual = {}
+            for pk, conversation_id, user_id, unread_count in (
+                    ConversationParticipant.objects.filter(
+                        conversation_id__in=conversation_ids)
+                    .values_list('pk', 'conversation_id', 'user_id', 'unread_count')):
+                stored[pk] = unread_count
+                actual[pk] = unread.get((conversation_id, user_id), 0)
+            corrected += _fix(ConversationParticipant.objects.all(), stored, actual)
+
+
+def reconcile(batch_size=1000):
+    """``(users_corrected, participants_corrected)`` after recomputing all counters"""
+    return reconcile_users(batch_size), reconcile_participants(batch_size)
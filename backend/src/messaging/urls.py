@@ -0,0 +1,15 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'messaging'
+
+urlpatterns = [
+    path('inbox/', views.inbox, name='inbox'),
+    path('sent/', views.sent, name='sent'),
+    path('unread/', views.unread_count, name='unread-count'),
+    path('read/', views.mark_read, name='mark-read'),
+    path('conversations/', views.conversations, name='conversations'),
+    path('conversations/<int:pk>/', views.conversation_messages,
+         name='conversation-messages'),
+]
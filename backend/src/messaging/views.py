@@ -1,3 +1,138 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET, require_POST
 
-# Create your views here.
+from carzone.pagination import CursorPaginator, page_size_from
+
+from . import threads, unread
+from .models import ConversationParticipant, Message
+
+
+def serialize_message(message):
+    """Plain-dict representation of a message for JSON responses"""
+    return {
+        'id': message.id,
+        'sender': message.sender.username,
+        'receiver': message.receiver.username,
+        'listing': message.listing_id,
+        'content': message.content,
+        'is_read': message.is_read,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def serialize_conversation(participant):
+    """Plain-dict representation of an inbox entry for JSON responses"""
+    conversation = participant.conversation
+    other = (conversation.second_user
+             if conversation.first_user_id == participant.user_id
+             else conversation.first_user)
+    last = conversation.last_message
+    return {
+        'id': conversation.id,
+        'with': other.username,
+        'listing': conversation.listing_id,
+        'listing_title': str(conversation.listing.car) if conversation.listing else None,
+        'message_count': conversation.message_count,
+        'unread_count': participant.unread_count,
+        'last_message': {
+            'sender': (conversation.first_user if last.sender_id == conversation.first_user_id
+                       else conversation.second_user).username,
+            'content': last.content[:200],
+            'timestamp': last.timestamp.isoformat(),
+        } if last else None,
+        'last_message_at': participant.last_message_at.isoformat(),
+    }
+
+
+def _feed(request, queryset, ordering, serialize):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    try:
+        paginator = CursorPaginator(
+            queryset, ordering=ordering, page_size=page_size_from(request))
+        page = paginator.page(request.GET.get('cursor'))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({
+        'next_cursor': page.next_cursor,
+        'results': [serialize(item) for item in page],
+    })
+
+
+def _message_feed(request, queryset):
+    return _feed(request, queryset.select_related('sender', 'receiver'),
+                 ('-timestamp', '-id'), serialize_message)
+
+
+@require_GET
+def inbox(request):
+    """Messages received by the current user, newest first"""
+    return _message_feed(
+        request, Message.objects.filter(receiver_id=request.user.pk))
+
+
+@require_GET
+def sent(request):
+    """Messages sent by the current user, newest first"""
+    return _message_feed(
+        request, Message.objects.filter(sender_id=request.user.pk))
+
+
+@require_GET
+def conversations(request):
+    """The current user's conversations, most recently active first"""
+    return _feed(request, threads.inbox(request.user.pk),
+                 ('-last_message_at', '-id'), serialize_conversation)
+
+
+@require_GET
+def conversation_messages(request, pk):
+    """Messages of one of the current user's conversations, newest first"""
+    if request.user.is_authenticated and not ConversationParticipant.objects.filter(
+            conversation_id=pk, user_id=request.user.pk).exists():
+        return JsonResponse({'error': 'Conversation not found.'}, status=404)
+    return _message_feed(request, Message.objects.filter(conversation_id=pk))
+
+
+@require_GET
+def unread_count(request):
+    """Number of unread messages of the current user"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    return JsonResponse({'unread': unread.count(request.user.pk)})
+
+
+def _optional_int(request, name):
+    value = request.POST.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}.")
+
+
+@require_POST
+def mark_read(request):
+    """
+    Mark the current user's received messages read, optionally only those
+    from ``sender``, about ``listing`` or in ``conversation`` and up to
+    ``until`` (ISO 8601)
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    try:
+        filters = {name: _optional_int(request, name)
+                   for name in ('sender', 'listing', 'conversation')}
+        until = request.POST.get('until')
+        if until:
+            until = parse_datetime(until)
+            if until is None:
+                raise ValueError("Invalid until.")
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    counts = unread.mark_thread_read(
+        request.user.pk, sender_id=filters['sender'], listing_id=filters['listing'],
+        conversation_id=filters['conversation'], until=until or None)
+    return JsonResponse({**counts, 'unread': unread.count(request.user.pk)})
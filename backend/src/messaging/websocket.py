@@ -0,0 +1,106 @@
+"""
+WebSocket endpoint pushing new messages to their receiver.
+
+``carzone.asgi`` routes WebSocket connections to ``application``. A client
+opens ``/ws/messages/`` with its session cookie and then receives one JSON
+text frame per message sent to it (see ``delivery.message_created``)::
+
+    {"type": "message", "conversation": 12, "message": {...}}
+
+Connections from other sites' pages (``Origin`` not in ``ALLOWED_HOSTS``)
+and without a logged-in session are refused.
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.request import validate_host
+
+from .delivery import get_broker, user_channel
+
+PATH = '/ws/messages/'
+
+# Close codes in the 4000-4999 range reserved for applications
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+CLOSE_UNAUTHORIZED = 4401
+
+
+def _headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1')
+            for name, value in scope.get('headers', ())}
+
+
+def _origin_allowed(headers):
+    origin = headers.get('origin')
+    if origin is None:
+        # Not a browser; cookies are not sent cross-site without one
+        return True
+    allowed = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed:
+        allowed = ['.localhost', '127.0.0.1', '[::1]']
+    host = urlsplit(origin).hostname or ''
+    return validate_host(host, allowed)
+
+
+@sync_to_async
+def _user_id(headers):
+    """Id of the user logged in with the request's session cookie, or None"""
+    cookie = SimpleCookie()
+    cookie.load(headers.get('cookie', ''))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    close_old_connections()
+    try:
+        request = HttpRequest()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+            morsel.value)
+        user = get_user(request)
+        return user.pk if user.is_authenticated else None
+    finally:
+        close_old_connections()
+
+
+async def _forward(subscription, send):
+    while True:
+        payload = await subscription.get()
+        await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+
+async def application(scope, receive, send):
+    """ASGI application for WebSocket connections"""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    headers = _headers(scope)
+    if scope['path'] != PATH:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    if not _origin_allowed(headers):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+    user_id = await _user_id(headers)
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    subscription = get_broker().subscribe(user_channel(user_id))
+    forwarder = None
+    try:
+        await send({'type': 'websocket.accept'})
+        forwarder = asyncio.create_task(_forward(subscription, send))
+        # Frames from the client are ignored; wait for it to go away
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+    finally:
+        subscription.close()
+        if forwarder is not None:
+            forwarder.cancel()
@@ -1,7 +1,28 @@
 from django.contrib import admin
+from django.shortcuts import redirect
+from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils import timezone
-from .models import Report
+from django.views.decorators.http import require_POST
+from . import cases, queue
+from .models import Report, ReportCase
+
+
+class QueueFilter(admin.SimpleListFilter):
+    """Pending reports claimed by the current moderator, or still unclaimed"""
+
+    title = 'work queue'
+    parameter_name = 'queue'
+
+    def lookups(self, request, model_admin):
+        return (('mine', 'Claimed by me'), ('unclaimed', 'Unclaimed'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'mine':
+            return queryset.filter(status='pending', claimed_by=request.user)
+        if self.value() == 'unclaimed':
+            return queryset.filter(status='pending', claimed_by__isnull=True)
+        return queryset
 
 
 @admin.register(Report)
@@ -9,10 +30,10 @@ class ReportAdmin(admin.ModelAdmin):
     """Admin for Report model"""
 
     list_display = (
-        'reporter', 'target_info', 'reason', 'status',
-        'reviewed_by', 'created_at'
+        'reporter', 'target_info', 'reason', 'status', 'priority',
+        'claimed_by', 'reviewed_by', 'created_at'
     )
-    list_filter = ('reason', 'status', 'created_at', 'reviewed_at')
+    list_filter = (QueueFilter, 'reason', 'status', 'created_at', 'reviewed_at')
     search_fields = (
         'reporter__username', 'reporter__email',
         'reported_user__username', 'reported_user__email',
@@ -27,27 +48,53 @@ class ReportAdmin(admin.ModelAdmin):
             'fields': ('reporter', 'reason', 'description')
         }),
         ('Reported Content', {
-            'fields': ('reported_listing', 'reported_user')
+            'fields': ('reported_listing', 'reported_user', 'case')
         }),
         ('Review Status', {
             'fields': ('status', 'reviewed_by', 'reviewed_at', 'admin_notes')
         }),
+        ('Work Queue', {
+            'fields': ('priority', 'claimed_by', 'claimed_at'),
+            'classes': ('collapse',)
+        }),
         ('Timestamps', {
             'fields': ('created_at',),
             'classes': ('collapse',)
         }),
     )
 
-    readonly_fields = ('created_at', 'reviewed_at')
+    readonly_fields = ('created_at', 'reviewed_at', 'priority', 'claimed_by', 'claimed_at',
+                       'case')
 
     def get_queryset(self, request):
         """Optimize queryset with select_related"""
         queryset = super().get_queryset(request)
         return queryset.select_related(
-            'reporter', 'reported_user', 'reviewed_by',
+            'reporter', 'reported_user', 'reviewed_by', 'claimed_by',
             'reported_listing', 'reported_listing__car'
         )
 
+    def get_ordering(self, request):
+        """Highest ranked first in the work queue views"""
+        if request.GET.get(QueueFilter.parameter_name):
+            return (queue.queue_score().desc(), 'id')
+        return super().get_ordering(request)
+
+    def get_urls(self):
+        """Add the claim-next-batch view"""
+        # Claiming changes state: POST only, so admin_view's CSRF check applies
+        claim = path('claim/', self.admin_site.admin_view(require_POST(self.claim_view)),
+                     name='moderation_report_claim')
+        return [claim] + super().get_urls()
+
+    def claim_view(self, request):
+        """Claim the next batch of the queue and show the moderator's claims"""
+        if not self.has_change_permission(request):
+            return redirect('admin:index')
+        claimed = queue.claim(request.user)
+        self.message_user(request, f"{len(claimed)} report(s) claimed.")
+        return redirect(f"{reverse('admin:moderation_report_changelist')}?queue=mine")
+
     def target_info(self, obj):
         """Display what was reported"""
         if obj.reported_listing:
@@ -69,11 +116,7 @@ class ReportAdmin(admin.ModelAdmin):
 
     def mark_as_reviewed(self, request, queryset):
         """Admin action to mark reports as reviewed"""
-        updated = queryset.filter(status='pending').update(
-            status='reviewed',
-            reviewed_by=request.user,
-            reviewed_at=timezone.now()
-        )
+        updated = cases.decide(queryset.filter(status='pending'), 'reviewed', request.user)
         self.message_user(
             request,
             f"{updated} report(s) marked as reviewed."
@@ -82,11 +125,7 @@ class ReportAdmin(admin.ModelAdmin):
 
     def mark_as_resolved(self, request, queryset):
         """Admin action to mark reports as resolved"""
-        updated = queryset.exclude(status='resolved').update(
-            status='resolved',
-            reviewed_by=request.user,
-            reviewed_at=timezone.now()
-        )
+        updated = cases.decide(queryset.exclude(status='resolved'), 'resolved', request.user)
         self.message_user(
             request,
             f"{updated} report(s) marked as resolved."
@@ -95,11 +134,7 @@ class ReportAdmin(admin.ModelAdmin):
 
     def mark_as_dismissed(self, request, queryset):
         """Admin action to mark reports as dismissed"""
-        updated = queryset.exclude(status='dismissed').update(
-            status='dismissed',
-            reviewed_by=request.user,
-            reviewed_at=timezone.now()
-        )
+        updated = cases.decide(queryset.exclude(status='dismissed'), 'dismissed', request.user)
         self.message_user(
             request,
             f"{updated} report(s) marked as dismissed."
@@ -113,3 +148,72 @@ class ReportAdmin(admin.ModelAdmin):
                 obj.reviewed_by = request.user
                 obj.reviewed_at = timezone.now()
         super().save_model(request, obj, form, change)
+
+
+@admin.register(ReportCase)
+class ReportCaseAdmin(admin.ModelAdmin):
+    """Admin for report cases: one row and one decision per reported target"""
+
+    list_display = (
+        'target_info', 'report_count', 'pending_count', 'reason_summary',
+        'first_seen', 'last_seen'
+    )
+    list_filter = ('last_seen',)
+    search_fields = ('reported_user__username', 'reported_user__email')
+    ordering = ('-pending_count', '-last_seen')
+    readonly_fields = (
+        'reported_listing', 'reported_user', 'report_count', 'pending_count',
+        'reasons', 'first_seen', 'last_seen'
+    )
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        """Optimize queryset with select_related"""
+        queryset = super().get_queryset(request)
+        return queryset.select_related(
+            'reported_user', 'reported_listing', 'reported_listing__car')
+
+    def has_add_permission(self, request):
+        """Cases are created from reports"""
+        return False
+
+    def target_info(self, obj):
+        """Display what the case is about"""
+        if obj.reported_listing_id:
+            return format_html(
+                'Listing: <a href="/admin/cars/carlisting/{}/change/">{}</a>',
+                obj.reported_listing_id,
+                f"{obj.reported_listing.car} - ${obj.reported_listing.price}"
+            )
+        return format_html(
+            'User: <a href="/admin/accounts/user/{}/change/">{}</a>',
+            obj.reported_user_id,
+            obj.reported_user.username
+        )
+    target_info.short_description = 'Reported Target'  # type: ignore
+
+    def reason_summary(self, obj):
+        """Display the reasons given, most frequent first"""
+        reasons = sorted(obj.reasons.items(), key=lambda item: -item[1])
+        return ', '.join(f"{reason} ({count})" for reason, count in reasons)
+    reason_summary.short_description = 'Reasons'  # type: ignore
+
+    actions = ['mark_as_reviewed', 'mark_as_resolved', 'mark_as_dismissed']
+
+    def mark_as_reviewed(self, request, queryset):
+        """Admin action to mark the pending reports of the cases as reviewed"""
+        updated = cases.decide_cases(queryset, 'reviewed', request.user)
+        self.message_user(request, f"{updated} report(s) marked as reviewed.")
+    mark_as_reviewed.short_description = "Mark reports of selected cases as reviewed"  # type: ignore
+
+    def mark_as_resolved(self, request, queryset):
+        """Admin action to mark every report of the cases as resolved"""
+        updated = cases.decide_cases(queryset, 'resolved', request.user)
+        self.message_user(request, f"{updated} report(s) marked as resolved.")
+    mark_as_resolved.short_description = "Mark reports of selected cases as resolved"  # type: ignore
+
+    def mark_as_dismissed(self, request, queryset):
+        """Admin action to mark every report of the cases as dismissed"""
+        updated = cases.decide_cases(queryset, 'dismissed', request.user)
+        self.message_user(request, f"{updated} report(s) marked as dismissed.")
+    mark_as_dismissed.short_description = "Mark reports of selected cases as dismissed"  # type: ignore
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ModerationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'moderation'
+
+    def ready(self):
+        from carzone.instrumentation import registry
+
+        from . import signals  # noqa: F401
+        from .risk import scorer
+        registry.register_provider('carzone_risk_scorer', scorer.metrics)
@@ -0,0 +1,160 @@
+"""
+Report cases: the reports about one target coalesced into one unit of work.
+
+A scam listing can collect hundreds of reports with the same reason;
+reviewing them one by one repeats the same decision. Every report belongs
+to the ``ReportCase`` of its target (its listing, or its user when no
+listing is reported), which keeps the number of reports, how many are
+still pending, the first and last report time and a histogram of reasons.
+
+``Report.save()`` maintains the case: a new report locks its case row and
+bumps the counters (constant work whatever the case size); a report whose
+status, reason or target changed has the affected cases recounted from
+their reports, one grouped query. Bulk decisions (``decide``) update all
+member reports in one statement, then recount the cases and re-rank the
+pending reports of their reporters in the work queue
+(``moderation.queue``). ``rebuild`` regroups every report, e.g. after
+reports were bulk-loaded.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from . import counters, queue
+
+
+def _models(report_model=None, case_model=None):
+    from .models import Report, ReportCase
+
+    return report_model or Report, case_model or ReportCase
+
+
+def _target_lookup(listing_id, user_id):
+    if listing_id:
+        return {'reported_listing_id': listing_id}
+    return {'reported_listing__isnull': True, 'reported_user_id': user_id}
+
+
+def case_for(report):
+    """The ``ReportCase`` of ``report``'s target, created if needed"""
+    _, ReportCase = _models()
+    case, _ = ReportCase.objects.get_or_create(
+        **_target_lookup(report.reported_listing_id, report.reported_user_id))
+    return case
+
+
+def report_saved(report, created, previous_case_id=None, fields=None):
+    """
+    Keep the case counters of a just-saved ``report`` current; ``fields``
+    are the tracked fields the save wrote (all by default)
+    """
+    _, ReportCase = _models()
+    if created:
+        case = ReportCase.objects.select_for_update().get(pk=report.case_id)
+        case.report_count += 1
+        case.pending_count += report.status == 'pending'
+        case.reasons[report.reason] = case.reasons.get(report.reason, 0) + 1
+        case.first_seen = min(filter(None, (case.first_seen, report.created_at)))
+        case.last_seen = max(filter(None, (case.last_seen, report.created_at)))
+        case.save()
+        return
+    if (report.case_id != previous_case_id
+            or report.changed_fields(
+                {'status', 'reason'} & set(report.TRACKED_FIELDS if fields is None else fields))):
+        refresh({report.case_id, previous_case_id})
+
+
+def refresh(case_ids, report_model=None, case_model=None):
+    """Recount the cases ``case_ids`` from their reports; empty cases are deleted"""
+    Report, ReportCase = _models(report_model, case_model)
+    case_ids = {pk for pk in case_ids if pk is not None}
+    if not case_ids:
+        return
+    members = Report.objects.filter(case_id__in=case_ids).order_by()
+    totals = {
+        row['case_id']: row for row in members.values('case_id').annotate(
+            n=Count('pk'), pending=Count('pk', filter=Q(status='pending')),
+            first=Min('created_at'), last=Max('created_at'))
+    }
+    reasons = defaultdict(dict)
+    for row in members.values('case_id', 'reason').annotate(n=Count('pk')):
+        reasons[row['case_id']][row['reason']] = row['n']
+    with transaction.atomic():
+        ReportCase.objects.filter(pk__in=case_ids - totals.keys()).delete()
+        ReportCase.objects.bulk_update([
+            ReportCase(pk=case_id, report_count=row['n'], pending_count=row['pending'],
+                       first_seen=row['first'], last_seen=row['last'],
+                       reasons=reasons[case_id])
+            for case_id, row in totals.items()
+        ], ['report_count', 'pending_count', 'first_seen', 'last_seen', 'reasons'],
+            batch_size=500)
+
+
+def rebuild(report_model=None, case_model=None):
+    """Regroup every report into cases from scratch; returns the number of cases"""
+    Report, ReportCase = _models(report_model, case_model)
+    groups = (
+        (Report.objects.filter(reported_listing__isnull=False), 'reported_listing_id'),
+        (Report.objects.filter(reported_listing__isnull=True), 'reported_user_id'),
+    )
+    with transaction.atomic():
+        Report.objects.update(case=None)
+        ReportCase.objects.all().delete()
+        for reports, field in groups:
+            reports = reports.order_by()
+            reasons = defaultdict(dict)
+            for row in reports.values(field, 'reason').annotate(n=Count('pk')):
+                reasons[row[field]][row['reason']] = row['n']
+            rows = reports.values(field).annotate(
+                n=Count('pk'), pending=Count('pk', filter=Q(status='pending')),
+                first=Min('created_at'), last=Max('created_at'))
+            ReportCase.objects.bulk_create([
+                ReportCase(**{field: row[field]}, report_count=row['n'],
+                           pending_count=row['pending'], first_seen=row['first'],
+                           last_seen=row['last'], reasons=reasons[row[field]])
+                for row in rows.iterator()
+            ], batch_size=1000)
+            case = ReportCase.objects.filter(
+                **{field: OuterRef(field)}, **(
+                    {'reported_listing__isnull': True} if field == 'reported_user_id' else {})
+            ).values('pk')[:1]
+            reports.update(case_id=Subquery(case))
+    return ReportCase.objects.count()
+
+
+def decide(reports, status, user):
+    """
+    Give the ``reports`` queryset ``status`` in one UPDATE, recount their
+    cases, move their report counters and re-rank their reporters' pending
+    reports; returns the number of reports updated.
+    """
+    with transaction.atomic():
+        # Read inside the transaction: the counters move from these statuses
+        members = list(reports.select_related(None).order_by().values(
+            'case_id', 'reporter_id', 'reported_listing_id', 'reported_user_id',
+            'reported_listing__seller_id', 'status', 'reason'))
+        updated = reports.update(
+            status=status,
+            reviewed_by=user,
+            reviewed_at=timezone.now()
+        )
+        refresh({row['case_id'] for row in members})
+        counters.decided(members, status)
+        queue.refresh(reporters={row['reporter_id'] for row in members})
+    return updated
+
+
+def decide_cases(cases, status, user):
+    """
+    Give the member reports of ``cases`` ``status``: pending ones when
+    marking reviewed, otherwise every report without that status.
+    """
+    Report, _ = _models()
+    members = Report.objects.filter(case__in=cases)
+    if status == 'reviewed':
+        members = members.filter(status='pending')
+    else:
+        members = members.exclude(status=status)
+    return decide(members, status, user)
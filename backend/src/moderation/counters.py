@@ -0,0 +1,201 @@
+"""
+Maintained report counters per user and per listing.
+
+"How many open reports does this seller have" used to count ``Report``
+twice over, by ``reported_user`` and by ``reported_listing__seller``, for
+every row of the user and listing admin lists. ``ReportCounter`` keeps the
+number of reports per status and reason for each reported listing (rows
+with ``listing`` set) and for each user (rows with ``listing`` empty). A
+user's counters cover the reports about them and about their listings; a
+report naming both a listing and its seller counts once for the seller.
+
+Counters move by deltas in the transaction that changes the reports:
+``Report.save()`` adds a new report to its subjects or moves a changed one
+from its old status, reason and target to the new ones, the bulk decisions
+(``cases.decide``) move every decided report in one pass, and deleting a
+report takes it off. Each delta is one ``UPDATE`` of one counter row. The
+old values of fields deferred when the report was loaded are read before
+it is saved, and saves that write none of these fields move nothing.
+``rebuild`` (the ``rebuild_report_counters`` command) recounts everything
+from the reports with grouped queries, e.g. after reports were bulk-loaded
+or changed with ``queryset.update()``.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+OPEN_STATUSES = ('pending', 'reviewed')
+
+
+def _models(report_model=None, counter_model=None):
+    from .models import Report, ReportCounter
+
+    return report_model or Report, counter_model or ReportCounter
+
+
+def subjects(listing_id, user_id, seller_id):
+    """Counter subjects of a report: ``('listing', id)`` and ``('user', id)`` keys"""
+    keys = [('listing', listing_id)] if listing_id else []
+    keys += [('user', pk) for pk in sorted({user_id, seller_id} - {None})]
+    return keys
+
+
+def _lookup(kind, pk):
+    if kind == 'listing':
+        return {'listing_id': pk}
+    return {'user_id': pk, 'listing__isnull': True}
+
+
+def apply(deltas):
+    """Add ``deltas`` (``(kind, id, status, reason)`` -> change) to the counters"""
+    _, ReportCounter = _models()
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        for (kind, pk, status, reason), delta in deltas.items():
+            lookup = {**_lookup(kind, pk), 'status': status, 'reason': reason}
+            updated = ReportCounter.objects.filter(**lookup).update(count=F('count') + delta)
+            if not updated and delta > 0:
+                counter, created = ReportCounter.objects.get_or_create(
+                    defaults={'count': delta}, **lookup)
+                if not created:
+                    ReportCounter.objects.filter(pk=counter.pk).update(
+                        count=F('count') + delta)
+
+
+def _sellers(listing_ids):
+    from cars.models import CarListing
+
+    listing_ids = {pk for pk in listing_ids if pk}
+    if not listing_ids:
+        return {}
+    return dict(CarListing.objects.filter(pk__in=listing_ids).values_list('pk', 'seller_id'))
+
+
+def _add(deltas, sellers, listing_id, user_id, status, reason, delta):
+    for kind, pk in subjects(listing_id, user_id, sellers.get(listing_id)):
+        deltas[kind, pk, status, reason] += delta
+
+
+def report_saved(report, created, fields=None):
+    """
+    Move a just-saved ``report`` from its previous status, reason and target;
+    ``fields`` are the tracked fields the save wrote (all by default)
+    """
+    names = report.TRACKED_FIELDS
+    old = None if created else tuple(report.saved_value(name) for name in names)
+    new = tuple(getattr(report, name) if fields is None or name in fields
+                else report.saved_value(name) for name in names)
+    if old == new:
+        return
+    sellers = _sellers({old[0] if old else None, new[0]})
+    deltas = Counter()
+    if old:
+        _add(deltas, sellers, *old, -1)
+    _add(deltas, sellers, *new, 1)
+    apply(deltas)
+
+
+def report_deleted(report):
+    """Take a deleted ``report`` off its subjects' counters"""
+    sellers = _sellers({report.reported_listing_id})
+    deltas = Counter()
+    _add(deltas, sellers, report.reported_listing_id, report.reported_user_id,
+         report.status, report.reason, -1)
+    apply(deltas)
+
+
+def decided(members, status):
+    """
+    Move ``members`` (dicts with ``reported_listing_id``, ``reported_user_id``,
+    ``reported_listing__seller_id``, ``status`` and ``reason``) to ``status``
+    """
+    deltas = Counter()
+    for row in members:
+        if row['status'] == status:
+            continue
+        sellers = {row['reported_listing_id']: row['reported_listing__seller_id']}
+        _add(deltas, sellers, row['reported_listing_id'], row['reported_user_id'],
+             row['status'], row['reason'], -1)
+        _add(deltas, sellers, row['reported_listing_id'], row['reported_user_id'],
+             status, row['reason'], 1)
+    apply(deltas)
+
+
+def _counts(reports, users=None, listings=None):
+    """``{(kind, id, status, reason): reports}`` counted from ``reports``"""
+    reports = reports.order_by()
+    counts = Counter()
+    queries = []
+    if listings is None or listings:
+        about = reports.filter(reported_listing__isnull=False)
+        if listings is not None:
+            about = about.filter(reported_listing_id__in=listings)
+        queries.append(('listing', 'reported_listing_id', about))
+    if users is None or users:
+        direct = reports.filter(reported_user__isnull=False)
+        # Reports about a seller's listing that name the seller are counted above
+        via_listing = reports.filter(reported_listing__isnull=False).exclude(
+            reported_user_id=F('reported_listing__seller_id'))
+        if users is not None:
+            direct = direct.filter(reported_user_id__in=users)
+            via_listing = via_listing.filter(reported_listing__seller_id__in=users)
+        queries += [('user', 'reported_user_id', direct),
+                    ('user', 'reported_listing__seller_id', via_listing)]
+    for kind, field, queryset in queries:
+        for row in queryset.values(field, 'status', 'reason').annotate(n=Count('pk')):
+            counts[kind, row[field], row['status'], row['reason']] += row['n']
+    return counts
+
+
+def _counters(model, counts):
+    return [
+        model(**({'listing_id': pk} if kind == 'listing' else {'user_id': pk}),
+              status=status, reason=reason, count=n)
+        for (kind, pk, status, reason), n in counts.items() if n
+    ]
+
+
+def rebuild(report_model=None, counter_model=None):
+    """Recount every counter from the reports; returns the number of counters"""
+    Report, ReportCounter = _models(report_model, counter_model)
+    counts = _counts(Report.objects.all())
+    with transaction.atomic():
+        ReportCounter.objects.all().delete()
+        ReportCounter.objects.bulk_create(_counters(ReportCounter, counts), batch_size=1000)
+    return ReportCounter.objects.count()
+
+
+def open_reports(field):
+    """
+    Open (pending or reviewed) reports counted for the outer row, a user
+    (``field='user'``) or a listing (``field='listing'``), as an annotation
+    """
+    _, ReportCounter = _models()
+    rows = ReportCounter.objects.filter(
+        status__in=OPEN_STATUSES, listing__isnull=field == 'user', **{field: OuterRef('pk')})
+    rows = rows.order_by().values(field).annotate(n=Sum('count')).values('n')[:1]
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def breakdown(**subject):
+    """``{status: {reason: reports}}`` of one subject, e.g. ``breakdown(listing_id=1)``"""
+    _, ReportCounter = _models()
+    result = defaultdict(dict)
+    for status, reason, n in (ReportCounter.objects.filter(count__gt=0, **subject)
+                              .values_list('status', 'reason', 'count')):
+        result[status][reason] = n
+    return dict(result)
+
+
+def describe(counts):
+    """A ``breakdown`` as text, e.g. ``pending: 3 (scam 2, spam 1); resolved: 1 (fake 1)``"""
+    if not counts:
+        return 'No reports'
+    return '; '.join(
+        f"{status}: {sum(reasons.values())} ("
+        + ', '.join(f"{reason} {n}" for reason, n in sorted(reasons.items())) + ')'
+        for status, reasons in sorted(counts.items()))
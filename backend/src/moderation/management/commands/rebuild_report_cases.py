@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from moderation import cases
+
+
+class Command(BaseCommand):
+    help = "Regroup every report into one case per reported listing or user"
+
+    def handle(self, *args, **options):
+        count = cases.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} report case(s)."))
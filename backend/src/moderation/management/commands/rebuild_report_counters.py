@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from moderation import counters
+
+
+class Command(BaseCommand):
+    help = "Recount the report counters of every reported user and listing"
+
+    def handle(self, *args, **options):
+        count = counters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} report counter(s)."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from moderation import queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the work-queue priority of every pending report from its "
+        "reason and its reporter's reliability"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--release-expired', action='store_true',
+                            help="Also return expired claims to the queue")
+
+    def handle(self, *args, **options):
+        changed = queue.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated the priority of {changed} pending report(s)."))
+        if options['release_expired']:
+            released = queue.release_expired()
+            self.stdout.write(f"Released {released} expired claim(s).")
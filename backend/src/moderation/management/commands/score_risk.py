@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cars.models import CarListing
+from messaging.models import Message
+from moderation import risk
+
+
+def _batches(queryset, batch_size, after):
+    """Consecutive pk ranges of ``queryset`` (keyset pagination)"""
+    while True:
+        ids = list(queryset.filter(pk__gt=after).order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        after = ids[-1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Risk-score existing listings or messages in batches and file "
+        "automated reports for the risky ones, e.g. to score a backlog"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', action='store_true',
+                            help="Score messages instead of listings")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Batches scored in parallel (1 on SQLite)")
+        parser.add_argument('--after-id', type=int, default=0,
+                            help="Resume after this primary key")
+
+    def score(self, first, last):
+        try:
+            if self.messages:
+                return risk.score_messages(risk.message_rows(
+                    Message.objects.filter(pk__gte=first, pk__lte=last)))
+            return risk.score_listings(risk.listing_rows(
+                CarListing.objects.filter(pk__gte=first, pk__lte=last)), self.medians)
+        finally:
+            if self.workers > 1:
+                connection.close()
+
+    def handle(self, *args, **options):
+        self.messages = options['messages']
+        model = Message if self.messages else CarListing
+        # SQLite allows a single writer; parallel batches would just contend
+        self.workers = 1 if connection.vendor == 'sqlite' else max(options['workers'], 1)
+        self.medians = None if self.messages else risk.load_medians()
+        risk.reporter()
+
+        start = time.perf_counter()
+        scored = filed = 0
+        last = options['after_id']
+        batches = _batches(model.objects.all(), options['batch_size'], last)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                chunk = [next(batches, None) for _ in range(self.workers * 4)]
+                chunk = [bounds for bounds in chunk if bounds is not None]
+                if not chunk:
+                    break
+                for batch_scored, batch_filed in pool.map(lambda b: self.score(*b), chunk):
+                    scored += batch_scored
+                    filed += batch_filed
+                last = chunk[-1][1]
+                self.stdout.write(
+                    f"{scored} scored, {filed} report(s) filed, up to id {last} "
+                    f"({scored / (time.perf_counter() - start):.0f}/s)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {scored} {model._meta.verbose_name_plural.lower()}; "
+            f"filed {filed} automated report(s)."))
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def prioritize_reports(apps, schema_editor):
+    from moderation import queue
+
+    queue.rebuild(model=apps.get_model('moderation', 'Report'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_reports', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='priority',
+            field=models.FloatField(default=0, help_text='Queue priority while pending; see moderation.queue'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('claimed_by__isnull', True), ('status', 'pending')), fields=['-priority', 'id'], name='report_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('claimed_by__isnull', False)), fields=['claimed_at'], name='report_claimed_idx'),
+        ),
+        migrations.RunPython(prioritize_reports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def group_reports(apps, schema_editor):
+    from moderation import cases
+
+    cases.rebuild(apps.get_model('moderation', 'Report'),
+                  apps.get_model('moderation', 'ReportCase'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0002_report_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportCase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_count', models.PositiveIntegerField(default=0)),
+                ('pending_count', models.PositiveIntegerField(default=0)),
+                ('reasons', models.JSONField(blank=True, default=dict, help_text='Reports per reason')),
+                ('first_seen', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('reported_listing', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='report_cases', to='cars.carlisting')),
+                ('reported_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='report_cases', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Report Case',
+                'verbose_name_plural': 'Report Cases',
+                'db_table': 'report_case',
+            },
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='case',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reports', to='moderation.reportcase'),
+        ),
+        migrations.AddIndex(
+            model_name='reportcase',
+            index=models.Index(fields=['-pending_count', '-last_seen'], name='report_case_pending_ac3700_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reportcase',
+            constraint=models.UniqueConstraint(condition=models.Q(('reported_listing__isnull', False)), fields=('reported_listing',), name='report_case_listing_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='reportcase',
+            constraint=models.UniqueConstraint(condition=models.Q(('reported_listing__isnull', True)), fields=('reported_user',), name='report_case_user_unique'),
+        ),
+        migrations.RunPython(group_reports, migrations.RunPython.noop),
+    ]
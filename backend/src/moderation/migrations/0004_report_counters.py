@@ -0,0 +1,75 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_reports(apps, schema_editor):
+    from moderation import counters
+
+    counters.rebuild(apps.get_model('moderation', 'Report'),
+                     apps.get_model('moderation', 'ReportCounter'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0007_place'),
+        ('moderation', '0003_report_case'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('reviewed', 'Reviewed'), ('resolved', 'Resolved'), ('dismissed', 'Dismissed')], max_length=20)),
+                ('reason', models.CharField(choices=[('scam', 'Scam'), ('spam', 'Spam'), ('offensive', 'Offensive Content'), ('fake', 'Fake Listing'), ('inappropriate', 'Inappropriate'), ('other', 'Other')], max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Report Counter',
+                'verbose_name_plural': 'Report Counters',
+                'db_table': 'report_counter',
+            },
+        ),
+        migrations.AlterField(
+            model_name='report',
+            name='reported_listing',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='cars.carlisting'),
+        ),
+        migrations.AlterField(
+            model_name='report',
+            name='reported_user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reports_received', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['reported_user', 'status'], name='report_reporte_867c50_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['reported_listing', 'status'], name='report_reporte_9734b9_idx'),
+        ),
+        migrations.AddField(
+            model_name='reportcounter',
+            name='listing',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='report_counters', to='cars.carlisting'),
+        ),
+        migrations.AddField(
+            model_name='reportcounter',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='report_counters', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='reportcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('listing__isnull', True)), fields=('user', 'status', 'reason'), name='report_counter_user_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='reportcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('listing__isnull', False)), fields=('listing', 'status', 'reason'), name='report_counter_listing_unique'),
+        ),
+        migrations.RunPython(count_reports, migrations.RunPython.noop),
+    ]
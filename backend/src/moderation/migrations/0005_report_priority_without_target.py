@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:50
+
+from django.db import migrations, models
+
+
+def drop_target_factor(apps, schema_editor):
+    from moderation import queue
+
+    queue.rebuild(apps.get_model('moderation', 'Report'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moderation', '0004_report_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='report',
+            name='priority',
+            field=models.FloatField(default=0, help_text="Queue priority while pending, before its target's factor; see moderation.queue"),
+        ),
+        migrations.RunPython(drop_target_factor, migrations.RunPython.noop),
+    ]
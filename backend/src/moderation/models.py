@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED, Q
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 
@@ -33,14 +34,16 @@ class Report(models.Model):
         on_delete=models.CASCADE,
         related_name='reports',
         null=True,
-        blank=True
+        blank=True,
+        db_index=False  # covered by the (reported_listing, status) index
     )
     reported_user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='reports_received',
         null=True,
-        blank=True
+        blank=True,
+        db_index=False  # covered by the (reported_user, status) index
     )
     reason = models.CharField(max_length=50, choices=REASON_CHOICES)
     description = models.TextField(
@@ -60,6 +63,27 @@ class Report(models.Model):
     admin_notes = models.TextField(
         blank=True, help_text="Internal admin notes")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Work queue (moderation.queue)
+    priority = models.FloatField(
+        default=0,
+        help_text="Queue priority while pending, before its target's factor; "
+                  "see moderation.queue")
+    claimed_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name='claimed_reports',
+        null=True,
+        blank=True
+    )
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    case = models.ForeignKey(
+        'ReportCase',
+        on_delete=models.SET_NULL,
+        related_name='reports',
+        null=True,
+        blank=True,
+        editable=False
+    )
 
     class Meta:
         db_table = 'report'
@@ -71,8 +95,70 @@ class Report(models.Model):
             models.Index(fields=['reason']),
             models.Index(fields=['created_at']),
             models.Index(fields=['reporter']),
+            models.Index(fields=['reported_user', 'status']),
+            models.Index(fields=['reported_listing', 'status']),
+            # Next batch to claim: unclaimed pending reports by priority
+            models.Index(
+                fields=['-priority', 'id'], name='report_queue_idx',
+                condition=Q(status='pending', claimed_by__isnull=True)),
+            models.Index(
+                fields=['claimed_at'], name='report_claimed_idx',
+                condition=Q(claimed_by__isnull=False)),
         ]
 
+    # Fields a save compares with their stored values: a decision refreshes
+    # the queue (see signals), a changed reason or target the case (see
+    # moderation.cases) and any change moves the counters
+    TRACKED_FIELDS = ('reported_listing_id', 'reported_user_id', 'status', 'reason')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Fields deferred with only() or defer() stay unknown until loaded
+        instance._saved = {name: instance.__dict__.get(name, DEFERRED)
+                           for name in cls.TRACKED_FIELDS}
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        # Also how a deferred field is loaded on first access
+        self._saved = {**getattr(self, '_saved', {}), **{
+            name: self.__dict__[name] for name in self.TRACKED_FIELDS
+            if name in self.__dict__ and (
+                fields is None or name in fields or name.removesuffix('_id') in fields)
+        }}
+
+    def saved_value(self, name):
+        """
+        Stored value of tracked field ``name`` when last loaded or saved;
+        its current value when unknown (a new report or a deferred field)
+        """
+        value = getattr(self, '_saved', {}).get(name, DEFERRED)
+        return getattr(self, name) if value is DEFERRED else value
+
+    def written_fields(self, update_fields=None):
+        """Tracked fields a save with ``update_fields`` writes"""
+        if self._state.adding:
+            return set(self.TRACKED_FIELDS)
+        if update_fields is None:
+            # Like Model.save(), a deferred-loaded report writes its loaded fields
+            return set(self.TRACKED_FIELDS) - self.get_deferred_fields()
+        return set(self.TRACKED_FIELDS) & {
+            self._meta.get_field(name).attname for name in update_fields}
+
+    def changed_fields(self, fields=None):
+        """Tracked ``fields`` (all by default) that differ from their stored values"""
+        return {name for name in (self.TRACKED_FIELDS if fields is None else fields)
+                if getattr(self, name) != self.saved_value(name)}
+
+    def _load_saved(self):
+        """Read the stored values of tracked fields that were set before being loaded"""
+        unknown = [name for name in self.TRACKED_FIELDS
+                   if getattr(self, '_saved', {}).get(name, DEFERRED) is DEFERRED]
+        if unknown:
+            stored = type(self)._base_manager.filter(pk=self.pk).values(*unknown).first()
+            self._saved = {**getattr(self, '_saved', {}), **(stored or {})}
+
     def clean(self):
         if not self.reported_listing and not self.reported_user:
             raise ValidationError(
@@ -82,8 +168,28 @@ class Report(models.Model):
             raise ValidationError("Reporter cannot report themselves.")
 
     def save(self, *args, **kwargs):
+        from . import cases, counters
+
         self.clean()
-        super().save(*args, **kwargs)
+        created = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        written = self.written_fields(update_fields)
+        with transaction.atomic():
+            if written and not created:
+                self._load_saved()
+            previous_case_id = self.case_id
+            if self.case_id is None or self.changed_fields(
+                    {'reported_listing_id', 'reported_user_id'} & written):
+                self.case = cases.case_for(self)
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, 'case'}
+            super().save(*args, **kwargs)
+            # Saves that write none of the tracked fields leave cases and counters be
+            if written:
+                cases.report_saved(self, created, previous_case_id, written)
+                counters.report_saved(self, created, written)
+        self._saved = {**getattr(self, '_saved', {}),
+                       **{name: getattr(self, name) for name in written}}
 
     def __str__(self):
         target = ""
@@ -93,3 +199,100 @@ class Report(models.Model):
             target = f"user '{self.reported_user.username}'"
 
         return f"Report by {self.reporter.username} about {target} ({self.reason})"
+
+
+class ReportCase(models.Model):
+    """All reports about one target (a listing, or a user when no listing
+    is reported), so moderators act once per case.
+
+    The counters and reason histogram are maintained by ``Report.save()``
+    (see ``moderation.cases``).
+    """
+
+    reported_listing = models.ForeignKey(
+        'cars.CarListing',
+        on_delete=models.CASCADE,
+        related_name='report_cases',
+        null=True,
+        blank=True
+    )
+    reported_user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='report_cases',
+        null=True,
+        blank=True
+    )
+    report_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    reasons = models.JSONField(
+        default=dict, blank=True, help_text="Reports per reason")
+    first_seen = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'report_case'
+        verbose_name = 'Report Case'
+        verbose_name_plural = 'Report Cases'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['reported_listing'], name='report_case_listing_unique',
+                condition=Q(reported_listing__isnull=False)),
+            models.UniqueConstraint(
+                fields=['reported_user'], name='report_case_user_unique',
+                condition=Q(reported_listing__isnull=True)),
+        ]
+        indexes = [
+            models.Index(fields=['-pending_count', '-last_seen']),
+        ]
+
+    def __str__(self):
+        if self.reported_listing_id:
+            target = f"listing #{self.reported_listing_id}"
+        else:
+            target = f"user #{self.reported_user_id}"
+        return f"Case about {target} ({self.report_count} report(s))"
+
+
+class ReportCounter(models.Model):
+    """Number of reports of one status and reason about a listing, or
+    about a user and their listings.
+
+    Maintained by ``Report.save()`` and the bulk decisions (see
+    ``moderation.counters``), so "open reports of this seller" is a lookup.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='report_counters',
+        null=True,
+        blank=True
+    )
+    listing = models.ForeignKey(
+        'cars.CarListing',
+        on_delete=models.CASCADE,
+        related_name='report_counters',
+        null=True,
+        blank=True
+    )
+    status = models.CharField(max_length=20, choices=Report.STATUS_CHOICES)
+    reason = models.CharField(max_length=50, choices=Report.REASON_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'report_counter'
+        verbose_name = 'Report Counter'
+        verbose_name_plural = 'Report Counters'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'status', 'reason'], name='report_counter_user_unique',
+                condition=Q(listing__isnull=True)),
+            models.UniqueConstraint(
+                fields=['listing', 'status', 'reason'], name='report_counter_listing_unique',
+                condition=Q(listing__isnull=False)),
+        ]
+
+    def __str__(self):
+        subject = f"listing #{self.listing_id}" if self.listing_id else f"user #{self.user_id}"
+        return f"{subject}: {self.count} {self.status} {self.reason}"
@@ -0,0 +1,263 @@
+"""
+Prioritized moderation work queue.
+
+Pending reports are ranked by
+
+    priority * target factor
+    priority = reason weight * (0.5 + reporter reliability)
+    target factor = 1 + log2(pending reports on the target)
+
+The reason weight comes from ``MODERATION_REASON_WEIGHTS`` (a scam outranks
+spam). A reporter's reliability is the smoothed share of their decided
+reports that were upheld: ``(resolved + 1) / (resolved + dismissed + 2)``,
+so a new reporter counts 0.5 and one whose reports keep being dismissed
+sinks towards 0. A target (a listing, or a user when no listing is
+reported) with many pending reports rises with each additional report.
+
+Only ``priority`` is stored on ``Report``. It is kept current by
+``moderation.signals``: a new report or one whose reason changed gets its
+own priority, and a decided report refreshes the pending reports of its
+reporter, whose reliability changed. The target factor follows the
+``pending_count`` that ``ReportCase`` already maintains (``cases``), so a
+new report costs the same whatever the number of reports on its target;
+nothing on the target is rewritten.
+
+Moderators claim batches with ``claim``. The unclaimed pending reports are
+covered by a partial index ordered by priority, and ``ranked`` reads it in
+order, multiplying each priority by its case's factor, until no later
+report could make the batch: a report scores at most its priority times
+the factor of the case with the most pending reports. Where the database
+supports it the chosen rows are locked with ``SELECT ... FOR UPDATE SKIP
+LOCKED``, so concurrent moderators skip each other's rows instead of
+waiting; elsewhere (SQLite, which serializes writers anyway) each claim is
+an ``UPDATE`` guarded by ``claimed_by IS NULL`` and only the rows it
+actually took are returned. Claims expire after
+``MODERATION_CLAIM_TIMEOUT`` seconds and return to the queue.
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, Q, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Ln
+from django.utils import timezone
+
+DEFAULT_WEIGHTS = {
+    'scam': 10.0, 'fake': 6.0, 'offensive': 5.0, 'inappropriate': 4.0,
+    'spam': 2.0, 'other': 1.0,
+}
+UPHELD, REJECTED = 'resolved', 'dismissed'
+
+
+def _weights():
+    return getattr(settings, 'MODERATION_REASON_WEIGHTS', DEFAULT_WEIGHTS)
+
+
+def _batch_size():
+    return getattr(settings, 'MODERATION_CLAIM_BATCH', 20)
+
+
+def _claim_timeout():
+    return getattr(settings, 'MODERATION_CLAIM_TIMEOUT', 1800)
+
+
+def _model(model):
+    if model is None:
+        from .models import Report as model
+    return model
+
+
+def reliability(upheld, rejected):
+    """Smoothed share of a reporter's decided reports that were upheld"""
+    return (upheld + 1) / (upheld + rejected + 2)
+
+
+def priority(reason, reporter_reliability):
+    """Stored priority of a pending report, see the module docstring"""
+    weights = _weights()
+    weight = weights.get(reason, weights.get('other', 1.0))
+    return round(weight * (0.5 + reporter_reliability), 6)
+
+
+def target_factor(target_reports):
+    """Multiplier of the reports on a target with ``target_reports`` pending"""
+    return 1 + math.log2(max(target_reports or 1, 1))
+
+
+def queue_score():
+    """``priority * target factor`` of a report, as an annotation"""
+    pending = Cast(Greatest(Coalesce(F('case__pending_count'), Value(1)), Value(1)),
+                   FloatField())
+    return F('priority') * (Value(1.0) + Ln(pending) / Value(math.log(2)))
+
+
+def _reliabilities(model, reporters=None):
+    decided = model.objects.filter(status__in=(UPHELD, REJECTED)).order_by()
+    if reporters is not None:
+        decided = decided.filter(reporter_id__in=reporters)
+    rows = decided.values('reporter_id').annotate(
+        upheld=Count('pk', filter=Q(status=UPHELD)),
+        rejected=Count('pk', filter=Q(status=REJECTED)))
+    return {row['reporter_id']: reliability(row['upheld'], row['rejected']) for row in rows}
+
+
+def _reprioritize(model, reports, reliabilities):
+    changed = []
+    for report in reports:
+        value = priority(report.reason, reliabilities.get(report.reporter_id, 0.5))
+        if value != report.priority:
+            report.priority = value
+            changed.append(report)
+    if changed:
+        # One prepared UPDATE for the whole batch; bulk_update's CASE per row
+        # is orders of magnitude slower for a full rebuild
+        quote = connection.ops.quote_name
+        sql = (f"UPDATE {quote(model._meta.db_table)} SET {quote('priority')} = %s "
+               f"WHERE {quote(model._meta.pk.column)} = %s")
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, [(report.priority, report.pk) for report in changed])
+    return len(changed)
+
+
+def refresh(reports=(), reporters=(), model=None):
+    """
+    Recompute the priority of the pending reports among ``reports`` (ids)
+    and of those filed by ``reporters``; returns the number of reports
+    whose priority changed.
+    """
+    model = _model(model)
+    reports, reporters = set(reports), set(reporters)
+    condition = Q()
+    if reports:
+        condition |= Q(pk__in=reports)
+    if reporters:
+        condition |= Q(reporter_id__in=reporters)
+    if not condition:
+        return 0
+    pending = list(model.objects.filter(condition, status='pending').only(
+        'reason', 'reporter_id', 'priority'))
+    if not pending:
+        return 0
+    reliabilities = _reliabilities(model, {report.reporter_id for report in pending})
+    return _reprioritize(model, pending, reliabilities)
+
+
+def rebuild(model=None):
+    """Recompute the priority of every pending report; returns the number changed"""
+    model = _model(model)
+    reliabilities = _reliabilities(model)
+    reports = model.objects.filter(status='pending').only('reason', 'reporter_id', 'priority')
+    changed, last = 0, 0
+    while True:
+        batch = list(reports.filter(pk__gt=last).order_by('pk')[:5000])
+        if not batch:
+            return changed
+        changed += _reprioritize(model, batch, reliabilities)
+        last = batch[-1].pk
+
+
+# Claiming
+
+def queue():
+    """Unclaimed pending reports by stored priority, highest first (the partial index)"""
+    from .models import Report
+
+    return Report.objects.filter(status='pending', claimed_by__isnull=True).order_by(
+        '-priority', 'pk')
+
+
+def ranked(size, chunk_size=None):
+    """
+    Ids of the ``size`` unclaimed pending reports with the highest
+    ``priority * target factor``, highest first. Reads the queue in
+    priority order and stops once a report's priority times the largest
+    target factor cannot beat the ``size``-th best score found.
+    """
+    from .models import ReportCase
+
+    chunk_size = chunk_size or max(4 * size, 100)
+    largest = (ReportCase.objects.order_by('-pending_count')
+               .values_list('pending_count', flat=True).first())
+    bound = target_factor(largest)
+    rows = queue().values_list('pk', 'priority', 'case__pending_count')
+    best, last = [], None
+    while True:
+        page = rows
+        if last is not None:
+            page = rows.filter(Q(priority__lt=last[0]) | Q(priority=last[0], pk__gt=last[1]))
+        page = list(page[:chunk_size])
+        best += [(value * target_factor(pending), pk) for pk, value, pending in page]
+        best = sorted(best, key=lambda item: (-item[0], item[1]))[:size]
+        if len(page) < chunk_size:
+            break
+        last = page[-1][1], page[-1][0]
+        if len(best) >= size and last[0] * bound <= best[-1][0]:
+            break
+    return [pk for _, pk in best]
+
+
+def release_expired():
+    """Return claims older than ``MODERATION_CLAIM_TIMEOUT`` to the queue"""
+    from .models import Report
+
+    cutoff = timezone.now() - timedelta(seconds=_claim_timeout())
+    return Report.objects.filter(
+        claimed_by__isnull=False, claimed_at__lt=cutoff, status='pending',
+    ).update(claimed_by=None, claimed_at=None)
+
+
+def _take(moderator, wanted, now):
+    """Claim the reports of ``wanted`` nobody else has claimed; returns their ids"""
+    from .models import Report
+
+    available = Report.objects.filter(pk__in=wanted, status='pending', claimed_by__isnull=True)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(available.select_for_update(skip_locked=True)
+                       .values_list('pk', flat=True))
+            Report.objects.filter(pk__in=ids).update(claimed_by=moderator, claimed_at=now)
+        return ids
+    available.update(claimed_by=moderator, claimed_at=now)
+    return list(Report.objects.filter(
+        pk__in=wanted, claimed_by=moderator, claimed_at=now).values_list('pk', flat=True))
+
+
+def claim(moderator, size=None):
+    """
+    Claim up to ``size`` of the highest-ranked unclaimed pending reports
+    for ``moderator``; returns the claimed reports, highest first.
+    """
+    size = size or _batch_size()
+    release_expired()
+    now = timezone.now()
+    ids = []
+    # Rows another moderator took between the ranking and the claim are
+    # skipped; rank again until the batch is full or the queue empty
+    for _ in range(3):
+        wanted = ranked(size - len(ids))
+        if not wanted:
+            break
+        ids += _take(moderator, wanted, now)
+        if len(ids) >= size:
+            break
+    return list(claimed(moderator).filter(pk__in=ids))
+
+
+def claimed(moderator):
+    """Pending reports claimed by ``moderator``, highest ranked first"""
+    from .models import Report
+
+    return (Report.objects.filter(status='pending', claimed_by=moderator)
+            .select_related('reporter', 'reported_user', 'reported_listing__car')
+            .annotate(queue_score=queue_score()).order_by('-queue_score', 'pk'))
+
+
+def release(moderator, ids=None):
+    """Return ``moderator``'s claimed reports (or those of ``ids``) to the queue"""
+    from .models import Report
+
+    reports = Report.objects.filter(claimed_by=moderator, status='pending')
+    if ids is not None:
+        reports = reports.filter(pk__in=ids)
+    return reports.update(claimed_by=None, claimed_at=None)
@@ -0,0 +1,379 @@
+"""
+Automated risk scoring of new listings and messages.
+
+Each new ``CarListing`` and ``Message`` is described by a few features:
+
+* ``price_drop``: how far a listing's price is below the median of its
+  price statistics group (same make, model, year and fuel type, see
+  ``cars.pricestats``), as a share of the median; 0 for groups with fewer
+  than ``RISK_MIN_GROUP_SIZE`` available listings.
+* ``contact``: kinds of off-platform contact details in the description or
+  message (phone number, e-mail address, link, messenger or payment app).
+* ``reports``: ``log1p`` of the reports against the seller or sender that
+  were not dismissed, read from their report counters
+  (``moderation.counters``).
+* ``burst``: messages the sender sent in the ``RISK_BURST_WINDOW`` seconds
+  up to this one, relative to ``RISK_BURST_LIMIT``, plus the same for
+  distinct receivers.
+
+The score is a logistic model over the features, ``1 / (1 + exp(-(bias +
+sum(weight * feature))))``, with the weights in ``RISK_WEIGHTS``. At or
+above ``RISK_REPORT_THRESHOLD`` a pending ``Report`` is filed by the
+``RISK_REPORTER_USERNAME`` account, with the reason of the strongest
+feature and the score and signals in its description; a target that
+already has a pending automated report is not reported twice. The report
+joins the target's case and so raises the queue rank of every pending
+report on it (``moderation.queue``), and the moderators' decisions on
+automated reports set the scorer's reliability like any reporter's.
+
+Scoring runs on a pool of ``RISK_WORKERS`` threads fed by the
+``post_save`` signals once the row is committed, so it adds nothing to the
+request that created the listing or message. ``score_listings`` and
+``score_messages`` work on batches with a fixed number of queries per
+batch; the ``score_risk`` command uses them to score a backlog.
+"""
+import atexit
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Sum
+
+from . import cases
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {
+    'bias': -5.0, 'price_drop': 6.0, 'contact': 2.0, 'reports': 1.2, 'burst': 2.5,
+}
+REASONS = {'price_drop': 'scam', 'contact': 'scam', 'reports': 'fake', 'burst': 'spam'}
+CONTACT_PATTERNS = {
+    'phone': re.compile(r'(?<!\d)(?:\+?\d[\s.\-()]*){10,13}(?!\d)'),
+    'email': re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'),
+    'link': re.compile(r'\b(?:https?://|www\.)\S+', re.IGNORECASE),
+    'off_platform': re.compile(
+        r'\b(?:whats\s?app|telegram|signal|wechat|western\s+union|moneygram|'
+        r'wire\s+transfer|gift\s+cards?|zelle|venmo|cash\s?app)\b', re.IGNORECASE),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _weights():
+    return {**DEFAULT_WEIGHTS, **_setting('RISK_WEIGHTS', {})}
+
+
+def contact_kinds(text):
+    """Kinds of contact details found in ``text``"""
+    return [kind for kind, pattern in CONTACT_PATTERNS.items() if pattern.search(text or '')]
+
+
+def score(features):
+    """Logistic risk score (0-1) of a feature dict"""
+    weights = _weights()
+    z = weights['bias'] + sum(weights[name] * value for name, value in features.items())
+    return 1 / (1 + math.exp(-max(min(z, 50.0), -50.0)))
+
+
+def strongest(features):
+    """The feature contributing most to the score"""
+    weights = _weights()
+    return max(features, key=lambda name: weights[name] * features[name])
+
+
+def _describe(features, kinds):
+    signals = []
+    if features.get('price_drop'):
+        signals.append(f"price {features['price_drop']:.0%} below the group median")
+    if kinds:
+        signals.append(f"contact details ({', '.join(kinds)})")
+    if features.get('reports'):
+        signals.append(f"{round(math.expm1(features['reports']))} prior report(s)")
+    if features.get('burst'):
+        signals.append("burst of messages")
+    return '; '.join(signals)
+
+
+def reporter():
+    """The account automated reports are filed by, created on first use"""
+    from django.contrib.auth import get_user_model
+
+    username = _setting('RISK_REPORTER_USERNAME', 'risk-scorer')
+    user, created = get_user_model().objects.get_or_create(
+        username=username, defaults={'is_active': False})
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
+
+
+def prior_reports(user_ids):
+    """``{user_id: reports against the user or their listings, not dismissed}``"""
+    from .models import ReportCounter
+
+    rows = (ReportCounter.objects.filter(user_id__in=user_ids, listing__isnull=True)
+            .exclude(status='dismissed').order_by()
+            .values('user_id').annotate(n=Sum('count')))
+    counts = defaultdict(int)
+    for row in rows:
+        counts[row['user_id']] += row['n']
+    return counts
+
+
+def _file_reports(flagged, kind):
+    """
+    File automated reports for ``[(target, score, features, kinds)]``,
+    skipping targets that already have a pending automated report.
+    Returns the number of reports filed.
+    """
+    from .models import Report, ReportCase
+
+    if not flagged:
+        return 0
+    bot = reporter()
+    field = 'reported_listing_id' if kind == 'listing' else 'reported_user_id'
+    reported = set(Report.objects.filter(
+        reporter=bot, status='pending',
+        **{f'{field}__in': [target for target, *_ in flagged]},
+    ).values_list(field, flat=True))
+    filed = 0
+    for target, value, features, kinds in flagged:
+        if target in reported:
+            continue
+        report = Report(
+            reporter=bot, reason=REASONS[strongest(features)],
+            description=f"Automated risk score {value:.2f}: {_describe(features, kinds)}",
+            **{field: target})
+        with transaction.atomic():
+            # The case row serializes workers scoring the same target
+            case = ReportCase.objects.select_for_update().get(pk=cases.case_for(report).pk)
+            if Report.objects.filter(reporter=bot, status='pending', case=case).exists():
+                continue
+            report.save()
+        reported.add(target)
+        filed += 1
+    return filed
+
+
+def listing_rows(listings):
+    """Rows ``score_listings`` reads, from a CarListing queryset"""
+    return listings.values_list(
+        'pk', 'seller_id', 'price', 'description',
+        'car__make', 'car__model', 'car__year', 'car__fuel_type')
+
+
+def score_listings(rows, medians=None):
+    """
+    Score ``listing_rows`` and file reports for the risky ones; returns
+    ``(scored, reports filed)``. ``medians`` maps price statistics groups
+    to ``(p50, count)`` and is read for the batch's groups when omitted.
+    """
+    from cars.pricestats import statistics_for_keys
+
+    rows = list(rows)
+    if not rows:
+        return 0, 0
+    if medians is None:
+        keys = {tuple(row[4:8]) for row in rows}
+        # Past a hundred groups one scan of the small statistics table is
+        # cheaper than (and avoids) a long OR of group conditions
+        medians = load_medians(None if len(keys) > 100 else
+                               statistics_for_keys(keys))
+    reports = prior_reports({row[1] for row in rows})
+    min_group = _setting('RISK_MIN_GROUP_SIZE', 5)
+    threshold = _setting('RISK_REPORT_THRESHOLD', 0.8)
+
+    flagged = []
+    for pk, seller_id, price, description, *key in rows:
+        median, count = medians.get(tuple(key), (None, 0))
+        drop = 0.0
+        if median and count >= min_group and price < median:
+            drop = float((median - price) / median)
+        kinds = contact_kinds(description)
+        features = {'price_drop': drop, 'contact': float(len(kinds)),
+                    'reports': math.log1p(reports.get(seller_id, 0))}
+        value = score(features)
+        if value >= threshold:
+            flagged.append((pk, value, features, kinds))
+    return len(rows), _file_reports(flagged, 'listing')
+
+
+def load_medians(statistics=None):
+    """``{(make, model, year, fuel_type): (p50, count)}`` of price statistics"""
+    from cars.models import PriceStatistics
+    from cars.pricestats import KEY_FIELDS
+
+    if statistics is None:
+        statistics = PriceStatistics.objects.all()
+    return {tuple(row[:4]): (row[4], row[5])
+            for row in statistics.values_list(*KEY_FIELDS, 'p50', 'count')}
+
+
+def message_rows(messages):
+    """Rows ``score_messages`` reads, from a Message queryset"""
+    return messages.values_list('pk', 'sender_id', 'receiver_id', 'content', 'timestamp')
+
+
+def score_messages(rows):
+    """Score ``message_rows`` and file reports on risky senders; returns ``(scored, filed)``"""
+    from messaging.models import Message
+
+    rows = list(rows)
+    if not rows:
+        return 0, 0
+    window = timedelta(seconds=_setting('RISK_BURST_WINDOW', 600))
+    limit = _setting('RISK_BURST_LIMIT', 20)
+    threshold = _setting('RISK_REPORT_THRESHOLD', 0.8)
+    senders = {row[1] for row in rows}
+    recent = defaultdict(list)
+    for sender_id, receiver_id, timestamp in Message.objects.filter(
+            sender_id__in=senders,
+            timestamp__gte=min(row[4] for row in rows) - window,
+            timestamp__lte=max(row[4] for row in rows),
+    ).order_by().values_list('sender_id', 'receiver_id', 'timestamp'):
+        recent[sender_id].append((timestamp, receiver_id))
+    reports = prior_reports(senders)
+
+    flagged = {}
+    for pk, sender_id, _, content, timestamp in rows:
+        sent = [receiver for at, receiver in recent[sender_id]
+                if timestamp - window <= at <= timestamp]
+        kinds = contact_kinds(content)
+        features = {
+            'contact': float(len(kinds)),
+            'reports': math.log1p(reports.get(sender_id, 0)),
+            'burst': max(len(sent) - limit, 0) / limit + max(len(set(sent)) - limit, 0) / limit,
+        }
+        value = score(features)
+        if value >= threshold and value > flagged.get(sender_id, (None, 0))[1]:
+            flagged[sender_id] = (sender_id, value, features, kinds)
+    return len(rows), _file_reports(list(flagged.values()), 'user')
+
+
+class RiskScorer:
+    """Scores queued new listings and messages on a pool of worker threads"""
+
+    def __init__(self, workers=None, batch_size=None, max_size=None, flush_interval=None):
+        self.workers = workers or _setting('RISK_WORKERS', 2)
+        self.batch_size = batch_size or _setting('RISK_BATCH_SIZE', 200)
+        self.max_size = max_size or _setting('RISK_QUEUE_SIZE', 10000)
+        self.flush_interval = flush_interval or _setting('RISK_FLUSH_INTERVAL', 1)
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._threads = []
+        self.scored = 0
+        self.reports = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.last_batch_ms = 0.0
+
+    def submit(self, kind, pk):
+        """Queue a committed ``'listing'`` or ``'message'``; False if the queue is full"""
+        if self._pid != os.getpid():
+            self._reset()
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((kind, pk))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _ensure_workers(self):
+        if len(self._threads) == self.workers and all(t.is_alive() for t in self._threads):
+            return
+        with self._start_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name=f'risk-scorer-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch(self.flush_interval)
+            if batch:
+                self.process(batch)
+            close_old_connections()
+
+    def drain(self):
+        """Score everything currently queued from the calling thread"""
+        while True:
+            batch = self._next_batch(timeout=0.001)
+            if not batch:
+                return
+            self.process(batch)
+
+    def process(self, batch):
+        """Score ``(kind, pk)`` items, filing reports for the risky ones"""
+        from cars.models import CarListing
+        from messaging.models import Message
+
+        start = time.perf_counter()
+        ids = defaultdict(list)
+        for kind, pk in batch:
+            ids[kind].append(pk)
+        try:
+            for kind, scorer, rows in (
+                ('listing', score_listings, lambda: listing_rows(
+                    CarListing.objects.filter(pk__in=ids['listing']))),
+                ('message', score_messages, lambda: message_rows(
+                    Message.objects.filter(pk__in=ids['message']))),
+            ):
+                if ids[kind]:
+                    scored, filed = scorer(rows())
+                    self.scored += scored
+                    self.reports += filed
+        except Exception:
+            logger.exception("Risk scoring of %d row(s) failed", len(batch))
+            self.failed_batches += 1
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+
+    def metrics(self):
+        """Queue depth and throughput figures for monitoring"""
+        return {
+            'queued': self._queue.qsize(),
+            'capacity': self.max_size,
+            'workers': sum(t.is_alive() for t in self._threads),
+            'scored': self.scored,
+            'reports': self.reports,
+            'dropped': self.dropped,
+            'failed_batches': self.failed_batches,
+            'last_batch_ms': round(self.last_batch_ms, 3),
+        }
+
+
+scorer = RiskScorer()
+
+
+@atexit.register
+def _drain_at_exit():
+    if scorer._pid == os.getpid() and not scorer._queue.empty():
+        scorer.drain()
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import cases, counters, queue, risk
+from .models import Report
+
+
+@receiver(post_save, sender=Report)
+def update_queue(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Rank a new or changed report; a decision re-ranks its reporter's reports"""
+    if raw:
+        return
+    changed = instance.changed_fields(
+        {'status', 'reason'} & instance.written_fields(update_fields))
+    decided = not created and 'status' in changed
+    if created or decided or 'reason' in changed:
+        queue.refresh(reports={instance.pk},
+                      reporters={instance.reporter_id} if decided else ())
+
+
+@receiver(pre_delete, sender=Report)
+def remove_from_counters(sender, instance, **kwargs):
+    """Take a report off its counters while its listing's seller can still be read"""
+    counters.report_deleted(instance)
+
+
+@receiver(post_delete, sender=Report)
+def remove_from_queue(sender, instance, **kwargs):
+    """Recount a deleted report's case and re-rank its reporter's if it was decided"""
+    cases.refresh({instance.case_id})
+    if instance.status in (queue.UPHELD, queue.REJECTED):
+        queue.refresh(reporters={instance.reporter_id})
+
+
+@receiver(post_save, sender='cars.CarListing')
+def score_listing(sender, instance, created, raw=False, **kwargs):
+    """Risk-score a new listing on the worker pool once committed"""
+    if created and not raw:
+        transaction.on_commit(lambda: risk.scorer.submit('listing', instance.pk))
+
+
+@receiver(post_save, sender='messaging.Message')
+def score_message(sender, instance, created, raw=False, **kwargs):
+    """Risk-score a new message on the worker pool once committed"""
+    if created and not raw:
+        transaction.on_commit(lambda: risk.scorer.submit('message', instance.pk))
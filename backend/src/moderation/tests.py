@@ -1,3 +1,476 @@
-from django.test import TestCase
+import math
+import random
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cars import pricestats
+from cars.models import Car, CarListing, ListingSummary
+from messaging.models import Message
+
+from . import cases, counters, queue, risk
+from .models import Report, ReportCase, ReportCounter
+
+User = get_user_model()
+
+
+def make_user(name, **fields):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='secret', **fields)
+
+
+def make_listing(seller, price=12000):
+    car = Car.objects.create(make='Toyota', model='Corolla', year=2018, mileage=42000,
+                             fuel_type='petrol', transmission='automatic', color='Blue',
+                             engine_size='1.8L')
+    return CarListing.objects.create(car=car, seller=seller, price=price,
+                                     description='Clean car', location='Boston, MA')
+
+
+class ModerationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = make_user('seller')
+        cls.moderator = make_user('moderator', is_staff=True)
+        cls.reporters = [make_user(f'reporter{i}') for i in range(6)]
+        cls.listing = make_listing(cls.seller)
+
+    def report(self, reporter=None, listing=None, user=None, reason='spam', **fields):
+        if listing is None and user is None:
+            listing = self.listing
+        return Report.objects.create(
+            reporter=reporter or self.reporters[0], reported_listing=listing,
+            reported_user=user, reason=reason, **fields)
+
+
+class QueueTests(ModerationTestCase):
+
+    def brute_force(self):
+        """Every unclaimed pending report ranked by the formula"""
+        reports = Report.objects.filter(status='pending', claimed_by__isnull=True)
+        return list(reports.annotate(score=queue.queue_score())
+                    .order_by('-score', 'pk').values_list('pk', flat=True))
+
+    def test_priority_and_target_factor(self):
+        scam = self.report(reason='scam', user=self.seller)
+        spam = [self.report(reporter) for reporter in self.reporters[:4]]
+        scam.refresh_from_db()
+        self.assertEqual(scam.priority, 10.0)
+        # Four pending reports on the listing: each spam report scores 2 * 3
+        self.assertEqual({report.priority for report in Report.objects.filter(
+            pk__in=[report.pk for report in spam])}, {2.0})
+        self.assertEqual(queue.ranked(2), [scam.pk, spam[0].pk])
+        self.assertAlmostEqual(
+            Report.objects.annotate(score=queue.queue_score()).get(pk=spam[0].pk).score, 6.0)
+        # A fifth report lifts the others without rewriting them
+        self.report(self.reporters[4])
+        self.assertEqual(Report.objects.get(pk=spam[0].pk).priority, 2.0)
+        self.assertAlmostEqual(
+            Report.objects.annotate(score=queue.queue_score()).get(pk=spam[0].pk).score,
+            2 * (1 + math.log2(5)))
+
+    def test_new_report_does_not_rewrite_its_target(self):
+        def queries_to_report(reporter):
+            with CaptureQueriesContext(connection) as context:
+                self.report(reporter)
+            return [query['sql'] for query in context.captured_queries]
+
+        # The first report also creates the case and counter rows
+        self.report(self.reporters[0])
+        second = queries_to_report(self.reporters[1])
+        for reporter in self.reporters[2:5]:
+            self.report(reporter)
+        sixth = queries_to_report(self.reporters[5])
+        self.assertEqual(len(sixth), len(second))
+        self.assertEqual(sum('SET "priority"' in sql for sql in sixth), 1)
+
+    def test_ranked_matches_a_full_sort(self):
+        rng = random.Random(7)
+        listings = [make_listing(self.seller) for _ in range(5)]
+        reasons = [reason for reason, _ in Report.REASON_CHOICES]
+        for _ in range(60):
+            self.report(rng.choice(self.reporters), rng.choice(listings), reason=rng.choice(reasons))
+        cases.decide(Report.objects.filter(reporter=self.reporters[0]), 'dismissed',
+                     self.moderator)
+        cases.decide(Report.objects.filter(reporter=self.reporters[1]), 'resolved',
+                     self.moderator)
+        expected = self.brute_force()
+        for size in (1, 5, 20, 100):
+            for chunk_size in (1, 3, 1000):
+                self.assertEqual(queue.ranked(size, chunk_size), expected[:size],
+                                 (size, chunk_size))
+
+    def test_decisions_rerank_the_reporter(self):
+        pending = self.report(self.reporters[0], user=self.seller)
+        decided = self.report(self.reporters[0], reason='scam')
+        for status, expected in (('dismissed', 2 * (0.5 + 1 / 3)),
+                                 ('resolved', 2 * (0.5 + 2 / 3))):
+            decided.status = status
+            decided.save()
+            pending.refresh_from_db()
+            self.assertAlmostEqual(pending.priority, expected, places=5)
+        decided.delete()
+        pending.refresh_from_db()
+        self.assertEqual(pending.priority, 2.0)
+        pending.reason = 'scam'
+        pending.save()
+        pending.refresh_from_db()
+        self.assertEqual(pending.priority, 10.0)
+
+    def test_rebuild(self):
+        reports = [self.report(reporter) for reporter in self.reporters[:3]]
+        Report.objects.update(priority=0)
+        self.assertEqual(queue.rebuild(), 3)
+        self.assertEqual(queue.rebuild(), 0)
+        self.assertEqual(queue.ranked(3), [report.pk for report in reports])
+
+
+class ClaimTests(ModerationTestCase):
+
+    def setUp(self):
+        self.other = make_user('other-moderator', is_staff=True)
+        self.reports = [self.report(reporter, user=self.seller, reason=reason)
+                        for reporter, reason in zip(self.reporters,
+                                                    ('scam', 'fake', 'spam', 'other'))]
+
+    def test_claims_are_disjoint_and_ranked(self):
+        mine = queue.claim(self.moderator, size=2)
+        self.assertEqual(mine, self.reports[:2])
+        self.assertEqual(queue.claim(self.other, size=3), self.reports[2:])
+        self.assertEqual(queue.claim(self.other), [])
+        self.assertEqual(list(queue.claimed(self.moderator)), self.reports[:2])
+
+    def test_claim_skips_rows_taken_meanwhile(self):
+        ranked = queue.ranked
+        calls = []
+
+        def taken_meanwhile(size, *args):
+            wanted = ranked(size, *args)
+            if not calls:
+                # Another moderator claims the top report before we do
+                Report.objects.filter(pk=wanted[0]).update(
+                    claimed_by=self.other, claimed_at=timezone.now())
+            calls.append(wanted)
+            return wanted
+
+        with mock.patch.object(queue, 'ranked', side_effect=taken_meanwhile):
+            claimed = queue.claim(self.moderator, size=2)
+        self.assertEqual(claimed, self.reports[1:3])
+        self.assertEqual(len(calls), 2)
+
+    def test_release_and_expiry(self):
+        queue.claim(self.moderator, size=3)
+        self.assertEqual(queue.release(self.moderator, ids=[self.reports[0].pk]), 1)
+        self.assertEqual(queue.ranked(1), [self.reports[0].pk])
+        Report.objects.filter(claimed_by=self.moderator).update(
+            claimed_at=timezone.now() - timedelta(hours=1))
+        with self.settings(MODERATION_CLAIM_TIMEOUT=60):
+            self.assertEqual(queue.claim(self.other, size=1), [self.reports[0]])
+            self.assertEqual(queue.release_expired(), 0)
+        self.assertFalse(queue.claimed(self.moderator).exists())
+
+    def test_decided_reports_leave_the_queue(self):
+        queue.claim(self.moderator, size=4)
+        cases.decide(Report.objects.filter(pk=self.reports[0].pk), 'resolved', self.moderator)
+        self.assertEqual(list(queue.claimed(self.moderator)), self.reports[1:])
+        self.assertEqual(queue.release(self.moderator), 3)
+        self.assertEqual(queue.ranked(10), [report.pk for report in self.reports[1:]])
+
+    def test_admin_claim_view(self):
+        self.moderator.is_superuser = True
+        self.moderator.save()
+        self.client.force_login(self.moderator)
+        # A GET (e.g. a cross-site image) claims nothing
+        response = self.client.get('/admin/moderation/report/claim/')
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(queue.claimed(self.moderator).exists())
+        self.assertContains(self.client.get('/admin/moderation/report/'),
+                            'action="/admin/moderation/report/claim/"')
+        strict = Client(enforce_csrf_checks=True)
+        strict.force_login(self.moderator)
+        self.assertEqual(strict.post('/admin/moderation/report/claim/').status_code, 403)
+        response = self.client.post('/admin/moderation/report/claim/')
+        self.assertRedirects(response, '/admin/moderation/report/?queue=mine',
+                             fetch_redirect_response=False)
+        self.assertEqual(queue.claimed(self.moderator).count(), 4)
+        response = self.client.get('/admin/moderation/report/', {'queue': 'mine'})
+        self.assertEqual([report.pk for report in response.context['cl'].result_list],
+                         [report.pk for report in self.reports])
+
+
+class CaseTests(ModerationTestCase):
+
+    def cases(self):
+        """``{target: (reports, pending, reasons, first, last)}`` of every case"""
+        return {
+            (case.reported_listing_id, case.reported_user_id if not case.reported_listing_id
+             else None): (case.report_count, case.pending_count, case.reasons,
+                          case.first_seen, case.last_seen)
+            for case in ReportCase.objects.all()
+        }
+
+    def assertCasesConsistent(self):
+        stored = self.cases()
+        cases.rebuild()
+        self.assertEqual(stored, self.cases())
+        for report in Report.objects.select_related('case'):
+            self.assertEqual(report.case.reported_listing_id, report.reported_listing_id)
+            if not report.reported_listing_id:
+                self.assertEqual(report.case.reported_user_id, report.reported_user_id)
+
+    def test_reports_coalesce_per_target(self):
+        other = make_listing(self.seller)
+        reports = [self.report(reporter, reason=reason) for reporter, reason in
+                   zip(self.reporters, ('scam', 'scam', 'spam'))]
+        about_user = self.report(user=self.seller, reason='fake')
+        # A listing report naming the seller belongs to the listing's case
+        named = self.report(self.reporters[3], other, user=self.seller)
+        self.assertEqual(len({report.case_id for report in reports}), 1)
+        case = ReportCase.objects.get(pk=reports[0].case_id)
+        self.assertEqual((case.report_count, case.pending_count, case.reasons),
+                         (3, 3, {'scam': 2, 'spam': 1}))
+        self.assertEqual(case.first_seen, reports[0].created_at)
+        self.assertEqual(case.last_seen, reports[2].created_at)
+        self.assertNotEqual(about_user.case_id, named.case_id)
+        self.assertEqual(ReportCase.objects.count(), 3)
+        self.assertCasesConsistent()
+
+    def test_changes_move_reports_between_cases(self):
+        other = make_listing(self.seller)
+        first, second = self.report(), self.report(self.reporters[1])
+        second.reason = 'scam'
+        second.status = 'reviewed'
+        second.save()
+        case = ReportCase.objects.get(pk=first.case_id)
+        self.assertEqual((case.pending_count, case.reasons), (1, {'spam': 1, 'scam': 1}))
+        second.reported_listing = other
+        second.save()
+        self.assertNotEqual(second.case_id, first.case_id)
+        first.reported_listing, first.reported_user = None, self.seller
+        first.save()
+        # The listing's case lost its last report
+        self.assertFalse(ReportCase.objects.filter(reported_listing=self.listing).exists())
+        self.assertCasesConsistent()
+        # Reloaded: the rebuild regrouped the reports into new cases
+        Report.objects.get(pk=second.pk).delete()
+        self.assertFalse(ReportCase.objects.filter(reported_listing=other).exists())
+        self.assertCasesConsistent()
+
+    def test_decide_cases(self):
+        for reporter in self.reporters[:3]:
+            self.report(reporter)
+        self.report(self.reporters[3], user=self.seller)
+        case = ReportCase.objects.get(reported_listing=self.listing)
+        self.assertEqual(cases.decide_cases(ReportCase.objects.filter(pk=case.pk),
+                                            'reviewed', self.moderator), 3)
+        self.assertEqual(cases.decide_cases(ReportCase.objects.filter(pk=case.pk),
+                                            'reviewed', self.moderator), 0)
+        case.refresh_from_db()
+        self.assertEqual((case.report_count, case.pending_count), (3, 0))
+        self.assertEqual(cases.decide_cases(ReportCase.objects.all(), 'dismissed',
+                                            self.moderator), 4)
+        self.assertEqual(set(Report.objects.values_list('status', 'reviewed_by')),
+                         {('dismissed', self.moderator.pk)})
+        self.assertCasesConsistent()
+
+    def test_admin_case_actions(self):
+        self.moderator.is_superuser = True
+        self.moderator.save()
+        self.client.force_login(self.moderator)
+        for reporter in self.reporters[:2]:
+            self.report(reporter, reason='scam')
+        case = ReportCase.objects.get()
+        response = self.client.get('/admin/moderation/reportcase/')
+        self.assertContains(response, 'scam (2)')
+        response = self.client.post('/admin/moderation/reportcase/', {
+            'action': 'mark_as_resolved', '_selected_action': [case.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Report.objects.filter(status='resolved').count(), 2)
+        self.assertCasesConsistent()
+
+
+class CounterTests(ModerationTestCase):
+
+    def counts(self):
+        return {(row.listing_id, row.user_id, row.status, row.reason): row.count
+                for row in ReportCounter.objects.filter(count__gt=0)}
+
+    def assertCountersConsistent(self):
+        stored = self.counts()
+        counters.rebuild()
+        self.assertEqual(stored, self.counts())
+        self.assertEqual(ListingSummary.objects.get(listing=self.listing).reports_count,
+                         Report.objects.filter(reported_listing=self.listing).count())
+
+    def test_saves_deletes_and_decisions(self):
+        other = make_listing(self.seller)
+        reports = [self.report(reporter) for reporter in self.reporters[:3]]
+        about_user = self.report(self.reporters[3], user=self.seller, reason='fake')
+        # Naming the listing's seller too, the report counts once for them
+        self.report(self.reporters[4], self.listing, user=self.seller)
+        self.assertEqual(counters.breakdown(user_id=self.seller.pk, listing__isnull=True),
+                         {'pending': {'spam': 4, 'fake': 1}})
+        self.assertCountersConsistent()
+        reports[0].status, reports[0].reason = 'reviewed', 'scam'
+        reports[0].save()
+        reports[1].reported_listing = other
+        reports[1].save()
+        about_user.delete()
+        self.assertCountersConsistent()
+        cases.decide(Report.objects.filter(status='pending'), 'resolved', self.moderator)
+        self.assertEqual(counters.breakdown(listing_id=self.listing.pk),
+                         {'reviewed': {'scam': 1}, 'resolved': {'spam': 2}})
+        self.assertCountersConsistent()
+
+    def test_deferred_saves(self):
+        report = self.report()
+        loaded = Report.objects.only('id', 'admin_notes').get(pk=report.pk)
+        loaded.admin_notes = 'Checked the photos'
+        with CaptureQueriesContext(connection) as context:
+            loaded.save()
+        # Neither the counters, the case nor the queue were touched
+        self.assertFalse([query for query in context.captured_queries
+                          if any(table in query['sql'] for table in
+                                 ('report_counter', 'report_case', '"priority"'))])
+        self.assertCountersConsistent()
+        # Set without being loaded: the stored status is read before saving
+        loaded = Report.objects.only('id').get(pk=report.pk)
+        loaded.status = 'reviewed'
+        loaded.save()
+        self.assertEqual(counters.breakdown(listing_id=self.listing.pk),
+                         {'reviewed': {'spam': 1}})
+        self.assertCountersConsistent()
+        loaded = Report.objects.defer('reason').get(pk=report.pk)
+        self.assertEqual(loaded.reason, 'spam')
+        loaded.reason = 'scam'
+        loaded.save()
+        self.assertEqual(ReportCase.objects.get().reasons, {'scam': 1})
+        self.assertCountersConsistent()
+
+    def test_update_fields(self):
+        report = self.report()
+        report.status = 'resolved'
+        report.admin_notes = 'Duplicate'
+        report.save(update_fields=['admin_notes'])
+        self.assertEqual(counters.breakdown(listing_id=self.listing.pk),
+                         {'pending': {'spam': 1}})
+        self.assertEqual(ReportCase.objects.get().pending_count, 1)
+        report.save(update_fields=['status'])
+        self.assertEqual(counters.breakdown(listing_id=self.listing.pk),
+                         {'resolved': {'spam': 1}})
+        self.assertEqual(ReportCase.objects.get().pending_count, 0)
+        other = make_listing(self.seller)
+        report.reported_listing = other
+        report.save(update_fields=['reported_listing'])
+        self.assertEqual(Report.objects.get(pk=report.pk).case.reported_listing, other)
+        self.assertCountersConsistent()
+
+
+class RiskTests(ModerationTestCase):
+    """Scored synchronously; the scorer thread only runs on commit"""
+
+    def setUp(self):
+        self.cheap = make_listing(self.seller, price=3000)
+        for _ in range(5):
+            make_listing(self.seller)
+        pricestats.rebuild()
+
+    def automated(self):
+        return Report.objects.filter(reporter__username='risk-scorer')
+
+    def describe(self, listing, text):
+        CarListing.objects.filter(pk=listing.pk).update(description=text)
+
+    def test_features(self):
+        self.assertEqual(risk.contact_kinds(
+            'Call +1 (555) 123-4567, mail me@example.com or WhatsApp'),
+            ['phone', 'email', 'off_platform'])
+        self.assertEqual(risk.contact_kinds('2018 Corolla, 42000 miles'), [])
+        self.assertLess(risk.score({'price_drop': 0.0, 'contact': 0.0}), 0.01)
+        self.assertEqual(risk.strongest({'price_drop': 0.1, 'contact': 1.0}), 'contact')
+
+    def test_risky_listings_are_reported_once(self):
+        self.describe(self.cheap, 'Pay by wire transfer, text +1 555 123 4567')
+        # Contact details alone stay below the threshold
+        self.describe(self.listing, 'Pay by wire transfer, text +1 555 123 4567')
+        listings = CarListing.objects.all()
+        self.assertEqual(risk.score_listings(risk.listing_rows(listings)), (7, 1))
+        report = self.automated().get()
+        self.assertEqual((report.reported_listing, report.reason), (self.cheap, 'scam'))
+        self.assertIn('75% below the group median', report.description)
+        self.assertIn('contact details (phone, off_platform)', report.description)
+        self.assertEqual(risk.score_listings(risk.listing_rows(listings)), (7, 0))
+        # Decided, the listing can be reported again
+        cases.decide(self.automated(), 'reviewed', self.moderator)
+        self.assertEqual(risk.score_listings(risk.listing_rows(listings)), (7, 1))
+
+    def test_small_groups_are_not_compared(self):
+        self.describe(self.cheap, 'Pay by wire transfer, text +1 555 123 4567')
+        listings = CarListing.objects.filter(pk=self.cheap.pk)
+        with self.settings(RISK_MIN_GROUP_SIZE=10):
+            self.assertEqual(risk.score_listings(risk.listing_rows(listings)), (1, 0))
+        self.assertEqual(risk.score_listings(risk.listing_rows(listings), medians={}), (1, 0))
+
+    def test_prior_reports_count_against_the_seller(self):
+        self.describe(self.listing, 'Wire transfer, text +1 555 123 4567 or mail a@example.com')
+        rows = risk.listing_rows(CarListing.objects.filter(pk=self.listing.pk))
+        self.assertEqual(risk.score_listings(rows), (1, 0))
+        for reporter in self.reporters[:5]:
+            self.report(reporter, user=self.seller, reason='fake')
+        self.assertEqual(risk.prior_reports([self.seller.pk]), {self.seller.pk: 5})
+        self.assertEqual(risk.score_listings(rows), (1, 1))
+        cases.decide(Report.objects.filter(reason='fake'), 'dismissed', self.moderator)
+        # The automated report on the listing still counts against its seller
+        self.assertEqual(risk.prior_reports([self.seller.pk]), {self.seller.pk: 1})
+
+    def test_message_bursts(self):
+        sender = make_user('sender')
+        for receiver in self.reporters:
+            Message.objects.create(sender=sender, receiver=receiver, content='Still available?')
+        Message.objects.create(sender=self.seller, receiver=sender, content='Yes')
+        rows = risk.message_rows(Message.objects.all())
+        self.assertEqual(risk.score_messages(rows), (7, 0))
+        with self.settings(RISK_BURST_LIMIT=2):
+            self.assertEqual(risk.score_messages(rows), (7, 1))
+            self.assertEqual(risk.score_messages(rows), (7, 0))
+        report = self.automated().get()
+        self.assertEqual((report.reported_user, report.reason), (sender, 'spam'))
+
+    def test_scorer_process(self):
+        self.describe(self.cheap, 'Pay by wire transfer, text +1 555 123 4567')
+        scorer = risk.RiskScorer(workers=1)
+        scorer.process([('listing', self.cheap.pk), ('listing', self.listing.pk)])
+        metrics = scorer.metrics()
+        self.assertEqual((metrics['scored'], metrics['reports'], metrics['failed_batches']),
+                         (2, 1, 0))
+        with mock.patch.object(risk, 'score_listings', side_effect=RuntimeError('down')), \
+                self.assertLogs('moderation.risk', 'ERROR'):
+            scorer.process([('listing', self.cheap.pk)])
+        self.assertEqual(scorer.failed_batches, 1)
+        self.assertEqual(scorer._threads, [])
+
+
+class ScoreRiskCommandTests(TransactionTestCase):
+    """The command scores its batches on a thread pool, outside the test transaction"""
+
+    def test_score_risk_command(self):
+        seller = make_user('seller')
+        cheap = make_listing(seller, price=3000)
+        for _ in range(5):
+            make_listing(seller)
+        pricestats.rebuild()
+        CarListing.objects.filter(pk=cheap.pk).update(
+            description='Pay by wire transfer, text +1 555 123 4567')
+        call_command('score_risk', batch_size=2, stdout=mock.MagicMock())
+        call_command('score_risk', after_id=cheap.pk - 1, stdout=mock.MagicMock())
+        automated = Report.objects.filter(reporter__username='risk-scorer')
+        self.assertEqual(list(automated.values_list('reported_listing', flat=True)), [cheap.pk])
+        call_command('score_risk', messages=True, stdout=mock.MagicMock())
+        self.assertEqual(automated.count(), 1)